@@ -0,0 +1,123 @@
+"""
+会話履歴からプロンプトに含めるメッセージを組み立てる時間を、直近の会話の数ごとに計測するマイクロベンチマーク。
+
+変更前（新しい順に1件ずつ先頭へ insert する実装）と、変更後（トークン数の累積和と二分探索を使う
+build_context_window）を 10/100/1000 往復の会話で比較する。
+トークン数は保存済みの値を使うので、トークン化の時間は含まない。
+
+PYTHONPATH=src python benchmarks/context_window.py
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List, Tuple
+from domain.message import ChatMessage
+from infrastructure.context_window_builder import ContextMessage, build_context_window
+from infrastructure.conversation_window_cache import ConversationTurn
+
+MESSAGE_TOKENS = 40
+SYSTEM_TOKENS = 200
+
+
+def create_turns(count: int) -> Tuple[ConversationTurn, ...]:
+    return tuple(
+        ConversationTurn(
+            user_message=f"{index}回目のユーザーのメッセージです。",
+            ai_message=f"{index}回目のカウンセラーのメッセージです。",
+            user_message_tokens=MESSAGE_TOKENS,
+            ai_message_tokens=MESSAGE_TOKENS,
+        )
+        for index in range(count)
+    )
+
+
+def build_before(
+    turns: Tuple[ConversationTurn, ...], max_token_limit: int
+) -> List[ChatMessage]:
+    conversation_history = [
+        {"role": role, "content": turn[message_type], "tokens": turn[tokens_type]}
+        for turn in turns
+        for role, message_type, tokens_type in [
+            ("user", "user_message", "user_message_tokens"),
+            ("assistant", "ai_message", "ai_message_tokens"),
+        ]
+    ]
+    conversation_history.append(
+        {"role": "user", "content": "新しいメッセージ", "tokens": MESSAGE_TOKENS}
+    )
+
+    chat_messages: List[ChatMessage] = []
+    total_tokens = 0
+    for message in reversed(conversation_history):
+        if total_tokens + message["tokens"] > max_token_limit and chat_messages:
+            break
+        chat_messages.insert(
+            0, ChatMessage(role=message["role"], content=message["content"])
+        )
+        total_tokens += message["tokens"]
+
+    if not any(message["role"] == "system" for message in chat_messages):
+        chat_messages.insert(0, {"role": "system", "content": "プロンプト"})
+
+    return chat_messages
+
+
+def build_after(
+    turns: Tuple[ConversationTurn, ...], max_token_limit: int
+) -> List[ChatMessage]:
+    return build_context_window(
+        ContextMessage("system", "プロンプト", SYSTEM_TOKENS),
+        None,
+        turns,
+        ContextMessage("user", "新しいメッセージ", MESSAGE_TOKENS),
+        max_token_limit,
+    )
+
+
+def measure(
+    build: Callable[[Tuple[ConversationTurn, ...], int], List[ChatMessage]],
+    turns: Tuple[ConversationTurn, ...],
+    max_token_limit: int,
+    iterations: int,
+) -> List[float]:
+    elapsed: List[float] = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        build(turns, max_token_limit)
+        elapsed.append(time.perf_counter() - started_at)
+    return elapsed
+
+
+def report(label: str, turns: int, elapsed: List[float]) -> None:
+    print(
+        f"{label:<8} turns={turns:<5} "
+        f"mean={statistics.mean(elapsed) * 1e6:9.1f}us "
+        f"p50={statistics.median(elapsed) * 1e6:9.1f}us "
+        f"max={max(elapsed) * 1e6:9.1f}us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=1000)
+    # 会話をすべて含められるように、トークン数の上限は十分大きくする
+    parser.add_argument("--max-token-limit", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for turns in (10, 100, 1000):
+        conversation = create_turns(turns)
+        report(
+            "before",
+            turns,
+            measure(build_before, conversation, args.max_token_limit, args.iterations),
+        )
+        report(
+            "after",
+            turns,
+            measure(build_after, conversation, args.max_token_limit, args.iterations),
+        )
+
+
+if __name__ == "__main__":
+    main()
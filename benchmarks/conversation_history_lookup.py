@@ -0,0 +1,182 @@
+"""
+会話履歴の取得クエリのレイテンシを (user_id, id) の複合インデックスの有無で比較するベンチマーク。
+
+docker compose で起動するローカルのMySQL（ai-counselor-mysql）に専用のDBを作り、
+大量の会話履歴を投入してから、ランダムなユーザーの直近の履歴を取得する時間の p50/p99 を計測する。
+
+DB_PASSWORD=xxx PYTHONPATH=src python benchmarks/conversation_history_lookup.py \
+  --host 127.0.0.1 --port 33066 --rows 2000000 --users 5000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from typing import List
+import aiomysql
+
+BENCHMARK_DB_NAME = "ai_counselor_benchmark"
+
+INDEX_NAME = "idx_conversation_histories_user_id_id"
+
+# 本番のスキーマはPlanetScaleで管理しているので、ベンチマークに必要なカラムだけを持つテーブルを作る
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS conversation_histories (
+  id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  user_id VARCHAR(64) NOT NULL,
+  user_message TEXT NOT NULL,
+  ai_message TEXT NOT NULL,
+  user_message_tokens INT UNSIGNED NULL,
+  ai_message_tokens INT UNSIGNED NULL,
+  token_encoding VARCHAR(32) NULL,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id),
+  KEY idx_conversation_histories_user_id (user_id)
+)
+"""
+
+LOOKUP_SQL = """
+SELECT id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding
+FROM conversation_histories
+WHERE user_id = %s
+ORDER BY id DESC
+LIMIT 10
+"""
+
+
+def create_user_id(index: int) -> str:
+    return f"Ubenchmark{index:023d}"
+
+
+async def seed(
+    connection: aiomysql.Connection, rows: int, users: int, batch_size: int
+) -> None:
+    async with connection.cursor() as cursor:
+        await cursor.execute("DROP TABLE IF EXISTS conversation_histories")
+        await cursor.execute(CREATE_TABLE_SQL)
+
+        inserted = 0
+        while inserted < rows:
+            size = min(batch_size, rows - inserted)
+            await cursor.executemany(
+                """
+                INSERT INTO conversation_histories
+                (user_id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                [
+                    (
+                        create_user_id(random.randrange(users)),
+                        f"こんにちは、私の悩みを聞いてください❗{inserted + offset}",
+                        f"もちろんです。何でもお話ください❗{inserted + offset}",
+                        20,
+                        20,
+                        "cl100k_base",
+                    )
+                    for offset in range(size)
+                ],
+            )
+            await connection.commit()
+            inserted += size
+            print(f"seeded {inserted}/{rows} rows", end="\r", flush=True)
+
+        print()
+
+
+async def set_composite_index(connection: aiomysql.Connection, enabled: bool) -> None:
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            """
+            SELECT COUNT(*) AS count
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE()
+            AND table_name = 'conversation_histories'
+            AND index_name = %s
+            """,
+            (INDEX_NAME,),
+        )
+        exists = (await cursor.fetchone())["count"] > 0
+
+        if enabled and not exists:
+            await cursor.execute(
+                f"ALTER TABLE conversation_histories ADD INDEX {INDEX_NAME} (user_id, id)"
+            )
+        if not enabled and exists:
+            await cursor.execute(
+                f"ALTER TABLE conversation_histories DROP INDEX {INDEX_NAME}"
+            )
+
+        await cursor.execute("ANALYZE TABLE conversation_histories")
+
+
+async def measure(
+    connection: aiomysql.Connection, users: int, lookups: int
+) -> List[float]:
+    elapsed: List[float] = []
+    async with connection.cursor() as cursor:
+        for _ in range(lookups):
+            user_id = create_user_id(random.randrange(users))
+            started_at = time.perf_counter()
+            await cursor.execute(LOOKUP_SQL, (user_id,))
+            await cursor.fetchall()
+            elapsed.append(time.perf_counter() - started_at)
+    return elapsed
+
+
+def report(label: str, elapsed: List[float]) -> None:
+    quantiles = statistics.quantiles(elapsed, n=100)
+    print(
+        f"{label:<20} "
+        f"p50={quantiles[49] * 1000:8.2f}ms "
+        f"p99={quantiles[98] * 1000:8.2f}ms "
+        f"max={max(elapsed) * 1000:8.2f}ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=33066)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument(
+        "--skip-seed",
+        action="store_true",
+        help="前回投入したデータをそのまま使う",
+    )
+    args = parser.parse_args()
+
+    connection = await aiomysql.connect(
+        host=args.host,
+        port=args.port,
+        user=args.user,
+        password=os.getenv("DB_PASSWORD"),
+        cursorclass=aiomysql.DictCursor,
+    )
+
+    try:
+        async with connection.cursor() as cursor:
+            await cursor.execute(f"CREATE DATABASE IF NOT EXISTS {BENCHMARK_DB_NAME}")
+        await connection.select_db(BENCHMARK_DB_NAME)
+
+        if not args.skip_seed:
+            await seed(connection, args.rows, args.users, args.batch_size)
+
+        await set_composite_index(connection, False)
+        report("user_id index", await measure(connection, args.users, args.lookups))
+
+        await set_composite_index(connection, True)
+        report(
+            "(user_id, id) index", await measure(connection, args.users, args.lookups)
+        )
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+処理段階ごとの所要時間の計測にかかるオーバーヘッドを計測するマイクロベンチマーク。
+
+リクエストの処理中にかかるコスト（track_request、measure_stage）と、
+メトリクスの収集時にまとめて行うヒストグラムへの記録（flush_request_timings）のコストを分けて表示する。
+リクエストの処理中の1段階あたりのオーバーヘッドが予算（デフォルト1マイクロ秒）を超えた場合は終了コード1で終了する。
+
+PYTHONPATH=src python benchmarks/instrumentation_overhead.py
+"""
+
+import argparse
+import sys
+import timeit
+import metrics.stage_timer as stage_timer
+from metrics.stage_timer import flush_request_timings, measure_stage, track_request
+
+STAGES = ("db_read", "tokenization", "completion", "db_write", "reply")
+
+
+def run_stages() -> None:
+    for stage in STAGES:
+        with measure_stage(stage):
+            pass
+
+
+def run_empty_stages() -> None:
+    for stage in STAGES:
+        pass
+
+
+def run_request() -> None:
+    with track_request("benchmark"):
+        pass
+
+
+def run_request_with_stages() -> None:
+    with track_request("benchmark"):
+        run_stages()
+
+
+def measure(function, number: int, repeat: int) -> float:
+    # timeit と同様にGCを止め、複数回計測した最小値を使ってノイズを減らす
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def measure_flush(number: int, repeat: int) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        flush_request_timings()
+        for _ in range(number):
+            run_request_with_stages()
+        elapsed.append(timeit.timeit(flush_request_timings, number=1))
+    return min(elapsed) / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--budget-us", type=float, default=1.0)
+    args = parser.parse_args()
+
+    # 計測中にヒストグラムへの記録が走らないようにする
+    stage_timer.MAX_FINISHED_REQUESTS = args.number + 1
+
+    with track_request("benchmark"):
+        per_stage = (
+            measure(run_stages, args.number, args.repeat)
+            - measure(run_empty_stages, args.number, args.repeat)
+        ) / len(STAGES)
+    flush_request_timings()
+
+    per_request = measure(run_request, args.number, args.repeat)
+    flush_request_timings()
+
+    flush_per_stage = measure_flush(args.number, args.repeat) / (len(STAGES) + 1)
+
+    print(f"track_request          {per_request * 1e6:6.3f}us/request")
+    print(
+        f"measure_stage          {per_stage * 1e6:6.3f}us/stage "
+        f"(budget {args.budget_us}us)"
+    )
+    print(f"flush (on collection)  {flush_per_stage * 1e6:6.3f}us/observation")
+
+    if per_stage * 1e6 > args.budget_us:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+run.py が保存した2つの結果を比較し、スループットとレイテンシの変化を表示する。
+しきい値を超えて悪化した指標がある場合は終了コード1で終了するので、CIでリグレッションを検出できる。
+
+python benchmarks/load_test/compare.py base.json head.json --threshold 10
+"""
+
+import argparse
+import json
+import math
+import sys
+from typing import Iterator, Tuple
+
+# (指標名, 比較元の値, 比較先の値, 値が大きいほど悪いかどうか)
+Metric = Tuple[str, float, float, bool]
+
+
+def iterate_metrics(base: dict, head: dict) -> Iterator[Metric]:
+    yield (
+        "requests_per_second",
+        base["requests_per_second"],
+        head["requests_per_second"],
+        False,
+    )
+    yield "errors", base["errors"], head["errors"], True
+
+    for group in ["latency_ms", "first_byte_ms"]:
+        for quantile in ["p50", "p95", "p99"]:
+            if quantile in base[group] and quantile in head[group]:
+                yield (
+                    f"{group}.{quantile}",
+                    base[group][quantile],
+                    head[group][quantile],
+                    True,
+                )
+
+    for stage in sorted(set(base["stages_ms"]) & set(head["stages_ms"])):
+        for quantile in ["p50", "p99"]:
+            yield (
+                f"stages_ms.{stage}.{quantile}",
+                base["stages_ms"][stage][quantile],
+                head["stages_ms"][stage][quantile],
+                True,
+            )
+
+
+def calculate_change(base_value: float, head_value: float) -> float:
+    """
+    比較元からの変化率（%）を返す。比較元が0の場合は、比較先が0でなければ無限大の変化とする。
+    エラー数が0件から増えた場合など、比較元が0の指標の悪化を見逃さないようにするため。
+    """
+    if base_value == 0:
+        if head_value == 0:
+            return 0.0
+        return math.copysign(math.inf, head_value)
+
+    return (head_value - base_value) / base_value * 100
+
+
+def format_change(change: float) -> str:
+    if math.isinf(change):
+        return f"{'+inf' if change > 0 else '-inf':>7}%"
+
+    return f"{change:+7.2f}%"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="悪化とみなす変化率（%%）",
+    )
+    args = parser.parse_args()
+
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.head) as file:
+        head = json.load(file)
+
+    if base["scenario"] != head["scenario"]:
+        sys.exit(f"scenario mismatch: {base['scenario']} != {head['scenario']}")
+
+    regressions = []
+    for name, base_value, head_value, lower_is_better in iterate_metrics(base, head):
+        change = calculate_change(base_value, head_value)
+        is_regression = (change if lower_is_better else -change) > args.threshold
+        if is_regression:
+            regressions.append(name)
+
+        print(
+            f"{name:<32} {base_value:>12.3f} -> {head_value:>12.3f} "
+            f"({format_change(change)}){'  REGRESSION' if is_regression else ''}"
+        )
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
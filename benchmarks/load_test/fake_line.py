@@ -0,0 +1,109 @@
+"""
+負荷試験用のLINEプラットフォームの代わりになるローカルサーバー。
+
+署名付きのWebhookを組み立ててアプリケーションに送り、
+Messaging APIの応答メッセージ（/v2/bot/message/reply）をチャネルアクセストークンを検証した上で受け取る。
+Webhookを送ってから応答メッセージが届くまでの時間を計測できる。
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from typing import Dict, List, Tuple
+from aiohttp import web
+
+
+def create_line_signature(body: str, channel_secret: str) -> str:
+    digest = hmac.new(channel_secret.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+class FakeLinePlatform:
+    def __init__(self, channel_secret: str, channel_access_token: str) -> None:
+        self.channel_secret = channel_secret
+        self.channel_access_token = channel_access_token
+        self.unauthorized_replies = 0
+        self.unknown_replies = 0
+        # サーバー側で受け取った応答メッセージ。reply_token -> 受信時刻
+        self._replies: Dict[str, asyncio.Future[float]] = {}
+        self.app = web.Application()
+        self.app.router.add_post("/v2/bot/message/reply", self.reply_message)
+
+    def create_webhook(self, user_id: str, text: str) -> Tuple[str, str, str]:
+        """
+        1件のテキストメッセージイベントを含むWebhookを作り、本文・署名・応答トークンを返す。
+        """
+        reply_token = uuid.uuid4().hex
+        body = json.dumps(
+            {
+                "destination": "Uload0test0destination0000000000",
+                "events": [
+                    {
+                        "type": "message",
+                        "mode": "active",
+                        "timestamp": int(time.time() * 1000),
+                        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+                        "deliveryContext": {"isRedelivery": False},
+                        "replyToken": reply_token,
+                        "source": {"type": "user", "userId": user_id},
+                        "message": {
+                            "type": "text",
+                            "id": str(uuid.uuid4().int)[:18],
+                            "quoteToken": uuid.uuid4().hex,
+                            "text": text,
+                        },
+                    }
+                ],
+            },
+            ensure_ascii=False,
+        )
+
+        self._replies[reply_token] = asyncio.get_running_loop().create_future()
+
+        return body, create_line_signature(body, self.channel_secret), reply_token
+
+    async def wait_for_reply(self, reply_token: str, timeout: float) -> float:
+        """
+        応答メッセージが届くまで待ち、届いた時刻（time.perf_counter）を返す。
+        """
+        try:
+            return await asyncio.wait_for(self._replies[reply_token], timeout)
+        finally:
+            self._replies.pop(reply_token, None)
+
+    def cancel_reply(self, reply_token: str) -> None:
+        self._replies.pop(reply_token, None)
+
+    async def reply_message(self, request: web.Request) -> web.Response:
+        received_at = time.perf_counter()
+
+        if (
+            request.headers.get("Authorization")
+            != f"Bearer {self.channel_access_token}"
+        ):
+            self.unauthorized_replies += 1
+            return web.json_response({"message": "Authentication failed"}, status=401)
+
+        body = await request.json()
+        messages: List[dict] = body.get("messages", [])
+        reply = self._replies.get(body.get("replyToken", ""))
+
+        if reply is None or not messages:
+            self.unknown_replies += 1
+            return web.json_response({"message": "Invalid reply token"}, status=400)
+
+        if not reply.done():
+            reply.set_result(received_at)
+
+        return web.json_response(
+            {
+                "sentMessages": [
+                    {"id": str(uuid.uuid4().int)[:18], "quoteToken": uuid.uuid4().hex}
+                    for _ in messages
+                ]
+            }
+        )
@@ -0,0 +1,134 @@
+"""
+負荷試験用のOpenAI Chat Completions APIの代わりになるローカルサーバー。
+
+最初のトークンを返すまでの時間と1秒あたりに生成するトークン数を指定でき、
+実際のAPIを呼び出さずに、生成にかかる時間を再現した状態でアプリケーションに負荷をかけられる。
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List
+from aiohttp import web
+
+# 生成するメッセージの1トークン分の文字列
+TOKEN_TEXT = "はい"
+
+
+@dataclass
+class FakeOpenAiConfig:
+    # リクエストを受けてから最初のトークンを返すまでの時間
+    time_to_first_token_ms: float
+    # 最初のトークン以降に1秒あたりに生成するトークン数
+    tokens_per_second: float
+    # 1回の応答で生成するトークン数
+    completion_tokens: int
+
+
+class FakeOpenAiServer:
+    def __init__(self, config: FakeOpenAiConfig) -> None:
+        self.config = config
+        self.requests = 0
+        # サーバー側で計測した、リクエストを受けてから応答を返し終わるまでの時間（秒）
+        self.completion_seconds: List[float] = []
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat/completions", self.create_chat_completion)
+
+    async def create_chat_completion(self, request: web.Request) -> web.StreamResponse:
+        started_at = time.perf_counter()
+        body = await request.json()
+        self.requests += 1
+
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response(
+                {"error": {"message": "missing api key", "type": "invalid_request"}},
+                status=401,
+            )
+
+        prompt_tokens = sum(
+            len(str(message.get("content", ""))) for message in body["messages"]
+        )
+
+        await asyncio.sleep(self.config.time_to_first_token_ms / 1000)
+
+        if body.get("stream"):
+            response = await self._stream(request, body)
+        else:
+            await asyncio.sleep(self._generation_seconds(self.config.completion_tokens))
+            response = web.json_response(
+                {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": TOKEN_TEXT * self.config.completion_tokens,
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": self.config.completion_tokens,
+                        "total_tokens": prompt_tokens + self.config.completion_tokens,
+                    },
+                }
+            )
+
+        self.completion_seconds.append(time.perf_counter() - started_at)
+        return response
+
+    async def _stream(
+        self, request: web.Request, body: Dict[str, Any]
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        for index in range(self.config.completion_tokens):
+            if index > 0:
+                await asyncio.sleep(self._generation_seconds(1))
+
+            await response.write(
+                self._format_chunk(
+                    completion_id, created, body["model"], {"content": TOKEN_TEXT}, None
+                )
+            )
+
+        await response.write(
+            self._format_chunk(completion_id, created, body["model"], {}, "stop")
+        )
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+
+        return response
+
+    def _generation_seconds(self, tokens: int) -> float:
+        if self.config.tokens_per_second <= 0:
+            return 0
+        return tokens / self.config.tokens_per_second
+
+    @staticmethod
+    def _format_chunk(
+        completion_id: str,
+        created: int,
+        model: str,
+        delta: Dict[str, str],
+        finish_reason: Any,
+    ) -> bytes:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(chunk)}\n\n".encode()
@@ -0,0 +1,534 @@
+"""
+/v1/messages と /v1/line/callback のスループットとレイテンシを計測する負荷試験。
+
+OpenAI APIとLINEプラットフォームはローカルのフェイクサーバーに置き換え、DBは docker compose で起動する
+ローカルのMySQL（ai-counselor-mysql）に専用のDBを作って使う。アプリケーションは別プロセスで起動し、
+指定した並列数でリクエストを送り、requests/sec、レイテンシの p50/p95/p99、処理段階ごとの所要時間を計測する。
+結果はJSONで保存するので、compare.py でリリース間の結果を比較できる。
+
+DB_PASSWORD=xxx PYTHONPATH=src python benchmarks/load_test/run.py \
+  --scenario messages --concurrency 32 --requests 2000 --ttft-ms 400 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, TypedDict
+import aiomysql
+import certifi
+import httpx
+from aiohttp import web
+from fake_line import FakeLinePlatform
+from fake_openai import FakeOpenAiConfig, FakeOpenAiServer
+
+BENCHMARK_DB_NAME = "ai_counselor_load_test"
+
+BASIC_AUTH_USERNAME = "load-test"
+BASIC_AUTH_PASSWORD = "load-test"
+LINE_CHANNEL_SECRET = "load-test-channel-secret"
+LINE_CHANNEL_ACCESS_TOKEN = "load-test-channel-access-token"
+
+# 本番のスキーマはPlanetScaleで管理しているので、migrations/ を適用した状態と同じテーブルを作る
+CREATE_TABLE_SQLS = [
+    """
+    CREATE TABLE conversation_histories (
+      id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+      user_id VARCHAR(64) NOT NULL,
+      user_message TEXT NOT NULL,
+      ai_message TEXT NOT NULL,
+      user_message_tokens INT UNSIGNED NULL,
+      ai_message_tokens INT UNSIGNED NULL,
+      token_encoding VARCHAR(32) NULL,
+      created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (id),
+      KEY idx_conversation_histories_user_id_id (user_id, id)
+    )
+    """,
+    """
+    CREATE TABLE conversation_summaries (
+      user_id VARCHAR(64) NOT NULL,
+      summary TEXT NOT NULL,
+      summary_tokens INT UNSIGNED NOT NULL,
+      token_encoding VARCHAR(32) NOT NULL,
+      last_summarized_history_id BIGINT UNSIGNED NOT NULL,
+      created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ON UPDATE CURRENT_TIMESTAMP,
+      PRIMARY KEY (user_id)
+    )
+    """,
+    """
+    CREATE TABLE processed_requests (
+      user_id VARCHAR(64) NOT NULL,
+      request_id VARCHAR(255) NOT NULL,
+      ai_response_id VARCHAR(255) NOT NULL,
+      ai_message TEXT NOT NULL,
+      created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (user_id, request_id),
+      KEY idx_processed_requests_created_at (created_at)
+    )
+    """,
+]
+
+REQUEST_MESSAGE = "最近仕事が忙しくて、なかなか眠れない日が続いています。どうすれば良いでしょうか？"
+
+
+class Sample(TypedDict):
+    ok: bool
+    # リクエストを送ってから応答を受け取り終わるまでの時間（LINEは応答メッセージが届くまでの時間）
+    latency: float
+    # 最初のバイトを受け取るまでの時間（LINEはWebhookに200が返るまでの時間）
+    first_byte: float
+    # Server-Timing ヘッダーで返された処理段階ごとの所要時間
+    stages: Dict[str, float]
+
+
+Send = Callable[[str], Awaitable[Sample]]
+
+STAGE_METRIC_PATTERN = re.compile(
+    r'^ai_counselor_stage_duration_seconds_(sum|count)\{endpoint="([^"]+)",'
+    r'stage="([^"]+)",outcome="success"\} (\S+)$'
+)
+
+# シナリオごとに、アプリケーションが処理段階ごとの所要時間を記録するエンドポイント名
+SCENARIO_ENDPOINTS = {
+    "messages": "messages",
+    "messages-stream": "messages_stream",
+    "line": "line_message_event",
+}
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    stages: Dict[str, float] = {}
+    for metric in filter(None, (part.strip() for part in value.split(","))):
+        name, *params = metric.split(";")
+        for param in params:
+            key, _, duration = param.partition("=")
+            if key.strip() == "dur":
+                stages[name.strip()] = float(duration) / 1000
+    return stages
+
+
+def percentile(values: List[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize_durations(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "max": round(max(values) * 1000, 3),
+        "mean": round(statistics.fmean(values) * 1000, 3),
+    }
+
+
+def find_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def scrape_stage_totals(
+    client: httpx.AsyncClient, endpoint: str
+) -> Dict[str, Dict[str, float]]:
+    """
+    /v1/metrics から、処理段階ごとの所要時間の合計（sum）と回数（count）を取得する。
+    """
+    response = await client.get("/v1/metrics")
+    response.raise_for_status()
+
+    totals: Dict[str, Dict[str, float]] = {}
+    for line in response.text.splitlines():
+        match = STAGE_METRIC_PATTERN.match(line)
+        if match is None or match.group(2) != endpoint:
+            continue
+        kind, _, stage, value = match.groups()
+        totals.setdefault(stage, {"sum": 0.0, "count": 0.0})[kind] = float(value)
+
+    return totals
+
+
+def calculate_stage_means(
+    before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]
+) -> Dict[str, float]:
+    means: Dict[str, float] = {}
+    for stage, total in after.items():
+        previous = before.get(stage, {"sum": 0.0, "count": 0.0})
+        count = total["count"] - previous["count"]
+        if count > 0:
+            means[stage] = round((total["sum"] - previous["sum"]) / count * 1000, 3)
+    return means
+
+
+async def setup_database(args: argparse.Namespace) -> None:
+    connection = await aiomysql.connect(
+        host=args.db_host,
+        port=args.db_port,
+        user=args.db_user,
+        password=os.getenv("DB_PASSWORD"),
+    )
+    try:
+        async with connection.cursor() as cursor:
+            await cursor.execute(f"DROP DATABASE IF EXISTS {BENCHMARK_DB_NAME}")
+            await cursor.execute(f"CREATE DATABASE {BENCHMARK_DB_NAME}")
+            await cursor.execute(f"USE {BENCHMARK_DB_NAME}")
+            for sql in CREATE_TABLE_SQLS:
+                await cursor.execute(sql)
+    finally:
+        connection.close()
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def start_app(
+    args: argparse.Namespace, openai_port: int, line_port: int
+) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "LINE_MESSAGING_API_HOST": f"http://127.0.0.1:{line_port}",
+        "LINE_CHANNEL_SECRET": LINE_CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": LINE_CHANNEL_ACCESS_TOKEN,
+        "BASIC_AUTH_USERNAME": BASIC_AUTH_USERNAME,
+        "BASIC_AUTH_PASSWORD": BASIC_AUTH_PASSWORD,
+        "DB_HOST": args.db_host,
+        "DB_PORT": str(args.db_port),
+        "DB_USERNAME": args.db_user,
+        "DB_NAME": BENCHMARK_DB_NAME,
+        "DB_SSL_ENABLED": "false",
+        "SSL_CERT_PATH": os.getenv("SSL_CERT_PATH", certifi.where()),
+        "SERVER_TIMING_ENABLED": "true",
+        # 少ないユーザーから大量に送るので、指定がなければユーザーごとのレート制限を無効にする
+        "USER_RATE_LIMIT_PER_MINUTE": os.getenv("USER_RATE_LIMIT_PER_MINUTE", "0"),
+    }
+
+    log_file = open(args.app_log, "w") if args.app_log else subprocess.DEVNULL
+
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--app-dir",
+            "src",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.app_port),
+            "--no-access-log",
+        ],
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            response = await client.get("/v1/health-checks")
+            if response.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"app did not become ready within {timeout} seconds")
+        await asyncio.sleep(0.2)
+
+
+def create_message_sender(client: httpx.AsyncClient, stream: bool) -> Send:
+    async def send(user_id: str) -> Sample:
+        started_at = time.perf_counter()
+        first_byte = 0.0
+        ok = False
+        stages: Dict[str, float] = {}
+
+        try:
+            async with client.stream(
+                "POST",
+                "/v1/messages",
+                params={"stream": "true"} if stream else None,
+                headers={"Ai-Counselor-Request-Id": uuid.uuid4().hex},
+                auth=(BASIC_AUTH_USERNAME, BASIC_AUTH_PASSWORD),
+                json={"user_id": user_id, "message": REQUEST_MESSAGE},
+            ) as response:
+                body = b""
+                async for chunk in response.aiter_bytes():
+                    if not first_byte:
+                        first_byte = time.perf_counter() - started_at
+                    body += chunk
+
+                stages = parse_server_timing(response.headers.get("Server-Timing", ""))
+                # エラーの場合もステータスコード200が返るので、本文で成否を判定する
+                ok = response.status_code == 200 and (
+                    b"event: done" in body if stream else b'"message"' in body
+                )
+        except httpx.HTTPError:
+            ok = False
+
+        return Sample(
+            ok=ok,
+            latency=time.perf_counter() - started_at,
+            first_byte=first_byte,
+            stages=stages,
+        )
+
+    return send
+
+
+def create_line_sender(
+    client: httpx.AsyncClient, platform: FakeLinePlatform, reply_timeout: float
+) -> Send:
+    async def send(user_id: str) -> Sample:
+        body, signature, reply_token = platform.create_webhook(user_id, REQUEST_MESSAGE)
+
+        started_at = time.perf_counter()
+        try:
+            response = await client.post(
+                "/v1/line/callback",
+                content=body.encode(),
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Line-Signature": signature,
+                },
+            )
+            acked_at = time.perf_counter()
+            if response.status_code != 200:
+                platform.cancel_reply(reply_token)
+                return Sample(
+                    ok=False,
+                    latency=acked_at - started_at,
+                    first_byte=acked_at - started_at,
+                    stages={},
+                )
+
+            replied_at = await platform.wait_for_reply(reply_token, reply_timeout)
+            return Sample(
+                ok=True,
+                latency=replied_at - started_at,
+                first_byte=acked_at - started_at,
+                stages={},
+            )
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            platform.cancel_reply(reply_token)
+            return Sample(
+                ok=False,
+                latency=time.perf_counter() - started_at,
+                first_byte=0.0,
+                stages={},
+            )
+
+    return send
+
+
+async def drive(
+    send: Send, user_ids: List[str], concurrency: int, requests: int
+) -> List[Sample]:
+    samples: List[Sample] = []
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            samples.append(await send(random.choice(user_ids)))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return samples
+
+
+def create_report(
+    args: argparse.Namespace,
+    samples: List[Sample],
+    elapsed: float,
+    openai_server: FakeOpenAiServer,
+    stage_means_ms: Dict[str, float],
+) -> dict:
+    succeeded = [sample for sample in samples if sample["ok"]]
+
+    stage_names = sorted({stage for sample in succeeded for stage in sample["stages"]})
+
+    return {
+        "scenario": args.scenario,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": find_git_commit(),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "users": args.users,
+            "ttft_ms": args.ttft_ms,
+            "tokens_per_second": args.tokens_per_second,
+            "completion_tokens": args.completion_tokens,
+        },
+        "requests": len(samples),
+        "errors": len(samples) - len(succeeded),
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(succeeded) / elapsed, 3) if elapsed else 0,
+        "latency_ms": summarize_durations([sample["latency"] for sample in succeeded]),
+        "first_byte_ms": summarize_durations(
+            [sample["first_byte"] for sample in succeeded]
+        ),
+        "stages_ms": {
+            stage: summarize_durations(
+                [
+                    sample["stages"][stage]
+                    for sample in succeeded
+                    if stage in sample["stages"]
+                ]
+            )
+            for stage in stage_names
+        },
+        # /v1/metrics から求めた処理段階ごとの平均。LINEのシナリオでも取得できる
+        "stage_means_ms": stage_means_ms,
+        "fake_openai_completion_ms": summarize_durations(
+            openai_server.completion_seconds
+        ),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['scenario']}: {report['requests']} requests, "
+        f"{report['errors']} errors, {report['requests_per_second']} req/s"
+    )
+    rows = [("latency", report["latency_ms"]), ("first byte", report["first_byte_ms"])]
+    rows += list(report["stages_ms"].items())
+    for label, durations in rows:
+        if not durations:
+            continue
+        print(
+            f"  {label:<16} "
+            f"p50={durations['p50']:9.2f}ms "
+            f"p95={durations['p95']:9.2f}ms "
+            f"p99={durations['p99']:9.2f}ms"
+        )
+    for stage, mean in report["stage_means_ms"].items():
+        print(f"  {stage:<16} mean={mean:9.2f}ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scenario",
+        choices=["messages", "messages-stream", "line"],
+        default="messages",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--warmup-requests", type=int, default=100)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--ttft-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--reply-timeout", type=float, default=60)
+    parser.add_argument("--db-host", default="127.0.0.1")
+    parser.add_argument("--db-port", type=int, default=33066)
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--openai-port", type=int, default=18001)
+    parser.add_argument("--line-port", type=int, default=18002)
+    parser.add_argument("--app-log", help="アプリケーションのログの出力先")
+    parser.add_argument(
+        "--output",
+        help="結果のJSONの出力先。省略時は benchmarks/load_test/results/ に保存する",
+    )
+    args = parser.parse_args()
+
+    await setup_database(args)
+
+    openai_server = FakeOpenAiServer(
+        FakeOpenAiConfig(
+            time_to_first_token_ms=args.ttft_ms,
+            tokens_per_second=args.tokens_per_second,
+            completion_tokens=args.completion_tokens,
+        )
+    )
+    line_platform = FakeLinePlatform(LINE_CHANNEL_SECRET, LINE_CHANNEL_ACCESS_TOKEN)
+
+    runners = [
+        await start_site(openai_server.app, args.openai_port),
+        await start_site(line_platform.app, args.line_port),
+    ]
+    app_process = start_app(args, args.openai_port, args.line_port)
+
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.app_port}",
+            timeout=httpx.Timeout(args.reply_timeout),
+            limits=httpx.Limits(max_connections=args.concurrency),
+        ) as client:
+            await wait_until_ready(client, timeout=30)
+
+            if args.scenario == "line":
+                send = create_line_sender(client, line_platform, args.reply_timeout)
+            else:
+                send = create_message_sender(
+                    client, stream=args.scenario == "messages-stream"
+                )
+
+            user_ids = [f"Uloadtest{index:023d}" for index in range(args.users)]
+
+            await drive(send, user_ids, args.concurrency, args.warmup_requests)
+            openai_server.completion_seconds.clear()
+
+            endpoint = SCENARIO_ENDPOINTS[args.scenario]
+            stage_totals_before = await scrape_stage_totals(client, endpoint)
+
+            started_at = time.perf_counter()
+            samples = await drive(send, user_ids, args.concurrency, args.requests)
+            elapsed = time.perf_counter() - started_at
+
+            # LINEのイベントは応答メッセージの送信後に計測が終わるので、少し待ってから取得する
+            await asyncio.sleep(1)
+            stage_means_ms = calculate_stage_means(
+                stage_totals_before, await scrape_stage_totals(client, endpoint)
+            )
+    finally:
+        app_process.terminate()
+        app_process.wait(timeout=30)
+        for runner in runners:
+            await runner.cleanup()
+
+    report = create_report(args, samples, elapsed, openai_server, stage_means_ms)
+    print_report(report)
+
+    output = args.output or os.path.join(
+        os.path.dirname(__file__),
+        "results",
+        f"{args.scenario}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+会話履歴を組み立てる際のトークン数計算にかかる時間を計測するマイクロベンチマーク。
+
+1ユーザーが連続して会話するケースを想定し、1リクエストあたり直近10往復分の履歴と新しいメッセージを
+トークン化する時間を、変更前（メッセージごとに encoding_for_model + encode）と
+変更後（TokenCounter によるバッチ計算 + キャッシュ）で比較する。
+
+PYTHONPATH=src python benchmarks/tokenization.py
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+import tiktoken
+from infrastructure.token_counter import TokenCounter, get_encoding
+
+HISTORY_TURNS = 10
+
+
+def create_message(index: int, role: str) -> str:
+    return (
+        f"{index}回目の{role}のメッセージです。"
+        "最近仕事が忙しくて、なかなか眠れない日が続いています。"
+        "どうすれば気持ちを落ち着けられるでしょうか？" * 3
+    )
+
+
+def create_request_messages(request_index: int) -> List[str]:
+    messages: List[str] = []
+    for turn in range(max(0, request_index - HISTORY_TURNS), request_index):
+        messages.append(create_message(turn, "user"))
+        messages.append(create_message(turn, "assistant"))
+    messages.append(create_message(request_index, "user"))
+    return messages
+
+
+def count_tokens_before(messages: List[str]) -> List[int]:
+    return [
+        len(tiktoken.encoding_for_model("gpt-4").encode(message))
+        for message in messages
+    ]
+
+
+def measure(
+    count_tokens: Callable[[List[str]], List[int]], requests: int
+) -> List[float]:
+    elapsed: List[float] = []
+    for request_index in range(requests):
+        messages = create_request_messages(request_index)
+        started_at = time.perf_counter()
+        count_tokens(messages)
+        elapsed.append(time.perf_counter() - started_at)
+    return elapsed
+
+
+def report(label: str, elapsed: List[float]) -> None:
+    # 履歴が揃う前の立ち上がり部分は除外する
+    steady = elapsed[HISTORY_TURNS:]
+    print(
+        f"{label:<8} "
+        f"mean={statistics.mean(steady) * 1e6:9.1f}us "
+        f"p50={statistics.median(steady) * 1e6:9.1f}us "
+        f"max={max(steady) * 1e6:9.1f}us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    # エンコーディングの読み込み時間は計測対象から外す
+    get_encoding("gpt-4")
+
+    token_counter = TokenCounter(get_encoding("gpt-4"))
+
+    report("before", measure(count_tokens_before, args.requests))
+    report("after", measure(token_counter.count_batch, args.requests))
+
+
+if __name__ == "__main__":
+    main()
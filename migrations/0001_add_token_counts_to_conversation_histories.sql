@@ -0,0 +1,6 @@
+-- 会話履歴の各メッセージのトークン数を保存し、履歴取得時にトークン数を再計算しなくて済むようにする
+-- 既存の行は src/command/backfill_conversation_history_token_counts.py でバックフィルする
+ALTER TABLE conversation_histories
+  ADD COLUMN user_message_tokens INT UNSIGNED NULL,
+  ADD COLUMN ai_message_tokens INT UNSIGNED NULL,
+  ADD COLUMN token_encoding VARCHAR(32) NULL;
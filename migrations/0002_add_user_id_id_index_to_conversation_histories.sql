@@ -0,0 +1,4 @@
+-- ユーザーごとの履歴を新しい順に取得するクエリ（WHERE user_id = ? ORDER BY id DESC LIMIT ?）で
+-- filesortが発生しないように複合インデックスを追加する
+ALTER TABLE conversation_histories
+  ADD INDEX idx_conversation_histories_user_id_id (user_id, id);
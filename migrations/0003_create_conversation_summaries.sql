@@ -0,0 +1,12 @@
+-- 直近の会話から外れた会話をユーザーごとに1つの要約にまとめて保存する
+-- プロンプトには直近の会話と要約だけを含めるので、会話が長く続いてもプロンプトのトークン数が増え続けない
+CREATE TABLE conversation_summaries (
+  user_id VARCHAR(64) NOT NULL,
+  summary TEXT NOT NULL,
+  summary_tokens INT UNSIGNED NOT NULL,
+  token_encoding VARCHAR(32) NOT NULL,
+  last_summarized_history_id BIGINT UNSIGNED NOT NULL,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id)
+);
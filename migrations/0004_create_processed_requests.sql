@@ -0,0 +1,12 @@
+-- 処理済みのリクエストの応答をリクエストIDごとに保存する
+-- LINEのWebhookの再送などで同じリクエストを再び受けた場合は、OpenAI APIを呼ばずに保存した応答を返す
+-- 再送を受ける期間を過ぎた行は command.purge_processed_requests（make purge-processed-requests）で created_at の古い順に削除する
+CREATE TABLE processed_requests (
+  user_id VARCHAR(64) NOT NULL,
+  request_id VARCHAR(255) NOT NULL,
+  ai_response_id VARCHAR(255) NOT NULL,
+  ai_message TEXT NOT NULL,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id, request_id),
+  KEY idx_processed_requests_created_at (created_at)
+);
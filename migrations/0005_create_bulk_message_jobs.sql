@@ -0,0 +1,22 @@
+-- Batch APIでまとめてメッセージを生成するジョブの状態を保存する
+-- プロセスが途中で終了した場合も、status と ingested_lines から続きを再開する
+CREATE TABLE bulk_message_jobs (
+  job_id VARCHAR(64) NOT NULL,
+  status VARCHAR(16) NOT NULL,
+  batch_id VARCHAR(255) NULL,
+  output_file_id VARCHAR(255) NULL,
+  ingested_lines INT UNSIGNED NOT NULL DEFAULT 0,
+  error TEXT NULL,
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (job_id),
+  KEY idx_bulk_message_jobs_status (status)
+);
+
+CREATE TABLE bulk_message_job_items (
+  job_id VARCHAR(64) NOT NULL,
+  custom_id VARCHAR(64) NOT NULL,
+  user_id VARCHAR(64) NOT NULL,
+  message TEXT NOT NULL,
+  PRIMARY KEY (job_id, custom_id)
+);
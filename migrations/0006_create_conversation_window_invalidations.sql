@@ -0,0 +1,8 @@
+-- アプリと別のプロセス（バルクメッセージのジョブなど）が会話を保存したユーザーを記録する
+-- アプリのプロセスは invalidated_at が新しい行を定期的に読み、そのユーザーの直近の会話のキャッシュを破棄する
+CREATE TABLE conversation_window_invalidations (
+  user_id VARCHAR(64) NOT NULL,
+  invalidated_at DATETIME(6) NOT NULL,
+  PRIMARY KEY (user_id),
+  KEY idx_conversation_window_invalidations_invalidated_at (invalidated_at)
+);
@@ -0,0 +1,88 @@
+"""
+トークン数が保存されていない conversation_histories の行にトークン数を書き込む
+
+PYTHONPATH=src python -m command.backfill_conversation_history_token_counts --batch-size 500
+"""
+
+import argparse
+import asyncio
+from infrastructure.db import create_db_connection
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    get_token_count_model,
+)
+from infrastructure.token_counter import get_token_counter
+
+
+async def backfill(batch_size: int) -> int:
+    token_counter = get_token_counter(get_token_count_model())
+    encoding_name = token_counter.encoding_name
+
+    connection = await create_db_connection()
+
+    last_id = 0
+    updated_rows = 0
+
+    try:
+        while True:
+            async with connection.cursor() as cursor:
+                sql = """
+                SELECT id, user_message, ai_message
+                FROM conversation_histories
+                WHERE id > %s
+                AND (token_encoding IS NULL OR token_encoding <> %s)
+                ORDER BY id
+                LIMIT %s
+                """
+                await cursor.execute(sql, (last_id, encoding_name, batch_size))
+                rows = await cursor.fetchall()
+
+                if not rows:
+                    break
+
+                token_counts = token_counter.count_batch(
+                    [
+                        message
+                        for row in rows
+                        for message in (row["user_message"], row["ai_message"])
+                    ]
+                )
+
+                sql = """
+                UPDATE conversation_histories
+                SET user_message_tokens = %s, ai_message_tokens = %s, token_encoding = %s
+                WHERE id = %s
+                """
+                await cursor.executemany(
+                    sql,
+                    [
+                        (
+                            token_counts[index * 2],
+                            token_counts[index * 2 + 1],
+                            encoding_name,
+                            row["id"],
+                        )
+                        for index, row in enumerate(rows)
+                    ],
+                )
+
+            await connection.commit()
+
+            last_id = rows[-1]["id"]
+            updated_rows += len(rows)
+            print(f"updated {updated_rows} rows (last id: {last_id})")
+    finally:
+        connection.close()
+
+    return updated_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
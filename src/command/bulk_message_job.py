@@ -0,0 +1,138 @@
+"""
+Batch APIでまとめてメッセージを生成し、会話履歴に保存する
+
+入力ファイルは1行に1つ {"user_id": "...", "message": "..."} を書いたJSONL
+PYTHONPATH=src python -m command.bulk_message_job submit --input requests.jsonl
+途中で終了したジョブを再開する
+PYTHONPATH=src python -m command.bulk_message_job resume
+
+BULK_MESSAGE_BATCH_BACKEND=local の場合はBatch APIを使わずに、その場で1件ずつ生成する
+"""
+
+import os
+import json
+import uuid
+import argparse
+import asyncio
+from typing import List, Optional
+from domain.prompt import COUNSELOR_PROMPT_NAME, validate_prompt_versions
+from domain.repository.batch_completion_repository_interface import (
+    BatchCompletionRepositoryInterface,
+)
+from infrastructure.db import create_db_connection
+from infrastructure.repository.aiomysql.aiomysql_db_handler import AiomysqlDbHandler
+from infrastructure.repository.aiomysql.aiomysql_bulk_message_job_repository import (
+    AiomysqlBulkMessageJobRepository,
+)
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    AiomysqlConversationHistoryRepository,
+    get_counselor_prompt_versions,
+)
+from infrastructure.repository.openai.openai_batch_completion_repository import (
+    OpenAiBatchCompletionRepository,
+)
+from infrastructure.repository.openai.openai_generate_message_repository import (
+    OpenAiGenerateMessageRepository,
+)
+from infrastructure.repository.local.local_batch_completion_repository import (
+    LocalBatchCompletionRepository,
+)
+from usecase.bulk_message_job_use_case import (
+    BulkMessageJobRepositories,
+    BulkMessageJobRequest,
+    BulkMessageJobUseCase,
+)
+
+
+def create_batch_completion_repository() -> BatchCompletionRepositoryInterface:
+    if os.getenv("BULK_MESSAGE_BATCH_BACKEND", "openai") == "local":
+        return LocalBatchCompletionRepository(OpenAiGenerateMessageRepository())
+
+    return OpenAiBatchCompletionRepository()
+
+
+async def create_repositories() -> BulkMessageJobRepositories:
+    # バッチの完了を待つ間にMySQLの wait_timeout で切断されないように、DBの操作ごとに接続する
+    connection = await create_db_connection()
+
+    return BulkMessageJobRepositories(
+        db_handler=AiomysqlDbHandler(connection),
+        bulk_message_job_repository=AiomysqlBulkMessageJobRepository(connection),
+        # アプリのプロセスが保持している直近の会話のキャッシュは、取り込んだユーザーの分を破棄させる
+        conversation_history_repository=AiomysqlConversationHistoryRepository(
+            connection, invalidate_window_caches=True
+        ),
+    )
+
+
+def read_requests(path: str) -> List[BulkMessageJobRequest]:
+    with open(path, encoding="utf-8") as f:
+        return [
+            BulkMessageJobRequest(user_id=data["user_id"], message=data["message"])
+            for data in (json.loads(line) for line in f if line.strip())
+        ]
+
+
+async def run(
+    input_path: Optional[str],
+    job_id: Optional[str],
+    chunk_size: int,
+    poll_interval: float,
+) -> None:
+    validate_prompt_versions(COUNSELOR_PROMPT_NAME, get_counselor_prompt_versions())
+
+    use_case = BulkMessageJobUseCase(
+        {
+            "batch_completion_repository": create_batch_completion_repository(),
+            "create_repositories": create_repositories,
+            "ingest_chunk_size": chunk_size,
+            "poll_interval_seconds": poll_interval,
+        }
+    )
+
+    if input_path is not None:
+        job_id = job_id or uuid.uuid4().hex
+        await use_case.create_job(job_id, read_requests(input_path))
+        print(f"created job {job_id}")
+
+    if job_id is not None:
+        jobs = [await use_case.run(job_id)]
+    else:
+        jobs = await use_case.resume_unfinished_jobs()
+
+    for job in jobs:
+        print(
+            f"job {job['job_id']}: {job['status']} (ingested lines: {job['ingested_lines']})"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit")
+    submit_parser.add_argument("--input", required=True)
+    submit_parser.add_argument("--job-id")
+
+    resume_parser = subparsers.add_parser("resume")
+    # 指定しない場合は終了していないジョブをすべて再開する
+    resume_parser.add_argument("--job-id")
+
+    for subparser in (submit_parser, resume_parser):
+        subparser.add_argument("--chunk-size", type=int, default=500)
+        subparser.add_argument("--poll-interval", type=float, default=60)
+
+    args = parser.parse_args()
+
+    asyncio.run(
+        run(
+            args.input if args.command == "submit" else None,
+            args.job_id,
+            args.chunk_size,
+            args.poll_interval,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+再送を受ける期間を過ぎた processed_requests の行を削除する
+
+PYTHONPATH=src python -m command.purge_processed_requests --retention-hours 24 --batch-size 1000
+
+cronなどで定期的に実行する。保持期間はLINEのWebhookの再送などで同じリクエストを受ける期間より長くする
+"""
+
+import os
+import argparse
+import asyncio
+from infrastructure.db import create_db_connection
+
+
+async def purge(retention_hours: float, batch_size: int) -> int:
+    connection = await create_db_connection()
+
+    deleted_rows = 0
+
+    try:
+        while True:
+            # ロックを長く持たないように、created_at のインデックスを使って少しずつ削除する
+            async with connection.cursor() as cursor:
+                sql = """
+                DELETE FROM processed_requests
+                WHERE created_at < NOW() - INTERVAL %s SECOND
+                ORDER BY created_at
+                LIMIT %s
+                """
+                await cursor.execute(sql, (int(retention_hours * 3600), batch_size))
+                deleted = cursor.rowcount
+
+            await connection.commit()
+
+            deleted_rows += deleted
+            print(f"deleted {deleted_rows} rows")
+
+            if deleted < batch_size:
+                break
+    finally:
+        connection.close()
+
+    return deleted_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--retention-hours",
+        type=float,
+        default=float(os.getenv("PROCESSED_REQUEST_RETENTION_HOURS", "24")),
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(purge(args.retention_hours, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
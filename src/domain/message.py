@@ -1,6 +1,15 @@
 from typing import Literal, TypedDict
 
 
+# OpenAI APIが利用できない場合に、エラーの代わりにユーザーへ返すメッセージ
+UNAVAILABLE_REPLY_MESSAGE = "申し訳ありません。ただいま混み合っているため、お返事ができません。少し時間をおいてから、もう一度話しかけてください。"
+
+# メッセージの送信が多すぎて受け付けられない場合に、ユーザーへ返すメッセージ
+RATE_LIMITED_REPLY_MESSAGE = (
+    "申し訳ありません。メッセージが続けて届いたため、お返事が追いつきません。少し時間をおいてから、もう一度話しかけてください。"
+)
+
+
 def is_message(value: str) -> bool:
     return 2 <= len(value) <= 5000
 
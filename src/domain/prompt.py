@@ -1,3 +1,10 @@
+import hashlib
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+COUNSELOR_PROMPT_NAME = "counselor"
+SUMMARY_PROMPT_NAME = "summary"
+
+
 template = """
 ### Instruction ###
 
@@ -15,5 +22,140 @@ template = """
 """
 
 
+class PromptTokenCounter(Protocol):
+    @property
+    def encoding_name(self) -> str:
+        ...
+
+    def count(self, text: str) -> int:
+        ...
+
+
+class Prompt:
+    """
+    レンダリング済みのプロンプト。import時に一度だけ作り、リクエストごとには作り直さない。
+    トークン数はエンコーディングごとに最初に使う時に一度だけ計算して保持する。
+    """
+
+    __slots__ = ("name", "version", "text", "content_hash", "_token_counts")
+
+    def __init__(self, name: str, version: str, text: str) -> None:
+        self.name = name
+        self.version = version
+        self.text = text
+        self.content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self._token_counts: Dict[str, int] = {}
+
+    def count_tokens(self, token_counter: PromptTokenCounter) -> int:
+        encoding_name = token_counter.encoding_name
+
+        token_count = self._token_counts.get(encoding_name)
+        if token_count is None:
+            token_count = token_counter.count(self.text)
+            self._token_counts[encoding_name] = token_count
+
+        return token_count
+
+
+# プロンプトの名前ごとに、登録した順にバージョンを並べる。最後に登録したバージョンが最新
+_prompts: Dict[str, Dict[str, Prompt]] = {}
+
+
+def register_prompt(name: str, version: str, text: str) -> Prompt:
+    versions = _prompts.setdefault(name, {})
+    if version in versions:
+        raise ValueError(f"prompt {name} {version} is already registered")
+
+    prompt = Prompt(name, version, text)
+    versions[version] = prompt
+
+    return prompt
+
+
+def get_prompt(name: str, version: Optional[str] = None) -> Prompt:
+    versions = _prompts.get(name, {})
+
+    if version is None and versions:
+        return list(versions.values())[-1]
+
+    if version not in versions:
+        raise ValueError(f"prompt {name} {version} is not registered")
+
+    return versions[version]
+
+
+def select_prompt(name: str, user_id: str, versions: Sequence[str] = ()) -> Prompt:
+    """
+    versions を指定した場合は、user_id から決まる1つのバージョンを選ぶ（A/Bテスト用）。
+    同じユーザーには常に同じバージョンを使うので、会話の途中でプロンプトが変わらない。
+    """
+    if not versions:
+        return get_prompt(name)
+
+    digest = hashlib.sha256(f"{name}:{user_id}".encode("utf-8")).digest()
+    return get_prompt(name, versions[int.from_bytes(digest[:8], "big") % len(versions)])
+
+
+def validate_prompt_versions(name: str, versions: Sequence[str]) -> None:
+    """
+    起動時に呼び出し、select_prompt に渡すバージョンがすべて登録されているか確かめる。
+    登録されていないバージョンがあると、そのバージョンを割り当てられたユーザーだけが失敗し続けるため。
+    """
+    registered = _prompts.get(name, {})
+    unknown = [version for version in versions if version not in registered]
+    if unknown:
+        raise ValueError(f"prompt {name} {', '.join(unknown)} is not registered")
+
+
+def precompute_prompt_token_counts(token_counter: PromptTokenCounter) -> None:
+    """
+    起動時に呼び出し、登録したすべてのプロンプトのトークン数を計算しておく。
+    """
+    for versions in _prompts.values():
+        for prompt in versions.values():
+            prompt.count_tokens(token_counter)
+
+
+register_prompt(COUNSELOR_PROMPT_NAME, "v1", template)
+
+
 def create_prompt() -> str:
-    return template
+    return get_prompt(COUNSELOR_PROMPT_NAME).text
+
+
+summary_template = """
+### Instruction ###
+
+あなたはカウンセリングの記録係です。
+これまでの会話の要約と、新しく要約に含める会話が与えられます。
+カウンセラーがこの先も会話を続けられるように、1つの要約にまとめ直してください。
+
+### 要約のルール ###
+* Userの悩み、気持ち、置かれている状況を残してください。
+* カウンセラーがこれまでに伝えたことや、Userと約束したことを残してください。
+* 400文字以内の箇条書きで書いてください。
+* 要約だけを出力してください。
+"""
+
+
+register_prompt(SUMMARY_PROMPT_NAME, "v1", summary_template)
+
+
+def create_summary_prompt() -> str:
+    return get_prompt(SUMMARY_PROMPT_NAME).text
+
+
+def create_summary_request_message(
+    previous_summary: str, conversations: List[Tuple[str, str]]
+) -> str:
+    lines = ["### これまでの会話の要約 ###", previous_summary or "なし", ""]
+    lines.append("### 新しく要約に含める会話 ###")
+    for user_message, ai_message in conversations:
+        lines.append(f"User: {user_message}")
+        lines.append(f"カウンセラー: {ai_message}")
+
+    return "\n".join(lines)
+
+
+def create_summary_message(summary: str) -> str:
+    return f"### これまでの会話の要約 ###\n{summary}"
@@ -0,0 +1,51 @@
+from typing import Literal, TypedDict, Protocol, List, Optional
+from domain.message import ChatMessage
+
+BatchStatus = Literal["in_progress", "completed", "failed"]
+
+
+class BatchCompletionRequest(TypedDict):
+    custom_id: str
+    user_id: str
+    chat_messages: List[ChatMessage]
+
+
+class SubmitBatchDto(TypedDict):
+    # 入力ファイルの名前などに使う
+    job_id: str
+    requests: List[BatchCompletionRequest]
+
+
+class Batch(TypedDict):
+    batch_id: str
+    status: BatchStatus
+    # status が completed の場合のみ
+    output_file_id: Optional[str]
+    # status が failed の場合のみ
+    error: Optional[str]
+
+
+class BatchCompletionResult(TypedDict):
+    custom_id: str
+    ai_response_id: str
+    # 生成できなかったリクエストは None
+    message: Optional[str]
+
+
+class BatchCompletionRepositoryInterface(Protocol):
+    async def submit_batch(self, dto: SubmitBatchDto) -> str:
+        """
+        リクエストをJSONLの入力ファイルに書き出してバッチを送信し、バッチのIDを返す。
+        """
+        ...
+
+    async def retrieve_batch(self, batch_id: str) -> Batch:
+        ...
+
+    async def find_batch_results(
+        self, output_file_id: str
+    ) -> List[BatchCompletionResult]:
+        """
+        結果は出力ファイルの行の順に返す。同じ output_file_id では常に同じ順になる。
+        """
+        ...
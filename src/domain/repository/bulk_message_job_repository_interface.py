@@ -0,0 +1,51 @@
+from typing import Literal, TypedDict, Protocol, List, Optional
+
+# created: 作成しただけでバッチを送信していない
+# submitted: バッチを送信し、完了を待っている
+# completed: バッチが完了し、結果を会話履歴に取り込んでいる
+# ingested: 結果をすべて会話履歴に取り込んだ
+# failed: バッチが失敗した
+BulkMessageJobStatus = Literal[
+    "created", "submitted", "completed", "ingested", "failed"
+]
+
+
+class BulkMessageJobItem(TypedDict):
+    # バッチの入力と結果を対応させるID。ジョブ内で一意
+    custom_id: str
+    user_id: str
+    message: str
+
+
+class BulkMessageJob(TypedDict):
+    job_id: str
+    status: BulkMessageJobStatus
+    batch_id: Optional[str]
+    output_file_id: Optional[str]
+    # 会話履歴に取り込んだ結果の行数。再開した場合はこの行の次から取り込む
+    ingested_lines: int
+    error: Optional[str]
+
+
+class CreateBulkMessageJobDto(TypedDict):
+    job_id: str
+    items: List[BulkMessageJobItem]
+
+
+class BulkMessageJobRepositoryInterface(Protocol):
+    async def create_bulk_message_job(self, dto: CreateBulkMessageJobDto) -> None:
+        ...
+
+    async def find_bulk_message_job(self, job_id: str) -> Optional[BulkMessageJob]:
+        ...
+
+    async def find_unfinished_bulk_message_jobs(self) -> List[BulkMessageJob]:
+        ...
+
+    async def find_bulk_message_job_items(
+        self, job_id: str
+    ) -> List[BulkMessageJobItem]:
+        ...
+
+    async def update_bulk_message_job(self, job: BulkMessageJob) -> None:
+        ...
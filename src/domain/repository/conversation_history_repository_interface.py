@@ -1,4 +1,4 @@
-from typing import TypedDict, Protocol, List
+from typing import TypedDict, Protocol, List, Optional
 from domain.message import ChatMessage
 
 
@@ -7,10 +7,38 @@ class CreateMessagesWithConversationHistoryDto(TypedDict):
     request_message: str
 
 
+class ConversationHistoryRequest(TypedDict):
+    # LINEのWebhookの場合は webhook_event_id
+    request_id: str
+    ai_response_id: str
+
+
 class SaveConversationHistoryDto(TypedDict):
     user_id: str
     user_message: str
     ai_message: str
+    # 会話を生成したリクエスト。指定した場合は会話と同時に処理済みのリクエストとして保存し、再送で会話が二重に保存されないようにする
+    processed_request: Optional[ConversationHistoryRequest]
+
+
+class FindConversationHistoriesDto(TypedDict):
+    user_id: str
+    # 前のページで最後に取得した（最も古い）履歴のID。Noneの場合は最新の履歴から取得する
+    last_seen_id: Optional[int]
+    limit: int
+
+
+class FindEvictedConversationHistoriesDto(TypedDict):
+    user_id: str
+    # このIDより新しい履歴のうち、直近の会話から外れたものを取得する
+    after_id: int
+    limit: int
+
+
+class ConversationHistory(TypedDict):
+    id: int
+    user_message: str
+    ai_message: str
 
 
 class ConversationHistoryRepositoryInterface(Protocol):
@@ -19,5 +47,25 @@ class ConversationHistoryRepositoryInterface(Protocol):
     ) -> List[ChatMessage]:
         ...
 
+    async def create_messages_with_conversation_histories(
+        self, dtos: List[CreateMessagesWithConversationHistoryDto]
+    ) -> List[List[ChatMessage]]:
+        ...
+
     async def save_conversation_history(self, dto: SaveConversationHistoryDto) -> None:
         ...
+
+    async def save_conversation_histories(
+        self, dtos: List[SaveConversationHistoryDto]
+    ) -> None:
+        ...
+
+    async def find_conversation_histories(
+        self, dto: FindConversationHistoriesDto
+    ) -> List[ConversationHistory]:
+        ...
+
+    async def find_evicted_conversation_histories(
+        self, dto: FindEvictedConversationHistoriesDto
+    ) -> List[ConversationHistory]:
+        ...
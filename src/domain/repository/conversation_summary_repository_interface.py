@@ -0,0 +1,24 @@
+from typing import TypedDict, Protocol, Optional
+
+
+class ConversationSummary(TypedDict):
+    user_id: str
+    summary: str
+    # 要約に含めた最後の会話履歴のID
+    last_summarized_history_id: int
+
+
+class SaveConversationSummaryDto(TypedDict):
+    user_id: str
+    summary: str
+    last_summarized_history_id: int
+
+
+class ConversationSummaryRepositoryInterface(Protocol):
+    async def find_conversation_summary(
+        self, user_id: str
+    ) -> Optional[ConversationSummary]:
+        ...
+
+    async def save_conversation_summary(self, dto: SaveConversationSummaryDto) -> None:
+        ...
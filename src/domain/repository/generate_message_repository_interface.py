@@ -1,10 +1,12 @@
-from typing import Protocol, TypedDict, List
+from typing import AsyncIterator, Protocol, TypedDict, List
 from domain.message import ChatMessage
 
 
 class GenerateMessageRepositoryDto(TypedDict):
     user_id: str
     chat_messages: List[ChatMessage]
+    # 応答のキャッシュを使わずに必ずメッセージを生成する
+    bypass_cache: bool
 
 
 class GenerateMessageResult(TypedDict):
@@ -12,8 +14,24 @@ class GenerateMessageResult(TypedDict):
     message: str
 
 
+class GenerateMessageStreamChunk(TypedDict):
+    ai_response_id: str
+    delta: str
+
+
+class GenerateMessageUnavailableError(Exception):
+    """
+    混雑や障害でメッセージを生成できない場合のエラー。
+    """
+
+
 class GenerateMessageRepositoryInterface(Protocol):
     async def generate_message(
         self, dto: GenerateMessageRepositoryDto
     ) -> GenerateMessageResult:
         ...
+
+    def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        ...
@@ -0,0 +1,31 @@
+from typing import List, TypedDict, Protocol, Optional
+
+
+class ProcessedRequest(TypedDict):
+    ai_response_id: str
+    message: str
+
+
+class FindProcessedRequestDto(TypedDict):
+    user_id: str
+    # LINEのWebhookの場合は webhook_event_id
+    request_id: str
+
+
+class ProcessedRequestRepositoryInterface(Protocol):
+    """
+    処理済みのリクエストは会話履歴と同時に保存する（SaveConversationHistoryDto の processed_request）。
+    """
+
+    async def find_processed_request(
+        self, dto: FindProcessedRequestDto
+    ) -> Optional[ProcessedRequest]:
+        ...
+
+    async def find_processed_requests(
+        self, dtos: List[FindProcessedRequestDto]
+    ) -> List[Optional[ProcessedRequest]]:
+        """
+        dtos と同じ順に、処理済みのリクエストを返す。処理していないリクエストは None。
+        """
+        ...
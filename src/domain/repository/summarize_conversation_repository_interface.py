@@ -0,0 +1,19 @@
+from typing import Protocol, TypedDict, List
+from domain.repository.conversation_history_repository_interface import (
+    ConversationHistory,
+)
+
+
+class SummarizeConversationRepositoryDto(TypedDict):
+    user_id: str
+    # これまでの要約。まだ要約が存在しない場合は空文字
+    previous_summary: str
+    # 新しく要約に含める会話履歴（古い順）
+    conversation_histories: List[ConversationHistory]
+
+
+class SummarizeConversationRepositoryInterface(Protocol):
+    async def summarize_conversation(
+        self, dto: SummarizeConversationRepositoryDto
+    ) -> str:
+        ...
@@ -0,0 +1,91 @@
+from bisect import bisect_left
+from itertools import accumulate
+from typing import List, Literal, Optional, Sequence
+from domain.message import ChatMessage
+from infrastructure.conversation_window_cache import (
+    ConversationSummaryMessage,
+    ConversationTurn,
+)
+
+
+class ContextMessage:
+    """
+    トークン数を付けたメッセージ。リクエストごとに作るので、__slots__ でメモリを抑える。
+    """
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(
+        self, role: Literal["system", "user", "assistant"], content: str, tokens: int
+    ) -> None:
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+
+def calculate_turn_token_budget(
+    system_message_tokens: int,
+    summary: Optional[ConversationSummaryMessage],
+    request_message_tokens: int,
+    max_token_limit: int,
+) -> int:
+    """
+    max_token_limit から、常に含めるsystemメッセージ・要約・新しいメッセージの分を除いた、直近の会話に使えるトークン数。
+    直近の会話から外れた会話を要約に回す時も同じ計算をして、プロンプトに含めない会話を取りこぼさないようにする。
+    """
+    reserved_tokens = system_message_tokens + request_message_tokens
+    if summary:
+        reserved_tokens += summary["tokens"]
+
+    return max_token_limit - reserved_tokens
+
+
+def build_context_window(
+    system_message: ContextMessage,
+    summary: Optional[ConversationSummaryMessage],
+    turns: Sequence[ConversationTurn],
+    request_message: ContextMessage,
+    max_token_limit: int,
+) -> List[ChatMessage]:
+    """
+    systemメッセージ、要約、直近の会話、新しいメッセージの順に並べたメッセージを作る。
+    systemメッセージと要約、新しいメッセージは常に含め、残りのトークン数に収まる分だけ新しい会話から含める。
+
+    メッセージのトークン数の累積和から含め始める位置を二分探索で求め、含めるメッセージだけを作るので、会話の数に対して O(n) で済む。
+    """
+    # 会話の i 往復目のユーザーのメッセージは 2i 番目、応答は 2i+1 番目
+    message_tokens = [
+        tokens
+        for turn in turns
+        for tokens in (turn["user_message_tokens"], turn["ai_message_tokens"])
+    ]
+
+    # prefix_tokens[i] は最初の i 件のトークン数。i 番目以降のトークン数は prefix_tokens[-1] - prefix_tokens[i]
+    prefix_tokens = list(accumulate(message_tokens, initial=0))
+
+    turn_token_budget = calculate_turn_token_budget(
+        system_message.tokens, summary, request_message.tokens, max_token_limit
+    )
+
+    # start 番目以降のメッセージが残りのトークン数に収まる最小の start
+    start = bisect_left(prefix_tokens, prefix_tokens[-1] - turn_token_budget)
+
+    chat_messages: List[ChatMessage] = [
+        {"role": "system", "content": system_message.content}
+    ]
+
+    # 直近の会話より前の会話は要約としてシステムメッセージの後に含める
+    if summary:
+        chat_messages.append({"role": "system", "content": summary["content"]})
+
+    # 含めるメッセージだけを作る
+    for index in range(start, len(message_tokens)):
+        turn = turns[index // 2]
+        if index % 2 == 0:
+            chat_messages.append({"role": "user", "content": turn["user_message"]})
+        else:
+            chat_messages.append({"role": "assistant", "content": turn["ai_message"]})
+
+    chat_messages.append({"role": "user", "content": request_message.content})
+
+    return chat_messages
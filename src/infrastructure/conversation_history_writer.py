@@ -0,0 +1,582 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import deque
+from functools import lru_cache
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+)
+import aiomysql
+from infrastructure.db import acquire_db_connection, release_db_connection
+from log.logger import AppLogger, ErrorLogExtra
+from metrics.registry import registry
+
+conversation_history_flush_batch_size = registry.histogram(
+    "ai_counselor_conversation_history_flush_batch_size",
+    "Number of conversation turns written by one multi-row INSERT.",
+    ["source"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+conversation_history_write_lag_seconds = registry.histogram(
+    "ai_counselor_conversation_history_write_lag_seconds",
+    "Time from queueing a conversation turn until it was written to the DB.",
+)
+
+conversation_history_flushes = registry.counter(
+    "ai_counselor_conversation_history_flushes_total",
+    "Number of write-behind flushes, by outcome.",
+    ["outcome"],
+)
+
+conversation_history_unsaved = registry.gauge(
+    "ai_counselor_conversation_history_unsaved",
+    "Number of conversation turns not yet written to the DB.",
+    ["state"],
+)
+
+
+class UnsavedConversationHistory(TypedDict):
+    # スプールからの再送後も同じ会話を識別するためのID（DBには保存しない）
+    write_id: str
+    user_id: str
+    user_message: str
+    ai_message: str
+    user_message_tokens: int
+    ai_message_tokens: int
+    token_encoding: str
+    # キューに積んだ時刻（UNIX時間）。プロセスの再起動をまたいでも遅延を計算できるように壁時計を使う
+    queued_at: float
+    # 会話を生成したリクエスト。指定した場合は同じトランザクションで processed_requests にも保存する
+    request_id: Optional[str]
+    ai_response_id: Optional[str]
+
+
+InsertRows = Callable[[List[UnsavedConversationHistory]], Awaitable[None]]
+
+
+class ConversationHistoryWriterUnavailableError(Exception):
+    """
+    停止中またはキューが一杯で、会話を受け付けられない場合のエラー。呼び出し元はDBに直接保存する。
+    """
+
+
+class ConversationHistoryWriterConfig(TypedDict):
+    # 1回のINSERTで保存する最大の会話数。この数だけ溜まったら待たずに保存する
+    max_batch_size: int
+    # 会話をキューに積んでから保存するまでの最大の秒数
+    flush_interval_seconds: float
+    # メモリ上に保持する未保存の会話の最大数
+    max_pending: int
+    # DBに保存できなかった会話を追記するファイル
+    spool_path: str
+
+
+def create_conversation_history_writer_config() -> ConversationHistoryWriterConfig:
+    return ConversationHistoryWriterConfig(
+        max_batch_size=int(
+            os.getenv("CONVERSATION_HISTORY_WRITE_BEHIND_MAX_BATCH_SIZE", "100")
+        ),
+        flush_interval_seconds=float(
+            os.getenv("CONVERSATION_HISTORY_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", "0.5")
+        ),
+        max_pending=int(
+            os.getenv("CONVERSATION_HISTORY_WRITE_BEHIND_MAX_PENDING", "10000")
+        ),
+        spool_path=os.getenv(
+            "CONVERSATION_HISTORY_SPOOL_PATH", "var/conversation_histories.spool"
+        ),
+    )
+
+
+def create_unsaved_conversation_history(
+    user_id: str,
+    user_message: str,
+    ai_message: str,
+    user_message_tokens: int,
+    ai_message_tokens: int,
+    token_encoding: str,
+    request_id: Optional[str] = None,
+    ai_response_id: Optional[str] = None,
+) -> UnsavedConversationHistory:
+    return UnsavedConversationHistory(
+        write_id=uuid.uuid4().hex,
+        user_id=user_id,
+        user_message=user_message,
+        ai_message=ai_message,
+        user_message_tokens=user_message_tokens,
+        ai_message_tokens=ai_message_tokens,
+        token_encoding=token_encoding,
+        queued_at=time.time(),
+        request_id=request_id,
+        ai_response_id=ai_response_id,
+    )
+
+
+async def insert_conversation_histories(
+    connection: aiomysql.Connection,
+    rows: List[UnsavedConversationHistory],
+    skip_processed_requests: bool = False,
+) -> None:
+    """
+    会話と、会話を生成したリクエストの processed_requests の行を保存する。呼び出し元のトランザクションの中で呼び出す。
+    skip_processed_requests を指定した場合は、すでに processed_requests にあるリクエストの会話を保存しない。
+    """
+    # 以前のバージョンのスプールには request_id がない
+    processed_rows = [row for row in rows if row.get("request_id")]
+
+    if processed_rows and skip_processed_requests:
+        saved = await find_saved_processed_requests(connection, processed_rows)
+        rows = [
+            row
+            for row in rows
+            if not row.get("request_id")
+            or (row["user_id"], row["request_id"]) not in saved
+        ]
+        processed_rows = [row for row in rows if row.get("request_id")]
+
+    if processed_rows:
+        await insert_processed_requests(connection, processed_rows)
+
+    if not rows:
+        return
+
+    # 1往復で保存するために、まとめた会話を1つの複数行のINSERTにする
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+    sql = f"""
+    INSERT INTO conversation_histories
+    (user_id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding)
+    VALUES {placeholders}
+    """
+
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            sql,
+            [
+                value
+                for row in rows
+                for value in (
+                    row["user_id"],
+                    row["user_message"],
+                    row["ai_message"],
+                    row["user_message_tokens"],
+                    row["ai_message_tokens"],
+                    row["token_encoding"],
+                )
+            ],
+        )
+
+
+async def find_saved_processed_requests(
+    connection: aiomysql.Connection, rows: List[UnsavedConversationHistory]
+) -> Set[Tuple[str, str]]:
+    placeholders = ", ".join(["(%s, %s)"] * len(rows))
+    sql = f"""
+    SELECT user_id, request_id
+    FROM processed_requests
+    WHERE (user_id, request_id) IN ({placeholders})
+    """
+
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            sql,
+            [value for row in rows for value in (row["user_id"], row["request_id"])],
+        )
+        result = await cursor.fetchall()
+
+    return {(row["user_id"], row["request_id"]) for row in result}
+
+
+async def insert_processed_requests(
+    connection: aiomysql.Connection, rows: List[UnsavedConversationHistory]
+) -> None:
+    # (user_id, request_id) の主キーで、同じリクエストの応答が重複して保存されるのを防ぐ
+    placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+    sql = f"""
+    INSERT INTO processed_requests
+    (user_id, request_id, ai_response_id, ai_message)
+    VALUES {placeholders}
+    """
+
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            sql,
+            [
+                value
+                for row in rows
+                for value in (
+                    row["user_id"],
+                    row["request_id"],
+                    row["ai_response_id"],
+                    row["ai_message"],
+                )
+            ],
+        )
+
+
+async def insert_in_transaction(
+    connection: aiomysql.Connection, rows: List[UnsavedConversationHistory]
+) -> None:
+    """
+    会話と processed_requests の行を1つのトランザクションで保存する。
+    書き込みの成否が分からずに保存し直した場合も、processed_requests にある会話は二重に保存しない。
+    """
+    await connection.begin()
+    try:
+        await insert_conversation_histories(
+            connection, rows, skip_processed_requests=True
+        )
+        await connection.commit()
+    except BaseException:
+        await connection.rollback()
+        raise
+
+
+async def insert_with_db_pool(rows: List[UnsavedConversationHistory]) -> None:
+    connection = await acquire_db_connection()
+    try:
+        await insert_in_transaction(connection, rows)
+    finally:
+        release_db_connection(connection)
+
+
+def append_to_spool(path: str, rows: List[UnsavedConversationHistory]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, "a", encoding="utf-8") as file:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def read_spool(path: str) -> Tuple[List[UnsavedConversationHistory], List[str]]:
+    """
+    スプールファイルの会話と、会話として読めなかった行を返す。
+    追記の途中でプロセスが終了すると、最後の行が途中で切れていることがある。
+    """
+    rows: List[UnsavedConversationHistory] = []
+    invalid_lines: List[str] = []
+
+    try:
+        with open(path, encoding="utf-8") as file:
+            lines = [line.rstrip("\n") for line in file if line.strip()]
+    except FileNotFoundError:
+        return [], []
+
+    for line in lines:
+        try:
+            row = json.loads(line)
+        except ValueError:
+            invalid_lines.append(line)
+            continue
+
+        if not isinstance(row, dict) or "write_id" not in row or "user_id" not in row:
+            invalid_lines.append(line)
+            continue
+
+        rows.append(row)
+
+    return rows, invalid_lines
+
+
+def quarantine_spool_lines(path: str, lines: List[str]) -> None:
+    """
+    スプールファイルの読めなかった行を、調べられるように {path}.invalid に追記する。
+    """
+    with open(f"{path}.invalid", "a", encoding="utf-8") as file:
+        for line in lines:
+            file.write(line + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def replace_spool(path: str, rows: List[UnsavedConversationHistory]) -> None:
+    if not rows:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    temporary_path = f"{path}.tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    append_to_spool(temporary_path, rows)
+    os.replace(temporary_path, path)
+
+
+class ConversationHistoryWriter:
+    """
+    会話履歴をキューに積んですぐに返し、バックグラウンドで複数行のINSERTにまとめて保存する（write-behind）。
+    DBに保存できない場合はスプールファイルに追記し、DBが復旧したら保存し直す。
+    保存するまでの会話は find_unsaved で参照できるので、同じプロセスでは保存した会話をすぐに読める。
+    DBへの書き込みは少なくとも1回行う。書き込みの成否が分からない場合は保存し直すので、
+    リクエストIDのない会話は重複することがある（リクエストIDのある会話は processed_requests で重複を防ぐ）。
+    """
+
+    def __init__(
+        self,
+        config: ConversationHistoryWriterConfig,
+        insert_rows: InsertRows = insert_with_db_pool,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.config = config
+        self.insert_rows = insert_rows
+        self.clock = clock
+        self.logger = AppLogger().logger
+        self._queue: Deque[UnsavedConversationHistory] = deque()
+        # ユーザーごとの未保存（キュー・書き込み中・スプール）の会話。write_id -> 会話
+        self._unsaved: Dict[str, Dict[str, UnsavedConversationHistory]] = {}
+        self._spooled = 0
+        # 前回のプロセスのスプールをまだ保存し終えていない
+        self._is_replay_pending = True
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+        self._accepting = False
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+
+        self._accepting = True
+        self._stopping = False
+        self._is_replay_pending = True
+        self._task = asyncio.create_task(
+            self._run(), name="conversation-history-writer"
+        )
+
+    def enqueue(self, row: UnsavedConversationHistory) -> None:
+        if not self._accepting:
+            raise ConversationHistoryWriterUnavailableError(
+                "conversation history writer is not running"
+            )
+
+        # バックグラウンドのタスクが止まっている場合、キューに積んでも保存されない
+        if self._task is not None and self._task.done():
+            raise ConversationHistoryWriterUnavailableError(
+                "conversation history writer has stopped"
+            )
+
+        if len(self._queue) >= self.config["max_pending"]:
+            raise ConversationHistoryWriterUnavailableError(
+                "conversation history writer is full"
+            )
+
+        self._queue.append(row)
+        self._unsaved.setdefault(row["user_id"], {})[row["write_id"]] = row
+        self._update_gauges()
+
+        if len(self._queue) >= self.config["max_batch_size"]:
+            self._wakeup.set()
+
+    def find_unsaved(self, user_id: str) -> List[UnsavedConversationHistory]:
+        """
+        まだDBに保存していないユーザーの会話を古い順に返す。
+        """
+        return list(self._unsaved.get(user_id, {}).values())
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """
+        新しい会話の受け付けを止め、キューに残った会話を保存してから停止する。
+        時間内に保存できなかった会話はスプールファイルに書き出す。
+        """
+        self._accepting = False
+        if self._task is None:
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        except asyncio.CancelledError:
+            # close を呼んだ側がキャンセルされた場合はそのまま伝える
+            if not self._task.cancelled():
+                raise
+        except Exception as e:
+            self.logger.error(
+                f"conversation history writer stopped with an error: {str(e)}",
+                exc_info=True,
+                extra=ErrorLogExtra(request_id="", user_id=""),
+            )
+
+        if self._queue:
+            append_to_spool(self.config["spool_path"], list(self._queue))
+            self._queue.clear()
+
+        self._task = None
+
+    async def _run(self) -> None:
+        # 前回のプロセスで保存できなかった会話を先に保存する
+        await self._flush()
+
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.config["flush_interval_seconds"]
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            await self._flush()
+
+        # 停止する前に、スプールした会話とキューに残った会話をもう一度保存する
+        await self._flush()
+
+    async def _flush(self) -> None:
+        try:
+            # 会話の順番が入れ替わらないように、スプールした会話を先に保存する
+            if self._spooled or self._is_replay_pending:
+                await self._replay_spool()
+
+            await self._flush_queue()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 想定外のエラーでもタスクを止めずに、次の保存で再び試す
+            conversation_history_flushes.inc(outcome="failed")
+            self.logger.error(
+                f"conversation histories could not be flushed: {str(e)}",
+                exc_info=True,
+                extra=ErrorLogExtra(request_id="", user_id=""),
+            )
+
+    async def _flush_queue(self) -> None:
+        while self._queue:
+            batch = [
+                self._queue.popleft()
+                for _ in range(min(len(self._queue), self.config["max_batch_size"]))
+            ]
+
+            # スプールした会話が残っている間は、順番を保つためにスプールに追記する
+            if self._spooled or self._is_replay_pending:
+                if not await self._spool(batch):
+                    return
+                continue
+
+            try:
+                await self.insert_rows(batch)
+            except asyncio.CancelledError:
+                self._queue.extendleft(reversed(batch))
+                raise
+            except Exception as e:
+                conversation_history_flushes.inc(outcome="spooled")
+                self.logger.warning(
+                    f"conversation histories were spooled: {str(e)}",
+                    exc_info=True,
+                )
+
+                if not await self._spool(batch):
+                    return
+                continue
+
+            conversation_history_flushes.inc(outcome="inserted")
+            self._mark_saved(batch, "queue")
+
+    async def _spool(self, batch: List[UnsavedConversationHistory]) -> bool:
+        try:
+            await asyncio.to_thread(append_to_spool, self.config["spool_path"], batch)
+        except Exception as e:
+            # ファイルにも書けない場合はキューに戻して、次の保存で再び試す
+            conversation_history_flushes.inc(outcome="failed")
+            self.logger.error(
+                f"conversation histories could not be spooled: {str(e)}",
+                exc_info=True,
+            )
+            self._queue.extendleft(reversed(batch))
+            self._update_gauges()
+            return False
+
+        self._spooled += len(batch)
+        self._update_gauges()
+        return True
+
+    async def _replay_spool(self) -> None:
+        spool_path = self.config["spool_path"]
+        rows, invalid_lines = await asyncio.to_thread(read_spool, spool_path)
+
+        # 読めなかった行は保存し直さずに別のファイルに移し、残りの会話の保存を止めない
+        if invalid_lines:
+            await asyncio.to_thread(quarantine_spool_lines, spool_path, invalid_lines)
+            await asyncio.to_thread(replace_spool, spool_path, rows)
+            self.logger.error(
+                f"moved {len(invalid_lines)} invalid spool lines to {spool_path}.invalid",
+                extra=ErrorLogExtra(request_id="", user_id=""),
+            )
+
+        for start in range(0, len(rows), self.config["max_batch_size"]):
+            batch = rows[start : start + self.config["max_batch_size"]]
+
+            try:
+                await self.insert_rows(batch)
+            except Exception as e:
+                self.logger.warning(
+                    f"spooled conversation histories could not be replayed: {str(e)}"
+                )
+                # 保存できた行だけをスプールファイルから取り除く
+                if start > 0:
+                    await asyncio.to_thread(
+                        replace_spool, self.config["spool_path"], rows[start:]
+                    )
+                self._spooled = len(rows) - start
+                self._update_gauges()
+                return
+
+            conversation_history_flushes.inc(outcome="replayed")
+            self._mark_saved(batch, "spool")
+
+        await asyncio.to_thread(replace_spool, self.config["spool_path"], [])
+        self._spooled = 0
+        self._is_replay_pending = False
+        self._update_gauges()
+
+    def _mark_saved(self, batch: List[UnsavedConversationHistory], source: str) -> None:
+        now = self.clock()
+        conversation_history_flush_batch_size.observe(len(batch), source=source)
+
+        for row in batch:
+            conversation_history_write_lag_seconds.observe(now - row["queued_at"])
+
+            unsaved = self._unsaved.get(row["user_id"])
+            if unsaved is None:
+                continue
+
+            unsaved.pop(row["write_id"], None)
+            if not unsaved:
+                del self._unsaved[row["user_id"]]
+
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        conversation_history_unsaved.set(len(self._queue), state="queued")
+        conversation_history_unsaved.set(self._spooled, state="spooled")
+
+
+@lru_cache(maxsize=None)
+def get_conversation_history_writer() -> Optional[ConversationHistoryWriter]:
+    if (
+        os.getenv("CONVERSATION_HISTORY_WRITE_BEHIND_ENABLED", "false").lower()
+        != "true"
+    ):
+        return None
+
+    return ConversationHistoryWriter(create_conversation_history_writer_config())
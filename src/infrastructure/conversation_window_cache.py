@@ -0,0 +1,151 @@
+import os
+import sys
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple, TypedDict
+from infrastructure.ttl_lru_cache import TtlLruCache
+
+CONVERSATION_HISTORY_DEPTH = 10
+
+
+def get_conversation_history_depth() -> int:
+    # プロンプトに含める直近の会話の最大数。トークン数の上限を超える分は含めない
+    return int(os.getenv("CONVERSATION_HISTORY_DEPTH", str(CONVERSATION_HISTORY_DEPTH)))
+
+
+class ConversationTurn(TypedDict):
+    user_message: str
+    ai_message: str
+    user_message_tokens: int
+    ai_message_tokens: int
+
+
+class ConversationSummaryMessage(TypedDict):
+    content: str
+    tokens: int
+
+
+class ConversationWindow(NamedTuple):
+    # トークン数を計算したエンコーディング名
+    encoding_name: str
+    # 直近の会話より前の会話の要約
+    summary: Optional[ConversationSummaryMessage]
+    # 古い順に並んだ直近の会話
+    turns: Tuple[ConversationTurn, ...]
+
+
+def calculate_window_size(window: ConversationWindow) -> int:
+    summary_size = sys.getsizeof(window.summary["content"]) if window.summary else 0
+    return summary_size + sum(
+        sys.getsizeof(turn["user_message"]) + sys.getsizeof(turn["ai_message"]) + 64
+        for turn in window.turns
+    )
+
+
+class ConversationWindowCache:
+    """
+    ユーザーごとの直近の会話をメモリ上に保持し、連続した会話でDBを読まずに済むようにする。
+    会話や要約の保存時にキャッシュも更新する（write-through）。
+    """
+
+    def __init__(
+        self,
+        max_users: int,
+        ttl_seconds: float,
+        max_bytes: int,
+        history_depth: int = CONVERSATION_HISTORY_DEPTH,
+    ) -> None:
+        self.history_depth = history_depth
+        self._cache: TtlLruCache[str, ConversationWindow] = TtlLruCache(
+            "conversation_window",
+            max_entries=max_users,
+            ttl_seconds=ttl_seconds,
+            max_bytes=max_bytes,
+            size_of=calculate_window_size,
+        )
+        # DBから読み込み中のユーザーと、読み込み中に会話が保存されたかどうか
+        self._loading: Dict[str, bool] = {}
+
+    def get(self, user_id: str, encoding_name: str) -> Optional[ConversationWindow]:
+        window = self._cache.get(user_id)
+        if window is None:
+            return None
+
+        if window.encoding_name != encoding_name:
+            self._cache.delete(user_id)
+            return None
+
+        return window
+
+    def start_loading(self, user_id: str) -> None:
+        self._loading[user_id] = False
+
+    def cancel_loading(self, user_id: str) -> None:
+        self._loading.pop(user_id, None)
+
+    def finish_loading(self, user_id: str, window: ConversationWindow) -> None:
+        is_stale = self._loading.pop(user_id, True)
+
+        # 読み込み中に別のリクエストが会話を保存した場合、読み込んだ内容は古いのでキャッシュしない
+        if is_stale:
+            return
+
+        self._cache.set(
+            user_id, window._replace(turns=window.turns[-self.history_depth :])
+        )
+
+    def append(self, user_id: str, encoding_name: str, turn: ConversationTurn) -> None:
+        window = self._find_window_to_update(user_id, encoding_name)
+        if window is None:
+            return
+
+        self._cache.set(
+            user_id,
+            window._replace(turns=(window.turns + (turn,))[-self.history_depth :]),
+        )
+
+    def set_summary(
+        self, user_id: str, encoding_name: str, summary: ConversationSummaryMessage
+    ) -> None:
+        window = self._find_window_to_update(user_id, encoding_name)
+        if window is None:
+            return
+
+        self._cache.set(user_id, window._replace(summary=summary))
+
+    def delete(self, user_id: str) -> None:
+        # 読み込み中の内容も古い可能性があるので、キャッシュしないようにする
+        if user_id in self._loading:
+            self._loading[user_id] = True
+
+        self._cache.delete(user_id)
+
+    def _find_window_to_update(
+        self, user_id: str, encoding_name: str
+    ) -> Optional[ConversationWindow]:
+        if user_id in self._loading:
+            self._loading[user_id] = True
+
+        window = self._cache.peek(user_id)
+        if window is None:
+            return None
+
+        if window.encoding_name != encoding_name:
+            self._cache.delete(user_id)
+            return None
+
+        return window
+
+
+@lru_cache(maxsize=None)
+def get_conversation_window_cache() -> Optional[ConversationWindowCache]:
+    if os.getenv("CONVERSATION_WINDOW_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    return ConversationWindowCache(
+        max_users=int(os.getenv("CONVERSATION_WINDOW_CACHE_MAX_USERS", "10000")),
+        ttl_seconds=float(os.getenv("CONVERSATION_WINDOW_CACHE_TTL_SECONDS", "300")),
+        max_bytes=int(
+            os.getenv("CONVERSATION_WINDOW_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+        ),
+        history_depth=get_conversation_history_depth(),
+    )
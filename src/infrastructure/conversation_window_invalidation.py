@@ -0,0 +1,184 @@
+"""
+別のプロセス（バルクメッセージのジョブなど）が保存した会話を、アプリのプロセスの直近の会話のキャッシュに反映する。
+
+書き込んだプロセスは会話と同じトランザクションで conversation_window_invalidations にユーザーを記録し、
+アプリのプロセスは定期的にこのテーブルを読んで、記録されたユーザーのキャッシュを破棄する。
+キャッシュが古いままになるのは、TTLの間ではなく確認の間隔の間だけになる。
+"""
+
+import os
+import asyncio
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional, Tuple, TypedDict
+import aiomysql
+from infrastructure.db import acquire_db_connection, release_db_connection
+from infrastructure.conversation_window_cache import (
+    ConversationWindowCache,
+    get_conversation_window_cache,
+)
+from log.logger import AppLogger, ErrorLogExtra
+
+# (前回確認したDBの時刻) -> (キャッシュを破棄するユーザー, 今回確認したDBの時刻)
+FetchInvalidatedUserIds = Callable[
+    [Optional[datetime], float], Awaitable[Tuple[List[str], datetime]]
+]
+
+
+class ConversationWindowInvalidationPollerConfig(TypedDict):
+    # conversation_window_invalidations を確認する間隔
+    poll_interval_seconds: float
+    # 記録した時刻よりコミットが遅れた行を読み逃さないように、前回確認した時刻より少し前から読む
+    overlap_seconds: float
+
+
+def create_conversation_window_invalidation_poller_config() -> (
+    ConversationWindowInvalidationPollerConfig
+):
+    return ConversationWindowInvalidationPollerConfig(
+        poll_interval_seconds=float(
+            os.getenv("CONVERSATION_WINDOW_INVALIDATION_POLL_INTERVAL_SECONDS", "5")
+        ),
+        overlap_seconds=float(
+            os.getenv("CONVERSATION_WINDOW_INVALIDATION_OVERLAP_SECONDS", "10")
+        ),
+    )
+
+
+async def insert_conversation_window_invalidations(
+    connection: aiomysql.Connection, user_ids: List[str]
+) -> None:
+    """
+    会話を保存したトランザクションの中で呼び出し、会話と同時にコミットされるようにする。
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
+
+    async with connection.cursor() as cursor:
+        placeholders = ", ".join(["(%s, NOW(6))"] * len(user_ids))
+        sql = f"""
+        INSERT INTO conversation_window_invalidations (user_id, invalidated_at)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE invalidated_at = VALUES(invalidated_at)
+        """
+        await cursor.execute(sql, tuple(user_ids))
+
+
+async def fetch_invalidated_user_ids(
+    connection: aiomysql.Connection,
+    last_polled_at: Optional[datetime],
+    overlap_seconds: float,
+) -> Tuple[List[str], datetime]:
+    async with connection.cursor() as cursor:
+        # アプリとDBの時計のずれの影響を受けないように、DBの時刻で比べる
+        await cursor.execute("SELECT NOW(6) AS polled_at")
+        row = await cursor.fetchone()
+        polled_at: datetime = row["polled_at"]
+
+        # 起動した時点ではキャッシュは空なので、それより前の記録は読まない
+        if last_polled_at is None:
+            return [], polled_at
+
+        sql = """
+        SELECT user_id
+        FROM conversation_window_invalidations
+        WHERE invalidated_at > %s
+        """
+        await cursor.execute(
+            sql, (last_polled_at - timedelta(seconds=overlap_seconds),)
+        )
+        result = await cursor.fetchall()
+
+    return [row["user_id"] for row in result], polled_at
+
+
+async def fetch_invalidated_user_ids_with_db_pool(
+    last_polled_at: Optional[datetime], overlap_seconds: float
+) -> Tuple[List[str], datetime]:
+    connection = await acquire_db_connection()
+    try:
+        return await fetch_invalidated_user_ids(
+            connection, last_polled_at, overlap_seconds
+        )
+    finally:
+        release_db_connection(connection)
+
+
+class ConversationWindowInvalidationPoller:
+    """
+    conversation_window_invalidations を定期的に確認し、別のプロセスが会話を保存したユーザーの直近の会話のキャッシュを破棄する。
+    """
+
+    def __init__(
+        self,
+        config: ConversationWindowInvalidationPollerConfig,
+        window_cache: ConversationWindowCache,
+        fetch_invalidated_user_ids: FetchInvalidatedUserIds = fetch_invalidated_user_ids_with_db_pool,
+    ) -> None:
+        self.config = config
+        self.window_cache = window_cache
+        self.fetch_invalidated_user_ids = fetch_invalidated_user_ids
+        self.logger = AppLogger().logger
+        self._last_polled_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+
+        self._task = asyncio.create_task(
+            self._run(), name="conversation-window-invalidation-poller"
+        )
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def poll(self) -> int:
+        """
+        前回の確認より後に記録されたユーザーのキャッシュを破棄し、破棄したユーザーの数を返す。
+        """
+        user_ids, self._last_polled_at = await self.fetch_invalidated_user_ids(
+            self._last_polled_at, self.config["overlap_seconds"]
+        )
+
+        for user_id in user_ids:
+            self.window_cache.delete(user_id)
+
+        return len(user_ids)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                # DBに接続できない場合も止めずに、次の確認で読み直す
+                self.logger.error(
+                    f"Failed to poll conversation window invalidations: {str(e)}",
+                    exc_info=True,
+                    extra=ErrorLogExtra(request_id="", user_id=""),
+                )
+
+            await asyncio.sleep(self.config["poll_interval_seconds"])
+
+
+@lru_cache(maxsize=None)
+def get_conversation_window_invalidation_poller() -> (
+    Optional[ConversationWindowInvalidationPoller]
+):
+    window_cache = get_conversation_window_cache()
+    config = create_conversation_window_invalidation_poller_config()
+
+    # キャッシュを使わない場合と、間隔に0を指定した場合は確認しない
+    if window_cache is None or config["poll_interval_seconds"] <= 0:
+        return None
+
+    return ConversationWindowInvalidationPoller(config, window_cache)
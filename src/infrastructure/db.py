@@ -2,24 +2,170 @@ import os
 import ssl
 import asyncio
 import aiomysql
-from aiomysql import Connection
+from typing import Optional, TypedDict
+from aiomysql import Connection, Pool
+from metrics.registry import registry
 
 ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
 ctx.load_verify_locations(cafile=os.getenv("SSL_CERT_PATH"))
 
 
+def is_db_ssl_enabled() -> bool:
+    # ローカルのMySQL（docker compose）に接続する場合はSSLを無効にする
+    return os.getenv("DB_SSL_ENABLED", "true").lower() == "true"
+
+
+class DbPoolConfig(TypedDict):
+    min_size: int
+    max_size: int
+    recycle: int
+    acquire_timeout: float
+
+
+class DbPoolStats(TypedDict):
+    min_size: int
+    max_size: int
+    size: int
+    in_use: int
+    idle: int
+    waiters: int
+
+
+def create_db_pool_config() -> DbPoolConfig:
+    return DbPoolConfig(
+        min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+        max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        # PlanetScaleはアイドル状態の接続を切断するため、それより短い間隔で接続を作り直す
+        recycle=int(os.getenv("DB_POOL_RECYCLE_SECONDS", "300")),
+        acquire_timeout=float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", "5")),
+    )
+
+
+class DbPoolNotInitializedError(Exception):
+    pass
+
+
+_pool: Optional[Pool] = None
+_pool_config: Optional[DbPoolConfig] = None
+_waiters = 0
+
+
 async def create_db_connection() -> Connection:
     loop = asyncio.get_event_loop()
 
     connection = await aiomysql.connect(
         host=os.getenv("DB_HOST"),
-        port=3306,
+        port=int(os.getenv("DB_PORT", "3306")),
         user=os.getenv("DB_USERNAME"),
         password=os.getenv("DB_PASSWORD"),
         db=os.getenv("DB_NAME"),
         loop=loop,
         cursorclass=aiomysql.DictCursor,
-        ssl=ctx,
+        ssl=ctx if is_db_ssl_enabled() else None,
     )
 
     return connection
+
+
+async def init_db_pool(config: Optional[DbPoolConfig] = None) -> Pool:
+    global _pool, _pool_config
+
+    if _pool is not None:
+        return _pool
+
+    _pool_config = config or create_db_pool_config()
+
+    _pool = await aiomysql.create_pool(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USERNAME"),
+        password=os.getenv("DB_PASSWORD"),
+        db=os.getenv("DB_NAME"),
+        minsize=_pool_config["min_size"],
+        maxsize=_pool_config["max_size"],
+        pool_recycle=_pool_config["recycle"],
+        # 参照クエリで暗黙のトランザクションが残ったままプールに返却されるのを防ぐ
+        autocommit=True,
+        cursorclass=aiomysql.DictCursor,
+        ssl=ctx if is_db_ssl_enabled() else None,
+    )
+
+    return _pool
+
+
+def get_db_pool() -> Pool:
+    if _pool is None:
+        raise DbPoolNotInitializedError("db pool is not initialized")
+
+    return _pool
+
+
+async def close_db_pool() -> None:
+    global _pool, _pool_config
+
+    if _pool is None:
+        return
+
+    _pool.close()
+    await _pool.wait_closed()
+
+    _pool = None
+    _pool_config = None
+
+
+async def acquire_db_connection() -> Connection:
+    global _waiters
+
+    pool = get_db_pool()
+    timeout = _pool_config["acquire_timeout"] if _pool_config else None
+
+    _waiters += 1
+    try:
+        return await asyncio.wait_for(pool.acquire(), timeout=timeout)
+    finally:
+        _waiters -= 1
+
+
+def release_db_connection(connection: Connection) -> None:
+    pool = get_db_pool()
+    pool.release(connection)
+
+
+def get_db_pool_stats() -> Optional[DbPoolStats]:
+    if _pool is None:
+        return None
+
+    return DbPoolStats(
+        min_size=_pool.minsize,
+        max_size=_pool.maxsize,
+        size=_pool.size,
+        in_use=_pool.size - _pool.freesize,
+        idle=_pool.freesize,
+        waiters=_waiters,
+    )
+
+
+db_pool_connections = registry.gauge(
+    "ai_counselor_db_pool_connections",
+    "Number of connections in the DB connection pool.",
+    ["state"],
+)
+
+db_pool_waiters = registry.gauge(
+    "ai_counselor_db_pool_waiters",
+    "Number of requests waiting to acquire a DB connection.",
+)
+
+
+def collect_db_pool_metrics() -> None:
+    stats = get_db_pool_stats()
+    if stats is None:
+        return
+
+    db_pool_connections.set(stats["in_use"], state="in_use")
+    db_pool_connections.set(stats["idle"], state="idle")
+    db_pool_connections.set(stats["max_size"], state="max")
+    db_pool_waiters.set(stats["waiters"])
+
+
+registry.register_collector(collect_db_pool_metrics)
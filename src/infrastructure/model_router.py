@@ -0,0 +1,333 @@
+import os
+import time
+from collections import deque
+from functools import lru_cache
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypedDict,
+)
+from domain.message import ChatMessage
+from infrastructure.token_counter import TokenCounter, get_token_counter
+from metrics.registry import registry
+
+RouteReason = Literal["primary", "fallback", "degraded"]
+
+SkipReason = Literal["context_window", "cost_budget", "slow", "erroring"]
+
+model_route_decisions = registry.counter(
+    "ai_counselor_model_route_decisions_total",
+    "Number of requests routed to each model, by why the model was chosen.",
+    ["model", "reason"],
+)
+
+model_route_skips = registry.counter(
+    "ai_counselor_model_route_skips_total",
+    "Number of times a model was passed over while routing, by reason.",
+    ["model", "reason"],
+)
+
+
+class ModelSpec(TypedDict):
+    # プロンプトと生成するメッセージを合わせた最大トークン数
+    context_window: int
+    # 1000トークンあたりの料金（USD）
+    prompt_cost_per_1k_tokens: float
+    completion_cost_per_1k_tokens: float
+
+
+MODEL_SPECS: Dict[str, ModelSpec] = {
+    "gpt-4-1106-preview": ModelSpec(
+        context_window=128000,
+        prompt_cost_per_1k_tokens=0.01,
+        completion_cost_per_1k_tokens=0.03,
+    ),
+    "gpt-4": ModelSpec(
+        context_window=8192,
+        prompt_cost_per_1k_tokens=0.03,
+        completion_cost_per_1k_tokens=0.06,
+    ),
+    "gpt-3.5-turbo-1106": ModelSpec(
+        context_window=16385,
+        prompt_cost_per_1k_tokens=0.001,
+        completion_cost_per_1k_tokens=0.002,
+    ),
+}
+
+
+class ModelRouterConfig(TypedDict):
+    # 優先して使うモデルから順に並べたモデル
+    models: List[str]
+    # 生成するメッセージのために空けておくトークン数
+    completion_tokens_reserve: int
+    # 1リクエストあたりの料金の上限（USD）。0の場合は上限なし
+    max_cost_per_request: float
+    # 直近の応答時間のパーセンタイルがこの秒数を超えたモデルは遅いとみなす
+    latency_budget_seconds: float
+    latency_percentile: float
+    # 直近の呼び出しの失敗率がこの割合を超えたモデルは障害中とみなす
+    max_error_rate: float
+    # 直近の呼び出しがこの件数に満たない間は、応答時間と失敗率で判断しない
+    min_samples: int
+    # 応答時間と失敗率はこの秒数以内の呼び出しから計算する
+    # フォールバックしている間は優先するモデルを呼び出さないので、古い失敗が消えないと元に戻れない
+    health_window_seconds: float
+
+
+def create_model_router_config() -> ModelRouterConfig:
+    return ModelRouterConfig(
+        models=[
+            model.strip()
+            for model in os.getenv(
+                "OPENAI_MODELS", "gpt-4-1106-preview,gpt-3.5-turbo-1106"
+            ).split(",")
+            if model.strip()
+        ],
+        completion_tokens_reserve=int(
+            os.getenv("MODEL_ROUTER_COMPLETION_TOKENS_RESERVE", "1000")
+        ),
+        max_cost_per_request=float(
+            os.getenv("MODEL_ROUTER_MAX_COST_PER_REQUEST_USD", "0")
+        ),
+        latency_budget_seconds=float(
+            os.getenv("MODEL_ROUTER_LATENCY_BUDGET_SECONDS", "20")
+        ),
+        latency_percentile=float(os.getenv("MODEL_ROUTER_LATENCY_PERCENTILE", "90")),
+        max_error_rate=float(os.getenv("MODEL_ROUTER_MAX_ERROR_RATE", "0.5")),
+        min_samples=int(os.getenv("MODEL_ROUTER_MIN_SAMPLES", "10")),
+        health_window_seconds=float(
+            os.getenv("MODEL_ROUTER_HEALTH_WINDOW_SECONDS", "60")
+        ),
+    )
+
+
+class ModelHealth:
+    """
+    モデルごとの直近の呼び出しの応答時間と成否を保持する。
+    window_seconds より前の呼び出しは捨てる。
+    """
+
+    def __init__(
+        self,
+        window_seconds: float,
+        max_samples: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.window_seconds = window_seconds
+        self._clock = clock
+        # (記録した時刻, 応答時間（秒）, 成功したかどうか)
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max_samples)
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._samples)
+
+    def record(self, seconds: float, succeeded: bool) -> None:
+        self._samples.append((self._clock(), seconds, succeeded))
+
+    def error_rate(self) -> float:
+        self._expire()
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, _, succeeded in self._samples if not succeeded) / len(
+            self._samples
+        )
+
+    def latency_percentile(self, percentile: float) -> float:
+        self._expire()
+        latencies = sorted(
+            seconds for _, seconds, succeeded in self._samples if succeeded
+        )
+        if not latencies:
+            return 0.0
+        index = round(percentile / 100 * (len(latencies) - 1))
+        return latencies[min(max(index, 0), len(latencies) - 1)]
+
+    def _expire(self) -> None:
+        expired_before = self._clock() - self.window_seconds
+        while self._samples and self._samples[0][0] < expired_before:
+            self._samples.popleft()
+
+
+class RouteDecision(NamedTuple):
+    # 呼び出すモデル
+    model: str
+    reason: RouteReason
+    # 選んだモデルのトークナイザーで数えたプロンプトのトークン数
+    prompt_tokens: int
+    # 呼び出しに失敗した場合に代わりに呼び出すモデル
+    fallback_models: Tuple[str, ...]
+
+
+class ModelRouter:
+    """
+    プロンプトのトークン数・料金の上限・直近の応答時間と失敗率から、リクエストごとに呼び出すモデルを選ぶ。
+    優先するモデルが遅い、または失敗が続いている場合は次のモデルにフォールバックする。
+    """
+
+    def __init__(
+        self,
+        config: ModelRouterConfig,
+        get_token_counter: Callable[[str], TokenCounter] = get_token_counter,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        unknown_models = [
+            model for model in config["models"] if model not in MODEL_SPECS
+        ]
+        if not config["models"] or unknown_models:
+            raise ValueError(f"unsupported models: {unknown_models or 'none'}")
+
+        self.config = config
+        self.get_token_counter = get_token_counter
+        self._health: Dict[str, ModelHealth] = {
+            model: ModelHealth(config["health_window_seconds"], clock=clock)
+            for model in config["models"]
+        }
+
+    def route(self, chat_messages: Sequence[ChatMessage]) -> RouteDecision:
+        prompt_tokens_by_encoding: Dict[str, int] = {}
+        # コンテキストと料金の上限には収まるが、遅い・障害中のモデル
+        degraded_models: List[Tuple[str, int]] = []
+
+        for index, model in enumerate(self.config["models"]):
+            # トークン数は選んだモデルのトークナイザーで数える（同じエンコーディングのモデル同士では数え直さない）
+            token_counter = self.get_token_counter(model)
+            prompt_tokens = prompt_tokens_by_encoding.get(token_counter.encoding_name)
+            if prompt_tokens is None:
+                prompt_tokens = sum(
+                    token_counter.count_batch(
+                        [message["content"] for message in chat_messages]
+                    )
+                )
+                prompt_tokens_by_encoding[token_counter.encoding_name] = prompt_tokens
+
+            skip_reason = self._find_skip_reason(model, prompt_tokens)
+            if skip_reason is None:
+                return self._decide(
+                    model, "primary" if index == 0 else "fallback", prompt_tokens
+                )
+
+            model_route_skips.inc(model=model, reason=skip_reason)
+            if skip_reason in ("slow", "erroring"):
+                degraded_models.append((model, prompt_tokens))
+
+        # すべてのモデルが遅い・障害中の場合は、上限に収まるモデルを優先順に使う
+        if degraded_models:
+            model, prompt_tokens = degraded_models[0]
+            return self._decide(model, "degraded", prompt_tokens)
+
+        # どのモデルにも収まらない場合は、最もコンテキストが大きいモデルに任せる
+        model = max(
+            self.config["models"],
+            key=lambda model: MODEL_SPECS[model]["context_window"],
+        )
+        return self._decide(
+            model,
+            "degraded",
+            prompt_tokens_by_encoding[self.get_token_counter(model).encoding_name],
+        )
+
+    def select_model(self) -> str:
+        """
+        プロンプトを作る前に、呼び出す予定のモデルを選ぶ。
+        route と同じ順にモデルを見て、遅い・障害中のモデルと、料金の上限でプロンプトを含められないモデルは飛ばす。
+        プロンプトは max_prompt_tokens に収めて作るので、route でもコンテキストと料金の上限では飛ばされない。
+        """
+        models = self.config["models"]
+        return next(
+            (
+                model
+                for model in models
+                if self.max_prompt_tokens(model) > 0
+                and self._find_health_skip_reason(model) is None
+            ),
+            models[0],
+        )
+
+    def max_prompt_tokens(self, model: str) -> int:
+        """
+        モデルのコンテキストと料金の上限に収まる、プロンプトの最大トークン数。
+        """
+        spec = MODEL_SPECS[model]
+        completion_tokens = self.config["completion_tokens_reserve"]
+
+        max_tokens = spec["context_window"] - completion_tokens
+
+        max_cost = self.config["max_cost_per_request"]
+        if max_cost > 0:
+            max_tokens = min(
+                max_tokens,
+                int(
+                    (
+                        max_cost * 1000
+                        - completion_tokens * spec["completion_cost_per_1k_tokens"]
+                    )
+                    / spec["prompt_cost_per_1k_tokens"]
+                ),
+            )
+
+        return max(max_tokens, 0)
+
+    def record_result(self, model: str, seconds: float, succeeded: bool) -> None:
+        health = self._health.get(model)
+        if health is not None:
+            health.record(seconds, succeeded)
+
+    def _find_skip_reason(self, model: str, prompt_tokens: int) -> Optional[SkipReason]:
+        spec = MODEL_SPECS[model]
+        completion_tokens = self.config["completion_tokens_reserve"]
+
+        if prompt_tokens + completion_tokens > spec["context_window"]:
+            return "context_window"
+
+        max_cost = self.config["max_cost_per_request"]
+        cost = (
+            prompt_tokens * spec["prompt_cost_per_1k_tokens"]
+            + completion_tokens * spec["completion_cost_per_1k_tokens"]
+        ) / 1000
+        if max_cost > 0 and cost > max_cost:
+            return "cost_budget"
+
+        return self._find_health_skip_reason(model)
+
+    def _find_health_skip_reason(self, model: str) -> Optional[SkipReason]:
+        health = self._health[model]
+        if len(health) < self.config["min_samples"]:
+            return None
+
+        if health.error_rate() > self.config["max_error_rate"]:
+            return "erroring"
+
+        if (
+            health.latency_percentile(self.config["latency_percentile"])
+            > self.config["latency_budget_seconds"]
+        ):
+            return "slow"
+
+        return None
+
+    def _decide(
+        self, model: str, reason: RouteReason, prompt_tokens: int
+    ) -> RouteDecision:
+        model_route_decisions.inc(model=model, reason=reason)
+
+        models = self.config["models"]
+        return RouteDecision(
+            model=model,
+            reason=reason,
+            prompt_tokens=prompt_tokens,
+            fallback_models=tuple(models[models.index(model) + 1 :]),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_model_router() -> ModelRouter:
+    # モデルごとの応答時間と失敗率はプロセス内で共有する
+    return ModelRouter(create_model_router_config())
@@ -1,17 +1,110 @@
-from typing import Literal
-import tiktoken
+import os
+from importlib.util import find_spec
+from typing import Optional, TypedDict
+import httpx
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
+from infrastructure.token_counter import get_token_counter
+from metrics.registry import registry
 
+openai_tokens = registry.counter(
+    "ai_counselor_openai_tokens_total",
+    "Number of tokens sent to and generated by the OpenAI API.",
+    ["model", "type"],
+)
 
-def calculate_token_count(text: str, model: Literal["gpt-4", "gpt-3.5-turbo"]) -> int:
-    tiktoken_encoding = tiktoken.encoding_for_model(model)
-    encoded = tiktoken_encoding.encode(text)
-    return len(encoded)
 
+def calculate_token_count(text: str, model: str) -> int:
+    return get_token_counter(model).count(text)
 
-DEFAULT_MAX_TOKEN_LIMIT = 1000
 
+def record_openai_usage(model: str, usage: Optional[CompletionUsage]) -> None:
+    if usage is None:
+        return
 
-def is_token_limit_exceeded(
-    use_token: int, max_token_limit: int = DEFAULT_MAX_TOKEN_LIMIT
-) -> bool:
-    return use_token > max_token_limit
+    openai_tokens.inc(usage.prompt_tokens, model=model, type="prompt")
+    openai_tokens.inc(usage.completion_tokens, model=model, type="completion")
+
+
+class OpenAiHttpClientConfig(TypedDict):
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    http2: bool
+    connect_timeout: float
+    read_timeout: float
+    write_timeout: float
+    pool_timeout: float
+
+
+def create_openai_http_client_config() -> OpenAiHttpClientConfig:
+    return OpenAiHttpClientConfig(
+        max_connections=int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(
+            os.getenv("OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+        ),
+        keepalive_expiry=float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS", "60")),
+        http2=os.getenv("OPENAI_HTTP2", "false").lower() == "true",
+        connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5")),
+        read_timeout=float(os.getenv("OPENAI_READ_TIMEOUT_SECONDS", "120")),
+        write_timeout=float(os.getenv("OPENAI_WRITE_TIMEOUT_SECONDS", "10")),
+        pool_timeout=float(os.getenv("OPENAI_POOL_TIMEOUT_SECONDS", "10")),
+    )
+
+
+_openai_client: Optional[AsyncOpenAI] = None
+
+
+def create_openai_client(
+    config: Optional[OpenAiHttpClientConfig] = None,
+) -> AsyncOpenAI:
+    config = config or create_openai_http_client_config()
+
+    # HTTP/2を利用するには h2 パッケージが必要なので、未インストールの場合はHTTP/1.1で接続する
+    http2 = config["http2"] and find_spec("h2") is not None
+
+    http_client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=config["keepalive_expiry"],
+        ),
+        timeout=httpx.Timeout(
+            connect=config["connect_timeout"],
+            read=config["read_timeout"],
+            write=config["write_timeout"],
+            pool=config["pool_timeout"],
+        ),
+    )
+
+    return AsyncOpenAI(
+        api_key=os.environ["OPENAI_API_KEY"],
+        http_client=http_client,
+        # リトライは OpenAiCallPolicy でタイムアウトやサーキットブレーカーと合わせて行う
+        max_retries=0,
+    )
+
+
+def init_openai_client() -> AsyncOpenAI:
+    global _openai_client
+
+    if _openai_client is None:
+        _openai_client = create_openai_client()
+
+    return _openai_client
+
+
+def get_openai_client() -> AsyncOpenAI:
+    # lifespan外（スクリプト実行など）から呼ばれた場合でも同じクライアントを使い回す
+    return init_openai_client()
+
+
+async def close_openai_client() -> None:
+    global _openai_client
+
+    if _openai_client is None:
+        return
+
+    await _openai_client.close()
+    _openai_client = None
@@ -0,0 +1,352 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Literal,
+    Optional,
+    Set,
+    TypedDict,
+    TypeVar,
+)
+import openai
+from metrics.registry import registry
+
+T = TypeVar("T")
+
+CircuitState = Literal["closed", "open", "half_open"]
+
+openai_call_attempts = registry.counter(
+    "ai_counselor_openai_call_attempts_total",
+    "Number of attempts to call the OpenAI API, by result.",
+    ["outcome"],
+)
+
+openai_hedged_requests = registry.counter(
+    "ai_counselor_openai_hedged_requests_total",
+    "Number of hedge requests sent because the first request was slow.",
+)
+
+openai_circuit_open = registry.gauge(
+    "ai_counselor_openai_circuit_open",
+    "1 while the circuit breaker for the OpenAI API is open, otherwise 0.",
+    ["model"],
+)
+
+
+class OpenAiUnavailableError(Exception):
+    """
+    リトライしてもOpenAI APIから応答を得られなかった場合のエラー。
+    """
+
+
+class CircuitOpenError(OpenAiUnavailableError):
+    """
+    サーキットブレーカーが開いているため、OpenAI APIを呼び出さずに失敗した場合のエラー。
+    """
+
+
+class OpenAiCallPolicyConfig(TypedDict):
+    # 1回の呼び出しのタイムアウト
+    attempt_timeout: float
+    # リトライの待ち時間を含めた全体のタイムアウト
+    overall_timeout: float
+    max_retries: int
+    # リトライの待ち時間は backoff_base * 2^n を上限とした範囲からランダムに選ぶ
+    backoff_base: float
+    backoff_max: float
+    hedge_enabled: bool
+    # 直近の応答時間のこのパーセンタイルを過ぎても応答がない場合に、同じリクエストをもう1つ送る
+    hedge_percentile: float
+    # 応答時間のサンプルがこの件数に満たない間はヘッジしない
+    hedge_min_samples: int
+    # 連続してこの回数失敗したらサーキットブレーカーを開く
+    circuit_failure_threshold: int
+    # サーキットブレーカーを開いてから、試しに1件だけ呼び出すまでの時間
+    circuit_reset_timeout: float
+
+
+def create_openai_call_policy_config() -> OpenAiCallPolicyConfig:
+    return OpenAiCallPolicyConfig(
+        attempt_timeout=float(os.getenv("OPENAI_ATTEMPT_TIMEOUT_SECONDS", "30")),
+        overall_timeout=float(os.getenv("OPENAI_OVERALL_TIMEOUT_SECONDS", "60")),
+        max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+        backoff_base=float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5")),
+        backoff_max=float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "8")),
+        hedge_enabled=os.getenv("OPENAI_HEDGE_ENABLED", "false").lower() == "true",
+        hedge_percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95")),
+        hedge_min_samples=int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20")),
+        circuit_failure_threshold=int(
+            os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "5")
+        ),
+        circuit_reset_timeout=float(
+            os.getenv("OPENAI_CIRCUIT_RESET_TIMEOUT_SECONDS", "30")
+        ),
+    )
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    レート制限（429）・サーバーエラー（5xx）・タイムアウト・接続エラーはリトライする。
+    """
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        # APITimeoutError は APIConnectionError のサブクラス
+        return True
+
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+
+    return False
+
+
+def parse_retry_after(error: BaseException) -> Optional[float]:
+    """
+    レスポンスの Retry-After（秒数またはHTTP日付）、retry-after-ms ヘッダーから待ち時間（秒）を返す。
+    """
+    if not isinstance(error, openai.APIStatusError):
+        return None
+
+    headers = error.response.headers
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    連続して失敗した場合に呼び出しを一定時間止め、障害中のAPIを待ち続けないようにする。
+    止めている時間が過ぎたら1件だけ試しに呼び出し、成功したら元に戻す。
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+        model: str = "",
+    ) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        # メトリクスのラベル。サーキットブレーカーはモデルごとに作る
+        self.model = model
+        self._state: CircuitState = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._is_trial_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        if (
+            self._state == "open"
+            and self._clock() - self._opened_at >= self.reset_timeout
+        ):
+            self._state = "half_open"
+        return self._state
+
+    def acquire(self) -> None:
+        state = self.state
+
+        if state == "open" or (state == "half_open" and self._is_trial_in_flight):
+            raise CircuitOpenError("the circuit breaker for the OpenAI API is open")
+
+        if state == "half_open":
+            self._is_trial_in_flight = True
+
+    def record_success(self) -> None:
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._is_trial_in_flight = False
+        openai_circuit_open.set(0, model=self.model)
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        self._is_trial_in_flight = False
+
+        if (
+            self._state == "half_open"
+            or self._consecutive_failures >= self.failure_threshold
+        ):
+            self._state = "open"
+            self._opened_at = self._clock()
+            openai_circuit_open.set(1, model=self.model)
+
+    def release(self) -> None:
+        """
+        成功とも失敗とも判断できない結果（リクエスト内容の誤りなど）で呼び出しが終わった場合に呼ぶ。
+        """
+        self._is_trial_in_flight = False
+
+
+class LatencyTracker:
+    """
+    直近の応答時間を保持し、ヘッジするまでの待ち時間を決める。
+    """
+
+    def __init__(self, max_samples: int = 200) -> None:
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> float:
+        samples = sorted(self._samples)
+        index = round(percentile / 100 * (len(samples) - 1))
+        return samples[min(max(index, 0), len(samples) - 1)]
+
+
+class OpenAiCallPolicy:
+    """
+    OpenAI APIの呼び出しにタイムアウト・リトライ・ヘッジ・サーキットブレーカーを適用する。
+    """
+
+    def __init__(
+        self,
+        config: OpenAiCallPolicyConfig,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+        model: str = "",
+    ) -> None:
+        self.config = config
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(
+            config["circuit_failure_threshold"],
+            config["circuit_reset_timeout"],
+            model=model,
+        )
+        self.latencies = LatencyTracker()
+        self._sleep = sleep
+
+    async def call(
+        self, operation: Callable[[], Awaitable[T]], hedge: bool = True
+    ) -> T:
+        """
+        operation を呼び出す。operation は呼び出すたびに新しいリクエストを送る関数にする。
+        hedge=False の場合は、ストリーミングや急がない処理のためヘッジしない。
+        """
+        self.circuit_breaker.acquire()
+
+        deadline = time.monotonic() + self.config["overall_timeout"]
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            started_at = time.monotonic()
+
+            try:
+                result = await asyncio.wait_for(
+                    self._call_with_hedge(operation) if hedge else operation(),
+                    timeout=min(self.config["attempt_timeout"], remaining),
+                )
+            except asyncio.CancelledError:
+                self.circuit_breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable_error(e):
+                    openai_call_attempts.inc(outcome="error")
+                    self.circuit_breaker.release()
+                    raise
+
+                openai_call_attempts.inc(
+                    outcome="timeout"
+                    if isinstance(e, asyncio.TimeoutError)
+                    else "retryable_error"
+                )
+
+                delay = self._calculate_retry_delay(e, attempt)
+                if (
+                    attempt >= self.config["max_retries"]
+                    or time.monotonic() + delay >= deadline
+                ):
+                    self.circuit_breaker.record_failure()
+                    raise OpenAiUnavailableError(
+                        f"the OpenAI API did not respond after {attempt + 1} attempts"
+                    ) from e
+
+                await self._sleep(delay)
+                attempt += 1
+                continue
+
+            openai_call_attempts.inc(outcome="success")
+            self.circuit_breaker.record_success()
+            if hedge:
+                self.latencies.record(time.monotonic() - started_at)
+
+            return result
+
+    def _calculate_retry_delay(self, error: BaseException, attempt: int) -> float:
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+
+        # 同時に失敗したリクエストが一斉にリトライしないように、待ち時間をランダムにずらす（Full Jitter）
+        return random.uniform(
+            0,
+            min(self.config["backoff_max"], self.config["backoff_base"] * 2**attempt),
+        )
+
+    async def _call_with_hedge(self, operation: Callable[[], Awaitable[T]]) -> T:
+        if (
+            not self.config["hedge_enabled"]
+            or len(self.latencies) < self.config["hedge_min_samples"]
+        ):
+            return await operation()
+
+        hedge_delay = self.latencies.percentile(self.config["hedge_percentile"])
+
+        tasks: Set["asyncio.Future[T]"] = {asyncio.ensure_future(operation())}
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                openai_hedged_requests.inc()
+                tasks.add(asyncio.ensure_future(operation()))
+
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                # 先に成功した応答を使い、片方が失敗してももう片方の応答を待つ
+                errors = [task.exception() for task in done]
+                for task, error in zip(done, errors):
+                    if error is None:
+                        return task.result()
+
+                if not tasks:
+                    raise errors[0]  # type: ignore
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+@lru_cache(maxsize=None)
+def get_openai_call_policy(model: str) -> OpenAiCallPolicy:
+    # サーキットブレーカーの状態と応答時間はモデルごとに、プロセス内で共有する
+    return OpenAiCallPolicy(create_openai_call_policy_config(), model=model)
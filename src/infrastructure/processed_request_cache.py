@@ -0,0 +1,25 @@
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+from domain.repository.processed_request_repository_interface import ProcessedRequest
+from infrastructure.ttl_lru_cache import TtlLruCache
+
+# (user_id, request_id)
+ProcessedRequestKey = Tuple[str, str]
+
+ProcessedRequestCache = TtlLruCache[ProcessedRequestKey, ProcessedRequest]
+
+
+@lru_cache(maxsize=None)
+def get_processed_request_cache() -> Optional[ProcessedRequestCache]:
+    """
+    再送されたリクエストの多くはDBを読まずに済むように、処理済みのリクエストの応答をメモリ上にも保持する。
+    """
+    if os.getenv("PROCESSED_REQUEST_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    return TtlLruCache(
+        "processed_request",
+        max_entries=int(os.getenv("PROCESSED_REQUEST_CACHE_MAX_ENTRIES", "10000")),
+        ttl_seconds=float(os.getenv("PROCESSED_REQUEST_CACHE_TTL_SECONDS", "600")),
+    )
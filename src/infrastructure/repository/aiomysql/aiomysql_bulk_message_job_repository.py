@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, Optional
+import aiomysql
+from domain.repository.bulk_message_job_repository_interface import (
+    BulkMessageJob,
+    BulkMessageJobItem,
+    BulkMessageJobRepositoryInterface,
+    CreateBulkMessageJobDto,
+)
+from tracing.tracer import create_mysql_span_attributes, traced
+
+
+def create_bulk_message_job(row: Dict[str, Any]) -> BulkMessageJob:
+    return BulkMessageJob(
+        job_id=row["job_id"],
+        status=row["status"],
+        batch_id=row["batch_id"],
+        output_file_id=row["output_file_id"],
+        ingested_lines=row["ingested_lines"],
+        error=row["error"],
+    )
+
+
+class AiomysqlBulkMessageJobRepository(BulkMessageJobRepositoryInterface):
+    def __init__(self, connection: aiomysql.Connection) -> None:
+        self.connection = connection
+
+    @traced(
+        "AiomysqlBulkMessageJobRepository.create_bulk_message_job",
+        create_mysql_span_attributes("INSERT", "bulk_message_jobs"),
+    )
+    async def create_bulk_message_job(self, dto: CreateBulkMessageJobDto) -> None:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            INSERT INTO bulk_message_jobs (job_id, status, ingested_lines)
+            VALUES (%s, 'created', 0)
+            """
+            await cursor.execute(sql, (dto["job_id"],))
+
+            sql = """
+            INSERT INTO bulk_message_job_items (job_id, custom_id, user_id, message)
+            VALUES (%s, %s, %s, %s)
+            """
+            await cursor.executemany(
+                sql,
+                [
+                    (dto["job_id"], item["custom_id"], item["user_id"], item["message"])
+                    for item in dto["items"]
+                ],
+            )
+
+    @traced(
+        "AiomysqlBulkMessageJobRepository.find_bulk_message_job",
+        create_mysql_span_attributes("SELECT", "bulk_message_jobs"),
+    )
+    async def find_bulk_message_job(self, job_id: str) -> Optional[BulkMessageJob]:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            SELECT job_id, status, batch_id, output_file_id, ingested_lines, error
+            FROM bulk_message_jobs
+            WHERE job_id = %s
+            """
+            await cursor.execute(sql, (job_id,))
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return create_bulk_message_job(row)
+
+    @traced(
+        "AiomysqlBulkMessageJobRepository.find_unfinished_bulk_message_jobs",
+        create_mysql_span_attributes("SELECT", "bulk_message_jobs"),
+    )
+    async def find_unfinished_bulk_message_jobs(self) -> List[BulkMessageJob]:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            SELECT job_id, status, batch_id, output_file_id, ingested_lines, error
+            FROM bulk_message_jobs
+            WHERE status IN ('created', 'submitted', 'completed')
+            ORDER BY created_at, job_id
+            """
+            await cursor.execute(sql)
+            rows = await cursor.fetchall()
+
+        return [create_bulk_message_job(row) for row in rows]
+
+    @traced(
+        "AiomysqlBulkMessageJobRepository.find_bulk_message_job_items",
+        create_mysql_span_attributes("SELECT", "bulk_message_job_items"),
+    )
+    async def find_bulk_message_job_items(
+        self, job_id: str
+    ) -> List[BulkMessageJobItem]:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            SELECT custom_id, user_id, message
+            FROM bulk_message_job_items
+            WHERE job_id = %s
+            ORDER BY custom_id
+            """
+            await cursor.execute(sql, (job_id,))
+            rows = await cursor.fetchall()
+
+        return [
+            BulkMessageJobItem(
+                custom_id=row["custom_id"],
+                user_id=row["user_id"],
+                message=row["message"],
+            )
+            for row in rows
+        ]
+
+    @traced(
+        "AiomysqlBulkMessageJobRepository.update_bulk_message_job",
+        create_mysql_span_attributes("UPDATE", "bulk_message_jobs"),
+    )
+    async def update_bulk_message_job(self, job: BulkMessageJob) -> None:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            UPDATE bulk_message_jobs
+            SET status = %s, batch_id = %s, output_file_id = %s, ingested_lines = %s, error = %s
+            WHERE job_id = %s
+            """
+            await cursor.execute(
+                sql,
+                (
+                    job["status"],
+                    job["batch_id"],
+                    job["output_file_id"],
+                    job["ingested_lines"],
+                    job["error"],
+                    job["job_id"],
+                ),
+            )
@@ -1,13 +1,90 @@
-from typing import cast, List, Literal
+import os
+from typing import Dict, List, Optional, Sequence
 import aiomysql
 from domain.message import ChatMessage, get_max_token_limit
-from domain.prompt import create_prompt
+from domain.prompt import (
+    COUNSELOR_PROMPT_NAME,
+    create_summary_message,
+    select_prompt,
+)
 from domain.repository.conversation_history_repository_interface import (
     SaveConversationHistoryDto,
     CreateMessagesWithConversationHistoryDto,
     ConversationHistoryRepositoryInterface,
+    ConversationHistory,
+    FindConversationHistoriesDto,
+    FindEvictedConversationHistoriesDto,
+)
+from domain.repository.processed_request_repository_interface import ProcessedRequest
+from infrastructure.token_counter import get_token_counter, TokenCounter
+from infrastructure.model_router import ModelRouter, get_model_router
+from infrastructure.processed_request_cache import ProcessedRequestCache
+from metrics.stage_timer import measure_stage
+from tracing.tracer import create_mysql_span_attributes, traced
+from infrastructure.context_window_builder import (
+    ContextMessage,
+    build_context_window,
+    calculate_turn_token_budget,
+)
+from infrastructure.conversation_window_cache import (
+    ConversationSummaryMessage,
+    ConversationTurn,
+    ConversationWindow,
+    ConversationWindowCache,
+    get_conversation_history_depth,
+)
+from infrastructure.conversation_history_writer import (
+    ConversationHistoryWriter,
+    ConversationHistoryWriterUnavailableError,
+    UnsavedConversationHistory,
+    create_unsaved_conversation_history,
+    insert_conversation_histories,
+    insert_in_transaction,
+)
+from infrastructure.conversation_window_invalidation import (
+    insert_conversation_window_invalidations,
 )
-from infrastructure.openai import calculate_token_count, is_token_limit_exceeded
+from infrastructure.repository.aiomysql.aiomysql_db_handler import (
+    AiomysqlDbHandler,
+    run_after_commit,
+)
+
+
+def get_token_count_model() -> str:
+    """
+    会話履歴や要約に保存するトークン数は、優先して使うモデルのトークナイザーで数える。
+    """
+    return get_model_router().config["models"][0]
+
+
+def get_counselor_prompt_versions() -> List[str]:
+    # カンマ区切りで複数指定した場合は、ユーザーごとにいずれかのバージョンを使う
+    versions = os.getenv("COUNSELOR_PROMPT_VERSIONS", "")
+    return [version.strip() for version in versions.split(",") if version.strip()]
+
+
+def merge_unsaved_turns(
+    saved_turns: List[ConversationTurn], unsaved_turns: List[ConversationTurn]
+) -> List[ConversationTurn]:
+    """
+    DBから読んだ会話の後ろに、まだDBに保存されていない会話をつなげる。
+    DBを読んでいる間に保存された会話は両方に含まれるので、DBの末尾と重なる分を取り除く。
+    """
+
+    def is_same_turn(a: ConversationTurn, b: ConversationTurn) -> bool:
+        return (
+            a["user_message"] == b["user_message"]
+            and a["ai_message"] == b["ai_message"]
+        )
+
+    for overlap in range(min(len(saved_turns), len(unsaved_turns)), 0, -1):
+        if all(
+            is_same_turn(saved, unsaved)
+            for saved, unsaved in zip(saved_turns[-overlap:], unsaved_turns)
+        ):
+            return saved_turns + unsaved_turns[overlap:]
+
+    return saved_turns + unsaved_turns
 
 
 class AiomysqlConversationHistoryRepository(ConversationHistoryRepositoryInterface):
@@ -15,77 +92,690 @@ class AiomysqlConversationHistoryRepository(ConversationHistoryRepositoryInterfa
         self,
         connection: aiomysql.Connection,
         max_token_limit: int = get_max_token_limit(),
+        window_cache: Optional[ConversationWindowCache] = None,
+        writer: Optional[ConversationHistoryWriter] = None,
+        prompt_versions: Optional[Sequence[str]] = None,
+        history_depth: Optional[int] = None,
+        db_handler: Optional[AiomysqlDbHandler] = None,
+        processed_request_cache: Optional[ProcessedRequestCache] = None,
+        model_router: Optional[ModelRouter] = None,
+        invalidate_window_caches: bool = False,
     ) -> None:
         self.connection = connection
         self.max_token_limit = max_token_limit
+        self.window_cache = window_cache
+        # 指定した場合は会話をキューに積むだけで返し、DBへの保存はバックグラウンドで行う
+        self.writer = writer
+        self.prompt_versions = (
+            prompt_versions
+            if prompt_versions is not None
+            else get_counselor_prompt_versions()
+        )
+        # プロンプトに含める直近の会話の最大数
+        self.history_depth = history_depth or get_conversation_history_depth()
+        # 保存した会話をキャッシュや writer に渡すのは、このトランザクションがコミットされた後にする
+        self.db_handler = db_handler
+        self.processed_request_cache = processed_request_cache
+        # プロンプトは、呼び出す予定のモデルのトークナイザーとコンテキストの上限に合わせて作る
+        self.model_router = model_router or get_model_router()
+        # アプリと別のプロセスで保存する場合に指定し、アプリのプロセスの直近の会話のキャッシュを破棄させる
+        self.invalidate_window_caches = invalidate_window_caches
 
     async def create_messages_with_conversation_history(
         self, dto: CreateMessagesWithConversationHistoryDto
     ) -> List[ChatMessage]:
-        async with self.connection.cursor() as cursor:
-            sql = """
-            SELECT user_message, ai_message
-            FROM conversation_histories
-            WHERE user_id = %s
-            ORDER BY id DESC
-            LIMIT 10
-            """
-            await cursor.execute(sql, (dto["user_id"],))
-            result = await cursor.fetchall()
-            if result:
-                result.reverse()
-
-            conversation_history = [
-                {"role": role_type, "content": row[message_type]}
-                for row in result
-                for role_type, message_type in [
-                    ("user", "user_message"),
-                    ("assistant", "ai_message"),
+        model = self.model_router.select_model()
+        token_counter = get_token_counter(model)
+
+        window = await self._find_conversation_window(dto["user_id"], token_counter)
+
+        return self._create_messages(
+            window, dto["user_id"], dto["request_message"], token_counter, model
+        )
+
+    async def create_messages_with_conversation_histories(
+        self, dtos: List[CreateMessagesWithConversationHistoryDto]
+    ) -> List[List[ChatMessage]]:
+        """
+        複数のユーザーの会話履歴を、ユーザー数によらず会話履歴と要約それぞれ1回のクエリで読み込む。
+        """
+        # バッチは優先して使うモデルで作る
+        model = self._primary_model()
+        token_counter = get_token_counter(model)
+
+        windows = await self._find_conversation_windows(
+            list(dict.fromkeys(dto["user_id"] for dto in dtos)), token_counter
+        )
+
+        return [
+            self._create_messages(
+                windows[dto["user_id"]],
+                dto["user_id"],
+                dto["request_message"],
+                token_counter,
+                model,
+            )
+            for dto in dtos
+        ]
+
+    def _create_messages(
+        self,
+        window: ConversationWindow,
+        user_id: str,
+        request_message: str,
+        token_counter: TokenCounter,
+        model: str,
+    ) -> List[ChatMessage]:
+        # プロンプトのトークン数は計算済みの値を使う
+        prompt = select_prompt(COUNSELOR_PROMPT_NAME, user_id, self.prompt_versions)
+
+        with measure_stage("tokenization"):
+            request_message_tokens = token_counter.count(request_message)
+
+        return build_context_window(
+            ContextMessage("system", prompt.text, prompt.count_tokens(token_counter)),
+            window.summary,
+            window.turns,
+            ContextMessage("user", request_message, request_message_tokens),
+            self._max_prompt_tokens(model),
+        )
+
+    def _primary_model(self) -> str:
+        return self.model_router.config["models"][0]
+
+    def _max_prompt_tokens(self, model: str) -> int:
+        """
+        会話履歴に使うトークン数の上限と、モデルのコンテキストと料金の上限に収まるトークン数の小さい方。
+        """
+        return min(self.max_token_limit, self.model_router.max_prompt_tokens(model))
+
+    @traced(
+        "AiomysqlConversationHistoryRepository.save_conversation_history",
+        create_mysql_span_attributes("INSERT", "conversation_histories"),
+    )
+    async def save_conversation_history(self, dto: SaveConversationHistoryDto) -> None:
+        # 保存後に内容が変わることはないので、トークン数は書き込み時に一度だけ計算して保存しておく
+        token_counter = get_token_counter(self._primary_model())
+        with measure_stage("tokenization"):
+            user_message_tokens, ai_message_tokens = token_counter.count_batch(
+                [dto["user_message"], dto["ai_message"]]
+            )
+
+        await self._save_rows(
+            [
+                self._create_row(
+                    dto,
+                    user_message_tokens,
+                    ai_message_tokens,
+                    token_counter.encoding_name,
+                )
+            ]
+        )
+
+    @traced(
+        "AiomysqlConversationHistoryRepository.save_conversation_histories",
+        create_mysql_span_attributes("INSERT", "conversation_histories"),
+    )
+    async def save_conversation_histories(
+        self, dtos: List[SaveConversationHistoryDto]
+    ) -> None:
+        """
+        複数の会話をまとめて1回の複数行のINSERTで保存する。
+        """
+        if not dtos:
+            return
+
+        token_counter = get_token_counter(self._primary_model())
+        with measure_stage("tokenization"):
+            token_counts = token_counter.count_batch(
+                [
+                    message
+                    for dto in dtos
+                    for message in (dto["user_message"], dto["ai_message"])
                 ]
+            )
+
+        await self._save_rows(
+            [
+                self._create_row(
+                    dto,
+                    token_counts[index * 2],
+                    token_counts[index * 2 + 1],
+                    token_counter.encoding_name,
+                )
+                for index, dto in enumerate(dtos)
             ]
+        )
 
-        # もし会話履歴がまだ存在しなければ、システムメッセージを追加
-        if not conversation_history:
-            conversation_history.append({"role": "system", "content": create_prompt()})
+    @staticmethod
+    def _create_row(
+        dto: SaveConversationHistoryDto,
+        user_message_tokens: int,
+        ai_message_tokens: int,
+        token_encoding: str,
+    ) -> UnsavedConversationHistory:
+        processed_request = dto["processed_request"]
 
-        # 新しいメッセージを会話履歴に追加
-        conversation_history.append({"role": "user", "content": dto["request_message"]})
+        return create_unsaved_conversation_history(
+            user_id=dto["user_id"],
+            user_message=dto["user_message"],
+            ai_message=dto["ai_message"],
+            user_message_tokens=user_message_tokens,
+            ai_message_tokens=ai_message_tokens,
+            token_encoding=token_encoding,
+            request_id=processed_request["request_id"] if processed_request else None,
+            ai_response_id=(
+                processed_request["ai_response_id"] if processed_request else None
+            ),
+        )
 
-        # 実際に会話履歴に含めるメッセージ
-        chat_messages: List[ChatMessage] = []
-        total_tokens = 0
+    async def _save_rows(self, rows: List[UnsavedConversationHistory]) -> None:
+        if self.writer is None:
+            await insert_conversation_histories(self.connection, rows)
 
-        for message in reversed(conversation_history):
-            message_tokens = calculate_token_count(message["content"], "gpt-4")
-            if (
-                is_token_limit_exceeded(
-                    total_tokens + message_tokens, self.max_token_limit
+            if self.invalidate_window_caches:
+                await insert_conversation_window_invalidations(
+                    self.connection, [row["user_id"] for row in rows]
                 )
-                and chat_messages
-            ):
-                # トークン数が最大を超える場合、ループを抜ける
-                break
-            role = cast(Literal["system", "user", "assistant"], message["role"])
-            chat_messages.insert(0, ChatMessage(role=role, content=message["content"]))
-            total_tokens += message_tokens
 
-        if not any(message["role"] == "system" for message in chat_messages):
-            chat_messages.insert(0, {"role": "system", "content": create_prompt()})
+        # write-behind の場合は、このトランザクションがコミットされてから writer に渡す。
+        # ロールバックした会話が後から保存されたり、会話より先に processed_requests だけが保存されたりしないようにする
+        async def on_commit() -> None:
+            if self.writer is not None:
+                await self._enqueue_conversation_histories(self.writer, rows)
 
-        return chat_messages
+            self._update_caches(rows)
 
-    async def save_conversation_history(self, dto: SaveConversationHistoryDto) -> None:
+        await run_after_commit(self.db_handler, on_commit)
+
+    async def _enqueue_conversation_histories(
+        self, writer: ConversationHistoryWriter, rows: List[UnsavedConversationHistory]
+    ) -> None:
+        rows_to_insert: List[UnsavedConversationHistory] = []
+
+        for row in rows:
+            try:
+                writer.enqueue(row)
+            except ConversationHistoryWriterUnavailableError:
+                rows_to_insert.append(row)
+
+        # キューに積めない場合はDBに直接保存する
+        if rows_to_insert:
+            await insert_in_transaction(self.connection, rows_to_insert)
+
+    def _update_caches(self, rows: List[UnsavedConversationHistory]) -> None:
+        for row in rows:
+            if self.window_cache is not None:
+                self.window_cache.append(
+                    row["user_id"],
+                    row["token_encoding"],
+                    ConversationTurn(
+                        user_message=row["user_message"],
+                        ai_message=row["ai_message"],
+                        user_message_tokens=row["user_message_tokens"],
+                        ai_message_tokens=row["ai_message_tokens"],
+                    ),
+                )
+
+            if self.processed_request_cache is not None and row["request_id"]:
+                self.processed_request_cache.set(
+                    (row["user_id"], row["request_id"]),
+                    ProcessedRequest(
+                        ai_response_id=row["ai_response_id"] or "",
+                        message=row["ai_message"],
+                    ),
+                )
+
+    async def find_conversation_histories(
+        self, dto: FindConversationHistoriesDto
+    ) -> List[ConversationHistory]:
+        rows = await self._fetch_conversation_histories(
+            dto["user_id"], dto["last_seen_id"], dto["limit"]
+        )
+
+        return [
+            ConversationHistory(
+                id=row["id"],
+                user_message=row["user_message"],
+                ai_message=row["ai_message"],
+            )
+            for row in rows
+        ]
+
+    @traced(
+        "AiomysqlConversationHistoryRepository._fetch_conversation_histories",
+        create_mysql_span_attributes("SELECT", "conversation_histories"),
+    )
+    async def _fetch_conversation_histories(
+        self, user_id: str, last_seen_id: Optional[int], limit: int
+    ) -> List[dict]:
+        """
+        (user_id, id) の複合インデックスを使い、新しい順に履歴を取得する。
+        OFFSETを使わずに前のページの最後のIDより古い行を取得するので、履歴が増えても読み取る行数は変わらない。
+        """
+        async with self.connection.cursor() as cursor:
+            if last_seen_id is None:
+                sql = """
+                SELECT id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding
+                FROM conversation_histories
+                WHERE user_id = %s
+                ORDER BY id DESC
+                LIMIT %s
+                """
+                await cursor.execute(sql, (user_id, limit))
+            else:
+                sql = """
+                SELECT id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding
+                FROM conversation_histories
+                WHERE user_id = %s AND id < %s
+                ORDER BY id DESC
+                LIMIT %s
+                """
+                await cursor.execute(sql, (user_id, last_seen_id, limit))
+
+            return list(await cursor.fetchall())
+
+    @traced(
+        "AiomysqlConversationHistoryRepository.find_evicted_conversation_histories",
+        create_mysql_span_attributes("SELECT", "conversation_histories"),
+    )
+    async def find_evicted_conversation_histories(
+        self, dto: FindEvictedConversationHistoriesDto
+    ) -> List[ConversationHistory]:
+        model = self._primary_model()
+        token_counter = get_token_counter(model)
+        user_id = dto["user_id"]
+
+        rows = await self._fetch_conversation_histories_within_budget(
+            user_id, self.history_depth, token_counter.encoding_name
+        )
+        summary = await self._fetch_conversation_summary(user_id, token_counter)
+        self._count_uncounted_rows(rows, token_counter)
+
+        # プロンプトに含める直近の会話と同じく、件数と、systemメッセージ・要約・新しいメッセージの分を除いた
+        # トークン数の上限に収まる行を直近の会話とする。
+        # 新しいメッセージはまだないので、直近の会話で最も長いユーザーのメッセージと同じだけ空けておく
+        prompt = select_prompt(COUNSELOR_PROMPT_NAME, user_id, self.prompt_versions)
+        recent_rows = self._trim_to_token_limit(
+            rows,
+            token_counter,
+            calculate_turn_token_budget(
+                prompt.count_tokens(token_counter),
+                summary,
+                max((row["user_message_tokens"] for row in rows), default=0),
+                self._max_prompt_tokens(model),
+            ),
+        )
+
+        async with self.connection.cursor() as cursor:
+            if recent_rows:
+                # 直近の会話に含まれる最も古い履歴より前の履歴が、直近の会話から外れた履歴
+                sql = """
+                SELECT id, user_message, ai_message
+                FROM conversation_histories
+                WHERE user_id = %s AND id > %s AND id < %s
+                ORDER BY id
+                LIMIT %s
+                """
+                await cursor.execute(
+                    sql,
+                    (
+                        user_id,
+                        dto["after_id"],
+                        recent_rows[-1]["id"],
+                        dto["limit"],
+                    ),
+                )
+            else:
+                # 最新の履歴も上限に収まらない場合は、すべての履歴が直近の会話から外れている
+                sql = """
+                SELECT id, user_message, ai_message
+                FROM conversation_histories
+                WHERE user_id = %s AND id > %s
+                ORDER BY id
+                LIMIT %s
+                """
+                await cursor.execute(sql, (user_id, dto["after_id"], dto["limit"]))
+            result = await cursor.fetchall()
+
+        return [
+            ConversationHistory(
+                id=row["id"],
+                user_message=row["user_message"],
+                ai_message=row["ai_message"],
+            )
+            for row in result
+        ]
+
+    async def _find_conversation_window(
+        self, user_id: str, token_counter: TokenCounter
+    ) -> ConversationWindow:
+        encoding_name = token_counter.encoding_name
+
+        if self.window_cache is not None:
+            cached_window = self.window_cache.get(user_id, encoding_name)
+            if cached_window is not None:
+                return cached_window
+
+            self.window_cache.start_loading(user_id)
+
+        # DBを読む前に取得する。読んでいる間に保存された会話は、DBの結果と重なる分を取り除く
+        unsaved = self.writer.find_unsaved(user_id) if self.writer is not None else []
+
+        try:
+            with measure_stage("db_read"):
+                result = await self._fetch_conversation_histories_within_budget(
+                    user_id, self.history_depth, encoding_name
+                )
+                summary = await self._fetch_conversation_summary(user_id, token_counter)
+        except BaseException:
+            if self.window_cache is not None:
+                self.window_cache.cancel_loading(user_id)
+            raise
+
+        window = self._create_window(result, summary, unsaved, token_counter)
+
+        if self.window_cache is not None:
+            self.window_cache.finish_loading(user_id, window)
+
+        return window
+
+    async def _find_conversation_windows(
+        self, user_ids: List[str], token_counter: TokenCounter
+    ) -> Dict[str, ConversationWindow]:
+        encoding_name = token_counter.encoding_name
+
+        windows: Dict[str, ConversationWindow] = {}
+        uncached_user_ids: List[str] = []
+
+        for user_id in user_ids:
+            if self.window_cache is not None:
+                cached_window = self.window_cache.get(user_id, encoding_name)
+                if cached_window is not None:
+                    windows[user_id] = cached_window
+                    continue
+
+                self.window_cache.start_loading(user_id)
+
+            uncached_user_ids.append(user_id)
+
+        if not uncached_user_ids:
+            return windows
+
+        unsaved = {
+            user_id: self.writer.find_unsaved(user_id) if self.writer else []
+            for user_id in uncached_user_ids
+        }
+
+        try:
+            with measure_stage("db_read"):
+                rows_by_user_id = await self._fetch_recent_conversation_histories(
+                    uncached_user_ids, self.history_depth, encoding_name
+                )
+                summaries = await self._fetch_conversation_summaries(
+                    uncached_user_ids, token_counter
+                )
+        except BaseException:
+            if self.window_cache is not None:
+                for user_id in uncached_user_ids:
+                    self.window_cache.cancel_loading(user_id)
+            raise
+
+        for user_id in uncached_user_ids:
+            window = self._create_window(
+                rows_by_user_id.get(user_id, []),
+                summaries.get(user_id),
+                unsaved[user_id],
+                token_counter,
+            )
+
+            if self.window_cache is not None:
+                self.window_cache.finish_loading(user_id, window)
+
+            windows[user_id] = window
+
+        return windows
+
+    def _create_window(
+        self,
+        result: List[dict],
+        summary: Optional[ConversationSummaryMessage],
+        unsaved: List[UnsavedConversationHistory],
+        token_counter: TokenCounter,
+    ) -> ConversationWindow:
+        """
+        新しい順に並んだ会話履歴の行から、直近の会話を作る。
+        """
+        encoding_name = token_counter.encoding_name
+
+        rows = list(reversed(result))
+        self._count_uncounted_rows(rows, token_counter)
+
+        turns = [
+            ConversationTurn(
+                user_message=row["user_message"],
+                ai_message=row["ai_message"],
+                user_message_tokens=row["user_message_tokens"],
+                ai_message_tokens=row["ai_message_tokens"],
+            )
+            for row in rows
+        ]
+
+        if unsaved:
+            turns = merge_unsaved_turns(
+                turns, self._create_unsaved_turns(unsaved, token_counter)
+            )[-self.history_depth :]
+
+        return ConversationWindow(
+            encoding_name=encoding_name,
+            summary=summary,
+            turns=tuple(turns),
+        )
+
+    @staticmethod
+    def _count_uncounted_rows(rows: List[dict], token_counter: TokenCounter) -> None:
+        """
+        トークン数がまだ保存されていない行（バックフィル前の行）だけ、まとめて計算して行に設定する。
+        """
+        uncounted_rows = [
+            row for row in rows if row["token_encoding"] != token_counter.encoding_name
+        ]
+        if not uncounted_rows:
+            return
+
+        with measure_stage("tokenization"):
+            token_counts = token_counter.count_batch(
+                [
+                    message
+                    for row in uncounted_rows
+                    for message in (row["user_message"], row["ai_message"])
+                ]
+            )
+        for index, row in enumerate(uncounted_rows):
+            row["user_message_tokens"] = token_counts[index * 2]
+            row["ai_message_tokens"] = token_counts[index * 2 + 1]
+
+    @classmethod
+    def _trim_to_token_limit(
+        cls, result: List[dict], token_counter: TokenCounter, max_tokens: int
+    ) -> List[dict]:
+        """
+        新しい順に並んだ行から、トークン数の合計が max_tokens に収まる行を新しい順に返す。
+        """
+        cls._count_uncounted_rows(result, token_counter)
+
+        rows = []
+        total_tokens = 0
+        for row in result:
+            total_tokens += row["user_message_tokens"] + row["ai_message_tokens"]
+            if total_tokens > max_tokens:
+                break
+            rows.append(row)
+
+        return rows
+
+    @traced(
+        "AiomysqlConversationHistoryRepository._fetch_conversation_histories_within_budget",
+        create_mysql_span_attributes("SELECT", "conversation_histories"),
+    )
+    async def _fetch_conversation_histories_within_budget(
+        self, user_id: str, limit: int, encoding_name: str
+    ) -> List[dict]:
+        """
+        直近 limit 件の履歴のうち、新しい順に保存済みのトークン数を足していき、max_token_limit に収まる行だけを新しい順に取得する。
+        プロンプトに含められない古い行は読み込まない。
+        トークン数が保存されていない行（バックフィル前の行）は0トークンとして取得し、取得後に計算してトリミングする。
+        """
         async with self.connection.cursor() as cursor:
             sql = """
-            INSERT INTO conversation_histories
-            (user_id, user_message, ai_message)
-            VALUES (%s, %s, %s)
+            SELECT id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding
+            FROM (
+              SELECT
+                id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding,
+                SUM(
+                  IF(token_encoding = %s, user_message_tokens + ai_message_tokens, 0)
+                ) OVER (ORDER BY id DESC ROWS UNBOUNDED PRECEDING) AS cumulative_tokens
+              FROM (
+                SELECT id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding
+                FROM conversation_histories
+                WHERE user_id = %s
+                ORDER BY id DESC
+                LIMIT %s
+              ) AS recent_histories
+            ) AS counted_histories
+            WHERE cumulative_tokens <= %s
+            ORDER BY id DESC
+            """
+            await cursor.execute(
+                sql, (encoding_name, user_id, limit, self.max_token_limit)
+            )
+
+            return list(await cursor.fetchall())
+
+    @traced(
+        "AiomysqlConversationHistoryRepository._fetch_recent_conversation_histories",
+        create_mysql_span_attributes("SELECT", "conversation_histories"),
+    )
+    async def _fetch_recent_conversation_histories(
+        self, user_ids: List[str], limit: int, encoding_name: str
+    ) -> Dict[str, List[dict]]:
+        """
+        複数のユーザーの直近の履歴を1回のクエリで、ユーザーごとに新しい順に取得する。
+        _fetch_conversation_histories_within_budget と同じく、max_token_limit に収まる行だけを取得する。
+        """
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        async with self.connection.cursor() as cursor:
+            sql = f"""
+            SELECT user_id, id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding
+            FROM (
+              SELECT
+                user_id, id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding,
+                SUM(
+                  IF(token_encoding = %s, user_message_tokens + ai_message_tokens, 0)
+                ) OVER (
+                  PARTITION BY user_id ORDER BY id DESC ROWS UNBOUNDED PRECEDING
+                ) AS cumulative_tokens
+              FROM (
+                SELECT
+                  user_id, id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding,
+                  ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id DESC) AS history_rank
+                FROM conversation_histories
+                WHERE user_id IN ({placeholders})
+              ) AS ranked_histories
+              WHERE history_rank <= %s
+            ) AS recent_histories
+            WHERE cumulative_tokens <= %s
+            ORDER BY user_id, id DESC
             """
             await cursor.execute(
-                sql,
-                (
-                    dto["user_id"],
-                    dto["user_message"],
-                    dto["ai_message"],
-                ),
+                sql, (encoding_name, *user_ids, limit, self.max_token_limit)
             )
+            result = await cursor.fetchall()
+
+        rows_by_user_id: Dict[str, List[dict]] = {}
+        for row in result:
+            rows_by_user_id.setdefault(row["user_id"], []).append(row)
+
+        return rows_by_user_id
+
+    @staticmethod
+    def _create_unsaved_turns(
+        unsaved: List[UnsavedConversationHistory], token_counter: TokenCounter
+    ) -> List[ConversationTurn]:
+        turns = []
+        for row in unsaved:
+            if row["token_encoding"] == token_counter.encoding_name:
+                user_message_tokens = row["user_message_tokens"]
+                ai_message_tokens = row["ai_message_tokens"]
+            else:
+                user_message_tokens, ai_message_tokens = token_counter.count_batch(
+                    [row["user_message"], row["ai_message"]]
+                )
+
+            turns.append(
+                ConversationTurn(
+                    user_message=row["user_message"],
+                    ai_message=row["ai_message"],
+                    user_message_tokens=user_message_tokens,
+                    ai_message_tokens=ai_message_tokens,
+                )
+            )
+        return turns
+
+    @traced(
+        "AiomysqlConversationHistoryRepository._fetch_conversation_summary",
+        create_mysql_span_attributes("SELECT", "conversation_summaries"),
+    )
+    async def _fetch_conversation_summary(
+        self, user_id: str, token_counter: TokenCounter
+    ) -> Optional[ConversationSummaryMessage]:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            SELECT summary, summary_tokens, token_encoding
+            FROM conversation_summaries
+            WHERE user_id = %s
+            """
+            await cursor.execute(sql, (user_id,))
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return self._create_summary_message(row, token_counter)
+
+    @traced(
+        "AiomysqlConversationHistoryRepository._fetch_conversation_summaries",
+        create_mysql_span_attributes("SELECT", "conversation_summaries"),
+    )
+    async def _fetch_conversation_summaries(
+        self, user_ids: List[str], token_counter: TokenCounter
+    ) -> Dict[str, ConversationSummaryMessage]:
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        async with self.connection.cursor() as cursor:
+            sql = f"""
+            SELECT user_id, summary, summary_tokens, token_encoding
+            FROM conversation_summaries
+            WHERE user_id IN ({placeholders})
+            """
+            await cursor.execute(sql, tuple(user_ids))
+            result = await cursor.fetchall()
+
+        return {
+            row["user_id"]: self._create_summary_message(row, token_counter)
+            for row in result
+        }
+
+    @staticmethod
+    def _create_summary_message(
+        row: dict, token_counter: TokenCounter
+    ) -> ConversationSummaryMessage:
+        content = create_summary_message(row["summary"])
+
+        return ConversationSummaryMessage(
+            content=content,
+            tokens=(
+                row["summary_tokens"]
+                if row["token_encoding"] == token_counter.encoding_name
+                else token_counter.count(content)
+            ),
+        )
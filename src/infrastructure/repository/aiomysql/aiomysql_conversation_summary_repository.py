@@ -0,0 +1,104 @@
+from typing import Optional
+import aiomysql
+from domain.prompt import create_summary_message
+from domain.repository.conversation_summary_repository_interface import (
+    ConversationSummary,
+    ConversationSummaryRepositoryInterface,
+    SaveConversationSummaryDto,
+)
+from infrastructure.token_counter import get_token_counter
+from tracing.tracer import create_mysql_span_attributes, traced
+from infrastructure.conversation_window_cache import (
+    ConversationSummaryMessage,
+    ConversationWindowCache,
+)
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    get_token_count_model,
+)
+from infrastructure.repository.aiomysql.aiomysql_db_handler import (
+    AiomysqlDbHandler,
+    run_after_commit,
+)
+
+
+class AiomysqlConversationSummaryRepository(ConversationSummaryRepositoryInterface):
+    def __init__(
+        self,
+        connection: aiomysql.Connection,
+        window_cache: Optional[ConversationWindowCache] = None,
+        db_handler: Optional[AiomysqlDbHandler] = None,
+    ) -> None:
+        self.connection = connection
+        self.window_cache = window_cache
+        self.db_handler = db_handler
+
+    @traced(
+        "AiomysqlConversationSummaryRepository.find_conversation_summary",
+        create_mysql_span_attributes("SELECT", "conversation_summaries"),
+    )
+    async def find_conversation_summary(
+        self, user_id: str
+    ) -> Optional[ConversationSummary]:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            SELECT user_id, summary, last_summarized_history_id
+            FROM conversation_summaries
+            WHERE user_id = %s
+            """
+            await cursor.execute(sql, (user_id,))
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return ConversationSummary(
+            user_id=row["user_id"],
+            summary=row["summary"],
+            last_summarized_history_id=row["last_summarized_history_id"],
+        )
+
+    @traced(
+        "AiomysqlConversationSummaryRepository.save_conversation_summary",
+        create_mysql_span_attributes("INSERT", "conversation_summaries"),
+    )
+    async def save_conversation_summary(self, dto: SaveConversationSummaryDto) -> None:
+        # プロンプトに含める形式でトークン数を計算しておき、履歴取得時に再計算しなくて済むようにする
+        token_counter = get_token_counter(get_token_count_model())
+        content = create_summary_message(dto["summary"])
+        summary_tokens = token_counter.count(content)
+
+        async with self.connection.cursor() as cursor:
+            sql = """
+            INSERT INTO conversation_summaries
+            (user_id, summary, summary_tokens, token_encoding, last_summarized_history_id)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+              summary = VALUES(summary),
+              summary_tokens = VALUES(summary_tokens),
+              token_encoding = VALUES(token_encoding),
+              last_summarized_history_id = VALUES(last_summarized_history_id)
+            """
+            await cursor.execute(
+                sql,
+                (
+                    dto["user_id"],
+                    dto["summary"],
+                    summary_tokens,
+                    token_counter.encoding_name,
+                    dto["last_summarized_history_id"],
+                ),
+            )
+
+        window_cache = self.window_cache
+        if window_cache is None:
+            return
+
+        # ロールバックした要約がキャッシュに残らないように、コミットした後に反映する
+        async def set_summary() -> None:
+            window_cache.set_summary(
+                dto["user_id"],
+                token_counter.encoding_name,
+                ConversationSummaryMessage(content=content, tokens=summary_tokens),
+            )
+
+        await run_after_commit(self.db_handler, set_summary)
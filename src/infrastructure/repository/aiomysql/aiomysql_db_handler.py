@@ -1,19 +1,58 @@
+from typing import Awaitable, Callable, List, Optional
 import aiomysql
 from usecase.db_handler_interface import DbHandlerInterface
 
+AfterCommitCallback = Callable[[], Awaitable[None]]
+
 
 class AiomysqlDbHandler(DbHandlerInterface):
-    def __init__(self, connection: aiomysql.Connection) -> None:
+    def __init__(
+        self, connection: aiomysql.Connection, pool: Optional[aiomysql.Pool] = None
+    ) -> None:
         self.connection = connection
+        self.pool = pool
+        self._after_commit_callbacks: List[AfterCommitCallback] = []
 
     async def begin(self) -> None:
+        self._after_commit_callbacks.clear()
         await self.connection.begin()
 
     async def commit(self) -> None:
         await self.connection.commit()
 
+        # コミットできた場合のみ呼び出す。登録された順に呼び出す
+        callbacks = self._after_commit_callbacks
+        self._after_commit_callbacks = []
+        for callback in callbacks:
+            await callback()
+
     async def rollback(self) -> None:
+        self._after_commit_callbacks.clear()
         await self.connection.rollback()
 
+    def after_commit(self, callback: AfterCommitCallback) -> None:
+        """
+        トランザクションがコミットされた後に行う処理（キャッシュの更新など）を登録する。ロールバックした場合は呼び出さない。
+        """
+        self._after_commit_callbacks.append(callback)
+
     def close(self) -> None:
+        # プールから借りた接続は切断せずにプールへ返却する
+        if self.pool is not None:
+            self.pool.release(self.connection)
+            return
+
         self.connection.close()
+
+
+async def run_after_commit(
+    db_handler: Optional[AiomysqlDbHandler], callback: AfterCommitCallback
+) -> None:
+    """
+    db_handler を指定しない（トランザクションを使わない）場合は、書き込みはすでに確定しているのですぐに呼び出す。
+    """
+    if db_handler is None:
+        await callback()
+        return
+
+    db_handler.after_commit(callback)
@@ -0,0 +1,147 @@
+from typing import Dict, List, Optional, Tuple
+import aiomysql
+from domain.repository.processed_request_repository_interface import (
+    FindProcessedRequestDto,
+    ProcessedRequest,
+    ProcessedRequestRepositoryInterface,
+)
+from infrastructure.processed_request_cache import ProcessedRequestCache
+from infrastructure.conversation_history_writer import ConversationHistoryWriter
+from tracing.tracer import create_mysql_span_attributes, traced
+
+
+class AiomysqlProcessedRequestRepository(ProcessedRequestRepositoryInterface):
+    """
+    processed_requests の行は AiomysqlConversationHistoryRepository が会話履歴と同時に保存する。
+    """
+
+    def __init__(
+        self,
+        connection: aiomysql.Connection,
+        cache: Optional[ProcessedRequestCache] = None,
+        writer: Optional[ConversationHistoryWriter] = None,
+    ) -> None:
+        self.connection = connection
+        self.cache = cache
+        # write-behind の場合、まだDBに保存していない処理済みのリクエストも探す
+        self.writer = writer
+
+    async def find_processed_request(
+        self, dto: FindProcessedRequestDto
+    ) -> Optional[ProcessedRequest]:
+        key = (dto["user_id"], dto["request_id"])
+
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        processed_request = self._find_unsaved_processed_request(dto)
+        if processed_request is not None:
+            return processed_request
+
+        processed_request = await self._fetch_processed_request(dto)
+
+        if processed_request is not None and self.cache is not None:
+            self.cache.set(key, processed_request)
+
+        return processed_request
+
+    async def find_processed_requests(
+        self, dtos: List[FindProcessedRequestDto]
+    ) -> List[Optional[ProcessedRequest]]:
+        """
+        キャッシュと、まだDBに保存していない処理済みのリクエストにないものだけを、1回のクエリでまとめて読み込む。
+        """
+        found: Dict[Tuple[str, str], ProcessedRequest] = {}
+        dtos_to_fetch: List[FindProcessedRequestDto] = []
+
+        for dto in dtos:
+            key = (dto["user_id"], dto["request_id"])
+
+            processed_request = (
+                self.cache.get(key) if self.cache is not None else None
+            ) or self._find_unsaved_processed_request(dto)
+
+            if processed_request is not None:
+                found[key] = processed_request
+            else:
+                dtos_to_fetch.append(dto)
+
+        if dtos_to_fetch:
+            fetched = await self._fetch_processed_requests(dtos_to_fetch)
+            for key, processed_request in fetched.items():
+                found[key] = processed_request
+                if self.cache is not None:
+                    self.cache.set(key, processed_request)
+
+        return [found.get((dto["user_id"], dto["request_id"])) for dto in dtos]
+
+    def _find_unsaved_processed_request(
+        self, dto: FindProcessedRequestDto
+    ) -> Optional[ProcessedRequest]:
+        if self.writer is None:
+            return None
+
+        for row in self.writer.find_unsaved(dto["user_id"]):
+            if row.get("request_id") == dto["request_id"]:
+                return ProcessedRequest(
+                    ai_response_id=row["ai_response_id"] or "",
+                    message=row["ai_message"],
+                )
+
+        return None
+
+    @traced(
+        "AiomysqlProcessedRequestRepository._fetch_processed_request",
+        create_mysql_span_attributes("SELECT", "processed_requests"),
+    )
+    async def _fetch_processed_request(
+        self, dto: FindProcessedRequestDto
+    ) -> Optional[ProcessedRequest]:
+        async with self.connection.cursor() as cursor:
+            sql = """
+            SELECT ai_response_id, ai_message
+            FROM processed_requests
+            WHERE user_id = %s AND request_id = %s
+            """
+            await cursor.execute(sql, (dto["user_id"], dto["request_id"]))
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return ProcessedRequest(
+            ai_response_id=row["ai_response_id"], message=row["ai_message"]
+        )
+
+    @traced(
+        "AiomysqlProcessedRequestRepository._fetch_processed_requests",
+        create_mysql_span_attributes("SELECT", "processed_requests"),
+    )
+    async def _fetch_processed_requests(
+        self, dtos: List[FindProcessedRequestDto]
+    ) -> Dict[Tuple[str, str], ProcessedRequest]:
+        placeholders = ", ".join(["(%s, %s)"] * len(dtos))
+        async with self.connection.cursor() as cursor:
+            sql = f"""
+            SELECT user_id, request_id, ai_response_id, ai_message
+            FROM processed_requests
+            WHERE (user_id, request_id) IN ({placeholders})
+            """
+            await cursor.execute(
+                sql,
+                [
+                    value
+                    for dto in dtos
+                    for value in (dto["user_id"], dto["request_id"])
+                ],
+            )
+            result = await cursor.fetchall()
+
+        return {
+            (row["user_id"], row["request_id"]): ProcessedRequest(
+                ai_response_id=row["ai_response_id"], message=row["ai_message"]
+            )
+            for row in result
+        }
@@ -0,0 +1,82 @@
+from typing import AsyncIterator, List
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryInterface,
+    GenerateMessageRepositoryDto,
+    GenerateMessageResult,
+    GenerateMessageStreamChunk,
+)
+from infrastructure.response_cache import (
+    ResponseCache,
+    get_response_cache,
+    response_cache_lookups,
+)
+
+
+class CachedGenerateMessageRepository(GenerateMessageRepositoryInterface):
+    """
+    キャッシュした応答がある場合はそれを返し、ない場合は repository で生成した応答をキャッシュする。
+    """
+
+    def __init__(
+        self, repository: GenerateMessageRepositoryInterface, cache: ResponseCache
+    ) -> None:
+        self.repository = repository
+        self.cache = cache
+
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        if dto["bypass_cache"]:
+            response_cache_lookups.inc(result="bypass")
+            return await self.repository.generate_message(dto)
+
+        cached = self.cache.get(dto["chat_messages"])
+        if cached is not None:
+            return cached
+
+        result = await self.repository.generate_message(dto)
+
+        self.cache.set(dto["chat_messages"], result)
+
+        return result
+
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        if dto["bypass_cache"]:
+            response_cache_lookups.inc(result="bypass")
+            async for chunk in self.repository.generate_message_stream(dto):
+                yield chunk
+            return
+
+        cached = self.cache.get(dto["chat_messages"])
+        if cached is not None:
+            yield {
+                "ai_response_id": cached["ai_response_id"],
+                "delta": cached["message"],
+            }
+            return
+
+        ai_response_id = ""
+        message_parts: List[str] = []
+
+        async for chunk in self.repository.generate_message_stream(dto):
+            ai_response_id = chunk["ai_response_id"]
+            message_parts.append(chunk["delta"])
+            yield chunk
+
+        # 途中で切断された応答はキャッシュしない
+        self.cache.set(
+            dto["chat_messages"],
+            {"ai_response_id": ai_response_id, "message": "".join(message_parts)},
+        )
+
+
+def create_cached_generate_message_repository(
+    repository: GenerateMessageRepositoryInterface,
+) -> GenerateMessageRepositoryInterface:
+    cache = get_response_cache()
+    if cache is None:
+        return repository
+
+    return CachedGenerateMessageRepository(repository, cache)
@@ -0,0 +1,121 @@
+import os
+import json
+from typing import List, Optional
+from domain.repository.batch_completion_repository_interface import (
+    Batch,
+    BatchCompletionRepositoryInterface,
+    BatchCompletionResult,
+    SubmitBatchDto,
+)
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryInterface,
+)
+from infrastructure.repository.openai.openai_batch_completion_repository import (
+    get_bulk_message_job_dir,
+    parse_batch_output,
+    write_batch_input_file,
+)
+from log.logger import AppLogger
+
+LOCAL_BATCH_MODEL = "local"
+
+
+class LocalBatchCompletionRepository(BatchCompletionRepositoryInterface):
+    """
+    Batch APIの代わりに、送信したバッチをその場で repository で1件ずつ生成する。
+    入力ファイルと出力ファイルはBatch APIと同じ形式で input_dir に書き出すので、ローカルでの動作確認や検証に使う。
+    """
+
+    def __init__(
+        self,
+        repository: GenerateMessageRepositoryInterface,
+        input_dir: Optional[str] = None,
+    ) -> None:
+        app_logger = AppLogger()
+        self.logger = app_logger.logger
+        self.repository = repository
+        self.input_dir = input_dir or get_bulk_message_job_dir()
+
+    async def submit_batch(self, dto: SubmitBatchDto) -> str:
+        input_path = write_batch_input_file(
+            self.input_dir, dto["job_id"], dto["requests"], LOCAL_BATCH_MODEL
+        )
+
+        batch_id = f"local-{dto['job_id']}"
+        output_lines: List[str] = []
+
+        with open(input_path, encoding="utf-8") as f:
+            for line in f:
+                output_lines.append(await self._generate(json.loads(line)))
+
+        with open(self._output_path(batch_id), "w", encoding="utf-8") as f:
+            f.writelines(output_line + "\n" for output_line in output_lines)
+
+        return batch_id
+
+    async def retrieve_batch(self, batch_id: str) -> Batch:
+        if not os.path.exists(self._output_path(batch_id)):
+            return Batch(
+                batch_id=batch_id,
+                status="failed",
+                output_file_id=None,
+                error="output file not found",
+            )
+
+        return Batch(
+            batch_id=batch_id, status="completed", output_file_id=batch_id, error=None
+        )
+
+    async def find_batch_results(
+        self, output_file_id: str
+    ) -> List[BatchCompletionResult]:
+        with open(self._output_path(output_file_id), encoding="utf-8") as f:
+            return parse_batch_output(f.read())
+
+    async def _generate(self, input_line: dict) -> str:
+        body = input_line["body"]
+
+        try:
+            result = await self.repository.generate_message(
+                {
+                    "user_id": body["user"],
+                    "chat_messages": body["messages"],
+                    "bypass_cache": False,
+                }
+            )
+        except Exception as e:
+            self.logger.warning(f"The message could not be generated: {str(e)}")
+            return json.dumps(
+                {
+                    "custom_id": input_line["custom_id"],
+                    "response": None,
+                    "error": {"code": "generation_failed", "message": str(e)},
+                },
+                ensure_ascii=False,
+            )
+
+        return json.dumps(
+            {
+                "custom_id": input_line["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "id": result["ai_response_id"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {
+                                    "role": "assistant",
+                                    "content": result["message"],
+                                },
+                            }
+                        ],
+                    },
+                },
+                "error": None,
+            },
+            ensure_ascii=False,
+        )
+
+    def _output_path(self, batch_id: str) -> str:
+        return os.path.join(self.input_dir, f"{batch_id}.output.jsonl")
@@ -0,0 +1,162 @@
+import os
+import json
+from typing import cast, Any, Dict, List, Literal, Optional, Sequence
+from openai import AsyncOpenAI
+from domain.repository.batch_completion_repository_interface import (
+    Batch,
+    BatchCompletionRepositoryInterface,
+    BatchCompletionRequest,
+    BatchCompletionResult,
+    SubmitBatchDto,
+)
+from infrastructure.openai import get_openai_client
+from infrastructure.model_router import ModelRouter, get_model_router
+from infrastructure.repository.openai.openai_generate_message_repository import (
+    TEMPERATURE,
+)
+from tracing.tracer import traced
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# 出力ファイルが作られていれば、期限切れやキャンセルでも生成できた分は取り込む
+FINISHED_BATCH_STATUSES = ("completed", "expired", "cancelled")
+FAILED_BATCH_STATUSES = ("failed", "expired", "cancelled")
+
+
+def get_bulk_message_job_dir() -> str:
+    return os.getenv("BULK_MESSAGE_JOB_DIR", "var/bulk_message_jobs")
+
+
+def create_batch_input_line(request: BatchCompletionRequest, model: str) -> str:
+    return json.dumps(
+        {
+            "custom_id": request["custom_id"],
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model,
+                "messages": request["chat_messages"],
+                "temperature": TEMPERATURE,
+                "user": request["user_id"],
+            },
+        },
+        ensure_ascii=False,
+    )
+
+
+def write_batch_input_file(
+    input_dir: str,
+    job_id: str,
+    requests: Sequence[BatchCompletionRequest],
+    model: str,
+) -> str:
+    os.makedirs(input_dir, exist_ok=True)
+
+    path = os.path.join(input_dir, f"{job_id}.input.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(create_batch_input_line(request, model) + "\n")
+
+    return path
+
+
+def parse_batch_output_line(line: str) -> BatchCompletionResult:
+    data = json.loads(line)
+    response = data.get("response") or {}
+    body = response.get("body") or {}
+
+    message: Optional[str] = None
+    if data.get("error") is None and response.get("status_code") == 200:
+        choices = body.get("choices") or []
+        if choices:
+            message = choices[0]["message"].get("content")
+
+    return BatchCompletionResult(
+        custom_id=data["custom_id"],
+        ai_response_id=body.get("id", ""),
+        message=message,
+    )
+
+
+def parse_batch_output(content: str) -> List[BatchCompletionResult]:
+    return [parse_batch_output_line(line) for line in content.splitlines() if line]
+
+
+class OpenAiBatchCompletionRepository(BatchCompletionRepositoryInterface):
+    """
+    OpenAIのBatch APIでメッセージを生成する。
+    openai 1.6.1 には batches のリソースがないため、/batches は汎用のリクエストで呼び出す。
+    """
+
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        model_router: Optional[ModelRouter] = None,
+        input_dir: Optional[str] = None,
+    ) -> None:
+        self.client = client or get_openai_client()
+        self.model_router = model_router or get_model_router()
+        self.input_dir = input_dir or get_bulk_message_job_dir()
+
+    @traced("OpenAiBatchCompletionRepository.submit_batch")
+    async def submit_batch(self, dto: SubmitBatchDto) -> str:
+        # 1つのバッチでは1つのモデルしか使えないので、最も優先するモデルを使う
+        model = self.model_router.config["models"][0]
+
+        path = write_batch_input_file(
+            self.input_dir, dto["job_id"], dto["requests"], model
+        )
+
+        with open(path, "rb") as f:
+            input_file = await self.client.files.create(
+                file=f, purpose=cast(Literal["fine-tune", "assistants"], "batch")
+            )
+
+        batch = await self.client.post(
+            "/batches",
+            body={
+                "input_file_id": input_file.id,
+                "endpoint": BATCH_ENDPOINT,
+                "completion_window": "24h",
+                "metadata": {"job_id": dto["job_id"]},
+            },
+            cast_to=Dict[str, Any],
+        )
+
+        return str(batch["id"])
+
+    @traced("OpenAiBatchCompletionRepository.retrieve_batch")
+    async def retrieve_batch(self, batch_id: str) -> Batch:
+        batch = await self.client.get(f"/batches/{batch_id}", cast_to=Dict[str, Any])
+
+        status = batch.get("status")
+        output_file_id = batch.get("output_file_id")
+
+        if status in FINISHED_BATCH_STATUSES and output_file_id:
+            return Batch(
+                batch_id=batch_id,
+                status="completed",
+                output_file_id=output_file_id,
+                error=None,
+            )
+
+        if status in FAILED_BATCH_STATUSES:
+            errors = (batch.get("errors") or {}).get("data") or []
+            return Batch(
+                batch_id=batch_id,
+                status="failed",
+                output_file_id=None,
+                error=errors[0].get("message") if errors else f"batch {status}",
+            )
+
+        return Batch(
+            batch_id=batch_id, status="in_progress", output_file_id=None, error=None
+        )
+
+    @traced("OpenAiBatchCompletionRepository.find_batch_results")
+    async def find_batch_results(
+        self, output_file_id: str
+    ) -> List[BatchCompletionResult]:
+        content = await self.client.files.content(output_file_id)
+
+        return parse_batch_output(content.text)
@@ -1,35 +1,178 @@
-import os
-from typing import cast, List
+import asyncio
+import time
+from typing import (
+    cast,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 from domain.repository.generate_message_repository_interface import (
     GenerateMessageRepositoryInterface,
     GenerateMessageRepositoryDto,
     GenerateMessageResult,
+    GenerateMessageStreamChunk,
+    GenerateMessageUnavailableError,
+)
+from infrastructure.openai import get_openai_client, openai_tokens, record_openai_usage
+from infrastructure.openai_call_policy import (
+    OpenAiCallPolicy,
+    OpenAiUnavailableError,
+    get_openai_call_policy,
+)
+from infrastructure.model_router import ModelRouter, RouteDecision, get_model_router
+from metrics.registry import registry
+from tracing.tracer import set_span_attributes, traced
+
+T = TypeVar("T")
+
+# 応答のキャッシュのキーにも含めるので、変更する場合はキャッシュも無効になる
+TEMPERATURE = 0.7
+
+time_to_first_token_seconds = registry.histogram(
+    "ai_counselor_openai_time_to_first_token_seconds",
+    "Time from the streaming completion request to the first content delta.",
 )
 
 
 class OpenAiGenerateMessageRepository(GenerateMessageRepositoryInterface):
-    def __init__(self) -> None:
-        self.OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
-        self.client = AsyncOpenAI(api_key=self.OPENAI_API_KEY)
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        model_router: Optional[ModelRouter] = None,
+        get_call_policy: Callable[[str], OpenAiCallPolicy] = get_openai_call_policy,
+    ) -> None:
+        self.client = client or get_openai_client()
+        self.model_router = model_router or get_model_router()
+        self.get_call_policy = get_call_policy
 
+    @traced("OpenAiGenerateMessageRepository.generate_message")
     async def generate_message(
         self, dto: GenerateMessageRepositoryDto
     ) -> GenerateMessageResult:
         messages = cast(List[ChatCompletionMessageParam], dto.get("chat_messages"))
         user_id = str(dto.get("user_id"))
 
-        response = await self.client.chat.completions.create(
-            model="gpt-4-1106-preview",
-            messages=messages,
-            temperature=0.7,
-            user=user_id,
+        decision = self.model_router.route(dto["chat_messages"])
+
+        response, model = await self._call_with_fallback(
+            decision,
+            lambda model: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=TEMPERATURE,
+                user=user_id,
+            ),
+            hedge=True,
         )
 
         ai_response_id = response.id
 
+        record_openai_usage(model, response.usage)
+
         return {
             "ai_response_id": ai_response_id,
             "message": str(response.choices[0].message.content),
         }
+
+    @traced("OpenAiGenerateMessageRepository.generate_message_stream")
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        messages = cast(List[ChatCompletionMessageParam], dto.get("chat_messages"))
+        user_id = str(dto.get("user_id"))
+
+        decision = self.model_router.route(dto["chat_messages"])
+
+        started_at = time.perf_counter()
+
+        # 応答の送信が始まってからのリトライやヘッジ、フォールバックはできないので、ストリームの開始までに適用する
+        stream, model = await self._call_with_fallback(
+            decision,
+            lambda model: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=TEMPERATURE,
+                user=user_id,
+                stream=True,
+            ),
+            hedge=False,
+        )
+
+        is_first_token = True
+        completion_tokens = 0
+
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+
+                if is_first_token:
+                    time_to_first_token_seconds.observe(
+                        time.perf_counter() - started_at
+                    )
+                    is_first_token = False
+
+                # ストリーミングでは使用量が返されないので、1チャンクを1トークンとして数える
+                completion_tokens += 1
+
+                yield {"ai_response_id": chunk.id, "delta": delta}
+        finally:
+            openai_tokens.inc(completion_tokens, model=model, type="completion")
+
+            # クライアントが切断した場合も上流の接続を閉じて、不要な生成を止める
+            await asyncio.shield(stream.response.aclose())
+
+    async def _call_with_fallback(
+        self,
+        decision: RouteDecision,
+        create: Callable[[str], Awaitable[T]],
+        hedge: bool,
+    ) -> Tuple[T, str]:
+        """
+        選んだモデルを呼び出し、応答が得られない場合はフォールバック先のモデルを順に呼び出す。
+        呼び出しの結果はモデルの選択に使うため ModelRouter に記録する。
+        """
+        set_span_attributes(
+            {
+                "gen_ai.request.model": decision.model,
+                "ai_counselor.model_route_reason": decision.reason,
+                "ai_counselor.prompt_tokens": decision.prompt_tokens,
+            }
+        )
+
+        last_error: Optional[OpenAiUnavailableError] = None
+
+        for model in (decision.model, *decision.fallback_models):
+            started_at = time.perf_counter()
+
+            try:
+                result = await self.get_call_policy(model).call(
+                    lambda: create(model), hedge=hedge
+                )
+            except OpenAiUnavailableError as e:
+                self.model_router.record_result(
+                    model, time.perf_counter() - started_at, succeeded=False
+                )
+                last_error = e
+                continue
+
+            self.model_router.record_result(
+                model, time.perf_counter() - started_at, succeeded=True
+            )
+
+            if model != decision.model:
+                set_span_attributes({"gen_ai.request.model": model})
+
+            return result, model
+
+        raise GenerateMessageUnavailableError(str(last_error)) from last_error
@@ -0,0 +1,56 @@
+from typing import Optional
+from openai import AsyncOpenAI
+from domain.prompt import create_summary_prompt, create_summary_request_message
+from domain.repository.summarize_conversation_repository_interface import (
+    SummarizeConversationRepositoryDto,
+    SummarizeConversationRepositoryInterface,
+)
+from infrastructure.openai import get_openai_client, record_openai_usage
+from infrastructure.openai_call_policy import OpenAiCallPolicy, get_openai_call_policy
+from tracing.tracer import traced
+
+# 要約は応答の生成よりも簡単なタスクなので、安価で速いモデルを使う
+SUMMARY_MODEL = "gpt-3.5-turbo-1106"
+
+
+class OpenAiSummarizeConversationRepository(SummarizeConversationRepositoryInterface):
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        call_policy: Optional[OpenAiCallPolicy] = None,
+    ) -> None:
+        self.client = client or get_openai_client()
+        self.call_policy = call_policy or get_openai_call_policy(SUMMARY_MODEL)
+
+    @traced(
+        "OpenAiSummarizeConversationRepository.summarize_conversation",
+        {"gen_ai.request.model": SUMMARY_MODEL},
+    )
+    async def summarize_conversation(
+        self, dto: SummarizeConversationRepositoryDto
+    ) -> str:
+        request_message = create_summary_request_message(
+            dto["previous_summary"],
+            [
+                (history["user_message"], history["ai_message"])
+                for history in dto["conversation_histories"]
+            ],
+        )
+
+        # 要約は急がないのでヘッジしない
+        response = await self.call_policy.call(
+            lambda: self.client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": create_summary_prompt()},
+                    {"role": "user", "content": request_message},
+                ],
+                temperature=0,
+                user=dto["user_id"],
+            ),
+            hedge=False,
+        )
+
+        record_openai_usage(SUMMARY_MODEL, response.usage)
+
+        return str(response.choices[0].message.content).strip()
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import hashlib
+import unicodedata
+from functools import lru_cache
+from typing import (
+    FrozenSet,
+    Literal,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypedDict,
+)
+from domain.message import ChatMessage
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageResult,
+)
+from infrastructure.ttl_lru_cache import TtlLruCache
+from infrastructure.model_router import get_model_router
+from infrastructure.repository.openai.openai_generate_message_repository import (
+    TEMPERATURE,
+)
+from metrics.registry import registry
+
+LookupResult = Literal["exact", "similar", "miss", "bypass"]
+
+response_cache_lookups = registry.counter(
+    "ai_counselor_response_cache_lookups_total",
+    "Number of response cache lookups, by whether and how a cached response was found.",
+    ["result"],
+)
+
+
+class ResponseCacheConfig(TypedDict):
+    max_entries: int
+    ttl_seconds: float
+    # キャッシュする応答のおおよそのメモリ使用量の上限
+    max_bytes: int
+    # 会話の最初のメッセージは、似たメッセージの応答も返す
+    similarity_enabled: bool
+    # 文字のバイグラムのJaccard係数がこの値以上のメッセージを似ているとみなす
+    similarity_threshold: float
+    # 似たメッセージを探す対象にする、最初のメッセージの応答の最大数
+    similarity_max_candidates: int
+
+
+def create_response_cache_config() -> ResponseCacheConfig:
+    return ResponseCacheConfig(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+        max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        similarity_enabled=os.getenv(
+            "RESPONSE_CACHE_SIMILARITY_ENABLED", "false"
+        ).lower()
+        == "true",
+        similarity_threshold=float(
+            os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.8")
+        ),
+        similarity_max_candidates=int(
+            os.getenv("RESPONSE_CACHE_SIMILARITY_MAX_CANDIDATES", "256")
+        ),
+    )
+
+
+def normalize_text(text: str) -> str:
+    """
+    全角・半角の違いと前後や連続する空白の違いを無視する。
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def create_response_cache_key(
+    chat_messages: Sequence[ChatMessage], model_parameters: Mapping[str, object]
+) -> str:
+    payload = json.dumps(
+        {
+            "messages": [
+                [message["role"], normalize_text(message["content"])]
+                for message in chat_messages
+            ],
+            "parameters": model_parameters,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def create_bigrams(text: str) -> FrozenSet[str]:
+    normalized = normalize_text(text).lower()
+    if len(normalized) < 2:
+        return frozenset([normalized])
+    return frozenset(normalized[i : i + 2] for i in range(len(normalized) - 1))
+
+
+def calculate_similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def split_first_turn(
+    chat_messages: Sequence[ChatMessage],
+) -> Optional[Tuple[Sequence[ChatMessage], str]]:
+    """
+    会話履歴がない最初のメッセージの場合は、systemメッセージとユーザーのメッセージに分ける。
+    """
+    if not chat_messages or chat_messages[-1]["role"] != "user":
+        return None
+
+    system_messages = chat_messages[:-1]
+    if any(message["role"] != "system" for message in system_messages):
+        return None
+
+    return system_messages, chat_messages[-1]["content"]
+
+
+def calculate_result_size(result: GenerateMessageResult) -> int:
+    return sys.getsizeof(result["message"]) + sys.getsizeof(result["ai_response_id"])
+
+
+class FirstTurnCandidate(NamedTuple):
+    # systemメッセージとモデルのパラメータのキー
+    prompt_key: str
+    bigrams: FrozenSet[str]
+    result: GenerateMessageResult
+
+
+class ResponseCache:
+    """
+    同じメッセージ（会話履歴とsystemメッセージを含む）とモデルのパラメータで生成した応答を保持する。
+    similarity_enabled の場合、会話の最初のメッセージは表記の近いメッセージの応答も返す。
+    """
+
+    def __init__(
+        self, config: ResponseCacheConfig, model_parameters: Mapping[str, object]
+    ) -> None:
+        self.config = config
+        self.model_parameters = model_parameters
+        self._responses: TtlLruCache[str, GenerateMessageResult] = TtlLruCache(
+            "response",
+            max_entries=config["max_entries"],
+            ttl_seconds=config["ttl_seconds"],
+            max_bytes=config["max_bytes"],
+            size_of=calculate_result_size,
+        )
+        self._first_turns: TtlLruCache[str, FirstTurnCandidate] = TtlLruCache(
+            "response_first_turn",
+            max_entries=config["similarity_max_candidates"],
+            ttl_seconds=config["ttl_seconds"],
+        )
+
+    def get(
+        self, chat_messages: Sequence[ChatMessage]
+    ) -> Optional[GenerateMessageResult]:
+        key = create_response_cache_key(chat_messages, self.model_parameters)
+
+        result = self._responses.get(key)
+        if result is not None:
+            response_cache_lookups.inc(result="exact")
+            return result
+
+        result = self._find_similar(chat_messages)
+        if result is not None:
+            response_cache_lookups.inc(result="similar")
+            return result
+
+        response_cache_lookups.inc(result="miss")
+        return None
+
+    def set(
+        self, chat_messages: Sequence[ChatMessage], result: GenerateMessageResult
+    ) -> None:
+        key = create_response_cache_key(chat_messages, self.model_parameters)
+        self._responses.set(key, result)
+
+        if not self.config["similarity_enabled"]:
+            return
+
+        first_turn = split_first_turn(chat_messages)
+        if first_turn is None:
+            return
+
+        system_messages, user_message = first_turn
+        self._first_turns.set(
+            key,
+            FirstTurnCandidate(
+                prompt_key=create_response_cache_key(
+                    system_messages, self.model_parameters
+                ),
+                bigrams=create_bigrams(user_message),
+                result=result,
+            ),
+        )
+
+    def _find_similar(
+        self, chat_messages: Sequence[ChatMessage]
+    ) -> Optional[GenerateMessageResult]:
+        if not self.config["similarity_enabled"]:
+            return None
+
+        first_turn = split_first_turn(chat_messages)
+        if first_turn is None:
+            return None
+
+        system_messages, user_message = first_turn
+        prompt_key = create_response_cache_key(system_messages, self.model_parameters)
+        bigrams = create_bigrams(user_message)
+
+        best_key: Optional[str] = None
+        best_similarity = self.config["similarity_threshold"]
+
+        for key, candidate in self._first_turns.items():
+            if candidate.prompt_key != prompt_key:
+                continue
+
+            similarity = calculate_similarity(bigrams, candidate.bigrams)
+            if similarity >= best_similarity:
+                best_key = key
+                best_similarity = similarity
+
+        if best_key is None:
+            return None
+
+        candidate = self._first_turns.get(best_key)
+        return candidate.result if candidate is not None else None
+
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> Optional[ResponseCache]:
+    # 同じメッセージにいつも同じ応答を返すことになるので、明示的に有効にした場合のみ使う
+    if os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() != "true":
+        return None
+
+    return ResponseCache(
+        create_response_cache_config(),
+        {
+            "models": get_model_router().config["models"],
+            "temperature": TEMPERATURE,
+        },
+    )
@@ -0,0 +1,93 @@
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import cast, Dict, List, Optional, Protocol, Sequence, Tuple
+import tiktoken
+
+DEFAULT_TOKEN_COUNT_CACHE_SIZE = 4096
+ENCODE_BATCH_MIN_SIZE = 32
+
+
+class Encoding(Protocol):
+    name: str
+
+    def encode(self, text: str) -> List[int]:
+        ...
+
+    def encode_batch(self, text: List[str]) -> List[List[int]]:
+        ...
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> Encoding:
+    return tiktoken.encoding_for_model(model)
+
+
+def create_content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCounter:
+    def __init__(
+        self,
+        encoding: Encoding,
+        max_cache_size: int = DEFAULT_TOKEN_COUNT_CACHE_SIZE,
+    ) -> None:
+        self.encoding = encoding
+        self.max_cache_size = max_cache_size
+        self._cache: OrderedDict[bytes, int] = OrderedDict()
+
+    @property
+    def encoding_name(self) -> str:
+        return self.encoding.name
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        counts: List[Optional[int]] = []
+        misses: Dict[bytes, Tuple[str, List[int]]] = {}
+
+        for index, text in enumerate(texts):
+            key = create_content_hash(text)
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+            elif key in misses:
+                misses[key][1].append(index)
+            else:
+                misses[key] = (text, [index])
+            counts.append(count)
+
+        if misses:
+            keys = list(misses.keys())
+            texts_to_encode = [misses[key][0] for key in keys]
+            # encode_batch は呼び出しごとにスレッドプールを作るので、件数が少ない場合は encode の方が速い
+            encoded = (
+                self.encoding.encode_batch(texts_to_encode)
+                if len(texts_to_encode) >= ENCODE_BATCH_MIN_SIZE
+                else [self.encoding.encode(text) for text in texts_to_encode]
+            )
+            for key, tokens in zip(keys, encoded):
+                count = len(tokens)
+                for index in misses[key][1]:
+                    counts[index] = count
+                self._store(key, count)
+
+        return cast(List[int], counts)
+
+    def _store(self, key: bytes, count: int) -> None:
+        self._cache[key] = count
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cache_size:
+            self._cache.popitem(last=False)
+
+
+@lru_cache(maxsize=None)
+def _get_token_counter_by_encoding_name(encoding_name: str) -> TokenCounter:
+    return TokenCounter(tiktoken.get_encoding(encoding_name))
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    # 同じエンコーディングを使うモデル同士でキャッシュを共有する
+    return _get_token_counter_by_encoding_name(get_encoding(model).name)
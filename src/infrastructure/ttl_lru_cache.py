@@ -0,0 +1,155 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, List, Optional, Tuple, TypeVar
+from metrics.registry import registry
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+cache_hits = registry.counter(
+    "ai_counselor_cache_hits_total",
+    "Number of cache lookups that found a live entry.",
+    ["cache"],
+)
+
+cache_misses = registry.counter(
+    "ai_counselor_cache_misses_total",
+    "Number of cache lookups that found no live entry.",
+    ["cache"],
+)
+
+cache_evictions = registry.counter(
+    "ai_counselor_cache_evictions_total",
+    "Number of entries removed from the cache before being explicitly deleted.",
+    ["cache", "reason"],
+)
+
+cache_entries = registry.gauge(
+    "ai_counselor_cache_entries",
+    "Number of entries held in the cache.",
+    ["cache"],
+)
+
+cache_bytes = registry.gauge(
+    "ai_counselor_cache_bytes",
+    "Approximate memory held by the cache entries.",
+    ["cache"],
+)
+
+
+class TtlLruCache(Generic[K, V]):
+    """
+    件数・有効期限・おおよそのメモリ使用量で上限を設けたLRUキャッシュ。
+    max_bytes を指定する場合は size_of で値のおおよそのバイト数を返す関数を渡す。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        ttl_seconds: float,
+        max_bytes: int = 0,
+        size_of: Optional[Callable[[V], int]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda value: 0)
+        self.clock = clock
+        # key -> (有効期限, サイズ, 値)
+        self._entries: OrderedDict[K, Tuple[float, int, V]] = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return self.peek(key) is not None
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: K) -> Optional[V]:
+        value = self.peek(key)
+        if value is None:
+            cache_misses.inc(cache=self.name)
+            return None
+
+        self._entries.move_to_end(key)
+        cache_hits.inc(cache=self.name)
+        return value
+
+    def peek(self, key: K) -> Optional[V]:
+        """
+        ヒット率やLRUの順番に影響を与えずに値を参照する。
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, _, value = entry
+        if expires_at <= self.clock():
+            self._remove(key)
+            self._update_gauges()
+            cache_evictions.inc(cache=self.name, reason="expired")
+            return None
+
+        return value
+
+    def items(self) -> List[Tuple[K, V]]:
+        """
+        有効期限内のすべての値を、古く使われた順に返す。peek と同じくヒット率やLRUの順番に影響を与えない。
+        """
+        now = self.clock()
+        return [
+            (key, value)
+            for key, (expires_at, _, value) in self._entries.items()
+            if expires_at > now
+        ]
+
+    def set(self, key: K, value: V) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+        size = self.size_of(value)
+        if self.max_bytes and size > self.max_bytes:
+            # 単体で上限を超える値はキャッシュしない
+            self._update_gauges()
+            return
+
+        self._entries[key] = (self.clock() + self.ttl_seconds, size, value)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest("capacity")
+
+        while self.max_bytes and self._bytes > self.max_bytes:
+            self._evict_oldest("memory")
+
+        self._update_gauges()
+
+    def delete(self, key: K) -> None:
+        if key in self._entries:
+            self._remove(key)
+            self._update_gauges()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._update_gauges()
+
+    def _evict_oldest(self, reason: str) -> None:
+        key = next(iter(self._entries))
+        self._remove(key)
+        cache_evictions.inc(cache=self.name, reason=reason)
+
+    def _remove(self, key: K) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _update_gauges(self) -> None:
+        cache_entries.set(len(self._entries), cache=self.name)
+        cache_bytes.set(self._bytes, cache=self.name)
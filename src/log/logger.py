@@ -1,20 +1,79 @@
-import json
-from logging import Logger, LogRecord, getLogger, StreamHandler, Formatter, INFO
-from typing import Literal, TypedDict
+import os
+import atexit
+import queue
+import random
+from logging import (
+    Filter,
+    Formatter,
+    Handler,
+    Logger,
+    LogRecord,
+    getLogger,
+    StreamHandler,
+    INFO,
+    WARNING,
+)
+from logging.handlers import QueueHandler, QueueListener
+from typing import Literal, Optional, TypedDict
+import orjson
+
+# JSONに出力する LogRecord の属性
+LOG_RECORD_FIELDS = (
+    "name",
+    "msg",
+    "levelname",
+    "created",
+    "module",
+    "funcName",
+    "lineno",
+)
+
+# extra で渡された値のうちJSONに出力するもの
+LOG_EXTRA_FIELDS = ("request_id", "user_id", "ai_response_id")
+
+SUCCESS_LOG_MESSAGE = "success"
 
 
 class JsonFormatter(Formatter):
     def format(self, record: LogRecord) -> str:
         try:
-            data = record.__dict__.copy()
-            exc_info = data.pop("exc_info")
-            if exc_info:
-                data["traceback"] = self.formatException(exc_info).splitlines()
-            return json.dumps(data)
+            data = {field: getattr(record, field) for field in LOG_RECORD_FIELDS}
+            for field in LOG_EXTRA_FIELDS:
+                value = record.__dict__.get(field)
+                if value is not None:
+                    data[field] = value
+            if record.exc_info:
+                data["traceback"] = self.formatException(record.exc_info).splitlines()
+            return orjson.dumps(data, default=str).decode()
         except Exception:
             return super().format(record)
 
 
+class SuccessLogSamplingFilter(Filter):
+    """
+    リクエストごとに出力される成功ログを sample_rate の割合だけ出力する。
+    WARNING以上のログや成功ログ以外のログは常に出力する。
+    """
+
+    def __init__(self, sample_rate: float) -> None:
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: LogRecord) -> bool:
+        if record.levelno >= WARNING or record.msg != SUCCESS_LOG_MESSAGE:
+            return True
+
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # メッセージの組み立てだけ呼び出し元で行い、JSONへの変換と出力はバックグラウンドのスレッドで行う
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 class SuccessLogExtra(TypedDict):
     request_id: str
     user_id: str
@@ -28,18 +87,69 @@ class ErrorLogExtra(TypedDict):
 
 LogLevel = Literal[0, 10, 20, 30, 40, 50]
 
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[Handler] = None
+
+
+def create_stream_handler() -> StreamHandler:
+    handler = StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    return handler
 
-class AppLogger:
-    def __init__(self, level: LogLevel = INFO) -> None:  # type: ignore
-        self._logger = getLogger()
-        self._logger.setLevel(level)
 
-        for handler in self._logger.handlers[:]:
-            self._logger.removeHandler(handler)
+def setup_logging(level: LogLevel = INFO) -> Logger:  # type: ignore
+    """
+    ルートロガーを一度だけ設定する。ログはキューに積むだけにして、
+    標準出力への書き込みはバックグラウンドのスレッドで行うので、イベントループがブロックされない。
+    """
+    global _listener, _queue_handler
 
-        handler = StreamHandler()
-        handler.setFormatter(JsonFormatter())
-        self._logger.addHandler(handler)
+    logger = getLogger()
+    if _listener is not None:
+        return logger
+
+    log_queue: "queue.SimpleQueue[LogRecord]" = queue.SimpleQueue()
+
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(
+        SuccessLogSamplingFilter(float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "1")))
+    )
+
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(_queue_handler)
+    logger.setLevel(level)
+
+    _listener = QueueListener(log_queue, create_stream_handler())
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    return logger
+
+
+def shutdown_logging() -> None:
+    """
+    キューに残っているログを出力してからバックグラウンドのスレッドを停止する。
+    停止後のログは呼び出し元のスレッドで直接出力する。
+    """
+    global _listener, _queue_handler
+
+    if _listener is None:
+        return
+
+    logger = getLogger()
+    if _queue_handler is not None:
+        logger.removeHandler(_queue_handler)
+    logger.addHandler(create_stream_handler())
+
+    _listener.stop()
+    _listener = None
+    _queue_handler = None
+
+
+class AppLogger:
+    def __init__(self, level: LogLevel = INFO) -> None:  # type: ignore
+        self._logger = setup_logging(level)
 
     @property
     def logger(self) -> Logger:
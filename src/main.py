@@ -1,11 +1,15 @@
 import uvicorn
 import os
+from functools import partial
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 from fastapi import FastAPI, status, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from presentation.router import health_checks
 from presentation.router import messages
+from presentation.router import metrics as metrics_router
 from pydantic_core import ValidationError
 from linebot.v3.webhook import WebhookParser
 from linebot.v3.messaging import (
@@ -17,23 +21,119 @@ from linebot.v3.messaging import (
 )
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from domain.message import RATE_LIMITED_REPLY_MESSAGE, UNAVAILABLE_REPLY_MESSAGE
+from domain.prompt import (
+    COUNSELOR_PROMPT_NAME,
+    precompute_prompt_token_counts,
+    validate_prompt_versions,
+)
 from infrastructure.repository.openai.openai_generate_message_repository import (
     OpenAiGenerateMessageRepository,
 )
-from infrastructure.db import create_db_connection
+from infrastructure.repository.cache.cached_generate_message_repository import (
+    create_cached_generate_message_repository,
+)
+from infrastructure.openai import init_openai_client, close_openai_client
+from infrastructure.token_counter import get_token_counter
+from infrastructure.db import (
+    init_db_pool,
+    close_db_pool,
+    acquire_db_connection,
+    get_db_pool,
+)
 from infrastructure.repository.aiomysql.aiomysql_db_handler import AiomysqlDbHandler
+from infrastructure.conversation_window_cache import get_conversation_window_cache
+from infrastructure.conversation_window_invalidation import (
+    get_conversation_window_invalidation_poller,
+)
+from infrastructure.conversation_history_writer import get_conversation_history_writer
+from infrastructure.processed_request_cache import get_processed_request_cache
 from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
     AiomysqlConversationHistoryRepository,
+    get_counselor_prompt_versions,
+    get_token_count_model,
+)
+from infrastructure.repository.aiomysql.aiomysql_processed_request_repository import (
+    AiomysqlProcessedRequestRepository,
 )
 from usecase.generate_message_use_case import (
     GenerateMessageUseCaseDto,
     GenerateMessageUseCaseResult,
     GenerateMessageUseCase,
 )
-from log.logger import AppLogger, ErrorLogExtra
+from presentation.admission_control import (
+    AdmissionRejectedError,
+    get_admission_controller,
+)
+from presentation.conversation_summary import (
+    conversation_summary_queue,
+    schedule_conversation_summary,
+)
+from log.logger import AppLogger, ErrorLogExtra, setup_logging, shutdown_logging
+from metrics.stage_timer import measure_stage, track_request
+from tracing.tracer import (
+    init_tracing,
+    shutdown_tracing,
+    start_request_span,
+    start_span,
+)
+from worker.keyed_work_queue import (
+    KeyedWorkQueue,
+    WorkQueueClosedError,
+    WorkQueueFullError,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    setup_logging()
+    init_tracing()
+    # 存在しないプロンプトのバージョンを指定した場合は、リクエストを受ける前に起動を止める
+    validate_prompt_versions(COUNSELOR_PROMPT_NAME, get_counselor_prompt_versions())
+    await init_db_pool()
+    init_openai_client()
+    # 会話の最初のメッセージでプロンプトのトークン数を計算しなくて済むように、起動時に計算しておく
+    precompute_prompt_token_counts(get_token_counter(get_token_count_model()))
+    line_event_queue.start()
+    conversation_summary_queue.start()
+    conversation_history_writer = get_conversation_history_writer()
+    if conversation_history_writer is not None:
+        conversation_history_writer.start()
+    conversation_window_invalidation_poller = (
+        get_conversation_window_invalidation_poller()
+    )
+    if conversation_window_invalidation_poller is not None:
+        conversation_window_invalidation_poller.start()
+    try:
+        yield
+    finally:
+        await line_event_queue.drain(
+            timeout=float(os.getenv("LINE_EVENT_QUEUE_DRAIN_TIMEOUT_SECONDS", "25"))
+        )
+        # LINEのイベント処理から要約が積まれることがあるので、LINEのキューの後に停止する
+        await conversation_summary_queue.drain(
+            timeout=float(
+                os.getenv("CONVERSATION_SUMMARY_QUEUE_DRAIN_TIMEOUT_SECONDS", "10")
+            )
+        )
+        # キューに残った会話履歴を保存してからDBの接続プールを閉じる
+        if conversation_history_writer is not None:
+            await conversation_history_writer.close(
+                timeout=float(
+                    os.getenv("CONVERSATION_HISTORY_WRITER_CLOSE_TIMEOUT_SECONDS", "10")
+                )
+            )
+        if conversation_window_invalidation_poller is not None:
+            await conversation_window_invalidation_poller.close()
+        await close_openai_client()
+        await close_db_pool()
+        shutdown_tracing()
+        shutdown_logging()
+
 
 app = FastAPI(
     title="ai-counselor",
+    lifespan=lifespan,
 )
 
 
@@ -108,96 +208,169 @@ async def pydantic_validation_exception_handler(request: Request, exc: Validatio
 
 app.include_router(health_checks.router)
 app.include_router(messages.router)
+app.include_router(metrics_router.router)
 
 channel_secret = os.getenv("LINE_CHANNEL_SECRET")
 channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 
-configuration = Configuration(access_token=channel_access_token)
+configuration = Configuration(
+    host=os.getenv("LINE_MESSAGING_API_HOST", "https://api.line.me"),
+    access_token=channel_access_token,
+)
 
 async_api_client = AsyncApiClient(configuration)
 line_bot_api = AsyncMessagingApi(async_api_client)
 parser = WebhookParser(channel_secret)
 
 
-@app.post("/v1/line/callback")
-async def handle_callback(request: Request):
-    signature = request.headers["X-Line-Signature"]
+line_event_queue = KeyedWorkQueue(
+    "line_event",
+    concurrency=int(os.getenv("LINE_EVENT_WORKER_CONCURRENCY", "8")),
+    max_queue_size=int(os.getenv("LINE_EVENT_QUEUE_MAX_SIZE", "1000")),
+)
 
-    body = await request.body()
-    body = body.decode()
+
+async def handle_line_message_event(event: MessageEvent) -> None:
+    if not isinstance(event.message, TextMessageContent):
+        await line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[TextMessage(text="申し訳ありません。テキストメッセージ以外は理解できません。")],
+            )
+        )
+        return
+
+    if event.source is None:
+        return
+
+    if event.source.type != "user" or not isinstance(event.source.user_id, str):
+        return
+
+    user_id = event.source.user_id
 
     try:
-        events = parser.parse(body, signature)
-    except InvalidSignatureError:
-        raise HTTPException(status_code=400, detail="Invalid signature")
+        ticket = await get_admission_controller().admit(user_id)
+    except AdmissionRejectedError as e:
+        # 混雑している場合も返信しないままにせず、時間をおいて送り直してもらうように返信する
+        await line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[
+                    TextMessage(
+                        text=(
+                            RATE_LIMITED_REPLY_MESSAGE
+                            if e.reason == "rate_limited"
+                            else UNAVAILABLE_REPLY_MESSAGE
+                        )
+                    )
+                ],
+            )
+        )
+        return
 
-    for event in events:
-        if not isinstance(event, MessageEvent):
-            continue
-        if not isinstance(event.message, TextMessageContent):
-            await line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="申し訳ありません。テキストメッセージ以外は理解できません。")],
-                )
+    with track_request("line_message_event") as request_timing, start_request_span(
+        "handle_line_message_event",
+        request_id=event.webhook_event_id,
+        webhook_event_id=event.webhook_event_id,
+    ):
+        try:
+            connection = await acquire_db_connection()
+
+            db_handler = AiomysqlDbHandler(connection, get_db_pool())
+
+            generate_message_repository = create_cached_generate_message_repository(
+                OpenAiGenerateMessageRepository()
             )
-            continue
 
-        if event.source is not None:
-            if event.source.type == "user" and isinstance(event.source.user_id, str):
-                user_id = event.source.user_id
+            conversation_history_repository = AiomysqlConversationHistoryRepository(
+                connection,
+                window_cache=get_conversation_window_cache(),
+                writer=get_conversation_history_writer(),
+                db_handler=db_handler,
+                processed_request_cache=get_processed_request_cache(),
+            )
 
-                try:
-                    connection = await create_db_connection()
+            processed_request_repository = AiomysqlProcessedRequestRepository(
+                connection,
+                cache=get_processed_request_cache(),
+                writer=get_conversation_history_writer(),
+            )
 
-                    db_handler = AiomysqlDbHandler(connection)
+            dto = GenerateMessageUseCaseDto(
+                request_id=event.webhook_event_id,
+                user_id=user_id,
+                message=event.message.text,
+                db_handler=db_handler,
+                generate_message_repository=generate_message_repository,
+                conversation_history_repository=conversation_history_repository,
+                processed_request_repository=processed_request_repository,
+                bypass_response_cache=False,
+            )
 
-                    generate_message_repository = OpenAiGenerateMessageRepository()
+            use_case = GenerateMessageUseCase(dto)
 
-                    conversation_history_repository = (
-                        AiomysqlConversationHistoryRepository(
-                            connection,
-                        )
-                    )
+            use_case_result: GenerateMessageUseCaseResult = await use_case.execute()
 
-                    dto = GenerateMessageUseCaseDto(
-                        request_id=event.webhook_event_id,
-                        user_id=user_id,
-                        message=event.message.text,
-                        db_handler=db_handler,
-                        generate_message_repository=generate_message_repository,
-                        conversation_history_repository=conversation_history_repository,
-                    )
+            schedule_conversation_summary(event.webhook_event_id, user_id)
 
-                    use_case = GenerateMessageUseCase(dto)
+            response_message = use_case_result.get("message")
 
-                    use_case_result: GenerateMessageUseCaseResult = (
-                        await use_case.execute()
+            with measure_stage("reply"), start_span("AsyncMessagingApi.reply_message"):
+                await line_bot_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=event.reply_token,
+                        messages=[TextMessage(text=response_message)],
                     )
+                )
+        except Exception as e:
+            request_timing.outcome = "error"
 
-                    response_message = use_case_result.get("message")
+            app_logger = AppLogger()
 
-                    await line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text=response_message)],
-                        )
-                    )
-                except Exception as e:
-                    app_logger = AppLogger()
-
-                    logger = app_logger.logger
-
-                    logger.error(
-                        f"An error occurred while line webhook process: {str(e)}",
-                        exc_info=True,
-                        extra=ErrorLogExtra(
-                            request_id=event.webhook_event_id,
-                            user_id=user_id,
-                        ),
-                    )
+            logger = app_logger.logger
+
+            logger.error(
+                f"An error occurred while line webhook process: {str(e)}",
+                exc_info=True,
+                extra=ErrorLogExtra(
+                    request_id=event.webhook_event_id,
+                    user_id=user_id,
+                ),
+            )
+        finally:
+            ticket.release()
+
+
+@app.post("/v1/line/callback")
+async def handle_callback(request: Request):
+    signature = request.headers["X-Line-Signature"]
+
+    body = await request.body()
+    body = body.decode()
+
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    # 応答が遅れるとLINEプラットフォームから再送されるので、イベントはキューに積んですぐに200を返す
+    for event in events:
+        if not isinstance(event, MessageEvent):
+            continue
 
-                    raise HTTPException(status_code=500, detail="Internal Server Error")
+        # 同じユーザーのイベントは順番に、異なるユーザーのイベントは並行して処理する
+        key = (
+            event.source.user_id
+            if event.source is not None
+            and event.source.type == "user"
+            and isinstance(event.source.user_id, str)
+            else event.webhook_event_id
+        )
+
+        try:
+            line_event_queue.enqueue(key, partial(handle_line_message_event, event))
+        except (WorkQueueFullError, WorkQueueClosedError):
+            raise HTTPException(status_code=503, detail="Service Unavailable")
 
     return "OK"
 
@@ -0,0 +1,71 @@
+from typing import Dict, List, Sequence
+from metrics.registry import Histogram, LabelValues, MetricsRegistry
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(label_names: Sequence[str], label_values: LabelValues) -> str:
+    if not label_names:
+        return ""
+
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    )
+    return f"{{{pairs}}}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_histogram(metric: Histogram) -> List[str]:
+    lines: List[str] = []
+    label_names = metric.label_names + ("le",)
+
+    for label_values, histogram_value in sorted(metric.values().items()):
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(
+            metric.buckets + (float("inf"),), histogram_value.bucket_counts
+        ):
+            cumulative_count += bucket_count
+            labels = format_labels(
+                label_names, label_values + (format_value(upper_bound),)
+            )
+            lines.append(f"{metric.name}_bucket{labels} {cumulative_count}")
+
+        labels = format_labels(metric.label_names, label_values)
+        lines.append(f"{metric.name}_sum{labels} {format_value(histogram_value.sum)}")
+        lines.append(f"{metric.name}_count{labels} {histogram_value.count}")
+
+    return lines
+
+
+def render_prometheus_text(registry: MetricsRegistry) -> str:
+    """
+    レジストリのメトリクスを Prometheus のテキスト形式（0.0.4）に変換する。
+    """
+    lines: List[str] = []
+
+    for metric in sorted(registry.collect(), key=lambda metric: metric.name):
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+
+        if isinstance(metric, Histogram):
+            lines.extend(render_histogram(metric))
+            continue
+
+        values: Dict[LabelValues, float] = metric.values()
+        for label_values, value in sorted(values.items()):
+            labels = format_labels(metric.label_names, label_values)
+            lines.append(f"{metric.name}{labels} {format_value(value)}")
+
+    return "\n".join(lines) + "\n"
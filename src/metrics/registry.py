@@ -0,0 +1,241 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Literal, Optional, Sequence, Tuple, Union
+
+MetricType = Literal["counter", "gauge", "histogram"]
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Metric:
+    type: MetricType
+
+    def __init__(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(
+                f"{self.name} expects labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class Counter(Metric):
+    type: MetricType = "counter"
+
+    def __init__(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Metric):
+    type: MetricType = "gauge"
+
+    def __init__(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class HistogramValue:
+    __slots__ = ("bucket_counts", "count", "sum")
+
+    def __init__(self, bucket_count: int) -> None:
+        self.bucket_counts = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    type: MetricType = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, HistogramValue] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram_value = self._find_or_create_value(key)
+            histogram_value.bucket_counts[index] += 1
+            histogram_value.count += 1
+            histogram_value.sum += value
+
+    def get(self, **labels: str) -> Optional[HistogramValue]:
+        return self._values.get(self._label_values(labels))
+
+    def labels(self, **labels: str) -> "BoundHistogram":
+        """
+        ラベルの値を固定したヒストグラムを返す。
+        同じラベルで何度も記録する場合、記録のたびにラベルを解決しなくて済む。
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            histogram_value = self._find_or_create_value(key)
+        return BoundHistogram(self.buckets, histogram_value, self._lock)
+
+    def _find_or_create_value(self, key: LabelValues) -> HistogramValue:
+        histogram_value = self._values.get(key)
+        if histogram_value is None:
+            # 最後の要素は +Inf のバケット
+            histogram_value = HistogramValue(len(self.buckets) + 1)
+            self._values[key] = histogram_value
+        return histogram_value
+
+    def values(self) -> Dict[LabelValues, HistogramValue]:
+        with self._lock:
+            return dict(self._values)
+
+
+class BoundHistogram:
+    __slots__ = ("buckets", "value", "lock")
+
+    def __init__(
+        self,
+        buckets: Tuple[float, ...],
+        value: HistogramValue,
+        lock: threading.Lock,
+    ) -> None:
+        self.buckets = buckets
+        self.value = value
+        self.lock = lock
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        histogram_value = self.value
+        with self.lock:
+            histogram_value.bucket_counts[index] += 1
+            histogram_value.count += 1
+            histogram_value.sum += value
+
+
+AnyMetric = Union[Counter, Gauge, Histogram]
+
+Collector = Callable[[], None]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, AnyMetric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def counter(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, description, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def metrics(self) -> List[AnyMetric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def register_collector(self, collector: Collector) -> None:
+        """
+        メトリクスを出力する直前に呼び出す関数を登録する。
+        DBコネクションプールの利用状況のように、出力時点の値を取得すれば良いものはここで更新する。
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def collect(self) -> List[AnyMetric]:
+        with self._lock:
+            collectors = list(self._collectors)
+
+        for collector in collectors:
+            collector()
+
+        return self.metrics()
+
+    def _register(self, metric):
+        with self._lock:
+            registered = self._metrics.get(metric.name)
+            if registered is not None:
+                # モジュールの再読み込みなどで同じメトリクスが複数回定義された場合は既存のものを返す
+                if type(registered) is not type(metric):
+                    raise ValueError(f"{metric.name} is already registered")
+                return registered
+            self._metrics[metric.name] = metric
+            return metric
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,156 @@
+from time import perf_counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Literal, Optional, Tuple
+from metrics.registry import BoundHistogram, registry
+
+# リクエストごとの処理段階（DBの読み込み、トークン数の計算など）ごとの所要時間（秒）
+StageTimings = Dict[str, float]
+
+Outcome = Literal["success", "error", "cancelled"]
+
+stage_duration_seconds = registry.histogram(
+    "ai_counselor_stage_duration_seconds",
+    "Time spent in each stage of handling a request.",
+    ["endpoint", "stage", "outcome"],
+)
+
+request_duration_seconds = registry.histogram(
+    "ai_counselor_request_duration_seconds",
+    "Time spent handling a request, including every stage.",
+    ["endpoint", "outcome"],
+)
+
+requests_in_flight = registry.gauge(
+    "ai_counselor_requests_in_flight",
+    "Number of requests currently being handled.",
+    ["endpoint"],
+)
+
+
+class RequestTiming:
+    __slots__ = ("endpoint", "timings", "outcome")
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self.timings: StageTimings = {}
+        self.outcome: Outcome = "success"
+
+
+_request_timing: ContextVar[Optional[RequestTiming]] = ContextVar(
+    "request_timing", default=None
+)
+
+# ラベルの組み合わせは限られているので、ラベルを解決したヒストグラムを使い回して記録のコストを抑える
+_stage_histograms: Dict[Tuple[str, str, str], BoundHistogram] = {}
+
+# ヒストグラムにまだ記録していない、終了したリクエストの (endpoint, outcome, 所要時間, 処理段階ごとの所要時間)
+_finished_requests: List[Tuple[str, str, float, StageTimings]] = []
+
+# メトリクスが収集されないまま溜まり続けないように、この件数を超えたらその場でヒストグラムに記録する
+MAX_FINISHED_REQUESTS = 10_000
+
+
+def _find_stage_histogram(endpoint: str, stage: str, outcome: str) -> BoundHistogram:
+    key = (endpoint, stage, outcome)
+    histogram = _stage_histograms.get(key)
+    if histogram is None:
+        histogram = stage_duration_seconds.labels(
+            endpoint=endpoint, stage=stage, outcome=outcome
+        )
+        _stage_histograms[key] = histogram
+    return histogram
+
+
+def flush_request_timings() -> None:
+    """
+    終了したリクエストの所要時間をヒストグラムに記録する。
+    リクエストの処理中はリストに追加するだけにして、記録のコストをメトリクスの収集時にまとめて払う。
+    """
+    global _finished_requests
+
+    finished_requests, _finished_requests = _finished_requests, []
+
+    for endpoint, outcome, duration, timings in finished_requests:
+        request_duration_seconds.observe(duration, endpoint=endpoint, outcome=outcome)
+        for stage, elapsed in timings.items():
+            _find_stage_histogram(endpoint, stage, outcome).observe(elapsed)
+
+
+registry.register_collector(flush_request_timings)
+
+
+@contextmanager
+def track_request(endpoint: str) -> Iterator[RequestTiming]:
+    """
+    リクエスト全体の所要時間と処理中のリクエスト数を記録し、処理段階ごとの所要時間の記録を開始する。
+    処理段階ごとの所要時間は、リクエストの結果（outcome）のラベルを付けて記録する。
+    例外を返さずにエラーを処理する場合は、呼び出し元で outcome を "error" に変更する。
+    """
+    request_timing = RequestTiming(endpoint)
+    token = _request_timing.set(request_timing)
+    requests_in_flight.inc(endpoint=endpoint)
+    started_at = perf_counter()
+
+    try:
+        yield request_timing
+    except Exception:
+        request_timing.outcome = "error"
+        raise
+    except BaseException:
+        # クライアントの切断などでキャンセルされた場合（CancelledError, GeneratorExit）
+        request_timing.outcome = "cancelled"
+        raise
+    finally:
+        requests_in_flight.dec(endpoint=endpoint)
+
+        _finished_requests.append(
+            (
+                endpoint,
+                request_timing.outcome,
+                perf_counter() - started_at,
+                request_timing.timings,
+            )
+        )
+        if len(_finished_requests) >= MAX_FINISHED_REQUESTS:
+            flush_request_timings()
+
+        try:
+            _request_timing.reset(token)
+        except ValueError:
+            # ストリームの途中で別のコンテキストから閉じられた場合はリセットできないので、値を消すだけにする
+            _request_timing.set(None)
+
+
+class StageMeasurement:
+    """
+    with measure_stage("db_read"): の形で使い、現在のリクエストの処理段階の所要時間を記録する。
+    リクエストの処理中でない場合は何も記録しない。
+    """
+
+    __slots__ = ("stage", "started_at")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.started_at = perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        request_timing = _request_timing.get()
+        if request_timing is None:
+            return
+
+        # 同じ段階が複数回実行された場合は合計する
+        timings = request_timing.timings
+        stage = self.stage
+        timings[stage] = timings.get(stage, 0.0) + (perf_counter() - self.started_at)
+
+
+measure_stage = StageMeasurement
+
+
+def format_server_timing(timings: StageTimings) -> str:
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings.items()
+    )
@@ -0,0 +1,305 @@
+import os
+import time
+import asyncio
+import math
+from functools import lru_cache
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional,
+    TypedDict,
+)
+from fastapi.responses import JSONResponse
+from starlette import status
+from infrastructure.ttl_lru_cache import TtlLruCache
+from metrics.registry import registry
+from usecase.admission_controller_interface import (
+    AdmissionControllerInterface,
+    AdmissionRejectedError,
+    AdmissionTicketInterface,
+    RejectReason,
+)
+from worker.keyed_lock import KeyedLock
+
+admission_wait_seconds = registry.histogram(
+    "ai_counselor_admission_wait_seconds",
+    "Time a request waited for a completion slot before being admitted or rejected.",
+    ["outcome"],
+)
+
+admission_rejections = registry.counter(
+    "ai_counselor_admission_rejections_total",
+    "Number of requests rejected by admission control, by reason.",
+    ["reason"],
+)
+
+completions_in_flight = registry.gauge(
+    "ai_counselor_admission_completions_in_flight",
+    "Number of requests holding a completion slot.",
+)
+
+completions_waiting = registry.gauge(
+    "ai_counselor_admission_completions_waiting",
+    "Number of requests waiting for a completion slot.",
+)
+
+
+class AdmissionControlConfig(TypedDict):
+    # 同時に処理する応答の生成の最大数。処理の間DB接続を保持するので、DBの接続プールの最大数以下にする
+    max_concurrency: int
+    # 処理の順番（ユーザーのロックを含む）を待てるリクエストの最大数
+    max_waiting: int
+    # 処理の順番とユーザーのロックを、それぞれ待つ最大の秒数
+    max_wait_seconds: float
+    # ユーザーごとに1分あたりに受け付けるメッセージ数。0の場合は制限しない
+    user_rate_per_minute: float
+    # ユーザーごとに連続して受け付けるメッセージ数
+    user_burst: int
+    # レート制限の状態を保持するユーザーの最大数
+    max_users: int
+    # 同じユーザーのメッセージを1件ずつ順番に処理する
+    serialize_user_turns: bool
+
+
+def create_admission_control_config() -> AdmissionControlConfig:
+    return AdmissionControlConfig(
+        max_concurrency=int(
+            os.getenv("ADMISSION_MAX_CONCURRENCY", os.getenv("DB_POOL_MAX_SIZE", "10"))
+        ),
+        max_waiting=int(os.getenv("ADMISSION_MAX_WAITING", "50")),
+        max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "5")),
+        user_rate_per_minute=float(os.getenv("USER_RATE_LIMIT_PER_MINUTE", "10")),
+        user_burst=int(os.getenv("USER_RATE_LIMIT_BURST", "5")),
+        max_users=int(os.getenv("USER_RATE_LIMIT_MAX_USERS", "100000")),
+        serialize_user_turns=os.getenv("SERIALIZE_USER_TURNS", "true").lower()
+        == "true",
+    )
+
+
+class TokenBucket(NamedTuple):
+    tokens: float
+    updated_at: float
+
+
+class UserRateLimiter:
+    """
+    ユーザーごとのトークンバケット。連続して burst 件まで受け付け、その後は rate_per_second の速さで回復する。
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        burst: int,
+        max_users: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate_per_second = rate_per_second
+        self.burst = max(1, burst)
+        self.clock = clock
+        # バケットが満タンまで回復したら、消えても状態は変わらないので有効期限にする
+        self._buckets: TtlLruCache[str, TokenBucket] = TtlLruCache(
+            "user_rate_limit",
+            max_entries=max_users,
+            ttl_seconds=self.burst / rate_per_second,
+            clock=clock,
+        )
+
+    def acquire(self, user_id: str) -> float:
+        """
+        1件分のトークンを消費する。受け付けた場合は0を、受け付けない場合は次に受け付けられるまでの秒数を返す。
+        """
+        now = self.clock()
+        tokens = self._current_tokens(user_id, now)
+
+        if tokens < 1:
+            return (1 - tokens) / self.rate_per_second
+
+        self._buckets.set(user_id, TokenBucket(tokens=tokens - 1, updated_at=now))
+        return 0.0
+
+    def refund(self, user_id: str) -> None:
+        """
+        acquire で消費したトークンを返す。受け付けた後に処理できなかった場合に呼ぶ。
+        """
+        now = self.clock()
+        tokens = min(float(self.burst), self._current_tokens(user_id, now) + 1)
+        self._buckets.set(user_id, TokenBucket(tokens=tokens, updated_at=now))
+
+    def _current_tokens(self, user_id: str, now: float) -> float:
+        bucket = self._buckets.peek(user_id)
+        if bucket is None:
+            return float(self.burst)
+
+        return min(
+            float(self.burst),
+            bucket.tokens + (now - bucket.updated_at) * self.rate_per_second,
+        )
+
+
+class AdmissionTicket(AdmissionTicketInterface):
+    """
+    処理の枠と、ユーザーのロックを保持していることを表す。release は何度呼んでも1回だけ返す。
+    """
+
+    __slots__ = ("_semaphore", "_user_locks", "_user_id", "_released")
+
+    def __init__(
+        self,
+        semaphore: asyncio.Semaphore,
+        user_locks: Optional[KeyedLock],
+        user_id: str,
+    ) -> None:
+        self._semaphore = semaphore
+        self._user_locks = user_locks
+        self._user_id = user_id
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+
+        self._released = True
+        self._semaphore.release()
+        completions_in_flight.dec()
+        if self._user_locks is not None:
+            self._user_locks.release(self._user_id)
+
+
+class AdmissionController(AdmissionControllerInterface):
+    """
+    ユーザーごとのレート制限と、応答の生成の同時実行数の上限をかける。
+    上限に達した場合は待たせ続けずに、すぐに AdmissionRejectedError で断る。
+
+    同じユーザーのメッセージは前のメッセージの会話履歴が保存されるまで待たせる。
+    同時に処理すると、どちらも相手の会話を含まない会話履歴でOpenAI APIを呼び出し、保存の順番も入れ替わるため。
+    """
+
+    def __init__(
+        self,
+        config: AdmissionControlConfig,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.config = config
+        self.user_rate_limiter: Optional[UserRateLimiter] = (
+            UserRateLimiter(
+                config["user_rate_per_minute"] / 60,
+                config["user_burst"],
+                config["max_users"],
+                clock=clock,
+            )
+            if config["user_rate_per_minute"] > 0
+            else None
+        )
+        self.user_locks: Optional[KeyedLock] = (
+            KeyedLock("user_turn") if config["serialize_user_turns"] else None
+        )
+        self._semaphore = asyncio.Semaphore(max(1, config["max_concurrency"]))
+        self._waiting = 0
+
+    async def admit(self, user_id: str) -> AdmissionTicket:
+        if self.user_rate_limiter is not None:
+            retry_after = self.user_rate_limiter.acquire(user_id)
+            if retry_after > 0:
+                raise self._reject("rate_limited", retry_after)
+
+        try:
+            return await self._acquire_user_lock_and_slot(user_id)
+        except BaseException:
+            # 処理の順番を待てずに断った場合は、レート制限の対象に数えない
+            if self.user_rate_limiter is not None:
+                self.user_rate_limiter.refund(user_id)
+            raise
+
+    async def _acquire_user_lock_and_slot(self, user_id: str) -> AdmissionTicket:
+        # 前のメッセージを処理している間に処理の枠を占有しないように、ユーザーのロックを先に取得する
+        if self.user_locks is not None:
+            user_locks = self.user_locks
+            await self._wait(
+                lambda: user_locks.acquire(user_id), user_locks.locked(user_id)
+            )
+
+        try:
+            return await self._acquire_slot(user_id)
+        except BaseException:
+            if self.user_locks is not None:
+                self.user_locks.release(user_id)
+            raise
+
+    async def _acquire_slot(self, user_id: str) -> AdmissionTicket:
+        started_at = time.perf_counter()
+
+        try:
+            await self._wait(self._semaphore.acquire, self._semaphore.locked())
+        except AdmissionRejectedError as e:
+            if e.reason == "queue_timeout":
+                admission_wait_seconds.observe(
+                    time.perf_counter() - started_at, outcome="rejected"
+                )
+            raise
+
+        admission_wait_seconds.observe(
+            time.perf_counter() - started_at, outcome="admitted"
+        )
+        completions_in_flight.inc()
+
+        return AdmissionTicket(self._semaphore, self.user_locks, user_id)
+
+    async def _wait(self, acquire: Callable[[], Awaitable[object]], busy: bool) -> None:
+        """
+        待つ必要がある場合は、待っている数の上限と待つ時間の上限をかけて acquire を待つ。
+        ユーザーのロックも同じ上限で待たせるので、1人のユーザーが待っているリクエストを積み上げられない。
+        """
+        if not busy:
+            await acquire()
+            return
+
+        if self._waiting >= self.config["max_waiting"]:
+            raise self._reject("queue_full", self.config["max_wait_seconds"])
+
+        self._waiting += 1
+        completions_waiting.inc()
+
+        try:
+            await asyncio.wait_for(acquire(), timeout=self.config["max_wait_seconds"])
+        except asyncio.TimeoutError:
+            raise self._reject("queue_timeout", self.config["max_wait_seconds"])
+        finally:
+            self._waiting -= 1
+            completions_waiting.dec()
+
+    @staticmethod
+    def _reject(reason: RejectReason, retry_after: float) -> AdmissionRejectedError:
+        admission_rejections.inc(reason=reason)
+        return AdmissionRejectedError(reason, retry_after)
+
+
+@lru_cache(maxsize=None)
+def get_admission_controller() -> AdmissionController:
+    return AdmissionController(create_admission_control_config())
+
+
+def create_admission_rejected_response(
+    error: AdmissionRejectedError, headers: Dict[str, str]
+) -> JSONResponse:
+    headers = {**headers, "Retry-After": str(max(1, math.ceil(error.retry_after)))}
+
+    if error.reason == "rate_limited":
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers=headers,
+            content={
+                "type": "TOO_MANY_REQUESTS",
+                "title": "too many messages have been sent. please wait a moment.",
+            },
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers=headers,
+        content={
+            "type": "SERVICE_UNAVAILABLE",
+            "title": "the service is busy. please try again later.",
+        },
+    )
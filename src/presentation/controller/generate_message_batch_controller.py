@@ -0,0 +1,159 @@
+import os
+import json
+from typing import AsyncIterator, List, Union
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import Request
+from pydantic import BaseModel, Field, field_validator
+from log.logger import AppLogger, ErrorLogExtra
+from usecase.generate_message_batch_use_case import (
+    GenerateMessageBatchRepositories,
+    GenerateMessageBatchUseCase,
+    GenerateMessageBatchUseCaseDto,
+)
+from presentation.request_id import extract_and_validate_request_id
+from presentation.admission_control import get_admission_controller
+from presentation.controller.generate_message_controller import (
+    GenerateMessageRequestBody,
+)
+from metrics.stage_timer import track_request
+from tracing.tracer import start_request_span
+from infrastructure.db import acquire_db_connection, get_db_pool
+from infrastructure.repository.aiomysql.aiomysql_db_handler import AiomysqlDbHandler
+from infrastructure.conversation_window_cache import get_conversation_window_cache
+from infrastructure.conversation_history_writer import get_conversation_history_writer
+from infrastructure.processed_request_cache import get_processed_request_cache
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    AiomysqlConversationHistoryRepository,
+)
+from infrastructure.repository.aiomysql.aiomysql_processed_request_repository import (
+    AiomysqlProcessedRequestRepository,
+)
+from infrastructure.repository.openai.openai_generate_message_repository import (
+    OpenAiGenerateMessageRepository,
+)
+from infrastructure.repository.cache.cached_generate_message_repository import (
+    create_cached_generate_message_repository,
+)
+
+
+def get_max_batch_items() -> int:
+    return int(os.getenv("MESSAGE_BATCH_MAX_ITEMS", "1000"))
+
+
+class GenerateMessageBatchRequestBody(BaseModel):
+    items: List[GenerateMessageRequestBody] = Field(
+        ...,
+        description="メッセージを送信するユーザーとメッセージの一覧。同じユーザーを複数含めることはできません。",
+    )
+
+    @field_validator("items")
+    @classmethod
+    def validate_items(
+        cls, v: List[GenerateMessageRequestBody]
+    ) -> List[GenerateMessageRequestBody]:
+        max_items = get_max_batch_items()
+        if not 1 <= len(v) <= max_items:
+            raise ValueError(f"items must contain between 1 and {max_items} items")
+
+        if len({item.user_id for item in v}) != len(v):
+            raise ValueError("items must not contain the same user_id more than once")
+
+        return v
+
+
+class GenerateMessageBatchController:
+    def __init__(
+        self, request: Request, request_body: GenerateMessageBatchRequestBody
+    ) -> None:
+        app_logger = AppLogger()
+        self.logger = app_logger.logger
+        self.request = request
+        self.request_body = request_body
+
+    async def exec(self) -> Union[StreamingResponse, JSONResponse]:
+        request_id_or_error = extract_and_validate_request_id(self.request)
+        if isinstance(request_id_or_error, JSONResponse):
+            return request_id_or_error
+
+        request_id = request_id_or_error
+
+        return StreamingResponse(
+            self._stream_results(request_id),
+            headers={
+                "Ai-Counselor-Request-Id": request_id,
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            },
+            media_type="application/x-ndjson",
+        )
+
+    async def _stream_results(self, request_id: str) -> AsyncIterator[str]:
+        # 1件の生成が終わるたびに、その結果を1行のJSONで返す
+        with track_request("messages_batch") as request_timing, start_request_span(
+            "GenerateMessageBatchController.exec", request_id=request_id
+        ):
+            try:
+                use_case = await self._create_use_case(request_id)
+
+                async for event in use_case.execute():
+                    yield self._format_line(dict(event))
+            except Exception as e:
+                request_timing.outcome = "error"
+
+                self.logger.error(
+                    str(e),
+                    exc_info=True,
+                    extra=ErrorLogExtra(request_id=request_id, user_id=""),
+                )
+
+                # 1件ごとのエラー（GenerateMessageBatchItemError）と同じく type は "error" にし、種類は error で返す
+                yield self._format_line(
+                    {
+                        "type": "error",
+                        "error": "INTERNAL_SERVER_ERROR",
+                        "title": "an unexpected error has occurred.",
+                    }
+                )
+
+    async def _create_use_case(self, request_id: str) -> GenerateMessageBatchUseCase:
+        return GenerateMessageBatchUseCase(
+            GenerateMessageBatchUseCaseDto(
+                request_id=request_id,
+                items=[
+                    {"user_id": item.user_id, "message": item.message}
+                    for item in self.request_body.items
+                ],
+                max_concurrency=int(os.getenv("MESSAGE_BATCH_MAX_CONCURRENCY", "4")),
+                admission_controller=get_admission_controller(),
+                generate_message_repository=create_cached_generate_message_repository(
+                    OpenAiGenerateMessageRepository()
+                ),
+                create_repositories=self._create_repositories,
+            )
+        )
+
+    @staticmethod
+    async def _create_repositories() -> GenerateMessageBatchRepositories:
+        connection = await acquire_db_connection()
+
+        db_handler = AiomysqlDbHandler(connection, get_db_pool())
+
+        return GenerateMessageBatchRepositories(
+            db_handler=db_handler,
+            conversation_history_repository=AiomysqlConversationHistoryRepository(
+                connection,
+                window_cache=get_conversation_window_cache(),
+                writer=get_conversation_history_writer(),
+                db_handler=db_handler,
+                processed_request_cache=get_processed_request_cache(),
+            ),
+            processed_request_repository=AiomysqlProcessedRequestRepository(
+                connection,
+                cache=get_processed_request_cache(),
+                writer=get_conversation_history_writer(),
+            ),
+        )
+
+    @staticmethod
+    def _format_line(data: dict) -> str:
+        return json.dumps(data, ensure_ascii=False) + "\n"
@@ -1,4 +1,8 @@
-from fastapi.responses import JSONResponse
+import os
+import json
+from typing import AsyncIterator, Union
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from starlette.requests import Request
 from pydantic import BaseModel, field_validator, Field
 from http import HTTPStatus
@@ -10,14 +14,32 @@ from usecase.generate_message_use_case import (
     GenerateMessageUseCaseDto,
 )
 from presentation.request_id import extract_and_validate_request_id
-from infrastructure.db import create_db_connection
+from presentation.conversation_summary import schedule_conversation_summary
+from presentation.admission_control import (
+    AdmissionRejectedError,
+    AdmissionTicket,
+    create_admission_rejected_response,
+    get_admission_controller,
+)
+from metrics.stage_timer import track_request, format_server_timing
+from tracing.tracer import start_request_span
+from infrastructure.db import acquire_db_connection, get_db_pool
 from infrastructure.repository.aiomysql.aiomysql_db_handler import AiomysqlDbHandler
+from infrastructure.conversation_window_cache import get_conversation_window_cache
+from infrastructure.conversation_history_writer import get_conversation_history_writer
+from infrastructure.processed_request_cache import get_processed_request_cache
 from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
     AiomysqlConversationHistoryRepository,
 )
+from infrastructure.repository.aiomysql.aiomysql_processed_request_repository import (
+    AiomysqlProcessedRequestRepository,
+)
 from infrastructure.repository.openai.openai_generate_message_repository import (
     OpenAiGenerateMessageRepository,
 )
+from infrastructure.repository.cache.cached_generate_message_repository import (
+    create_cached_generate_message_repository,
+)
 
 
 class GenerateMessageRequestBody(BaseModel):
@@ -77,53 +99,165 @@ class GenerateMessageController:
         response_headers = {"Ai-Counselor-Request-Id": request_id}
 
         try:
-            connection = await create_db_connection()
+            ticket = await get_admission_controller().admit(self.request_body.user_id)
+        except AdmissionRejectedError as e:
+            return create_admission_rejected_response(e, response_headers)
 
-            db_handler = AiomysqlDbHandler(connection)
+        with track_request("messages") as request_timing, start_request_span(
+            "GenerateMessageController.exec", request_id=request_id
+        ):
+            try:
+                use_case = await self._create_use_case(request_id)
 
-            generate_message_repository = OpenAiGenerateMessageRepository()
+                use_case_result = await use_case.execute()
 
-            conversation_history_repository = AiomysqlConversationHistoryRepository(
-                connection,
-            )
+                schedule_conversation_summary(request_id, self.request_body.user_id)
+
+                # 負荷試験などで処理段階ごとの所要時間を確認できるように Server-Timing ヘッダーで返す
+                if os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true":
+                    response_headers["Server-Timing"] = format_server_timing(
+                        request_timing.timings
+                    )
 
-            use_case = GenerateMessageUseCase(
-                GenerateMessageUseCaseDto(
+                return JSONResponse(
+                    status_code=HTTPStatus.OK,
+                    headers=response_headers,
+                    content=use_case_result,
+                )
+            except Exception as e:
+                request_timing.outcome = "error"
+
+                unexpected_error = GenerateMessageErrorResponseBody(
+                    type="INTERNAL_SERVER_ERROR",
+                    title="an unexpected error has occurred.",
+                )
+
+                extra = ErrorLogExtra(
                     request_id=request_id,
                     user_id=self.request_body.user_id,
-                    message=self.request_body.message,
-                    db_handler=db_handler,
-                    generate_message_repository=generate_message_repository,
-                    conversation_history_repository=conversation_history_repository,
                 )
-            )
 
-            use_case_result = await use_case.execute()
+                self.logger.error(
+                    str(e),
+                    exc_info=True,
+                    extra=extra,
+                )
+
+                return JSONResponse(
+                    status_code=HTTPStatus.OK,
+                    headers=response_headers,
+                    content=unexpected_error,
+                )
+            finally:
+                ticket.release()
 
-            return JSONResponse(
-                status_code=HTTPStatus.OK,
-                headers=response_headers,
-                content=use_case_result,
-            )
-        except Exception as e:
-            unexpected_error = GenerateMessageErrorResponseBody(
-                type="INTERNAL_SERVER_ERROR",
-                title="an unexpected error has occurred.",
-            )
+    async def exec_stream(self) -> Union[StreamingResponse, JSONResponse]:
+        request_id_or_error = extract_and_validate_request_id(self.request)
+        if isinstance(request_id_or_error, JSONResponse):
+            return request_id_or_error
+
+        request_id = request_id_or_error
+
+        response_headers = {
+            "Ai-Counselor-Request-Id": request_id,
+            "Cache-Control": "no-cache",
+            # リバースプロキシでのバッファリングを無効にして、生成されたメッセージをすぐに届ける
+            "X-Accel-Buffering": "no",
+        }
+
+        try:
+            ticket = await get_admission_controller().admit(self.request_body.user_id)
+        except AdmissionRejectedError as e:
+            return create_admission_rejected_response(e, response_headers)
+
+        return StreamingResponse(
+            self._stream_events(request_id, ticket),
+            headers=response_headers,
+            media_type="text/event-stream",
+            # ストリームの送信が始まる前に切断された場合も、処理の枠を返す
+            background=BackgroundTask(ticket.release),
+        )
+
+    async def _stream_events(
+        self, request_id: str, ticket: AdmissionTicket
+    ) -> AsyncIterator[str]:
+        # DB接続はストリームの送信が始まってから取得し、送信前に切断された場合に接続が漏れないようにする
+        with track_request("messages_stream") as request_timing, start_request_span(
+            "GenerateMessageController.exec_stream", request_id=request_id
+        ):
+            try:
+                use_case = await self._create_use_case(request_id)
+
+                async for delta in use_case.execute_stream():
+                    yield self._format_event("message", {"delta": delta})
+
+                schedule_conversation_summary(request_id, self.request_body.user_id)
+
+                yield self._format_event("done", {})
+            except Exception as e:
+                request_timing.outcome = "error"
+
+                unexpected_error = GenerateMessageErrorResponseBody(
+                    type="INTERNAL_SERVER_ERROR",
+                    title="an unexpected error has occurred.",
+                )
+
+                extra = ErrorLogExtra(
+                    request_id=request_id,
+                    user_id=self.request_body.user_id,
+                )
+
+                self.logger.error(
+                    str(e),
+                    exc_info=True,
+                    extra=extra,
+                )
+
+                yield self._format_event("error", unexpected_error.model_dump())
+            finally:
+                ticket.release()
+
+    async def _create_use_case(self, request_id: str) -> GenerateMessageUseCase:
+        connection = await acquire_db_connection()
+
+        db_handler = AiomysqlDbHandler(connection, get_db_pool())
 
-            extra = ErrorLogExtra(
+        generate_message_repository = create_cached_generate_message_repository(
+            OpenAiGenerateMessageRepository()
+        )
+
+        conversation_history_repository = AiomysqlConversationHistoryRepository(
+            connection,
+            window_cache=get_conversation_window_cache(),
+            writer=get_conversation_history_writer(),
+            db_handler=db_handler,
+            processed_request_cache=get_processed_request_cache(),
+        )
+
+        processed_request_repository = AiomysqlProcessedRequestRepository(
+            connection,
+            cache=get_processed_request_cache(),
+            writer=get_conversation_history_writer(),
+        )
+
+        return GenerateMessageUseCase(
+            GenerateMessageUseCaseDto(
                 request_id=request_id,
                 user_id=self.request_body.user_id,
+                message=self.request_body.message,
+                db_handler=db_handler,
+                generate_message_repository=generate_message_repository,
+                conversation_history_repository=conversation_history_repository,
+                processed_request_repository=processed_request_repository,
+                bypass_response_cache=self._should_bypass_response_cache(),
             )
+        )
 
-            self.logger.error(
-                str(e),
-                exc_info=True,
-                extra=extra,
-            )
+    def _should_bypass_response_cache(self) -> bool:
+        # Cache-Control: no-cache が指定された場合は、キャッシュした応答を使わずに生成する
+        cache_control = self.request.headers.get("cache-control", "").lower()
+        return "no-cache" in cache_control or "no-store" in cache_control
 
-            return JSONResponse(
-                status_code=HTTPStatus.OK,
-                headers=response_headers,
-                content=unexpected_error,
-            )
+    @staticmethod
+    def _format_event(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
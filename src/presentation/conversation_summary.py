@@ -0,0 +1,91 @@
+import os
+from typing import Set
+from log.logger import AppLogger, ErrorLogExtra
+from infrastructure.db import acquire_db_connection, get_db_pool
+from infrastructure.repository.aiomysql.aiomysql_db_handler import AiomysqlDbHandler
+from infrastructure.conversation_window_cache import get_conversation_window_cache
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    AiomysqlConversationHistoryRepository,
+)
+from infrastructure.repository.aiomysql.aiomysql_conversation_summary_repository import (
+    AiomysqlConversationSummaryRepository,
+)
+from infrastructure.repository.openai.openai_summarize_conversation_repository import (
+    OpenAiSummarizeConversationRepository,
+)
+from usecase.summarize_conversation_use_case import (
+    SummarizeConversationUseCase,
+    SummarizeConversationUseCaseDto,
+)
+from worker.keyed_work_queue import (
+    KeyedWorkQueue,
+    WorkQueueClosedError,
+    WorkQueueFullError,
+)
+
+conversation_summary_queue = KeyedWorkQueue(
+    "conversation_summary",
+    concurrency=int(os.getenv("CONVERSATION_SUMMARY_WORKER_CONCURRENCY", "4")),
+    max_queue_size=int(os.getenv("CONVERSATION_SUMMARY_QUEUE_MAX_SIZE", "1000")),
+)
+
+# キューに積まれてまだ処理が始まっていないユーザー。同じユーザーの要約を重複して積まないようにする
+_pending_user_ids: Set[str] = set()
+
+
+def is_conversation_summary_enabled() -> bool:
+    return os.getenv("CONVERSATION_SUMMARY_ENABLED", "true").lower() == "true"
+
+
+def schedule_conversation_summary(request_id: str, user_id: str) -> None:
+    """
+    会話履歴の保存後に呼び出し、直近の会話から外れた会話の要約をバックグラウンドで更新する。
+    要約は応答に必要ないので、キューが一杯の場合は次の会話の保存時に任せる。
+    """
+    if not is_conversation_summary_enabled() or user_id in _pending_user_ids:
+        return
+
+    async def summarize() -> None:
+        _pending_user_ids.discard(user_id)
+        await summarize_conversation(request_id, user_id)
+
+    try:
+        conversation_summary_queue.enqueue(user_id, summarize)
+    except (WorkQueueFullError, WorkQueueClosedError) as e:
+        AppLogger().logger.warning(
+            f"conversation summary was not scheduled: {str(e)}",
+            extra=ErrorLogExtra(request_id=request_id, user_id=user_id),
+        )
+        return
+
+    _pending_user_ids.add(user_id)
+
+
+async def summarize_conversation(request_id: str, user_id: str) -> None:
+    connection = await acquire_db_connection()
+
+    window_cache = get_conversation_window_cache()
+
+    db_handler = AiomysqlDbHandler(connection, get_db_pool())
+
+    use_case = SummarizeConversationUseCase(
+        SummarizeConversationUseCaseDto(
+            request_id=request_id,
+            user_id=user_id,
+            min_turns=int(os.getenv("CONVERSATION_SUMMARY_MIN_TURNS", "4")),
+            db_handler=db_handler,
+            conversation_history_repository=AiomysqlConversationHistoryRepository(
+                connection,
+                window_cache=window_cache,
+                db_handler=db_handler,
+            ),
+            conversation_summary_repository=AiomysqlConversationSummaryRepository(
+                connection,
+                window_cache=window_cache,
+                db_handler=db_handler,
+            ),
+            summarize_conversation_repository=OpenAiSummarizeConversationRepository(),
+        )
+    )
+
+    await use_case.execute()
@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from pydantic import BaseModel
 from http import HTTPStatus
 from starlette.responses import JSONResponse
+from infrastructure.db import get_db_pool_stats
 
 router = APIRouter()
 
@@ -20,3 +21,34 @@ async def health_checks() -> JSONResponse:
         status_code=HTTPStatus.OK,
         content={"status": "ok"},
     )
+
+
+class DbPoolStatsJsonResponse(BaseModel):
+    min_size: int
+    max_size: int
+    size: int
+    in_use: int
+    idle: int
+    waiters: int
+
+
+@router.get("/v1/health-checks/db-pool", response_model=DbPoolStatsJsonResponse)
+async def db_pool_health_checks() -> JSONResponse:
+    """
+    DBコネクションプールの利用状況を返すモニタリング用のエンドポイントです。\n
+    プールが初期化されていない場合は503を返します。
+    """
+    stats = get_db_pool_stats()
+    if stats is None:
+        return JSONResponse(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            content={
+                "type": "SERVICE_UNAVAILABLE",
+                "title": "db pool is not initialized.",
+            },
+        )
+
+    return JSONResponse(
+        status_code=HTTPStatus.OK,
+        content=stats,
+    )
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends
+from typing import Union
+from fastapi import APIRouter, Depends, Query
 from fastapi.security import HTTPBasicCredentials
 from pydantic import BaseModel, field_validator, Field
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 from presentation.auth import basic_auth
 from presentation.controller.generate_message_controller import (
     GenerateMessageController,
     GenerateMessageRequestBody,
 )
+from presentation.controller.generate_message_batch_controller import (
+    GenerateMessageBatchController,
+    GenerateMessageBatchRequestBody,
+)
 from domain.message import is_message
 from domain.user_id import is_user_id
 
@@ -51,15 +56,46 @@ class GenerateMessageJsonResponse(BaseModel):
 async def generate_message(
     request: Request,
     request_body: GenerateMessageRequestBody,
+    stream: bool = Query(
+        default=False,
+        description="trueの場合、生成中のメッセージをServer-Sent Eventsで逐次返します。",
+    ),
     credentials: HTTPBasicCredentials = Depends(basic_auth),
-) -> JSONResponse:
+) -> Union[JSONResponse, StreamingResponse]:
     """
     このエンドポイントはAIが生成したメッセージを返します。
 
     - **userId**: ユーザーの識別子。
     - **message**: エンドユーザーから送信されるメッセージの内容。
+
+    `stream=true` を指定するか `Accept: text/event-stream` ヘッダーを送信すると、
+    生成されたメッセージを `message` イベントで逐次返し、最後に `done` イベントを返します。
     """
 
     controller = GenerateMessageController(request, request_body)
 
+    if stream or "text/event-stream" in request.headers.get("accept", ""):
+        return await controller.exec_stream()
+
+    return await controller.exec()
+
+
+@router.post("/v1/messages/batch", response_model=None)
+async def generate_message_batch(
+    request: Request,
+    request_body: GenerateMessageBatchRequestBody,
+    credentials: HTTPBasicCredentials = Depends(basic_auth),
+) -> Union[JSONResponse, StreamingResponse]:
+    """
+    複数のユーザーへのメッセージをまとめて生成します。
+
+    - **items**: `userId` と `message` の組の一覧。
+
+    結果はNDJSON（1行に1つのJSON）で、生成が終わった順に返します。
+    各行の `type` は `result`（生成したメッセージ）、`error`（生成できなかった）、`done`（最後の行）のいずれかです。
+    会話履歴は最後にまとめて保存するので、`done` の行を受け取れなかった場合は保存されていません。
+    """
+
+    controller = GenerateMessageBatchController(request, request_body)
+
     return await controller.exec()
@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from starlette.responses import Response
+from metrics.prometheus import PROMETHEUS_CONTENT_TYPE, render_prometheus_text
+from metrics.registry import registry
+
+router = APIRouter()
+
+
+@router.get("/v1/metrics", response_class=Response)
+async def metrics() -> Response:
+    """
+    Prometheus形式のメトリクスを返すモニタリング用のエンドポイントです。\n
+    処理段階ごとの所要時間、OpenAI APIのトークン数、DBコネクションプールの利用状況などを含みます。
+    """
+    return Response(
+        content=render_prometheus_text(registry),
+        media_type=PROMETHEUS_CONTENT_TYPE,
+    )
@@ -0,0 +1,207 @@
+import os
+import functools
+import inspect
+from contextlib import aclosing, contextmanager
+from contextvars import ContextVar
+from importlib.util import find_spec
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    Literal,
+    Optional,
+    TypedDict,
+    TypeVar,
+    cast,
+)
+
+# OpenTelemetry は任意の依存関係なので、インストールされていない場合はトレースを記録しない
+if find_spec("opentelemetry.sdk") is not None:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SpanExporter,
+    )
+else:  # pragma: no cover
+    trace = None  # type: ignore
+
+SpanAttributes = Dict[str, Any]
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+TracingExporter = Literal["otlp", "console"]
+
+
+class TracingConfig(TypedDict):
+    enabled: bool
+    exporter: TracingExporter
+    service_name: str
+
+
+def create_tracing_config() -> TracingConfig:
+    exporter = os.getenv("TRACING_EXPORTER", "otlp")
+    return TracingConfig(
+        enabled=os.getenv("TRACING_ENABLED", "false").lower() == "true",
+        exporter="console" if exporter == "console" else "otlp",
+        service_name=os.getenv("OTEL_SERVICE_NAME", "ai-counselor"),
+    )
+
+
+_tracer_provider: Optional["TracerProvider"] = None
+
+# リクエストIDなど、リクエスト内のすべてのスパンに付与する属性
+_request_attributes: ContextVar[SpanAttributes] = ContextVar(
+    "request_attributes", default={}
+)
+
+
+def create_span_exporter(exporter: TracingExporter) -> "SpanExporter":
+    if exporter == "console":
+        return ConsoleSpanExporter()
+
+    # 送信先はOpenTelemetryの標準の環境変数（OTEL_EXPORTER_OTLP_ENDPOINT など）で指定する
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+
+    return OTLPSpanExporter()
+
+
+def init_tracing(
+    config: Optional[TracingConfig] = None,
+    exporter: Optional["SpanExporter"] = None,
+) -> bool:
+    """
+    トレースの記録を開始する。スパンはバッチでまとめてエクスポートする。
+    トレースが無効、または OpenTelemetry がインストールされていない場合は何もせずFalseを返す。
+    """
+    global _tracer_provider
+
+    config = config or create_tracing_config()
+
+    if not config["enabled"] or trace is None:
+        return False
+
+    if _tracer_provider is not None:
+        return True
+
+    _tracer_provider = TracerProvider(
+        resource=Resource.create({"service.name": config["service_name"]})
+    )
+    _tracer_provider.add_span_processor(
+        BatchSpanProcessor(exporter or create_span_exporter(config["exporter"]))
+    )
+
+    return True
+
+
+def shutdown_tracing() -> None:
+    """
+    エクスポートされていないスパンを送信してからトレースの記録を停止する。
+    """
+    global _tracer_provider
+
+    if _tracer_provider is None:
+        return
+
+    _tracer_provider.shutdown()
+    _tracer_provider = None
+
+
+def force_flush_tracing() -> None:
+    if _tracer_provider is not None:
+        _tracer_provider.force_flush()
+
+
+@contextmanager
+def start_request_span(name: str, **attributes: Any) -> Iterator[None]:
+    """
+    リクエスト全体のスパンを開始する。
+    ここで渡した属性（リクエストIDなど）は、リクエスト内のすべてのスパンにも付与される。
+    """
+    previous_attributes = _request_attributes.get()
+    token = _request_attributes.set(
+        {**previous_attributes, **create_request_attributes(attributes)}
+    )
+    try:
+        with start_span(name):
+            yield
+    finally:
+        try:
+            _request_attributes.reset(token)
+        except ValueError:
+            # ストリームの途中で別のコンテキストから閉じられた場合はリセットできないので、元の値に戻すだけにする
+            _request_attributes.set(previous_attributes)
+
+
+@contextmanager
+def start_span(
+    name: str, attributes: Optional[SpanAttributes] = None
+) -> Iterator[None]:
+    if _tracer_provider is None:
+        yield
+        return
+
+    tracer = _tracer_provider.get_tracer(__name__)
+    with tracer.start_as_current_span(
+        name, attributes={**_request_attributes.get(), **(attributes or {})}
+    ):
+        yield
+
+
+def set_span_attributes(attributes: SpanAttributes) -> None:
+    """
+    実行中に決まる値（呼び出すモデルなど）を現在のスパンに追加する。
+    """
+    if _tracer_provider is None:
+        return
+
+    trace.get_current_span().set_attributes(attributes)
+
+
+def create_request_attributes(attributes: SpanAttributes) -> SpanAttributes:
+    return {
+        f"ai_counselor.{key}": value
+        for key, value in attributes.items()
+        if value is not None
+    }
+
+
+def create_mysql_span_attributes(operation: str, table: str) -> SpanAttributes:
+    return {"db.system": "mysql", "db.operation": operation, "db.sql.table": table}
+
+
+def traced(name: str, attributes: Optional[SpanAttributes] = None) -> Callable[[F], F]:
+    """
+    コルーチン関数、または非同期ジェネレーター関数の実行をスパンとして記録するデコレーター。
+    非同期ジェネレーターの場合は、最後の値を返し終わるまでを1つのスパンとして記録する。
+    """
+
+    def decorator(function: F) -> F:
+        if inspect.isasyncgenfunction(function):
+
+            @functools.wraps(function)
+            async def generator_wrapper(
+                *args: Any, **kwargs: Any
+            ) -> AsyncIterator[Any]:
+                # 呼び出し元が途中で閉じた場合も、元のジェネレーターの後処理をすぐに実行する
+                with start_span(name, attributes):
+                    async with aclosing(function(*args, **kwargs)) as generator:
+                        async for item in generator:
+                            yield item
+
+            return cast(F, generator_wrapper)
+
+        @functools.wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with start_span(name, attributes):
+                return await function(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
@@ -0,0 +1,24 @@
+from typing import Literal, Protocol
+
+RejectReason = Literal["rate_limited", "queue_full", "queue_timeout"]
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, reason: RejectReason, retry_after: float) -> None:
+        super().__init__(f"the request was rejected by admission control: {reason}")
+        self.reason = reason
+        # クライアントに返す、再送までの待ち時間（秒）
+        self.retry_after = retry_after
+
+
+class AdmissionTicketInterface(Protocol):
+    def release(self) -> None:
+        ...
+
+
+class AdmissionControllerInterface(Protocol):
+    async def admit(self, user_id: str) -> AdmissionTicketInterface:
+        """
+        処理の枠とユーザーのロックを取得する。受け付けない場合は AdmissionRejectedError を送出する。
+        """
+        ...
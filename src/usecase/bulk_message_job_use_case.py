@@ -0,0 +1,280 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, TypedDict, TypeVar
+from usecase.db_handler_interface import DbHandlerInterface
+from domain.repository.bulk_message_job_repository_interface import (
+    BulkMessageJob,
+    BulkMessageJobItem,
+    BulkMessageJobRepositoryInterface,
+)
+from domain.repository.batch_completion_repository_interface import (
+    BatchCompletionRepositoryInterface,
+    BatchCompletionRequest,
+)
+from domain.repository.conversation_history_repository_interface import (
+    ConversationHistoryRepositoryInterface,
+    SaveConversationHistoryDto,
+)
+from log.logger import AppLogger, ErrorLogExtra, SUCCESS_LOG_MESSAGE
+from tracing.tracer import traced
+
+FINISHED_STATUSES = ("ingested", "failed")
+
+T = TypeVar("T")
+
+
+class BulkMessageJobRequest(TypedDict):
+    user_id: str
+    message: str
+
+
+class BulkMessageJobNotFoundError(Exception):
+    pass
+
+
+class BulkMessageJobRepositories(TypedDict):
+    # 1つのDB接続を共有するリポジトリ。使い終わったら db_handler.close() で接続を閉じる
+    db_handler: DbHandlerInterface
+    bulk_message_job_repository: BulkMessageJobRepositoryInterface
+    conversation_history_repository: ConversationHistoryRepositoryInterface
+
+
+class BulkMessageJobUseCaseDto(TypedDict):
+    batch_completion_repository: BatchCompletionRepositoryInterface
+    # DB接続を取得してリポジトリを作る。バッチの完了を待つ間（最大24時間）はDB接続を保持しないように、
+    # 送信・完了の確認・取り込みのDBの操作ごとに呼び出す
+    create_repositories: Callable[[], Awaitable[BulkMessageJobRepositories]]
+    # 1回のトランザクションで会話履歴に取り込む結果の行数
+    ingest_chunk_size: int
+    # バッチの完了を確認する間隔
+    poll_interval_seconds: float
+
+
+class BulkMessageJobUseCase:
+    """
+    夜間の定期メッセージなどリアルタイムでなくてよいメッセージを、Batch APIでまとめて生成する。
+    ジョブは created → submitted → completed → ingested の順に進み、状態はDBに保存する。
+    途中でプロセスが終了しても、run を呼び直せば保存した状態から再開する。
+    """
+
+    def __init__(
+        self,
+        dto: BulkMessageJobUseCaseDto,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> None:
+        app_logger = AppLogger()
+        self.logger = app_logger.logger
+        self.dto = dto
+        self.sleep = sleep
+
+    async def create_job(
+        self, job_id: str, requests: List[BulkMessageJobRequest]
+    ) -> None:
+        # 同じユーザーの会話履歴を同じ状態から2回作ると、会話が重複して保存される
+        if len({request["user_id"] for request in requests}) != len(requests):
+            raise ValueError(
+                "requests must not contain the same user_id more than once"
+            )
+
+        # custom_id の順に取得するので、ゼロ埋めして入力の順を保つ
+        items = [
+            BulkMessageJobItem(
+                custom_id=f"{index:08d}",
+                user_id=request["user_id"],
+                message=request["message"],
+            )
+            for index, request in enumerate(requests)
+        ]
+
+        await self._in_transaction(
+            lambda repositories: repositories[
+                "bulk_message_job_repository"
+            ].create_bulk_message_job({"job_id": job_id, "items": items})
+        )
+
+    @traced("BulkMessageJobUseCase.run")
+    async def run(self, job_id: str) -> BulkMessageJob:
+        job: Optional[BulkMessageJob] = await self._read(
+            lambda repositories: repositories[
+                "bulk_message_job_repository"
+            ].find_bulk_message_job(job_id)
+        )
+        if job is None:
+            raise BulkMessageJobNotFoundError(f"bulk message job {job_id} not found")
+
+        while job["status"] not in FINISHED_STATUSES:
+            if job["status"] == "created":
+                job = await self._submit(job)
+            elif job["status"] == "submitted":
+                job = await self._wait(job)
+            else:
+                job = await self._ingest(job)
+
+        return job
+
+    async def resume_unfinished_jobs(self) -> List[BulkMessageJob]:
+        jobs: List[BulkMessageJob] = await self._read(
+            lambda repositories: repositories[
+                "bulk_message_job_repository"
+            ].find_unfinished_bulk_message_jobs()
+        )
+
+        return [await self.run(job["job_id"]) for job in jobs]
+
+    async def _submit(self, job: BulkMessageJob) -> BulkMessageJob:
+        repositories = await self.dto["create_repositories"]()
+        try:
+            items = await repositories[
+                "bulk_message_job_repository"
+            ].find_bulk_message_job_items(job["job_id"])
+
+            chat_messages_list = await repositories[
+                "conversation_history_repository"
+            ].create_messages_with_conversation_histories(
+                [
+                    {"user_id": item["user_id"], "request_message": item["message"]}
+                    for item in items
+                ]
+            )
+        finally:
+            repositories["db_handler"].close()
+
+        # 送信後、batch_id を保存する前に終了した場合は再送信する。取り込みは1回だけなので会話は重複しない
+        batch_id = await self.dto["batch_completion_repository"].submit_batch(
+            {
+                "job_id": job["job_id"],
+                "requests": [
+                    BatchCompletionRequest(
+                        custom_id=item["custom_id"],
+                        user_id=item["user_id"],
+                        chat_messages=chat_messages,
+                    )
+                    for item, chat_messages in zip(items, chat_messages_list)
+                ],
+            }
+        )
+
+        return await self._update_job(
+            {**job, "status": "submitted", "batch_id": batch_id}
+        )
+
+    async def _wait(self, job: BulkMessageJob) -> BulkMessageJob:
+        batch_id = str(job["batch_id"])
+
+        while True:
+            batch = await self.dto["batch_completion_repository"].retrieve_batch(
+                batch_id
+            )
+
+            if batch["status"] == "completed":
+                return await self._update_job(
+                    {
+                        **job,
+                        "status": "completed",
+                        "output_file_id": batch["output_file_id"],
+                    }
+                )
+
+            if batch["status"] == "failed":
+                self.logger.error(
+                    f"The bulk message job {job['job_id']} failed: {batch['error']}",
+                    extra=ErrorLogExtra(request_id=job["job_id"], user_id=""),
+                )
+                return await self._update_job(
+                    {**job, "status": "failed", "error": batch["error"]}
+                )
+
+            await self.sleep(self.dto["poll_interval_seconds"])
+
+    async def _ingest(self, job: BulkMessageJob) -> BulkMessageJob:
+        """
+        結果を ingest_chunk_size 行ずつ会話履歴に保存する。
+        会話履歴と取り込んだ行数を同じトランザクションで保存するので、再開しても同じ結果を2回保存しない。
+        """
+        items: List[BulkMessageJobItem] = await self._read(
+            lambda repositories: repositories[
+                "bulk_message_job_repository"
+            ].find_bulk_message_job_items(job["job_id"])
+        )
+        items_by_custom_id: Dict[str, BulkMessageJobItem] = {
+            item["custom_id"]: item for item in items
+        }
+
+        results = await self.dto["batch_completion_repository"].find_batch_results(
+            str(job["output_file_id"])
+        )
+
+        chunk_size = max(1, self.dto["ingest_chunk_size"])
+
+        for start in range(job["ingested_lines"], len(results), chunk_size):
+            chunk = results[start : start + chunk_size]
+
+            dtos = [
+                SaveConversationHistoryDto(
+                    user_id=items_by_custom_id[result["custom_id"]]["user_id"],
+                    user_message=items_by_custom_id[result["custom_id"]]["message"],
+                    ai_message=result["message"],
+                    # 取り込んだ行数をジョブに記録して、同じ結果を二重に保存しないようにしている
+                    processed_request=None,
+                )
+                for result in chunk
+                if result["message"] is not None
+                and result["custom_id"] in items_by_custom_id
+            ]
+
+            job = await self._save_chunk(
+                dtos, {**job, "ingested_lines": start + len(chunk)}
+            )
+
+        generated = len([result for result in results if result["message"] is not None])
+        self.logger.info(
+            f"{SUCCESS_LOG_MESSAGE} (job: {job['job_id']}, generated: {generated}, failed: {len(items) - generated})",
+            extra=ErrorLogExtra(request_id=job["job_id"], user_id=""),
+        )
+
+        return await self._update_job({**job, "status": "ingested"})
+
+    async def _save_chunk(
+        self, dtos: List[SaveConversationHistoryDto], job: BulkMessageJob
+    ) -> BulkMessageJob:
+        async def save(repositories: BulkMessageJobRepositories) -> None:
+            await repositories[
+                "conversation_history_repository"
+            ].save_conversation_histories(dtos)
+            await repositories["bulk_message_job_repository"].update_bulk_message_job(
+                job
+            )
+
+        await self._in_transaction(save)
+        return job
+
+    async def _update_job(self, job: BulkMessageJob) -> BulkMessageJob:
+        await self._in_transaction(
+            lambda repositories: repositories[
+                "bulk_message_job_repository"
+            ].update_bulk_message_job(job)
+        )
+        return job
+
+    async def _read(
+        self, operation: Callable[[BulkMessageJobRepositories], Awaitable[T]]
+    ) -> T:
+        repositories = await self.dto["create_repositories"]()
+        try:
+            return await operation(repositories)
+        finally:
+            repositories["db_handler"].close()
+
+    async def _in_transaction(
+        self, operation: Callable[[BulkMessageJobRepositories], Awaitable[None]]
+    ) -> None:
+        repositories = await self.dto["create_repositories"]()
+        try:
+            await repositories["db_handler"].begin()
+            try:
+                await operation(repositories)
+                await repositories["db_handler"].commit()
+            except Exception:
+                await repositories["db_handler"].rollback()
+                raise
+        finally:
+            repositories["db_handler"].close()
@@ -0,0 +1,325 @@
+import asyncio
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    List,
+    Literal,
+    Tuple,
+    TypedDict,
+    Union,
+)
+from usecase.db_handler_interface import DbHandlerInterface
+from usecase.admission_controller_interface import (
+    AdmissionControllerInterface,
+    AdmissionRejectedError,
+)
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryDto,
+    GenerateMessageRepositoryInterface,
+    GenerateMessageUnavailableError,
+)
+from domain.repository.conversation_history_repository_interface import (
+    ConversationHistoryRepositoryInterface,
+    ConversationHistoryRequest,
+    SaveConversationHistoryDto,
+)
+from domain.repository.processed_request_repository_interface import (
+    ProcessedRequest,
+    ProcessedRequestRepositoryInterface,
+)
+from domain.message import ChatMessage
+from log.logger import AppLogger, ErrorLogExtra, SUCCESS_LOG_MESSAGE
+from metrics.stage_timer import measure_stage
+from tracing.tracer import traced
+from worker.micro_batcher import MicroBatcher
+
+
+class GenerateMessageBatchItem(TypedDict):
+    user_id: str
+    message: str
+
+
+class GenerateMessageBatchItemResult(TypedDict):
+    type: Literal["result"]
+    # リクエストの items の何番目か
+    index: int
+    user_id: str
+    message: str
+
+
+# RATE_LIMITED: ユーザーのレート制限を超えた。UNAVAILABLE: 混雑や障害で生成できなかった。INTERNAL_SERVER_ERROR: 予期しないエラー
+BatchItemErrorType = Literal["RATE_LIMITED", "UNAVAILABLE", "INTERNAL_SERVER_ERROR"]
+
+
+class GenerateMessageBatchItemError(TypedDict):
+    type: Literal["error"]
+    index: int
+    user_id: str
+    error: BatchItemErrorType
+
+
+class GenerateMessageBatchDone(TypedDict):
+    type: Literal["done"]
+    # 会話履歴に保存したメッセージの数（同じリクエストの再送で、保存済みの応答を返したものを除く）
+    saved: int
+    failed: int
+
+
+GenerateMessageBatchEvent = Union[
+    GenerateMessageBatchItemResult,
+    GenerateMessageBatchItemError,
+    GenerateMessageBatchDone,
+]
+
+
+class GenerateMessageBatchRepositories(TypedDict):
+    # 1つのDB接続を共有するリポジトリ。使い終わったら db_handler.close() で接続を返す
+    db_handler: DbHandlerInterface
+    conversation_history_repository: ConversationHistoryRepositoryInterface
+    processed_request_repository: ProcessedRequestRepositoryInterface
+
+
+class GenerateMessageBatchUseCaseDto(TypedDict):
+    request_id: str
+    items: List[GenerateMessageBatchItem]
+    # 同時にメッセージを生成する最大数
+    max_concurrency: int
+    admission_controller: AdmissionControllerInterface
+    generate_message_repository: GenerateMessageRepositoryInterface
+    # DB接続を取得してリポジトリを作る。応答の生成を待つ間はDB接続を保持しないように、使うたびに呼び出す
+    create_repositories: Callable[[], Awaitable[GenerateMessageBatchRepositories]]
+
+
+# 保存した（または保存済みの）応答と、このバッチで保存したかどうか
+GeneratedMessage = Tuple[str, bool]
+
+# 処理済みのリクエストの場合は保存済みの応答、そうでない場合はOpenAI APIに渡すメッセージ
+LoadedItem = Union[ProcessedRequest, List[ChatMessage]]
+
+
+class GenerateMessageBatchUseCase:
+    """
+    複数のユーザーへのメッセージをまとめて生成する。
+    生成は max_concurrency 件まで並行して行い、生成して会話履歴に保存できた順に結果を返す。
+
+    1件ごとに通常のメッセージと同じ AdmissionController を通し、全体の同時実行数の上限とユーザーのロックをかける。
+    処理済みのリクエストは (user_id, request_id) で記録するので、同じ request_id で再送されたバッチは保存済みの応答を返す。
+
+    会話履歴の読み込みと保存は、同時に処理の枠を得た項目（保存は同時に生成し終えた項目）をまとめて、
+    それぞれ1つのDB接続で1回ずつ行う。
+    バッチ全体の最後にまとめて保存すると、保存するまで全項目のユーザーのロックを保持し続けることになるため。
+    """
+
+    def __init__(self, dto: GenerateMessageBatchUseCaseDto) -> None:
+        app_logger = AppLogger()
+        self.logger = app_logger.logger
+        self.dto = dto
+        self._loader: MicroBatcher[GenerateMessageBatchItem, LoadedItem] = MicroBatcher(
+            self._load_items
+        )
+        self._saver: MicroBatcher[SaveConversationHistoryDto, None] = MicroBatcher(
+            self._save_items
+        )
+
+    @traced("GenerateMessageBatchUseCase.execute")
+    async def execute(self) -> AsyncIterator[GenerateMessageBatchEvent]:
+        items = self.dto["items"]
+        semaphore = asyncio.Semaphore(max(1, self.dto["max_concurrency"]))
+        tasks = [
+            asyncio.create_task(self._generate(index, semaphore))
+            for index in range(len(items))
+        ]
+
+        try:
+            saved = 0
+            failed = 0
+
+            for completed in asyncio.as_completed(tasks):
+                index, result = await completed
+                item = items[index]
+
+                if isinstance(result, str):
+                    failed += 1
+                    yield GenerateMessageBatchItemError(
+                        type="error",
+                        index=index,
+                        user_id=item["user_id"],
+                        error=result,
+                    )
+                    continue
+
+                message, is_saved = result
+                if is_saved:
+                    saved += 1
+
+                yield GenerateMessageBatchItemResult(
+                    type="result",
+                    index=index,
+                    user_id=item["user_id"],
+                    message=message,
+                )
+
+            self.logger.info(
+                f"{SUCCESS_LOG_MESSAGE} (saved: {saved}, failed: {failed})",
+                extra=ErrorLogExtra(request_id=self.dto["request_id"], user_id=""),
+            )
+
+            yield GenerateMessageBatchDone(type="done", saved=saved, failed=failed)
+        except (asyncio.CancelledError, GeneratorExit):
+            # クライアントが切断した場合は、生成中のメッセージを保存せずに終了する
+            self.logger.info(
+                "client disconnected",
+                extra=ErrorLogExtra(request_id=self.dto["request_id"], user_id=""),
+            )
+
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _generate(
+        self, index: int, semaphore: asyncio.Semaphore
+    ) -> Tuple[int, Union[GeneratedMessage, BatchItemErrorType]]:
+        """
+        1件の失敗でバッチ全体を止めないように、生成できなかった場合はエラーの種類を返す。
+        """
+        item = self.dto["items"][index]
+        extra = ErrorLogExtra(
+            request_id=self.dto["request_id"], user_id=item["user_id"]
+        )
+
+        async with semaphore:
+            try:
+                ticket = await self.dto["admission_controller"].admit(item["user_id"])
+            except AdmissionRejectedError as e:
+                self.logger.warning(
+                    f"The message was rejected by admission control: {e.reason}",
+                    extra=extra,
+                )
+                return index, (
+                    "RATE_LIMITED" if e.reason == "rate_limited" else "UNAVAILABLE"
+                )
+
+            try:
+                return index, await self._generate_and_save(item)
+            except GenerateMessageUnavailableError as e:
+                self.logger.warning(
+                    f"The message could not be generated: {str(e)}", extra=extra
+                )
+                return index, "UNAVAILABLE"
+            except Exception as e:
+                self.logger.error(
+                    f"An error occurred while creating the message: {str(e)}",
+                    exc_info=True,
+                    extra=extra,
+                )
+                return index, "INTERNAL_SERVER_ERROR"
+            finally:
+                ticket.release()
+
+    async def _generate_and_save(
+        self, item: GenerateMessageBatchItem
+    ) -> GeneratedMessage:
+        user_id = item["user_id"]
+
+        # 応答の生成を待つ間はDB接続を保持しないように、読み込みと保存でそれぞれ接続を取得する
+        loaded = await self._loader.submit(item)
+        if isinstance(loaded, dict):
+            return loaded["message"], False
+
+        result = await self.dto["generate_message_repository"].generate_message(
+            GenerateMessageRepositoryDto(
+                user_id=user_id,
+                chat_messages=loaded,
+                bypass_cache=False,
+            )
+        )
+
+        saved = self._saver.submit(
+            SaveConversationHistoryDto(
+                user_id=user_id,
+                user_message=item["message"],
+                ai_message=result["message"],
+                # バッチの request_id とユーザーIDで、再送されたバッチで二重に保存しないようにする
+                processed_request=ConversationHistoryRequest(
+                    request_id=self.dto["request_id"],
+                    ai_response_id=result["ai_response_id"],
+                ),
+            )
+        )
+        try:
+            await asyncio.shield(saved)
+        except asyncio.CancelledError:
+            # 渡した会話の保存は止まらないので、保存が終わってからユーザーのロックを返す
+            await asyncio.wait([saved])
+            raise
+
+        return result["message"], True
+
+    async def _load_items(
+        self, items: List[GenerateMessageBatchItem]
+    ) -> List[LoadedItem]:
+        """
+        処理済みのリクエストと、処理していないリクエストの会話履歴を1つのDB接続でまとめて読み込む。
+        """
+        repositories = await self.dto["create_repositories"]()
+        try:
+            processed_requests = await repositories[
+                "processed_request_repository"
+            ].find_processed_requests(
+                [
+                    {"user_id": item["user_id"], "request_id": self.dto["request_id"]}
+                    for item in items
+                ]
+            )
+
+            unprocessed_items = [
+                item
+                for item, processed_request in zip(items, processed_requests)
+                if processed_request is None
+            ]
+            chat_messages_list = (
+                await repositories[
+                    "conversation_history_repository"
+                ].create_messages_with_conversation_histories(
+                    [
+                        {"user_id": item["user_id"], "request_message": item["message"]}
+                        for item in unprocessed_items
+                    ]
+                )
+                if unprocessed_items
+                else []
+            )
+        finally:
+            repositories["db_handler"].close()
+
+        chat_messages_iterator = iter(chat_messages_list)
+        return [
+            processed_request
+            if processed_request is not None
+            else next(chat_messages_iterator)
+            for processed_request in processed_requests
+        ]
+
+    async def _save_items(self, dtos: List[SaveConversationHistoryDto]) -> List[None]:
+        """
+        会話と処理済みのリクエストを、1つのトランザクションの複数行のINSERTでまとめて保存する。
+        """
+        repositories = await self.dto["create_repositories"]()
+        try:
+            with measure_stage("db_write"):
+                await repositories["db_handler"].begin()
+
+                await repositories[
+                    "conversation_history_repository"
+                ].save_conversation_histories(dtos)
+
+                await repositories["db_handler"].commit()
+        except BaseException:
+            await repositories["db_handler"].rollback()
+            raise
+        finally:
+            repositories["db_handler"].close()
+
+        return [None] * len(dtos)
@@ -1,14 +1,24 @@
-from typing import TypedDict
+import asyncio
+from typing import AsyncIterator, List, Optional, TypedDict
 from usecase.db_handler_interface import DbHandlerInterface
+from domain.message import UNAVAILABLE_REPLY_MESSAGE
 from domain.repository.generate_message_repository_interface import (
     GenerateMessageRepositoryDto,
     GenerateMessageRepositoryInterface,
+    GenerateMessageUnavailableError,
 )
 from domain.repository.conversation_history_repository_interface import (
     ConversationHistoryRepositoryInterface,
+    ConversationHistoryRequest,
     SaveConversationHistoryDto,
 )
-from log.logger import AppLogger, SuccessLogExtra, ErrorLogExtra
+from domain.repository.processed_request_repository_interface import (
+    ProcessedRequest,
+    ProcessedRequestRepositoryInterface,
+)
+from log.logger import AppLogger, SuccessLogExtra, ErrorLogExtra, SUCCESS_LOG_MESSAGE
+from metrics.stage_timer import measure_stage
+from tracing.tracer import traced
 
 
 class GenerateMessageUseCaseDto(TypedDict):
@@ -18,6 +28,9 @@ class GenerateMessageUseCaseDto(TypedDict):
     db_handler: DbHandlerInterface
     generate_message_repository: GenerateMessageRepositoryInterface
     conversation_history_repository: ConversationHistoryRepositoryInterface
+    processed_request_repository: ProcessedRequestRepositoryInterface
+    # 応答のキャッシュを使わずに必ずメッセージを生成する
+    bypass_response_cache: bool
 
 
 class GenerateMessageUseCaseResult(TypedDict):
@@ -30,12 +43,19 @@ class GenerateMessageUseCase:
         self.logger = app_logger.logger
         self.dto = dto
 
+    @traced("GenerateMessageUseCase.execute")
     async def execute(
         self,
     ) -> GenerateMessageUseCaseResult:
         user_id: str = self.dto["user_id"]
 
         try:
+            processed_request = await self._find_processed_request()
+            if processed_request is not None:
+                return GenerateMessageUseCaseResult(
+                    message=processed_request["message"]
+                )
+
             chat_messages = await self.dto[
                 "conversation_history_repository"
             ].create_messages_with_conversation_history(
@@ -48,27 +68,41 @@ class GenerateMessageUseCase:
             generate_message_repository_dto = GenerateMessageRepositoryDto(
                 user_id=user_id,
                 chat_messages=chat_messages,
+                bypass_cache=self.dto["bypass_response_cache"],
             )
 
-            generate_message_result = await self.dto[
-                "generate_message_repository"
-            ].generate_message(generate_message_repository_dto)
+            try:
+                with measure_stage("completion"):
+                    generate_message_result = await self.dto[
+                        "generate_message_repository"
+                    ].generate_message(generate_message_repository_dto)
+            except GenerateMessageUnavailableError as e:
+                # エラーにせずお詫びのメッセージを返す。会話履歴には保存しない
+                self._log_unavailable(e)
 
-            await self.dto["db_handler"].begin()
+                return GenerateMessageUseCaseResult(message=UNAVAILABLE_REPLY_MESSAGE)
 
-            save_conversation_history_dto = SaveConversationHistoryDto(
-                user_id=user_id,
-                user_message=self.dto["message"],
-                ai_message=generate_message_result.get("message"),
-            )
-            await self.dto["conversation_history_repository"].save_conversation_history(
-                save_conversation_history_dto,
-            )
+            with measure_stage("db_write"):
+                await self.dto["db_handler"].begin()
 
-            await self.dto["db_handler"].commit()
+                save_conversation_history_dto = SaveConversationHistoryDto(
+                    user_id=user_id,
+                    user_message=self.dto["message"],
+                    ai_message=generate_message_result.get("message"),
+                    processed_request=self._create_processed_request(
+                        generate_message_result.get("ai_response_id")
+                    ),
+                )
+                await self.dto[
+                    "conversation_history_repository"
+                ].save_conversation_history(
+                    save_conversation_history_dto,
+                )
+
+                await self.dto["db_handler"].commit()
 
             self.logger.info(
-                "success",
+                SUCCESS_LOG_MESSAGE,
                 extra=SuccessLogExtra(
                     request_id=self.dto["request_id"],
                     user_id=user_id,
@@ -94,3 +128,144 @@ class GenerateMessageUseCase:
             raise e
         finally:
             self.dto["db_handler"].close()
+
+    @traced("GenerateMessageUseCase.execute_stream")
+    async def execute_stream(self) -> AsyncIterator[str]:
+        user_id: str = self.dto["user_id"]
+
+        try:
+            processed_request = await self._find_processed_request()
+            if processed_request is not None:
+                yield processed_request["message"]
+                return
+
+            chat_messages = await self.dto[
+                "conversation_history_repository"
+            ].create_messages_with_conversation_history(
+                {
+                    "user_id": user_id,
+                    "request_message": self.dto["message"],
+                }
+            )
+
+            generate_message_repository_dto = GenerateMessageRepositoryDto(
+                user_id=user_id,
+                chat_messages=chat_messages,
+                bypass_cache=self.dto["bypass_response_cache"],
+            )
+
+            ai_response_id = ""
+            message_parts: List[str] = []
+
+            try:
+                with measure_stage("completion"):
+                    async for chunk in self.dto[
+                        "generate_message_repository"
+                    ].generate_message_stream(generate_message_repository_dto):
+                        ai_response_id = chunk["ai_response_id"]
+                        message_parts.append(chunk["delta"])
+                        yield chunk["delta"]
+            except GenerateMessageUnavailableError as e:
+                # 生成を始める前に失敗した場合のみ、お詫びのメッセージを返す
+                if message_parts:
+                    raise
+
+                self._log_unavailable(e)
+
+                yield UNAVAILABLE_REPLY_MESSAGE
+                return
+
+            # ストリームが最後まで送信できた場合のみ会話履歴を保存する
+            with measure_stage("db_write"):
+                await self.dto["db_handler"].begin()
+
+                save_conversation_history_dto = SaveConversationHistoryDto(
+                    user_id=user_id,
+                    user_message=self.dto["message"],
+                    ai_message="".join(message_parts),
+                    processed_request=self._create_processed_request(ai_response_id),
+                )
+                await self.dto[
+                    "conversation_history_repository"
+                ].save_conversation_history(
+                    save_conversation_history_dto,
+                )
+
+                await self.dto["db_handler"].commit()
+
+            self.logger.info(
+                SUCCESS_LOG_MESSAGE,
+                extra=SuccessLogExtra(
+                    request_id=self.dto["request_id"],
+                    user_id=user_id,
+                    ai_response_id=ai_response_id,
+                ),
+            )
+        except (asyncio.CancelledError, GeneratorExit):
+            # クライアントが切断した場合は会話履歴を保存せずに終了する
+            self.logger.info(
+                "client disconnected",
+                extra=ErrorLogExtra(
+                    request_id=self.dto["request_id"],
+                    user_id=user_id,
+                ),
+            )
+
+            raise
+        except Exception as e:
+            await self.dto["db_handler"].rollback()
+
+            self.logger.error(
+                f"An error occurred while creating the message: {str(e)}",
+                exc_info=True,
+                extra=ErrorLogExtra(
+                    request_id=self.dto["request_id"],
+                    user_id=self.dto["user_id"],
+                ),
+            )
+
+            raise e
+        finally:
+            self.dto["db_handler"].close()
+
+    def _log_unavailable(self, error: GenerateMessageUnavailableError) -> None:
+        self.logger.warning(
+            f"The message could not be generated: {str(error)}",
+            extra=ErrorLogExtra(
+                request_id=self.dto["request_id"],
+                user_id=self.dto["user_id"],
+            ),
+        )
+
+    async def _find_processed_request(self) -> Optional[ProcessedRequest]:
+        """
+        LINEのWebhookの再送などで処理済みのリクエストを受けた場合は、保存した応答を返す。
+        """
+        processed_request = await self.dto[
+            "processed_request_repository"
+        ].find_processed_request(
+            {
+                "user_id": self.dto["user_id"],
+                "request_id": self.dto["request_id"],
+            }
+        )
+
+        if processed_request is not None:
+            self.logger.info(
+                "the request has already been processed",
+                extra=SuccessLogExtra(
+                    request_id=self.dto["request_id"],
+                    user_id=self.dto["user_id"],
+                    ai_response_id=processed_request["ai_response_id"],
+                ),
+            )
+
+        return processed_request
+
+    def _create_processed_request(
+        self, ai_response_id: str
+    ) -> ConversationHistoryRequest:
+        # 会話履歴と一緒に保存し、再送されたリクエストで会話履歴が二重に保存されないようにする
+        return ConversationHistoryRequest(
+            request_id=self.dto["request_id"], ai_response_id=ai_response_id
+        )
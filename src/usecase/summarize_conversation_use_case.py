@@ -0,0 +1,117 @@
+from typing import TypedDict
+from usecase.db_handler_interface import DbHandlerInterface
+from domain.repository.conversation_history_repository_interface import (
+    ConversationHistoryRepositoryInterface,
+    FindEvictedConversationHistoriesDto,
+)
+from domain.repository.conversation_summary_repository_interface import (
+    ConversationSummaryRepositoryInterface,
+    SaveConversationSummaryDto,
+)
+from domain.repository.summarize_conversation_repository_interface import (
+    SummarizeConversationRepositoryDto,
+    SummarizeConversationRepositoryInterface,
+)
+from log.logger import AppLogger, ErrorLogExtra
+
+# 1回の要約に含める会話の最大数
+MAX_TURNS_PER_SUMMARY = 20
+
+
+class SummarizeConversationUseCaseDto(TypedDict):
+    # 要約のきっかけになったリクエストのID
+    request_id: str
+    user_id: str
+    # 直近の会話から外れた会話がこの数以上たまったら要約する
+    min_turns: int
+    db_handler: DbHandlerInterface
+    conversation_history_repository: ConversationHistoryRepositoryInterface
+    conversation_summary_repository: ConversationSummaryRepositoryInterface
+    summarize_conversation_repository: SummarizeConversationRepositoryInterface
+
+
+class SummarizeConversationUseCaseResult(TypedDict):
+    summarized_turns: int
+
+
+class SummarizeConversationUseCase:
+    """
+    直近の会話から外れた会話を、ユーザーごとに保存している要約に少しずつ畳み込む。
+    """
+
+    def __init__(self, dto: SummarizeConversationUseCaseDto) -> None:
+        app_logger = AppLogger()
+        self.logger = app_logger.logger
+        self.dto = dto
+
+    async def execute(self) -> SummarizeConversationUseCaseResult:
+        user_id: str = self.dto["user_id"]
+
+        try:
+            conversation_summary = await self.dto[
+                "conversation_summary_repository"
+            ].find_conversation_summary(user_id)
+
+            previous_summary = (
+                conversation_summary["summary"] if conversation_summary else ""
+            )
+            last_summarized_history_id = (
+                conversation_summary["last_summarized_history_id"]
+                if conversation_summary
+                else 0
+            )
+
+            evicted_histories = await self.dto[
+                "conversation_history_repository"
+            ].find_evicted_conversation_histories(
+                FindEvictedConversationHistoriesDto(
+                    user_id=user_id,
+                    after_id=last_summarized_history_id,
+                    limit=MAX_TURNS_PER_SUMMARY,
+                )
+            )
+
+            # 毎ターン要約するとコストがかかるので、ある程度たまってからまとめて要約する
+            if not evicted_histories or len(evicted_histories) < self.dto["min_turns"]:
+                return SummarizeConversationUseCaseResult(summarized_turns=0)
+
+            summary = await self.dto[
+                "summarize_conversation_repository"
+            ].summarize_conversation(
+                SummarizeConversationRepositoryDto(
+                    user_id=user_id,
+                    previous_summary=previous_summary,
+                    conversation_histories=evicted_histories,
+                )
+            )
+
+            await self.dto["db_handler"].begin()
+
+            await self.dto["conversation_summary_repository"].save_conversation_summary(
+                SaveConversationSummaryDto(
+                    user_id=user_id,
+                    summary=summary,
+                    last_summarized_history_id=evicted_histories[-1]["id"],
+                )
+            )
+
+            await self.dto["db_handler"].commit()
+
+            return SummarizeConversationUseCaseResult(
+                summarized_turns=len(evicted_histories)
+            )
+        except Exception as e:
+            await self.dto["db_handler"].rollback()
+
+            self.logger.error(
+                f"An error occurred while summarizing the conversation: {str(e)}",
+                exc_info=True,
+                extra=ErrorLogExtra(
+                    request_id=self.dto["request_id"],
+                    user_id=user_id,
+                ),
+            )
+
+            raise e
+        finally:
+            self.dto["db_handler"].close()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Dict
+from metrics.registry import registry
+
+keyed_lock_keys = registry.gauge(
+    "ai_counselor_keyed_lock_keys",
+    "Number of keys that currently hold or wait for the lock.",
+    ["lock"],
+)
+
+keyed_lock_wait_seconds = registry.histogram(
+    "ai_counselor_keyed_lock_wait_seconds",
+    "Time spent waiting for the lock of a key.",
+    ["lock"],
+)
+
+
+class _KeyedLockEntry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # ロックを保持している、または待っている数
+        self.users = 0
+
+
+class KeyedLock:
+    """
+    キーごとの非同期ロック。同じキーの処理は順番に、異なるキーの処理は並行して実行する。
+    ロックを保持している・待っている処理がなくなったキーは自動的に削除するので、キーが増え続けない。
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._entries: Dict[str, _KeyedLockEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def locked(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    async def acquire(self, key: str) -> None:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _KeyedLockEntry()
+            self._entries[key] = entry
+            keyed_lock_keys.set(len(self._entries), lock=self.name)
+
+        entry.users += 1
+        started_at = time.perf_counter()
+
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._leave(key, entry)
+            raise
+
+        keyed_lock_wait_seconds.observe(
+            time.perf_counter() - started_at, lock=self.name
+        )
+
+    def release(self, key: str) -> None:
+        entry = self._entries[key]
+        entry.lock.release()
+        self._leave(key, entry)
+
+    def _leave(self, key: str, entry: _KeyedLockEntry) -> None:
+        entry.users -= 1
+        if entry.users == 0:
+            del self._entries[key]
+            keyed_lock_keys.set(len(self._entries), lock=self.name)
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from log.logger import AppLogger
+from metrics.registry import registry
+
+Job = Callable[[], Awaitable[None]]
+
+queue_depth = registry.gauge(
+    "ai_counselor_work_queue_depth",
+    "Number of jobs waiting or running in the work queue.",
+    ["queue"],
+)
+
+queue_wait_seconds = registry.histogram(
+    "ai_counselor_work_queue_wait_seconds",
+    "Time a job spent in the work queue before a worker picked it up.",
+    ["queue"],
+)
+
+queue_processing_seconds = registry.histogram(
+    "ai_counselor_work_queue_processing_seconds",
+    "Time from enqueueing a job until the job finished.",
+    ["queue"],
+)
+
+
+class WorkQueueClosedError(Exception):
+    pass
+
+
+class WorkQueueFullError(Exception):
+    pass
+
+
+class KeyedWorkQueue:
+    """
+    同じキーのジョブは投入された順番に1つずつ、異なるキーのジョブは並行して処理するワーカーキュー。
+    キーごとに処理を待っているジョブを並べ、処理中のジョブがないキーだけを全ワーカー共通のキューに積む。
+    あるキーのジョブが遅くても、ほかのキーのジョブは空いているワーカーで処理される。
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue_size: int = 0) -> None:
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue_size = max_queue_size
+        # 処理を待っているジョブがあるキー。処理中のジョブがあるキーは含まない
+        self._ready_keys: asyncio.Queue[str] = asyncio.Queue()
+        # 処理中または処理を待っているジョブがあるキーと、そのキーの処理を待っているジョブ
+        self._jobs: Dict[str, Deque[Tuple[float, Job]]] = {}
+        # 処理中または処理を待っているジョブの数
+        self._size = 0
+        self._workers: List[asyncio.Task[None]] = []
+        self._accepting = False
+        self.logger = AppLogger().logger
+
+    def start(self) -> None:
+        if self._workers:
+            return
+
+        self._accepting = True
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"{self.name}-worker-{index}")
+            for index in range(self.concurrency)
+        ]
+
+    def enqueue(self, key: str, job: Job) -> None:
+        if not self._accepting:
+            raise WorkQueueClosedError(f"{self.name} is not accepting jobs")
+
+        if self.max_queue_size > 0 and self._size >= self.max_queue_size:
+            raise WorkQueueFullError(f"{self.name} is full")
+
+        jobs = self._jobs.get(key)
+        if jobs is None:
+            jobs = self._jobs[key] = deque()
+            self._ready_keys.put_nowait(key)
+
+        # 同じキーのジョブを処理中の場合は、処理が終わった後にワーカーがキーを積み直す
+        jobs.append((time.perf_counter(), job))
+        self._size += 1
+        queue_depth.inc(queue=self.name)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """
+        新しいジョブの受付を止め、キューに残っているジョブを処理し終えてからワーカーを停止する。
+        """
+        self._accepting = False
+
+        try:
+            await asyncio.wait_for(self._ready_keys.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"{self.name} could not be drained within {timeout} seconds",
+            )
+        finally:
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready_keys.get()
+            jobs = self._jobs[key]
+            enqueued_at, job = jobs.popleft()
+            queue_wait_seconds.observe(
+                time.perf_counter() - enqueued_at, queue=self.name
+            )
+
+            try:
+                await job()
+            except Exception as e:
+                self.logger.error(
+                    f"An error occurred while processing {self.name} job: {str(e)}",
+                    exc_info=True,
+                )
+            finally:
+                queue_processing_seconds.observe(
+                    time.perf_counter() - enqueued_at, queue=self.name
+                )
+                self._size -= 1
+                queue_depth.dec(queue=self.name)
+
+                # 次のジョブは、ほかのキーの後ろに積み直して順番に処理する
+                if jobs:
+                    self._ready_keys.put_nowait(key)
+                else:
+                    del self._jobs[key]
+                self._ready_keys.task_done()
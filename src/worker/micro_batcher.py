@@ -0,0 +1,57 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    並行して submit された値をまとめて、1回の operation で処理する（グループコミット）。
+    最初の submit と同じイベントループの周回で届いた値を1つのバッチにし、
+    処理中に届いた値は、処理が終わってから次のバッチにまとめる。
+
+    operation は受け取った値と同じ順に結果を返す。operation が失敗した場合は、バッチのすべての値が失敗する。
+    submit した側がキャンセルされても、渡した値の処理は止めない。
+    """
+
+    def __init__(self, operation: Callable[[List[T]], Awaitable[List[R]]]) -> None:
+        self.operation = operation
+        self._pending: List[Tuple[T, "asyncio.Future[R]"]] = []
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def submit(self, value: T) -> "asyncio.Future[R]":
+        future: asyncio.Future[R] = asyncio.get_running_loop().create_future()
+        self._pending.append((value, future))
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        return future
+
+    async def _run(self) -> None:
+        batch: List[Tuple[T, asyncio.Future[R]]] = []
+        try:
+            while self._pending:
+                # 同じ周回で submit される値を待ってから、まとめて処理する
+                await asyncio.sleep(0)
+                batch, self._pending = self._pending, []
+
+                try:
+                    results = await self.operation([value for value, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._task = None
+
+            # イベントループの終了などで止められた場合、待っている側が待ち続けないようにする
+            for _, future in batch + self._pending:
+                future.cancel()
+            self._pending = []
@@ -0,0 +1,85 @@
+import pytest
+from typing import List
+from domain.prompt import (
+    COUNSELOR_PROMPT_NAME,
+    create_prompt,
+    get_prompt,
+    register_prompt,
+    select_prompt,
+    validate_prompt_versions,
+)
+
+
+class CountingTokenCounter:
+    def __init__(self, encoding_name: str) -> None:
+        self._encoding_name = encoding_name
+        self.counted: List[str] = []
+
+    @property
+    def encoding_name(self) -> str:
+        return self._encoding_name
+
+    def count(self, text: str) -> int:
+        self.counted.append(text)
+        return len(text)
+
+
+def test_count_tokens_counts_once_per_encoding():
+    prompt = register_prompt("test_count_tokens", "v1", "あなたはカウンセラーです。")
+    token_counter = CountingTokenCounter("cl100k_base")
+
+    assert prompt.count_tokens(token_counter) == len(prompt.text)
+    assert prompt.count_tokens(token_counter) == len(prompt.text)
+    assert len(token_counter.counted) == 1
+
+    other_token_counter = CountingTokenCounter("o200k_base")
+    prompt.count_tokens(other_token_counter)
+    assert len(other_token_counter.counted) == 1
+
+
+def test_get_prompt_returns_the_latest_version_by_default():
+    register_prompt("test_latest", "v1", "v1のプロンプト")
+    register_prompt("test_latest", "v2", "v2のプロンプト")
+
+    assert get_prompt("test_latest").version == "v2"
+    assert get_prompt("test_latest", "v1").text == "v1のプロンプト"
+    assert get_prompt(COUNSELOR_PROMPT_NAME).text == create_prompt()
+
+
+def test_register_prompt_rejects_a_registered_version():
+    register_prompt("test_duplicate", "v1", "プロンプト")
+
+    with pytest.raises(ValueError):
+        register_prompt("test_duplicate", "v1", "別のプロンプト")
+
+
+def test_get_prompt_rejects_an_unknown_prompt():
+    with pytest.raises(ValueError):
+        get_prompt("test_unknown")
+
+
+def test_select_prompt_always_selects_the_same_version_for_a_user():
+    a = register_prompt("test_select", "a", "Aのプロンプト")
+    b = register_prompt("test_select", "b", "Bのプロンプト")
+
+    selected = [
+        select_prompt("test_select", f"user-{index}", ["a", "b"])
+        for index in range(100)
+    ]
+
+    assert {prompt.version for prompt in selected} == {"a", "b"}
+    assert select_prompt("test_select", "user-1", ["a", "b"]) is selected[1]
+    assert select_prompt("test_select", "user-1") is b
+    assert a.content_hash != b.content_hash
+
+
+def test_validate_prompt_versions_rejects_an_unknown_version():
+    register_prompt("test_validate", "a", "Aのプロンプト")
+
+    validate_prompt_versions("test_validate", ["a"])
+    validate_prompt_versions("test_validate", [])
+
+    with pytest.raises(ValueError) as error:
+        validate_prompt_versions("test_validate", ["a", "b"])
+
+    assert "b" in str(error.value)
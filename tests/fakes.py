@@ -0,0 +1,110 @@
+"""
+複数のテストで使う偽物の実装
+"""
+
+from typing import Dict, List, Optional
+import httpx
+from openai import AsyncOpenAI
+
+
+class FakeClock:
+    """
+    now を書き換えて時間を進める時計。time.monotonic の代わりに渡す。
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeEncoding:
+    """
+    1文字を1トークンとして数えるエンコーディング。tiktoken の Encoding の代わりに使う。
+    """
+
+    name = "fake"
+
+    def __init__(self) -> None:
+        self.encoded_texts: List[str] = []
+
+    def encode(self, text: str) -> List[int]:
+        return self.encode_batch([text])[0]
+
+    def encode_batch(self, text: List[str]) -> List[List[int]]:
+        self.encoded_texts.extend(text)
+        return [list(range(len(value))) for value in text]
+
+
+class FakeDbHandler:
+    """
+    トランザクションの操作を calls に記録する。
+    """
+
+    def __init__(self, calls: Optional[List[str]] = None) -> None:
+        self.calls: List[str] = calls if calls is not None else []
+
+    async def begin(self) -> None:
+        self.calls.append("begin")
+
+    async def commit(self) -> None:
+        self.calls.append("commit")
+
+    async def rollback(self) -> None:
+        self.calls.append("rollback")
+
+    def close(self) -> None:
+        self.calls.append("close")
+
+
+class FakeOpenAiServer:
+    """
+    OpenAI APIの代わり。テストごとに handle をオーバーライドして応答を決める。
+    """
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        raise NotImplementedError
+
+    def create_client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            api_key="test",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)),
+        )
+
+    @staticmethod
+    def create_error_response(
+        status_code: int, headers: Optional[Dict[str, str]] = None
+    ) -> httpx.Response:
+        return httpx.Response(
+            status_code,
+            headers=headers,
+            json={"error": {"message": "error", "type": "error"}},
+        )
+
+    @staticmethod
+    def create_chat_completion_response(
+        ai_response_id: str, model: str, content: str
+    ) -> httpx.Response:
+        return httpx.Response(
+            200,
+            json={
+                "id": ai_response_id,
+                "object": "chat.completion",
+                "created": 0,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": 1,
+                    "total_tokens": 11,
+                },
+            },
+        )
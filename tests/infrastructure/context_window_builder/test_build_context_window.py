@@ -0,0 +1,85 @@
+from typing import List
+from infrastructure.context_window_builder import (
+    ContextMessage,
+    build_context_window,
+    calculate_turn_token_budget,
+)
+from infrastructure.conversation_window_cache import ConversationTurn
+
+SYSTEM_MESSAGE = ContextMessage("system", "プロンプト", 10)
+REQUEST_MESSAGE = ContextMessage("user", "新しいメッセージ", 5)
+
+
+def create_turns(count: int) -> List[ConversationTurn]:
+    return [
+        ConversationTurn(
+            user_message=f"ユーザー{index}",
+            ai_message=f"カウンセラー{index}",
+            user_message_tokens=3,
+            ai_message_tokens=7,
+        )
+        for index in range(count)
+    ]
+
+
+def test_build_context_window_includes_every_turn_within_the_limit():
+    chat_messages = build_context_window(
+        SYSTEM_MESSAGE, None, create_turns(2), REQUEST_MESSAGE, 1000
+    )
+
+    assert chat_messages == [
+        {"role": "system", "content": "プロンプト"},
+        {"role": "user", "content": "ユーザー0"},
+        {"role": "assistant", "content": "カウンセラー0"},
+        {"role": "user", "content": "ユーザー1"},
+        {"role": "assistant", "content": "カウンセラー1"},
+        {"role": "user", "content": "新しいメッセージ"},
+    ]
+
+
+def test_build_context_window_drops_the_oldest_messages_over_the_limit():
+    # systemメッセージと新しいメッセージで15トークン使うので、残りは17トークン
+    chat_messages = build_context_window(
+        SYSTEM_MESSAGE, None, create_turns(3), REQUEST_MESSAGE, 32
+    )
+
+    assert chat_messages == [
+        {"role": "system", "content": "プロンプト"},
+        {"role": "assistant", "content": "カウンセラー1"},
+        {"role": "user", "content": "ユーザー2"},
+        {"role": "assistant", "content": "カウンセラー2"},
+        {"role": "user", "content": "新しいメッセージ"},
+    ]
+
+
+def test_build_context_window_counts_the_summary_as_used():
+    chat_messages = build_context_window(
+        SYSTEM_MESSAGE,
+        {"content": "要約", "tokens": 10},
+        create_turns(3),
+        REQUEST_MESSAGE,
+        34,
+    )
+
+    assert chat_messages == [
+        {"role": "system", "content": "プロンプト"},
+        {"role": "system", "content": "要約"},
+        {"role": "assistant", "content": "カウンセラー2"},
+        {"role": "user", "content": "新しいメッセージ"},
+    ]
+
+
+def test_build_context_window_always_includes_the_request_message():
+    chat_messages = build_context_window(
+        SYSTEM_MESSAGE, None, create_turns(3), REQUEST_MESSAGE, 1
+    )
+
+    assert chat_messages == [
+        {"role": "system", "content": "プロンプト"},
+        {"role": "user", "content": "新しいメッセージ"},
+    ]
+
+
+def test_calculate_turn_token_budget_reserves_the_messages_always_included():
+    assert calculate_turn_token_budget(10, None, 5, 32) == 17
+    assert calculate_turn_token_budget(10, {"content": "要約", "tokens": 10}, 5, 32) == 7
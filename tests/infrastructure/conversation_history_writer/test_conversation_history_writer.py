@@ -0,0 +1,316 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+import pytest
+import infrastructure.conversation_history_writer
+from infrastructure.conversation_history_writer import (
+    ConversationHistoryWriter,
+    ConversationHistoryWriterConfig,
+    ConversationHistoryWriterUnavailableError,
+    UnsavedConversationHistory,
+    append_to_spool,
+    create_unsaved_conversation_history,
+    insert_in_transaction,
+    read_spool,
+)
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    merge_unsaved_turns,
+)
+
+USER_ID = "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+
+
+class FakeDb:
+    def __init__(self) -> None:
+        self.available = True
+        self.batches: List[List[str]] = []
+
+    async def insert_rows(self, rows: List[UnsavedConversationHistory]) -> None:
+        if not self.available:
+            raise ConnectionError("db is unreachable")
+        self.batches.append([row["user_message"] for row in rows])
+
+
+async def wait_until(predicate, timeout: float = 1) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def create_writer(
+    db: FakeDb, spool_path: str, **overrides
+) -> ConversationHistoryWriter:
+    config = ConversationHistoryWriterConfig(
+        max_batch_size=3,
+        flush_interval_seconds=0.01,
+        max_pending=10,
+        spool_path=spool_path,
+    )
+    config.update(overrides)  # type: ignore
+    return ConversationHistoryWriter(config, db.insert_rows)
+
+
+def create_row(
+    message: str, request_id: Optional[str] = None
+) -> UnsavedConversationHistory:
+    return create_unsaved_conversation_history(
+        user_id=USER_ID,
+        user_message=message,
+        ai_message=f"{message}への応答",
+        user_message_tokens=1,
+        ai_message_tokens=1,
+        token_encoding="cl100k_base",
+        request_id=request_id,
+        ai_response_id=f"chatcmpl-{request_id}" if request_id else None,
+    )
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakeConnection") -> None:
+        self.connection = connection
+        self.result: List[Dict[str, Any]] = []
+
+    async def __aenter__(self) -> "FakeCursor":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        return None
+
+    async def execute(self, sql: str, args: List[Any]) -> None:
+        statement = " ".join(sql.split())
+        self.connection.statements.append((statement, args))
+
+        if statement.startswith("SELECT"):
+            keys = list(zip(args[0::2], args[1::2]))
+            self.result = [
+                {"user_id": user_id, "request_id": request_id}
+                for user_id, request_id in keys
+                if (user_id, request_id) in self.connection.processed_requests
+            ]
+
+    async def fetchall(self) -> List[Dict[str, Any]]:
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self, processed_requests: Set[Tuple[str, str]]) -> None:
+        self.processed_requests = processed_requests
+        self.statements: List[Tuple[str, List[Any]]] = []
+        self.calls: List[str] = []
+
+    async def begin(self) -> None:
+        self.calls.append("begin")
+
+    async def commit(self) -> None:
+        self.calls.append("commit")
+
+    async def rollback(self) -> None:
+        self.calls.append("rollback")
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+
+@pytest.mark.asyncio
+async def test_flushes_queued_turns_in_batches(tmp_path):
+    db = FakeDb()
+    writer = create_writer(db, str(tmp_path / "spool"))
+    writer.start()
+
+    for message in ["1", "2", "3", "4"]:
+        writer.enqueue(create_row(message))
+
+    assert [row["user_message"] for row in writer.find_unsaved(USER_ID)] == [
+        "1",
+        "2",
+        "3",
+        "4",
+    ]
+
+    await writer.close(timeout=1)
+
+    assert db.batches == [["1", "2", "3"], ["4"]]
+    assert writer.find_unsaved(USER_ID) == []
+
+
+@pytest.mark.asyncio
+async def test_spools_turns_while_db_is_unreachable(tmp_path):
+    db = FakeDb()
+    db.available = False
+    spool_path = str(tmp_path / "spool")
+    writer = create_writer(db, spool_path)
+    writer.start()
+
+    writer.enqueue(create_row("1"))
+    await wait_until(lambda: read_spool(spool_path)[0] != [])
+
+    assert [row["user_message"] for row in read_spool(spool_path)[0]] == ["1"]
+    # DBに保存するまでは同じプロセスから読める
+    assert [row["user_message"] for row in writer.find_unsaved(USER_ID)] == ["1"]
+
+    # スプールした会話を先に保存して、順番を保つ
+    writer.enqueue(create_row("2"))
+    db.available = True
+    await writer.close(timeout=1)
+
+    assert [message for batch in db.batches for message in batch] == ["1", "2"]
+    assert read_spool(spool_path) == ([], [])
+    assert writer.find_unsaved(USER_ID) == []
+
+
+@pytest.mark.asyncio
+async def test_replays_spool_left_by_previous_process(tmp_path):
+    db = FakeDb()
+    db.available = False
+    spool_path = str(tmp_path / "spool")
+
+    previous = create_writer(db, spool_path)
+    previous.start()
+    previous.enqueue(create_row("1"))
+    await previous.close(timeout=1)
+
+    db.available = True
+    writer = create_writer(db, spool_path)
+    writer.start()
+    await writer.close(timeout=1)
+
+    assert db.batches == [["1"]]
+    assert read_spool(spool_path) == ([], [])
+
+
+@pytest.mark.asyncio
+async def test_rejects_turns_when_not_running_or_full(tmp_path):
+    writer = create_writer(FakeDb(), str(tmp_path / "spool"), max_pending=1)
+
+    with pytest.raises(ConversationHistoryWriterUnavailableError):
+        writer.enqueue(create_row("1"))
+
+    writer.start()
+    # バッチの大きさに達しないように、保存の間隔を長くする
+    writer.config["flush_interval_seconds"] = 60
+    writer.enqueue(create_row("1"))
+
+    with pytest.raises(ConversationHistoryWriterUnavailableError):
+        writer.enqueue(create_row("2"))
+
+    await writer.close(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_keeps_running_when_a_flush_fails(tmp_path, monkeypatch):
+    db = FakeDb()
+    spool_path = str(tmp_path / "spool")
+    append_to_spool(spool_path, [create_row("1")])
+
+    replace_spool = infrastructure.conversation_history_writer.replace_spool
+    failures: List[str] = []
+
+    def fail_once(path: str, rows: List[UnsavedConversationHistory]) -> None:
+        if not failures:
+            failures.append(path)
+            raise OSError("no space left on device")
+        replace_spool(path, rows)
+
+    monkeypatch.setattr(
+        infrastructure.conversation_history_writer, "replace_spool", fail_once
+    )
+
+    writer = create_writer(db, spool_path)
+    writer.start()
+    await wait_until(lambda: failures != [])
+
+    # 保存に失敗した後も受け付けて、次の保存で再び試す
+    writer.enqueue(create_row("2"))
+    await wait_until(lambda: writer.find_unsaved(USER_ID) == [])
+
+    assert not writer._task.done()
+    await writer.close(timeout=1)
+
+    # スプールの会話は保存し直すことがある（書き込みは少なくとも1回）
+    assert [message for batch in db.batches for message in batch] == ["1", "1", "2"]
+    assert read_spool(spool_path) == ([], [])
+
+
+@pytest.mark.asyncio
+async def test_moves_invalid_spool_lines_aside(tmp_path):
+    db = FakeDb()
+    spool_path = str(tmp_path / "spool")
+    append_to_spool(spool_path, [create_row("1")])
+    truncated = json.dumps(create_row("2"), ensure_ascii=False)[:20]
+    with open(spool_path, "a", encoding="utf-8") as file:
+        file.write(truncated)
+
+    writer = create_writer(db, spool_path)
+    writer.start()
+    await writer.close(timeout=1)
+
+    assert db.batches == [["1"]]
+    assert read_spool(spool_path) == ([], [])
+    with open(f"{spool_path}.invalid", encoding="utf-8") as file:
+        assert file.read() == truncated + "\n"
+
+
+@pytest.mark.asyncio
+async def test_rejects_turns_after_task_has_stopped(tmp_path):
+    writer = create_writer(FakeDb(), str(tmp_path / "spool"))
+    writer.start()
+
+    writer._task.cancel()
+    await asyncio.sleep(0)
+
+    # 呼び出し元がDBに直接保存できるように、キューに積まずに断る
+    with pytest.raises(ConversationHistoryWriterUnavailableError):
+        writer.enqueue(create_row("1"))
+
+    await writer.close(timeout=1)
+
+
+def test_merge_unsaved_turns_removes_turns_already_saved():
+    def turn(message: str):
+        return {
+            "user_message": message,
+            "ai_message": message,
+            "user_message_tokens": 1,
+            "ai_message_tokens": 1,
+        }
+
+    saved = [turn("1"), turn("2"), turn("3")]
+
+    assert merge_unsaved_turns(saved, [turn("3"), turn("4")]) == [
+        turn("1"),
+        turn("2"),
+        turn("3"),
+        turn("4"),
+    ]
+    assert merge_unsaved_turns(saved, [turn("4")]) == saved + [turn("4")]
+
+
+@pytest.mark.asyncio
+async def test_insert_in_transaction_skips_turns_of_processed_requests():
+    # request-1 は前回の書き込みで保存済み（書き込みの成否が分からずに保存し直した場合など）
+    connection = FakeConnection({(USER_ID, "request-1")})
+
+    await insert_in_transaction(
+        connection,
+        [
+            create_row("1", request_id="request-1"),
+            create_row("2", request_id="request-2"),
+            create_row("3"),
+        ],
+    )
+
+    assert connection.calls == ["begin", "commit"]
+    assert [statement.split(" (")[0] for statement, _ in connection.statements] == [
+        "SELECT user_id, request_id FROM processed_requests WHERE",
+        "INSERT INTO processed_requests",
+        "INSERT INTO conversation_histories",
+    ]
+    assert connection.statements[1][1] == [
+        USER_ID,
+        "request-2",
+        "chatcmpl-request-2",
+        "2への応答",
+    ]
+    # 会話と処理済みのリクエストは同じトランザクションで保存する
+    assert connection.statements[2][1][1::6] == ["2", "3"]
@@ -0,0 +1,89 @@
+from infrastructure.conversation_window_cache import (
+    ConversationTurn,
+    ConversationWindow,
+    ConversationWindowCache,
+)
+
+user_id = "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+
+
+def create_turn(index: int) -> ConversationTurn:
+    return ConversationTurn(
+        user_message=f"こんにちは{index}",
+        ai_message=f"もちろんです{index}",
+        user_message_tokens=index,
+        ai_message_tokens=index,
+    )
+
+
+def create_window(*turns: ConversationTurn) -> ConversationWindow:
+    return ConversationWindow(encoding_name="cl100k_base", summary=None, turns=turns)
+
+
+def create_cache() -> ConversationWindowCache:
+    return ConversationWindowCache(
+        max_users=10, ttl_seconds=60, max_bytes=1024 * 1024, history_depth=2
+    )
+
+
+def test_append_writes_through_to_loaded_window():
+    cache = create_cache()
+
+    cache.start_loading(user_id)
+    cache.finish_loading(user_id, create_window(create_turn(1), create_turn(2)))
+    cache.append(user_id, "cl100k_base", create_turn(3))
+
+    assert cache.get(user_id, "cl100k_base") == create_window(
+        create_turn(2), create_turn(3)
+    )
+
+
+def test_set_summary_writes_through_to_loaded_window():
+    cache = create_cache()
+
+    cache.start_loading(user_id)
+    cache.finish_loading(user_id, create_window(create_turn(1)))
+    cache.set_summary(user_id, "cl100k_base", {"content": "要約", "tokens": 2})
+
+    window = cache.get(user_id, "cl100k_base")
+
+    assert window is not None
+    assert window.summary == {"content": "要約", "tokens": 2}
+    assert window.turns == (create_turn(1),)
+
+
+def test_append_is_ignored_when_window_is_not_cached():
+    cache = create_cache()
+
+    cache.append(user_id, "cl100k_base", create_turn(1))
+
+    assert cache.get(user_id, "cl100k_base") is None
+
+
+def test_window_saved_while_loading_is_not_cached():
+    cache = create_cache()
+
+    cache.start_loading(user_id)
+    cache.append(user_id, "cl100k_base", create_turn(2))
+    cache.finish_loading(user_id, create_window(create_turn(1)))
+
+    assert cache.get(user_id, "cl100k_base") is None
+
+
+def test_window_deleted_while_loading_is_not_cached():
+    cache = create_cache()
+
+    cache.start_loading(user_id)
+    cache.delete(user_id)
+    cache.finish_loading(user_id, create_window(create_turn(1)))
+
+    assert cache.get(user_id, "cl100k_base") is None
+
+
+def test_window_with_other_encoding_is_not_used():
+    cache = create_cache()
+
+    cache.start_loading(user_id)
+    cache.finish_loading(user_id, create_window(create_turn(1)))
+
+    assert cache.get(user_id, "o200k_base") is None
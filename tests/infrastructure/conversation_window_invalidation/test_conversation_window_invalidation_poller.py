@@ -0,0 +1,105 @@
+import pytest
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from infrastructure.conversation_window_cache import (
+    ConversationWindow,
+    ConversationWindowCache,
+)
+from infrastructure.conversation_window_invalidation import (
+    ConversationWindowInvalidationPoller,
+    ConversationWindowInvalidationPollerConfig,
+)
+
+ENCODING_NAME = "cl100k_base"
+
+
+class FakeInvalidations:
+    """
+    conversation_window_invalidations の代わり。DBの時刻は記録するたびと確認するたびに進める。
+    """
+
+    def __init__(self) -> None:
+        self.now = datetime(2024, 1, 1)
+        self.rows: List[Tuple[str, datetime]] = []
+        self.calls: List[Optional[datetime]] = []
+
+    def invalidate(self, user_id: str) -> None:
+        self.now += timedelta(milliseconds=1)
+        self.rows.append((user_id, self.now))
+
+    async def fetch(
+        self, last_polled_at: Optional[datetime], overlap_seconds: float
+    ) -> Tuple[List[str], datetime]:
+        self.calls.append(last_polled_at)
+        self.now += timedelta(seconds=1)
+
+        if last_polled_at is None:
+            return [], self.now
+
+        since = last_polled_at - timedelta(seconds=overlap_seconds)
+        return [
+            user_id for user_id, invalidated_at in self.rows if invalidated_at > since
+        ], self.now
+
+
+def create_window_cache(*user_ids: str) -> ConversationWindowCache:
+    window_cache = ConversationWindowCache(
+        max_users=10, ttl_seconds=60, max_bytes=1024 * 1024
+    )
+    for user_id in user_ids:
+        window_cache.start_loading(user_id)
+        window_cache.finish_loading(
+            user_id,
+            ConversationWindow(encoding_name=ENCODING_NAME, summary=None, turns=()),
+        )
+    return window_cache
+
+
+def create_poller(
+    window_cache: ConversationWindowCache, invalidations: FakeInvalidations
+) -> ConversationWindowInvalidationPoller:
+    return ConversationWindowInvalidationPoller(
+        ConversationWindowInvalidationPollerConfig(
+            poll_interval_seconds=5, overlap_seconds=0
+        ),
+        window_cache,
+        invalidations.fetch,
+    )
+
+
+@pytest.mark.asyncio
+async def test_poll_deletes_windows_of_users_saved_by_another_process():
+    window_cache = create_window_cache("user-1", "user-2")
+    invalidations = FakeInvalidations()
+    poller = create_poller(window_cache, invalidations)
+
+    # 起動前の記録は読まない
+    invalidations.invalidate("user-2")
+    assert await poller.poll() == 0
+
+    invalidations.invalidate("user-1")
+    assert await poller.poll() == 1
+
+    assert window_cache.get("user-1", ENCODING_NAME) is None
+    assert window_cache.get("user-2", ENCODING_NAME) is not None
+    # 2回目からは、前回確認したDBの時刻より後の記録だけを読む
+    assert invalidations.calls[0] is None
+    assert invalidations.calls[1] is not None
+
+
+@pytest.mark.asyncio
+async def test_poll_does_not_cache_window_loaded_before_invalidation():
+    window_cache = create_window_cache()
+    invalidations = FakeInvalidations()
+    poller = create_poller(window_cache, invalidations)
+    await poller.poll()
+
+    window_cache.start_loading("user-1")
+    invalidations.invalidate("user-1")
+    await poller.poll()
+    window_cache.finish_loading(
+        "user-1",
+        ConversationWindow(encoding_name=ENCODING_NAME, summary=None, turns=()),
+    )
+
+    assert window_cache.get("user-1", ENCODING_NAME) is None
@@ -0,0 +1,168 @@
+from typing import Optional
+from infrastructure.token_counter import TokenCounter
+from domain.message import ChatMessage
+from infrastructure.model_router import (
+    ModelRouter,
+    ModelRouterConfig,
+    model_route_decisions,
+    model_route_skips,
+)
+from tests.fakes import FakeClock, FakeEncoding
+
+PRIMARY_MODEL = "gpt-4"
+FALLBACK_MODEL = "gpt-3.5-turbo-1106"
+
+
+token_counter = TokenCounter(FakeEncoding())
+
+
+def create_router(clock: Optional[FakeClock] = None, **overrides) -> ModelRouter:
+    return ModelRouter(
+        create_config(**overrides),
+        lambda model: token_counter,
+        clock=clock or FakeClock(),
+    )
+
+
+def create_config(**overrides) -> ModelRouterConfig:
+    config = ModelRouterConfig(
+        models=[PRIMARY_MODEL, FALLBACK_MODEL],
+        completion_tokens_reserve=1000,
+        max_cost_per_request=0,
+        latency_budget_seconds=10,
+        latency_percentile=90,
+        max_error_rate=0.5,
+        min_samples=3,
+        health_window_seconds=60,
+    )
+    config.update(overrides)  # type: ignore
+    return config
+
+
+def create_messages(content: str) -> list[ChatMessage]:
+    return [
+        {"role": "system", "content": "あなたは優しいカウンセラーです。"},
+        {"role": "user", "content": content},
+    ]
+
+
+def test_routes_to_primary_model():
+    router = create_router()
+    decisions = model_route_decisions.get(model=PRIMARY_MODEL, reason="primary")
+
+    decision = router.route(create_messages("こんにちは"))
+
+    assert decision.model == PRIMARY_MODEL
+    assert decision.reason == "primary"
+    assert decision.prompt_tokens == 21
+    assert decision.fallback_models == (FALLBACK_MODEL,)
+    assert (
+        model_route_decisions.get(model=PRIMARY_MODEL, reason="primary")
+        == decisions + 1
+    )
+
+
+def test_skips_model_whose_context_window_is_too_small():
+    router = create_router()
+    skips = model_route_skips.get(model=PRIMARY_MODEL, reason="context_window")
+
+    # gpt-4 のコンテキストは8192トークン
+    decision = router.route(create_messages("a" * 8000))
+
+    assert decision.model == FALLBACK_MODEL
+    assert decision.reason == "fallback"
+    assert decision.fallback_models == ()
+    assert (
+        model_route_skips.get(model=PRIMARY_MODEL, reason="context_window") == skips + 1
+    )
+
+
+def test_skips_model_over_cost_budget():
+    router = create_router(max_cost_per_request=0.01)
+
+    decision = router.route(create_messages("こんにちは"))
+
+    assert decision.model == FALLBACK_MODEL
+
+
+def test_falls_back_when_primary_is_erroring():
+    router = create_router()
+    for succeeded in [False, False, True]:
+        router.record_result(PRIMARY_MODEL, 0.5, succeeded)
+
+    decision = router.route(create_messages("こんにちは"))
+
+    assert decision.model == FALLBACK_MODEL
+    assert decision.reason == "fallback"
+
+
+def test_returns_to_primary_once_its_failures_expire():
+    clock = FakeClock()
+    router = create_router(clock)
+    for _ in range(10):
+        router.record_result(PRIMARY_MODEL, 0.5, False)
+
+    # フォールバック先が成功し続けても、優先するモデルの失敗は残っている
+    for _ in range(1000):
+        router.record_result(FALLBACK_MODEL, 0.5, True)
+    assert router.route(create_messages("こんにちは")).model == FALLBACK_MODEL
+
+    clock.now = 61
+
+    assert router.select_model() == PRIMARY_MODEL
+    decision = router.route(create_messages("こんにちは"))
+    assert decision.model == PRIMARY_MODEL
+    assert decision.reason == "primary"
+
+
+def test_falls_back_when_primary_is_slow():
+    router = create_router()
+    for _ in range(3):
+        router.record_result(PRIMARY_MODEL, 15, True)
+
+    decision = router.route(create_messages("こんにちは"))
+
+    assert decision.model == FALLBACK_MODEL
+
+
+def test_uses_degraded_model_when_every_model_is_unhealthy():
+    router = create_router()
+    for model in [PRIMARY_MODEL, FALLBACK_MODEL]:
+        for _ in range(3):
+            router.record_result(model, 0.5, False)
+
+    decision = router.route(create_messages("こんにちは"))
+
+    assert decision.model == PRIMARY_MODEL
+    assert decision.reason == "degraded"
+    assert decision.fallback_models == (FALLBACK_MODEL,)
+
+
+def test_selects_primary_model_before_creating_prompt():
+    router = create_router()
+
+    assert router.select_model() == PRIMARY_MODEL
+    # gpt-4 のコンテキストから生成するメッセージの分を除いたトークン数
+    assert router.max_prompt_tokens(PRIMARY_MODEL) == 7192
+
+
+def test_selects_fallback_model_when_primary_is_erroring():
+    router = create_router()
+    for succeeded in [False, False, True]:
+        router.record_result(PRIMARY_MODEL, 0.5, succeeded)
+
+    model = router.select_model()
+
+    assert model == FALLBACK_MODEL
+    # 選んだモデルの上限に収まるプロンプトは、route でも同じモデルに割り当てられる
+    prompt = create_messages("a" * (router.max_prompt_tokens(model) - 100))
+    assert router.route(prompt).model == FALLBACK_MODEL
+
+
+def test_limits_prompt_tokens_by_cost_budget():
+    router = create_router(max_cost_per_request=0.01)
+
+    # gpt-4 は生成するメッセージの分だけで上限を超えるので選ばない
+    assert router.select_model() == FALLBACK_MODEL
+    # (0.01 * 1000 - 1000 * 0.002) / 0.001
+    assert router.max_prompt_tokens(FALLBACK_MODEL) == 8000
@@ -0,0 +1,216 @@
+import asyncio
+from typing import List, Tuple
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+from infrastructure.openai_call_policy import (
+    CircuitBreaker,
+    CircuitOpenError,
+    OpenAiCallPolicy,
+    OpenAiCallPolicyConfig,
+    OpenAiUnavailableError,
+    openai_circuit_open,
+)
+from tests.fakes import FakeClock, FakeOpenAiServer
+
+# (ステータスコード, ヘッダー, 応答までの秒数)
+FakeResponse = Tuple[int, dict, float]
+
+
+class ScriptedOpenAiServer(FakeOpenAiServer):
+    """
+    用意した応答を順番に返す。用意した応答がなくなったら成功を返す。
+    """
+
+    def __init__(self, responses: List[FakeResponse]) -> None:
+        self.responses = responses
+        self.requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        status_code, headers, delay = (
+            self.responses.pop(0) if self.responses else (200, {}, 0)
+        )
+
+        await asyncio.sleep(delay)
+
+        if status_code != 200:
+            return self.create_error_response(status_code, headers)
+
+        return self.create_chat_completion_response(
+            f"chatcmpl-{self.requests}", "gpt-4-1106-preview", "こんにちは"
+        )
+
+
+def create_config(**overrides) -> OpenAiCallPolicyConfig:
+    config = OpenAiCallPolicyConfig(
+        attempt_timeout=1,
+        overall_timeout=5,
+        max_retries=2,
+        backoff_base=0.5,
+        backoff_max=8,
+        hedge_enabled=False,
+        hedge_percentile=95,
+        hedge_min_samples=20,
+        circuit_failure_threshold=5,
+        circuit_reset_timeout=30,
+    )
+    config.update(overrides)  # type: ignore
+    return config
+
+
+class RecordingSleep:
+    def __init__(self) -> None:
+        self.delays: List[float] = []
+
+    async def __call__(self, delay: float) -> None:
+        self.delays.append(delay)
+
+
+def create_completion(client: AsyncOpenAI):
+    return lambda: client.chat.completions.create(
+        model="gpt-4-1106-preview",
+        messages=[{"role": "user", "content": "こんにちは"}],
+    )
+
+
+@pytest.mark.asyncio
+async def test_retries_server_errors_with_jittered_backoff():
+    server = ScriptedOpenAiServer([(500, {}, 0), (503, {}, 0)])
+    sleep = RecordingSleep()
+    policy = OpenAiCallPolicy(create_config(), sleep=sleep)
+
+    response = await policy.call(create_completion(server.create_client()))
+
+    assert response.choices[0].message.content == "こんにちは"
+    assert server.requests == 3
+    assert len(sleep.delays) == 2
+    assert 0 <= sleep.delays[0] <= 0.5
+    assert 0 <= sleep.delays[1] <= 1
+
+
+@pytest.mark.asyncio
+async def test_honors_retry_after():
+    server = ScriptedOpenAiServer(
+        [(429, {"retry-after": "2"}, 0), (429, {"retry-after-ms": "150"}, 0)]
+    )
+    sleep = RecordingSleep()
+    policy = OpenAiCallPolicy(create_config(), sleep=sleep)
+
+    await policy.call(create_completion(server.create_client()))
+
+    assert sleep.delays == [2, 0.15]
+
+
+@pytest.mark.asyncio
+async def test_gives_up_when_retry_after_exceeds_deadline():
+    server = ScriptedOpenAiServer([(429, {"retry-after": "10"}, 0)])
+    policy = OpenAiCallPolicy(create_config(), sleep=RecordingSleep())
+
+    with pytest.raises(OpenAiUnavailableError):
+        await policy.call(create_completion(server.create_client()))
+
+    assert server.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_does_not_retry_client_errors():
+    server = ScriptedOpenAiServer([(400, {}, 0)])
+    policy = OpenAiCallPolicy(create_config(), sleep=RecordingSleep())
+
+    with pytest.raises(openai.BadRequestError):
+        await policy.call(create_completion(server.create_client()))
+
+    assert server.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_retries_attempt_timeout():
+    server = ScriptedOpenAiServer([(200, {}, 1)])
+    policy = OpenAiCallPolicy(
+        create_config(attempt_timeout=0.05), sleep=RecordingSleep()
+    )
+
+    response = await policy.call(create_completion(server.create_client()))
+
+    assert response.id == "chatcmpl-2"
+    assert server.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_and_recovers():
+    server = ScriptedOpenAiServer([(500, {}, 0)] * 4)
+    clock = FakeClock()
+    policy = OpenAiCallPolicy(
+        create_config(max_retries=1),
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=2, reset_timeout=30, clock=clock
+        ),
+        sleep=RecordingSleep(),
+    )
+    client = server.create_client()
+
+    for _ in range(2):
+        with pytest.raises(OpenAiUnavailableError):
+            await policy.call(create_completion(client))
+
+    assert policy.circuit_breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        await policy.call(create_completion(client))
+
+    assert server.requests == 4
+
+    clock.now = 30
+
+    assert policy.circuit_breaker.state == "half_open"
+
+    await policy.call(create_completion(client))
+
+    assert policy.circuit_breaker.state == "closed"
+    assert server.requests == 5
+
+
+def test_circuit_breaker_reports_state_per_model():
+    opened = CircuitBreaker(failure_threshold=1, reset_timeout=30, model="model-a")
+    closed = CircuitBreaker(failure_threshold=1, reset_timeout=30, model="model-b")
+
+    opened.record_failure()
+    closed.record_success()
+
+    # 別のモデルのサーキットブレーカーが閉じても、開いている状態を上書きしない
+    assert openai_circuit_open.get(model="model-a") == 1
+    assert openai_circuit_open.get(model="model-b") == 0
+
+
+@pytest.mark.asyncio
+async def test_hedges_slow_requests():
+    server = ScriptedOpenAiServer([(200, {}, 1)])
+    policy = OpenAiCallPolicy(
+        create_config(hedge_enabled=True, hedge_min_samples=3),
+        sleep=RecordingSleep(),
+    )
+    for _ in range(3):
+        policy.latencies.record(0.01)
+
+    response = await asyncio.wait_for(
+        policy.call(create_completion(server.create_client())), timeout=0.5
+    )
+
+    assert response.id == "chatcmpl-2"
+    assert server.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_does_not_hedge_without_enough_samples():
+    server = ScriptedOpenAiServer([(200, {}, 0.05)])
+    policy = OpenAiCallPolicy(
+        create_config(hedge_enabled=True, hedge_min_samples=3),
+        sleep=RecordingSleep(),
+    )
+
+    response = await policy.call(create_completion(server.create_client()))
+
+    assert response.id == "chatcmpl-1"
+    assert server.requests == 1
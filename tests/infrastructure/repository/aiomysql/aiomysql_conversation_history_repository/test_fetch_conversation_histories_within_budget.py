@@ -0,0 +1,69 @@
+import pytest
+from typing import Tuple
+from aiomysql import Connection
+from tests.db.create_and_setup_db_connection import create_and_setup_db_connection
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    AiomysqlConversationHistoryRepository,
+)
+
+USER_ID = "Uaxxxxxxxxxxxxxxxxxxxxxxxxxxx0001"
+
+
+@pytest.fixture
+async def create_test_db_connection() -> Tuple[Connection, str]:
+    connection, test_db_name = await create_and_setup_db_connection()
+
+    async with connection.cursor() as cursor:
+        await cursor.execute("TRUNCATE TABLE conversation_histories")
+
+        # 1往復あたり200トークンの会話と、トークン数が保存されていない会話
+        await cursor.executemany(
+            """
+            INSERT INTO
+              conversation_histories
+              (user_id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding)
+            VALUES
+              (%s, %s, %s, %s, %s, %s)
+            """,
+            [
+                (USER_ID, f"メッセージ{index}", f"応答{index}", 100, 100, "cl100k_base")
+                for index in range(1, 5)
+            ]
+            + [(USER_ID, "メッセージ5", "応答5", None, None, None)],
+        )
+    await connection.commit()
+
+    return connection, test_db_name
+
+
+@pytest.mark.asyncio
+async def test_fetch_conversation_histories_within_budget(create_test_db_connection):
+    connection, test_db_name = await create_test_db_connection
+
+    repository = AiomysqlConversationHistoryRepository(connection, 500)
+
+    rows = await repository._fetch_conversation_histories_within_budget(
+        USER_ID, 10, "cl100k_base"
+    )
+
+    # トークン数が保存されていない行は0トークンとして扱い、500トークンに収まる2往復分まで取得する
+    assert [row["user_message"] for row in rows] == [
+        "メッセージ5",
+        "メッセージ4",
+        "メッセージ3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_fetch_conversation_histories_within_budget_with_limit(
+    create_test_db_connection,
+):
+    connection, test_db_name = await create_test_db_connection
+
+    repository = AiomysqlConversationHistoryRepository(connection, 10000)
+
+    rows = await repository._fetch_conversation_histories_within_budget(
+        USER_ID, 2, "cl100k_base"
+    )
+
+    assert [row["user_message"] for row in rows] == ["メッセージ5", "メッセージ4"]
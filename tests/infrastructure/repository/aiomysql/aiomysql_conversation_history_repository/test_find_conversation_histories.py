@@ -0,0 +1,80 @@
+import pytest
+from typing import Tuple
+from aiomysql import Connection
+from tests.db.create_and_setup_db_connection import create_and_setup_db_connection
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    AiomysqlConversationHistoryRepository,
+    FindConversationHistoriesDto,
+)
+
+
+@pytest.fixture
+async def create_test_db_connection() -> Tuple[Connection, str]:
+    connection, test_db_name = await create_and_setup_db_connection()
+
+    async with connection.cursor() as cursor:
+        await cursor.execute("TRUNCATE TABLE conversation_histories")
+
+        await cursor.executemany(
+            """
+            INSERT INTO
+              conversation_histories
+              (user_id, user_message, ai_message)
+            VALUES
+              (%s, %s, %s)
+            """,
+            [
+                (
+                    user_id,
+                    f"こんにちは、私の悩みを聞いてください❗{index}",
+                    f"もちろんです。何でもお話ください❗{index}",
+                )
+                for index in range(1, 6)
+                for user_id in [
+                    "Uaxxxxxxxxxxxxxxxxxxxxxxxxxxx0001",
+                    "Uaxxxxxxxxxxxxxxxxxxxxxxxxxxx0002",
+                ]
+            ],
+        )
+    await connection.commit()
+
+    return connection, test_db_name
+
+
+@pytest.mark.asyncio
+async def test_find_conversation_histories(create_test_db_connection):
+    connection, test_db_name = await create_test_db_connection
+
+    user_id = "Uaxxxxxxxxxxxxxxxxxxxxxxxxxxx0001"
+
+    repository = AiomysqlConversationHistoryRepository(connection)
+
+    first_page = await repository.find_conversation_histories(
+        FindConversationHistoriesDto(user_id=user_id, last_seen_id=None, limit=2)
+    )
+
+    assert [history["user_message"] for history in first_page] == [
+        "こんにちは、私の悩みを聞いてください❗5",
+        "こんにちは、私の悩みを聞いてください❗4",
+    ]
+
+    second_page = await repository.find_conversation_histories(
+        FindConversationHistoriesDto(
+            user_id=user_id, last_seen_id=first_page[-1]["id"], limit=2
+        )
+    )
+
+    assert [history["user_message"] for history in second_page] == [
+        "こんにちは、私の悩みを聞いてください❗3",
+        "こんにちは、私の悩みを聞いてください❗2",
+    ]
+
+    last_page = await repository.find_conversation_histories(
+        FindConversationHistoriesDto(
+            user_id=user_id, last_seen_id=second_page[-1]["id"], limit=2
+        )
+    )
+
+    assert [history["ai_message"] for history in last_page] == [
+        "もちろんです。何でもお話ください❗1",
+    ]
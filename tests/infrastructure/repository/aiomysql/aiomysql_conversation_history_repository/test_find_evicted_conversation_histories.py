@@ -0,0 +1,125 @@
+import pytest
+from typing import Tuple
+from aiomysql import Connection
+from tests.db.create_and_setup_db_connection import create_and_setup_db_connection
+from domain.prompt import COUNSELOR_PROMPT_NAME, get_prompt
+from infrastructure.token_counter import get_token_counter
+from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
+    AiomysqlConversationHistoryRepository,
+    FindEvictedConversationHistoriesDto,
+    get_token_count_model,
+)
+
+USER_ID = "Uaxxxxxxxxxxxxxxxxxxxxxxxxxxx0001"
+
+
+def calculate_max_token_limit(turns: int) -> int:
+    """
+    systemメッセージと新しいメッセージ（直近の最も長いユーザーのメッセージと同じ100トークン）の分に加えて、
+    turns 往復分の会話が収まるトークン数の上限。
+    """
+    prompt = get_prompt(COUNSELOR_PROMPT_NAME)
+    prompt_tokens = prompt.count_tokens(get_token_counter(get_token_count_model()))
+    return prompt_tokens + 100 + 200 * turns
+
+
+@pytest.fixture
+async def create_test_db_connection() -> Tuple[Connection, str]:
+    connection, test_db_name = await create_and_setup_db_connection()
+
+    async with connection.cursor() as cursor:
+        await cursor.execute("TRUNCATE TABLE conversation_histories")
+        await cursor.execute("TRUNCATE TABLE conversation_summaries")
+
+        # 1往復あたり200トークンの会話
+        await cursor.executemany(
+            """
+            INSERT INTO
+              conversation_histories
+              (user_id, user_message, ai_message, user_message_tokens, ai_message_tokens, token_encoding)
+            VALUES
+              (%s, %s, %s, %s, %s, %s)
+            """,
+            [
+                (USER_ID, f"メッセージ{index}", f"応答{index}", 100, 100, "cl100k_base")
+                for index in range(1, 6)
+            ],
+        )
+    await connection.commit()
+
+    return connection, test_db_name
+
+
+@pytest.mark.asyncio
+async def test_find_evicted_conversation_histories_outside_token_limit(
+    create_test_db_connection,
+):
+    connection, test_db_name = await create_test_db_connection
+
+    # 件数の上限には収まるが、トークン数の上限には直近の2往復分しか収まらない
+    repository = AiomysqlConversationHistoryRepository(
+        connection, calculate_max_token_limit(2), history_depth=10
+    )
+
+    histories = await repository.find_evicted_conversation_histories(
+        FindEvictedConversationHistoriesDto(user_id=USER_ID, after_id=0, limit=10)
+    )
+
+    assert [history["user_message"] for history in histories] == [
+        "メッセージ1",
+        "メッセージ2",
+        "メッセージ3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_find_evicted_conversation_histories_pushed_out_by_summary(
+    create_test_db_connection,
+):
+    connection, test_db_name = await create_test_db_connection
+
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            """
+            INSERT INTO
+              conversation_summaries
+              (user_id, summary, summary_tokens, token_encoding, last_summarized_history_id)
+            VALUES
+              (%s, %s, %s, %s, %s)
+            """,
+            (USER_ID, "要約", 200, "cl100k_base", 0),
+        )
+    await connection.commit()
+
+    # プロンプトに含める時と同じく要約の分を除くので、直近の1往復分しか収まらない
+    repository = AiomysqlConversationHistoryRepository(
+        connection, calculate_max_token_limit(2), history_depth=10
+    )
+
+    histories = await repository.find_evicted_conversation_histories(
+        FindEvictedConversationHistoriesDto(user_id=USER_ID, after_id=0, limit=10)
+    )
+
+    assert [history["user_message"] for history in histories] == [
+        "メッセージ1",
+        "メッセージ2",
+        "メッセージ3",
+        "メッセージ4",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_find_evicted_conversation_histories_outside_history_depth(
+    create_test_db_connection,
+):
+    connection, test_db_name = await create_test_db_connection
+
+    repository = AiomysqlConversationHistoryRepository(
+        connection, 10000, history_depth=4
+    )
+
+    histories = await repository.find_evicted_conversation_histories(
+        FindEvictedConversationHistoriesDto(user_id=USER_ID, after_id=0, limit=10)
+    )
+
+    assert [history["user_message"] for history in histories] == ["メッセージ1"]
@@ -1,11 +1,25 @@
 import pytest
-from typing import Tuple
+from typing import Any, List, Tuple
 from aiomysql import Connection
 from tests.db.create_and_setup_db_connection import create_and_setup_db_connection
+from infrastructure.token_counter import TokenCounter
+from infrastructure.repository.aiomysql import aiomysql_conversation_history_repository
 from infrastructure.repository.aiomysql.aiomysql_conversation_history_repository import (
     AiomysqlConversationHistoryRepository,
     SaveConversationHistoryDto,
 )
+from infrastructure.repository.aiomysql.aiomysql_db_handler import AiomysqlDbHandler
+from infrastructure.conversation_window_cache import (
+    ConversationWindow,
+    ConversationWindowCache,
+)
+from infrastructure.conversation_history_writer import (
+    ConversationHistoryWriter,
+    ConversationHistoryWriterConfig,
+    UnsavedConversationHistory,
+)
+from infrastructure.ttl_lru_cache import TtlLruCache
+from tests.fakes import FakeEncoding
 
 
 @pytest.fixture
@@ -29,6 +43,7 @@ async def test_save_conversation_history(create_test_db_connection):
         user_id=user_id,
         user_message="こんにちは私の悩みを聞いてください。",
         ai_message="こんにちは。お話しできることを嬉しく思います。どのようなことでお悩みですか？",
+        processed_request=None,
     )
 
     repository = AiomysqlConversationHistoryRepository(connection)
@@ -49,3 +64,211 @@ async def test_save_conversation_history(create_test_db_connection):
     assert result["user_id"] == user_id
     assert result["user_message"] == dto.get("user_message")
     assert result["ai_message"] == dto.get("ai_message")
+    assert result["user_message_tokens"] > 0
+    assert result["ai_message_tokens"] > 0
+    assert result["token_encoding"] == "cl100k_base"
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakeConnection") -> None:
+        self.connection = connection
+
+    async def __aenter__(self) -> "FakeCursor":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        return None
+
+    async def execute(self, sql: str, args: Any) -> None:
+        self.connection.calls.append(" ".join(sql.split()).split(" (")[0])
+
+    async def fetchall(self) -> List[dict]:
+        return []
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.calls: List[str] = []
+
+    async def begin(self) -> None:
+        self.calls.append("begin")
+
+    async def commit(self) -> None:
+        self.calls.append("commit")
+
+    async def rollback(self) -> None:
+        self.calls.append("rollback")
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+
+@pytest.fixture
+def fake_token_counter(monkeypatch) -> None:
+    monkeypatch.setattr(
+        aiomysql_conversation_history_repository,
+        "get_token_counter",
+        lambda model: TokenCounter(FakeEncoding()),
+    )
+
+
+def create_writer(
+    spool_path: str, inserted: List[List[UnsavedConversationHistory]]
+) -> ConversationHistoryWriter:
+    async def insert_rows(rows: List[UnsavedConversationHistory]) -> None:
+        inserted.append(rows)
+
+    return ConversationHistoryWriter(
+        ConversationHistoryWriterConfig(
+            max_batch_size=10,
+            flush_interval_seconds=60,
+            max_pending=10,
+            spool_path=spool_path,
+        ),
+        insert_rows,
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_conversation_history_updates_window_cache_after_commit(
+    fake_token_counter,
+):
+    user_id = "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+    connection = FakeConnection()
+    db_handler = AiomysqlDbHandler(connection)
+    window_cache = ConversationWindowCache(
+        max_users=10, ttl_seconds=60, max_bytes=1024 * 1024
+    )
+    window_cache.start_loading(user_id)
+    window_cache.finish_loading(user_id, ConversationWindow("fake", None, ()))
+
+    repository = AiomysqlConversationHistoryRepository(
+        connection, window_cache=window_cache, db_handler=db_handler
+    )
+
+    await db_handler.begin()
+    await repository.save_conversation_history(
+        SaveConversationHistoryDto(
+            user_id=user_id,
+            user_message="ロールバック",
+            ai_message="されます",
+            processed_request=None,
+        )
+    )
+    await db_handler.rollback()
+
+    assert window_cache.get(user_id, "fake").turns == ()
+
+    await db_handler.begin()
+    await repository.save_conversation_history(
+        SaveConversationHistoryDto(
+            user_id=user_id,
+            user_message="コミット",
+            ai_message="されます",
+            processed_request=None,
+        )
+    )
+
+    assert window_cache.get(user_id, "fake").turns == ()
+
+    await db_handler.commit()
+
+    assert [
+        turn["user_message"] for turn in window_cache.get(user_id, "fake").turns
+    ] == ["コミット"]
+
+
+@pytest.mark.asyncio
+async def test_save_conversation_history_hands_turn_to_writer_after_commit(
+    fake_token_counter, tmp_path
+):
+    user_id = "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+    connection = FakeConnection()
+    db_handler = AiomysqlDbHandler(connection)
+    inserted: List[List[UnsavedConversationHistory]] = []
+    writer = create_writer(str(tmp_path / "spool"), inserted)
+    writer.start()
+    processed_request_cache = TtlLruCache(
+        "processed_request", max_entries=10, ttl_seconds=60
+    )
+
+    repository = AiomysqlConversationHistoryRepository(
+        connection,
+        writer=writer,
+        db_handler=db_handler,
+        processed_request_cache=processed_request_cache,
+    )
+    dto = SaveConversationHistoryDto(
+        user_id=user_id,
+        user_message="こんにちは",
+        ai_message="こんにちは。",
+        processed_request={"request_id": "request-1", "ai_response_id": "chatcmpl-1"},
+    )
+
+    await db_handler.begin()
+    await repository.save_conversation_history(dto)
+    await db_handler.rollback()
+
+    assert writer.find_unsaved(user_id) == []
+    assert processed_request_cache.get((user_id, "request-1")) is None
+
+    await db_handler.begin()
+    await repository.save_conversation_history(dto)
+
+    assert writer.find_unsaved(user_id) == []
+
+    await db_handler.commit()
+
+    assert [
+        (row["request_id"], row["ai_response_id"])
+        for row in writer.find_unsaved(user_id)
+    ] == [("request-1", "chatcmpl-1")]
+    assert processed_request_cache.get((user_id, "request-1")) == {
+        "ai_response_id": "chatcmpl-1",
+        "message": "こんにちは。",
+    }
+    # トランザクションの中ではDBに書き込まない
+    assert connection.calls == ["begin", "rollback", "begin", "commit"]
+
+    await writer.close(timeout=1)
+
+    assert [[row["request_id"] for row in rows] for rows in inserted] == [["request-1"]]
+
+
+@pytest.mark.asyncio
+async def test_save_conversation_history_inserts_after_commit_when_writer_rejects(
+    fake_token_counter, tmp_path
+):
+    connection = FakeConnection()
+    db_handler = AiomysqlDbHandler(connection)
+    # 起動していない writer は会話を受け付けない
+    writer = create_writer(str(tmp_path / "spool"), [])
+
+    repository = AiomysqlConversationHistoryRepository(
+        connection, writer=writer, db_handler=db_handler
+    )
+
+    await db_handler.begin()
+    await repository.save_conversation_history(
+        SaveConversationHistoryDto(
+            user_id="Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+            user_message="こんにちは",
+            ai_message="こんにちは。",
+            processed_request={
+                "request_id": "request-1",
+                "ai_response_id": "chatcmpl-1",
+            },
+        )
+    )
+    await db_handler.commit()
+
+    # 会話と処理済みのリクエストを、コミットした後に別のトランザクションでまとめて保存する
+    assert connection.calls == [
+        "begin",
+        "commit",
+        "begin",
+        "SELECT user_id, request_id FROM processed_requests WHERE",
+        "INSERT INTO processed_requests",
+        "INSERT INTO conversation_histories",
+        "commit",
+    ]
@@ -0,0 +1,98 @@
+import pytest
+from typing import List
+from infrastructure.repository.aiomysql.aiomysql_db_handler import (
+    AiomysqlDbHandler,
+    run_after_commit,
+)
+
+
+class FakeConnection:
+    def __init__(self, fail_commit: bool = False) -> None:
+        self.fail_commit = fail_commit
+        self.calls: List[str] = []
+
+    async def begin(self) -> None:
+        self.calls.append("begin")
+
+    async def commit(self) -> None:
+        if self.fail_commit:
+            raise ConnectionError("lost connection")
+        self.calls.append("commit")
+
+    async def rollback(self) -> None:
+        self.calls.append("rollback")
+
+
+@pytest.mark.asyncio
+async def test_after_commit_runs_callbacks_in_order_after_commit():
+    connection = FakeConnection()
+    db_handler = AiomysqlDbHandler(connection)
+
+    async def first() -> None:
+        connection.calls.append("first")
+
+    async def second() -> None:
+        connection.calls.append("second")
+
+    await db_handler.begin()
+    db_handler.after_commit(first)
+    db_handler.after_commit(second)
+    await db_handler.commit()
+
+    assert connection.calls == ["begin", "commit", "first", "second"]
+
+    # 次のトランザクションでは呼び出さない
+    await db_handler.begin()
+    await db_handler.commit()
+
+    assert connection.calls[-2:] == ["begin", "commit"]
+
+
+@pytest.mark.asyncio
+async def test_after_commit_does_not_run_callbacks_on_rollback():
+    connection = FakeConnection()
+    db_handler = AiomysqlDbHandler(connection)
+    called: List[str] = []
+
+    async def callback() -> None:
+        called.append("callback")
+
+    await db_handler.begin()
+    db_handler.after_commit(callback)
+    await db_handler.rollback()
+
+    await db_handler.begin()
+    await db_handler.commit()
+
+    assert called == []
+
+
+@pytest.mark.asyncio
+async def test_after_commit_does_not_run_callbacks_when_commit_fails():
+    db_handler = AiomysqlDbHandler(FakeConnection(fail_commit=True))
+    called: List[str] = []
+
+    async def callback() -> None:
+        called.append("callback")
+
+    await db_handler.begin()
+    db_handler.after_commit(callback)
+
+    with pytest.raises(ConnectionError):
+        await db_handler.commit()
+
+    await db_handler.rollback()
+
+    assert called == []
+
+
+@pytest.mark.asyncio
+async def test_run_after_commit_without_db_handler_runs_immediately():
+    called: List[str] = []
+
+    async def callback() -> None:
+        called.append("callback")
+
+    await run_after_commit(None, callback)
+
+    assert called == ["callback"]
@@ -0,0 +1,58 @@
+import pytest
+from typing import List
+from infrastructure.conversation_history_writer import (
+    ConversationHistoryWriter,
+    ConversationHistoryWriterConfig,
+    UnsavedConversationHistory,
+    create_unsaved_conversation_history,
+)
+from infrastructure.repository.aiomysql.aiomysql_processed_request_repository import (
+    AiomysqlProcessedRequestRepository,
+)
+
+USER_ID = "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+
+
+class UnreachableConnection:
+    def cursor(self):
+        raise AssertionError("the db must not be read")
+
+
+@pytest.mark.asyncio
+async def test_find_processed_request_returns_request_not_yet_written(tmp_path):
+    async def insert_rows(rows: List[UnsavedConversationHistory]) -> None:
+        return None
+
+    writer = ConversationHistoryWriter(
+        ConversationHistoryWriterConfig(
+            max_batch_size=10,
+            flush_interval_seconds=60,
+            max_pending=10,
+            spool_path=str(tmp_path / "spool"),
+        ),
+        insert_rows,
+    )
+    writer.start()
+    writer.enqueue(
+        create_unsaved_conversation_history(
+            user_id=USER_ID,
+            user_message="こんにちは",
+            ai_message="こんにちは。",
+            user_message_tokens=1,
+            ai_message_tokens=1,
+            token_encoding="cl100k_base",
+            request_id="request-1",
+            ai_response_id="chatcmpl-1",
+        )
+    )
+
+    repository = AiomysqlProcessedRequestRepository(
+        UnreachableConnection(), writer=writer
+    )
+
+    # 会話履歴と一緒にDBへ保存される前に再送されても、保存した応答を返す
+    assert await repository.find_processed_request(
+        {"user_id": USER_ID, "request_id": "request-1"}
+    ) == {"ai_response_id": "chatcmpl-1", "message": "こんにちは。"}
+
+    await writer.close(timeout=1)
@@ -0,0 +1,105 @@
+from typing import AsyncIterator
+import pytest
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryDto,
+    GenerateMessageResult,
+    GenerateMessageStreamChunk,
+)
+from infrastructure.response_cache import ResponseCache, ResponseCacheConfig
+from infrastructure.repository.cache.cached_generate_message_repository import (
+    CachedGenerateMessageRepository,
+)
+
+
+class FakeGenerateMessageRepository:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        self.calls += 1
+        return {"ai_response_id": f"chatcmpl-{self.calls}", "message": "こんにちは。"}
+
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        self.calls += 1
+        for delta in ["こんにちは", "。"]:
+            yield {"ai_response_id": f"chatcmpl-{self.calls}", "delta": delta}
+
+
+def create_repository(
+    repository: FakeGenerateMessageRepository,
+) -> CachedGenerateMessageRepository:
+    cache = ResponseCache(
+        ResponseCacheConfig(
+            max_entries=10,
+            ttl_seconds=60,
+            max_bytes=1024 * 1024,
+            similarity_enabled=False,
+            similarity_threshold=0.8,
+            similarity_max_candidates=10,
+        ),
+        {"models": ["gpt-4-1106-preview"], "temperature": 0.7},
+    )
+    return CachedGenerateMessageRepository(repository, cache)
+
+
+def create_dto(bypass_cache: bool = False) -> GenerateMessageRepositoryDto:
+    return {
+        "user_id": "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+        "chat_messages": [{"role": "user", "content": "こんにちは"}],
+        "bypass_cache": bypass_cache,
+    }
+
+
+@pytest.mark.asyncio
+async def test_generate_message_returns_cached_response():
+    inner = FakeGenerateMessageRepository()
+    repository = create_repository(inner)
+
+    first = await repository.generate_message(create_dto())
+    second = await repository.generate_message(create_dto())
+
+    assert first == second == {"ai_response_id": "chatcmpl-1", "message": "こんにちは。"}
+    assert inner.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_generate_message_bypasses_cache():
+    inner = FakeGenerateMessageRepository()
+    repository = create_repository(inner)
+
+    await repository.generate_message(create_dto())
+    result = await repository.generate_message(create_dto(bypass_cache=True))
+
+    assert result["ai_response_id"] == "chatcmpl-2"
+    assert inner.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_generate_message_stream_returns_cached_response():
+    inner = FakeGenerateMessageRepository()
+    repository = create_repository(inner)
+
+    first = [chunk async for chunk in repository.generate_message_stream(create_dto())]
+    second = [chunk async for chunk in repository.generate_message_stream(create_dto())]
+
+    assert [chunk["delta"] for chunk in first] == ["こんにちは", "。"]
+    assert second == [{"ai_response_id": "chatcmpl-1", "delta": "こんにちは。"}]
+    assert inner.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_generate_message_stream_does_not_cache_interrupted_response():
+    inner = FakeGenerateMessageRepository()
+    repository = create_repository(inner)
+
+    stream = repository.generate_message_stream(create_dto())
+    await stream.__anext__()
+    await stream.aclose()
+
+    await repository.generate_message(create_dto())
+
+    assert inner.calls == 2
@@ -0,0 +1,97 @@
+import json
+import pytest
+from pathlib import Path
+from typing import AsyncIterator
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryDto,
+    GenerateMessageResult,
+    GenerateMessageStreamChunk,
+    GenerateMessageUnavailableError,
+)
+from infrastructure.repository.local.local_batch_completion_repository import (
+    LocalBatchCompletionRepository,
+)
+
+
+class FakeGenerateMessageRepository:
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        if dto["user_id"] == "unavailable":
+            raise GenerateMessageUnavailableError("circuit open")
+
+        return {
+            "ai_response_id": f"chatcmpl-{dto['user_id']}",
+            "message": f"{dto['chat_messages'][-1]['content']}への応答",
+        }
+
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        raise NotImplementedError
+        yield
+
+
+@pytest.mark.asyncio
+async def test_submit_batch_writes_batch_api_files_and_returns_results(
+    tmp_path: Path,
+) -> None:
+    repository = LocalBatchCompletionRepository(
+        FakeGenerateMessageRepository(), input_dir=str(tmp_path)
+    )
+
+    batch_id = await repository.submit_batch(
+        {
+            "job_id": "job-1",
+            "requests": [
+                {
+                    "custom_id": "00000000",
+                    "user_id": "user-1",
+                    "chat_messages": [{"role": "user", "content": "おはよう"}],
+                },
+                {
+                    "custom_id": "00000001",
+                    "user_id": "unavailable",
+                    "chat_messages": [{"role": "user", "content": "こんにちは"}],
+                },
+            ],
+        }
+    )
+
+    input_lines = (tmp_path / "job-1.input.jsonl").read_text().splitlines()
+    assert json.loads(input_lines[0]) == {
+        "custom_id": "00000000",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": "local",
+            "messages": [{"role": "user", "content": "おはよう"}],
+            "temperature": 0.7,
+            "user": "user-1",
+        },
+    }
+
+    batch = await repository.retrieve_batch(batch_id)
+    assert batch["status"] == "completed"
+    assert batch["output_file_id"] is not None
+
+    results = await repository.find_batch_results(batch["output_file_id"])
+    assert results == [
+        {
+            "custom_id": "00000000",
+            "ai_response_id": "chatcmpl-user-1",
+            "message": "おはようへの応答",
+        },
+        {"custom_id": "00000001", "ai_response_id": "", "message": None},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_batch_fails_for_an_unknown_batch(tmp_path: Path) -> None:
+    repository = LocalBatchCompletionRepository(
+        FakeGenerateMessageRepository(), input_dir=str(tmp_path)
+    )
+
+    batch = await repository.retrieve_batch("local-unknown")
+
+    assert batch["status"] == "failed"
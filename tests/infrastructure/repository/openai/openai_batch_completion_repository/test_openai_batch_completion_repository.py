@@ -0,0 +1,183 @@
+import json
+from pathlib import Path
+from typing import Dict, List
+import httpx
+import pytest
+from infrastructure.model_router import ModelRouter, ModelRouterConfig
+from infrastructure.token_counter import TokenCounter
+from infrastructure.repository.openai.openai_batch_completion_repository import (
+    OpenAiBatchCompletionRepository,
+)
+from tests.fakes import FakeEncoding, FakeOpenAiServer
+
+PRIMARY_MODEL = "gpt-4-1106-preview"
+
+OUTPUT_LINES = [
+    {
+        "id": "batch_req_1",
+        "custom_id": "00000001",
+        "response": {
+            "status_code": 200,
+            "body": {
+                "id": "chatcmpl-2",
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": "応答2"}}
+                ],
+            },
+        },
+        "error": None,
+    },
+    {
+        "id": "batch_req_2",
+        "custom_id": "00000000",
+        "response": {"status_code": 429, "body": {"error": {"message": "limit"}}},
+        "error": None,
+    },
+]
+
+
+class BatchOpenAiServer(FakeOpenAiServer):
+    """
+    Files APIとBatch APIの応答を返す。retrieve は batch_statuses の順にステータスを返す。
+    """
+
+    def __init__(self, batch_statuses: List[Dict]) -> None:
+        self.batch_statuses = batch_statuses
+        self.uploaded: List[bytes] = []
+        self.created_batches: List[Dict] = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+
+        if request.method == "POST" and path == "/v1/files":
+            self.uploaded.append(request.content)
+            return httpx.Response(
+                200,
+                json={
+                    "id": "file-input",
+                    "object": "file",
+                    "bytes": 0,
+                    "created_at": 0,
+                    "filename": "job-1.input.jsonl",
+                    "purpose": "batch",
+                    "status": "uploaded",
+                },
+            )
+
+        if request.method == "POST" and path == "/v1/batches":
+            self.created_batches.append(json.loads(request.content))
+            return httpx.Response(200, json={"id": "batch_1", "status": "validating"})
+
+        if path == "/v1/batches/batch_1":
+            return httpx.Response(200, json=self.batch_statuses.pop(0))
+
+        if path == "/v1/files/file-output/content":
+            return httpx.Response(
+                200,
+                content="\n".join(json.dumps(line) for line in OUTPUT_LINES) + "\n",
+            )
+
+        return httpx.Response(404, json={"error": {"message": "not found"}})
+
+
+def create_repository(
+    server: BatchOpenAiServer, input_dir: Path
+) -> OpenAiBatchCompletionRepository:
+    return OpenAiBatchCompletionRepository(
+        client=server.create_client(),
+        model_router=ModelRouter(
+            ModelRouterConfig(
+                models=[PRIMARY_MODEL],
+                completion_tokens_reserve=1000,
+                max_cost_per_request=0,
+                latency_budget_seconds=10,
+                latency_percentile=90,
+                max_error_rate=0.5,
+                min_samples=10,
+                health_window_seconds=60,
+            ),
+            lambda model: TokenCounter(FakeEncoding()),
+        ),
+        input_dir=str(input_dir),
+    )
+
+
+@pytest.mark.asyncio
+async def test_submit_batch_uploads_the_input_file_and_creates_a_batch(
+    tmp_path: Path,
+) -> None:
+    server = BatchOpenAiServer([])
+    repository = create_repository(server, tmp_path)
+
+    batch_id = await repository.submit_batch(
+        {
+            "job_id": "job-1",
+            "requests": [
+                {
+                    "custom_id": "00000000",
+                    "user_id": "user-1",
+                    "chat_messages": [{"role": "user", "content": "おはよう"}],
+                }
+            ],
+        }
+    )
+
+    assert batch_id == "batch_1"
+    assert server.created_batches == [
+        {
+            "input_file_id": "file-input",
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+            "metadata": {"job_id": "job-1"},
+        }
+    ]
+
+    input_line = json.loads((tmp_path / "job-1.input.jsonl").read_text())
+    assert input_line["body"]["model"] == PRIMARY_MODEL
+    assert input_line["body"]["user"] == "user-1"
+    assert b'name="purpose"\r\n\r\nbatch' in server.uploaded[0]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_batch_and_find_batch_results(tmp_path: Path) -> None:
+    server = BatchOpenAiServer(
+        [
+            {"id": "batch_1", "status": "in_progress", "output_file_id": None},
+            {"id": "batch_1", "status": "completed", "output_file_id": "file-output"},
+        ]
+    )
+    repository = create_repository(server, tmp_path)
+
+    assert (await repository.retrieve_batch("batch_1"))["status"] == "in_progress"
+
+    batch = await repository.retrieve_batch("batch_1")
+    assert batch["status"] == "completed"
+    assert batch["output_file_id"] == "file-output"
+
+    # 出力ファイルの行は入力の順とは限らないので、custom_id で対応させる
+    assert await repository.find_batch_results("file-output") == [
+        {"custom_id": "00000001", "ai_response_id": "chatcmpl-2", "message": "応答2"},
+        {"custom_id": "00000000", "ai_response_id": "", "message": None},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_retrieve_batch_reports_the_error_of_a_failed_batch(
+    tmp_path: Path,
+) -> None:
+    server = BatchOpenAiServer(
+        [
+            {
+                "id": "batch_1",
+                "status": "failed",
+                "output_file_id": None,
+                "errors": {"data": [{"message": "invalid model"}]},
+            }
+        ]
+    )
+    repository = create_repository(server, tmp_path)
+
+    batch = await repository.retrieve_batch("batch_1")
+
+    assert batch["status"] == "failed"
+    assert batch["error"] == "invalid model"
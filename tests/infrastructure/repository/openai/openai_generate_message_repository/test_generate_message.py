@@ -0,0 +1,120 @@
+import json
+from typing import Dict, List
+import httpx
+import pytest
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageUnavailableError,
+)
+from infrastructure.model_router import ModelRouter, ModelRouterConfig
+from infrastructure.openai_call_policy import OpenAiCallPolicy, OpenAiCallPolicyConfig
+from infrastructure.token_counter import TokenCounter
+from infrastructure.repository.openai.openai_generate_message_repository import (
+    OpenAiGenerateMessageRepository,
+)
+from tests.fakes import FakeEncoding, FakeOpenAiServer
+
+PRIMARY_MODEL = "gpt-4-1106-preview"
+FALLBACK_MODEL = "gpt-3.5-turbo-1106"
+
+
+class ModelStatusOpenAiServer(FakeOpenAiServer):
+    """
+    モデルごとに決めたステータスコードを返す。
+    """
+
+    def __init__(self, status_codes: Dict[str, int]) -> None:
+        self.status_codes = status_codes
+        self.requested_models: List[str] = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        model = json.loads(request.content)["model"]
+        self.requested_models.append(model)
+
+        status_code = self.status_codes.get(model, 200)
+        if status_code != 200:
+            return self.create_error_response(status_code)
+
+        return self.create_chat_completion_response("chatcmpl-1", model, model)
+
+
+class NoSleep:
+    async def __call__(self, delay: float) -> None:
+        pass
+
+
+def create_repository(
+    server: ModelStatusOpenAiServer,
+) -> OpenAiGenerateMessageRepository:
+    policy_config = OpenAiCallPolicyConfig(
+        attempt_timeout=1,
+        overall_timeout=5,
+        max_retries=1,
+        backoff_base=0.1,
+        backoff_max=1,
+        hedge_enabled=False,
+        hedge_percentile=95,
+        hedge_min_samples=20,
+        circuit_failure_threshold=5,
+        circuit_reset_timeout=30,
+    )
+    policies = {
+        model: OpenAiCallPolicy(policy_config, sleep=NoSleep())
+        for model in [PRIMARY_MODEL, FALLBACK_MODEL]
+    }
+
+    return OpenAiGenerateMessageRepository(
+        client=server.create_client(),
+        model_router=ModelRouter(
+            ModelRouterConfig(
+                models=[PRIMARY_MODEL, FALLBACK_MODEL],
+                completion_tokens_reserve=1000,
+                max_cost_per_request=0,
+                latency_budget_seconds=10,
+                latency_percentile=90,
+                max_error_rate=0.5,
+                min_samples=10,
+                health_window_seconds=60,
+            ),
+            lambda model: TokenCounter(FakeEncoding()),
+        ),
+        get_call_policy=policies.__getitem__,
+    )
+
+
+def create_dto():
+    return {
+        "user_id": "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+        "chat_messages": [{"role": "user", "content": "こんにちは"}],
+        "bypass_cache": False,
+    }
+
+
+@pytest.mark.asyncio
+async def test_generate_message_with_primary_model():
+    server = ModelStatusOpenAiServer({})
+    repository = create_repository(server)
+
+    result = await repository.generate_message(create_dto())
+
+    assert result["message"] == PRIMARY_MODEL
+    assert server.requested_models == [PRIMARY_MODEL]
+
+
+@pytest.mark.asyncio
+async def test_generate_message_falls_back_when_primary_is_unavailable():
+    server = ModelStatusOpenAiServer({PRIMARY_MODEL: 503})
+    repository = create_repository(server)
+
+    result = await repository.generate_message(create_dto())
+
+    assert result["message"] == FALLBACK_MODEL
+    assert server.requested_models == [PRIMARY_MODEL, PRIMARY_MODEL, FALLBACK_MODEL]
+
+
+@pytest.mark.asyncio
+async def test_generate_message_raises_when_every_model_is_unavailable():
+    server = ModelStatusOpenAiServer({PRIMARY_MODEL: 503, FALLBACK_MODEL: 429})
+    repository = create_repository(server)
+
+    with pytest.raises(GenerateMessageUnavailableError):
+        await repository.generate_message(create_dto())
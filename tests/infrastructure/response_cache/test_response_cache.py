@@ -0,0 +1,82 @@
+from domain.message import ChatMessage
+from infrastructure.response_cache import (
+    ResponseCache,
+    ResponseCacheConfig,
+    response_cache_lookups,
+)
+
+SYSTEM_MESSAGE: ChatMessage = {"role": "system", "content": "あなたは優しいカウンセラーです。"}
+
+RESULT = {"ai_response_id": "chatcmpl-1", "message": "こんにちは。どうしましたか？"}
+
+
+def create_cache(similarity_enabled: bool = False) -> ResponseCache:
+    return ResponseCache(
+        ResponseCacheConfig(
+            max_entries=10,
+            ttl_seconds=60,
+            max_bytes=1024 * 1024,
+            similarity_enabled=similarity_enabled,
+            similarity_threshold=0.6,
+            similarity_max_candidates=10,
+        ),
+        {"models": ["gpt-4-1106-preview"], "temperature": 0.7},
+    )
+
+
+def create_messages(content: str) -> list[ChatMessage]:
+    return [SYSTEM_MESSAGE, {"role": "user", "content": content}]
+
+
+def test_returns_response_for_same_messages_ignoring_whitespace_and_width():
+    cache = create_cache()
+    hits = response_cache_lookups.get(result="exact")
+
+    cache.set(create_messages("話を聞いてください"), RESULT)
+
+    assert cache.get(create_messages(" 話を聞いてください　")) == RESULT
+    assert response_cache_lookups.get(result="exact") == hits + 1
+
+
+def test_does_not_return_response_for_different_model_parameters():
+    cache = create_cache()
+    cache.set(create_messages("こんにちは"), RESULT)
+
+    other = ResponseCache(cache.config, {"models": ["gpt-4"], "temperature": 0.7})
+    other.set(create_messages("こんばんは"), RESULT)
+
+    assert other.get(create_messages("こんにちは")) is None
+
+
+def test_returns_response_for_similar_first_message():
+    cache = create_cache(similarity_enabled=True)
+    hits = response_cache_lookups.get(result="similar")
+
+    cache.set(create_messages("話を聞いてください"), RESULT)
+
+    assert cache.get(create_messages("話を聞いてください！")) == RESULT
+    assert cache.get(create_messages("眠れません")) is None
+    assert response_cache_lookups.get(result="similar") == hits + 1
+
+
+def test_does_not_use_similarity_when_conversation_has_history():
+    cache = create_cache(similarity_enabled=True)
+    history: list[ChatMessage] = [
+        SYSTEM_MESSAGE,
+        {"role": "user", "content": "こんにちは"},
+        {"role": "assistant", "content": "こんにちは。"},
+    ]
+
+    cache.set(history + [{"role": "user", "content": "話を聞いてください"}], RESULT)
+
+    assert cache.get(history + [{"role": "user", "content": "話を聞いてください！"}]) is None
+
+
+def test_does_not_use_similarity_unless_enabled():
+    cache = create_cache()
+    misses = response_cache_lookups.get(result="miss")
+
+    cache.set(create_messages("話を聞いてください"), RESULT)
+
+    assert cache.get(create_messages("話を聞いてください！")) is None
+    assert response_cache_lookups.get(result="miss") == misses + 1
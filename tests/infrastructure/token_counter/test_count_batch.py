@@ -0,0 +1,31 @@
+from infrastructure.token_counter import TokenCounter
+from tests.fakes import FakeEncoding
+
+
+def test_count_batch():
+    encoding = FakeEncoding()
+    token_counter = TokenCounter(encoding)
+
+    assert token_counter.count_batch(["abc", "de", "abc"]) == [3, 2, 3]
+    assert encoding.encoded_texts == ["abc", "de"]
+
+
+def test_count_batch_uses_cached_counts():
+    encoding = FakeEncoding()
+    token_counter = TokenCounter(encoding)
+
+    token_counter.count_batch(["abc", "de"])
+    assert token_counter.count_batch(["de", "fghi", "abc"]) == [2, 4, 3]
+    assert encoding.encoded_texts == ["abc", "de", "fghi"]
+
+
+def test_count_batch_evicts_least_recently_used():
+    encoding = FakeEncoding()
+    token_counter = TokenCounter(encoding, max_cache_size=2)
+
+    token_counter.count_batch(["a", "bb"])
+    token_counter.count("a")
+    token_counter.count("ccc")
+    token_counter.count_batch(["a", "bb"])
+
+    assert encoding.encoded_texts == ["a", "bb", "ccc", "bb"]
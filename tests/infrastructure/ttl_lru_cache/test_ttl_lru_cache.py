@@ -0,0 +1,61 @@
+from infrastructure.ttl_lru_cache import TtlLruCache
+from tests.fakes import FakeClock
+
+
+def test_evicts_least_recently_used_entry():
+    cache: TtlLruCache[str, str] = TtlLruCache("test", max_entries=2, ttl_seconds=60)
+
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_expires_entry_after_ttl():
+    clock = FakeClock()
+    cache: TtlLruCache[str, str] = TtlLruCache(
+        "test", max_entries=10, ttl_seconds=60, clock=clock
+    )
+
+    cache.set("a", "1")
+    clock.now = 59
+    assert cache.get("a") == "1"
+
+    clock.now = 60
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_evicts_entries_over_max_bytes():
+    cache: TtlLruCache[str, str] = TtlLruCache(
+        "test", max_entries=10, ttl_seconds=60, max_bytes=5, size_of=len
+    )
+
+    cache.set("a", "123")
+    cache.set("b", "45")
+    assert cache.bytes == 5
+
+    cache.set("c", "6")
+    assert cache.get("a") is None
+    assert cache.bytes == 3
+
+    cache.set("d", "123456")
+    assert cache.get("d") is None
+
+
+def test_items_returns_only_live_entries():
+    clock = FakeClock()
+    cache: TtlLruCache[str, str] = TtlLruCache(
+        "test", max_entries=10, ttl_seconds=60, clock=clock
+    )
+
+    cache.set("a", "1")
+    clock.now = 30
+    cache.set("b", "2")
+    clock.now = 61
+
+    assert cache.items() == [("b", "2")]
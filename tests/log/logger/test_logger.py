@@ -0,0 +1,72 @@
+import json
+import logging
+import sys
+from log.logger import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    SuccessLogSamplingFilter,
+    SUCCESS_LOG_MESSAGE,
+)
+
+
+def create_record(
+    message: str, level: int = logging.INFO, **extra
+) -> logging.LogRecord:
+    record = logging.LogRecord("root", level, __file__, 1, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_outputs_only_whitelisted_fields():
+    record = create_record(
+        "success",
+        request_id="request-id",
+        user_id="Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+        ai_response_id="chatcmpl-1",
+        secret="should not be logged",
+    )
+
+    data = json.loads(JsonFormatter().format(record))
+
+    assert data["msg"] == "success"
+    assert data["levelname"] == "INFO"
+    assert data["request_id"] == "request-id"
+    assert data["ai_response_id"] == "chatcmpl-1"
+    assert "secret" not in data
+    assert "args" not in data
+
+
+def test_json_formatter_outputs_traceback():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord(
+            "root", logging.ERROR, __file__, 1, "failed", None, sys.exc_info()
+        )
+
+    data = json.loads(JsonFormatter().format(record))
+
+    assert data["traceback"][-1] == "ValueError: boom"
+
+
+def test_success_log_sampling_filter():
+    drop_all = SuccessLogSamplingFilter(0)
+
+    assert drop_all.filter(create_record(SUCCESS_LOG_MESSAGE)) is False
+    assert drop_all.filter(create_record("client disconnected")) is True
+    assert (
+        drop_all.filter(create_record(SUCCESS_LOG_MESSAGE, level=logging.WARNING))
+        is True
+    )
+    assert SuccessLogSamplingFilter(1).filter(create_record(SUCCESS_LOG_MESSAGE))
+
+
+def test_non_blocking_queue_handler_merges_message_arguments():
+    record = logging.LogRecord(
+        "root", logging.INFO, __file__, 1, "hello %s", ("world",), None
+    )
+
+    prepared = NonBlockingQueueHandler(None).prepare(record)  # type: ignore
+
+    assert prepared.msg == "hello world"
+    assert prepared.args is None
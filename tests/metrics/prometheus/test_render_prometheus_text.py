@@ -0,0 +1,36 @@
+from metrics.prometheus import render_prometheus_text
+from metrics.registry import MetricsRegistry
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("test_requests_total", "Requests.", ["endpoint"])
+    in_flight = registry.gauge("test_in_flight", "In flight.")
+    latency = registry.histogram(
+        "test_latency_seconds", "Latency.", ["endpoint"], buckets=[0.1, 1]
+    )
+    collected = []
+    registry.register_collector(lambda: collected.append(True))
+
+    requests.inc(3, endpoint='say "hi"\n')
+    in_flight.set(2)
+    latency.labels(endpoint="messages").observe(0.05)
+    latency.observe(0.5, endpoint="messages")
+    latency.observe(2.5, endpoint="messages")
+
+    assert render_prometheus_text(registry) == (
+        "# HELP test_in_flight In flight.\n"
+        "# TYPE test_in_flight gauge\n"
+        "test_in_flight 2\n"
+        "# HELP test_latency_seconds Latency.\n"
+        "# TYPE test_latency_seconds histogram\n"
+        'test_latency_seconds_bucket{endpoint="messages",le="0.1"} 1\n'
+        'test_latency_seconds_bucket{endpoint="messages",le="1"} 2\n'
+        'test_latency_seconds_bucket{endpoint="messages",le="+Inf"} 3\n'
+        'test_latency_seconds_sum{endpoint="messages"} 3.05\n'
+        'test_latency_seconds_count{endpoint="messages"} 3\n'
+        "# HELP test_requests_total Requests.\n"
+        "# TYPE test_requests_total counter\n"
+        'test_requests_total{endpoint="say \\"hi\\"\\n"} 3\n'
+    )
+    assert collected == [True]
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from metrics.stage_timer import (
+    flush_request_timings,
+    format_server_timing,
+    measure_stage,
+    request_duration_seconds,
+    requests_in_flight,
+    stage_duration_seconds,
+    track_request,
+)
+
+
+@pytest.mark.asyncio
+async def test_measure_stage_accumulates_timings_of_current_request():
+    async def handle_request(sleep_seconds: float):
+        with track_request("test_accumulate") as request_timing:
+            with measure_stage("db_read"):
+                await asyncio.sleep(sleep_seconds)
+            with measure_stage("db_read"):
+                await asyncio.sleep(sleep_seconds)
+            with measure_stage("completion"):
+                pass
+
+        return request_timing.timings
+
+    # 並行して処理されるリクエストの所要時間が混ざらないこと
+    slow, fast = await asyncio.gather(handle_request(0.05), handle_request(0))
+
+    assert list(slow) == ["db_read", "completion"]
+    assert slow["db_read"] >= 0.1
+    assert fast["db_read"] < 0.05
+
+    flush_request_timings()
+    db_read = stage_duration_seconds.get(
+        endpoint="test_accumulate", stage="db_read", outcome="success"
+    )
+    assert db_read is not None
+    # 処理段階ごとの所要時間はリクエストごとに合計して記録する
+    assert db_read.count == 2
+
+
+def test_track_request_records_outcome():
+    with pytest.raises(ValueError):
+        with track_request("test_outcome"):
+            assert requests_in_flight.get(endpoint="test_outcome") == 1
+            with measure_stage("completion"):
+                raise ValueError("boom")
+
+    with track_request("test_outcome") as request_timing:
+        request_timing.outcome = "error"
+
+    assert requests_in_flight.get(endpoint="test_outcome") == 0
+
+    flush_request_timings()
+    errors = request_duration_seconds.get(endpoint="test_outcome", outcome="error")
+    assert errors is not None
+    assert errors.count == 2
+    assert stage_duration_seconds.get(
+        endpoint="test_outcome", stage="completion", outcome="error"
+    )
+
+
+def test_measure_stage_without_request():
+    with measure_stage("db_read"):
+        pass
+
+
+def test_format_server_timing():
+    assert (
+        format_server_timing({"db_read": 0.0012345, "completion": 0.5})
+        == "db_read;dur=1.234, completion;dur=500.000"
+    )
@@ -0,0 +1,199 @@
+import asyncio
+import pytest
+from presentation.admission_control import (
+    AdmissionController,
+    AdmissionControlConfig,
+    AdmissionRejectedError,
+    UserRateLimiter,
+    create_admission_rejected_response,
+)
+from tests.fakes import FakeClock
+
+
+def create_config(**overrides) -> AdmissionControlConfig:
+    config = AdmissionControlConfig(
+        max_concurrency=1,
+        max_waiting=1,
+        max_wait_seconds=0.05,
+        user_rate_per_minute=0,
+        user_burst=5,
+        max_users=100,
+        serialize_user_turns=False,
+    )
+    config.update(overrides)  # type: ignore
+    return config
+
+
+def test_user_rate_limiter_allows_burst_then_refills():
+    clock = FakeClock()
+    limiter = UserRateLimiter(rate_per_second=1, burst=2, max_users=100, clock=clock)
+
+    assert limiter.acquire("user-1") == 0
+    assert limiter.acquire("user-1") == 0
+    assert limiter.acquire("user-1") == pytest.approx(1)
+    # 他のユーザーには影響しない
+    assert limiter.acquire("user-2") == 0
+
+    clock.now = 0.5
+    assert limiter.acquire("user-1") == pytest.approx(0.5)
+
+    clock.now = 1
+    assert limiter.acquire("user-1") == 0
+
+
+@pytest.mark.asyncio
+async def test_rejects_user_over_rate_limit():
+    controller = AdmissionController(
+        create_config(max_concurrency=10, user_rate_per_minute=60, user_burst=1)
+    )
+
+    ticket = await controller.admit("user-1")
+    ticket.release()
+
+    with pytest.raises(AdmissionRejectedError) as error:
+        await controller.admit("user-1")
+
+    assert error.value.reason == "rate_limited"
+    assert error.value.retry_after == pytest.approx(1, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_does_not_count_rejected_requests_against_rate_limit():
+    controller = AdmissionController(
+        create_config(user_rate_per_minute=60, user_burst=1)
+    )
+
+    ticket = await controller.admit("user-1")
+
+    with pytest.raises(AdmissionRejectedError) as error:
+        await controller.admit("user-2")
+
+    assert error.value.reason == "queue_timeout"
+
+    ticket.release()
+
+    # 処理の枠を待てずに断ったリクエストは、トークンを消費しない
+    second_ticket = await controller.admit("user-2")
+    second_ticket.release()
+
+
+@pytest.mark.asyncio
+async def test_waits_for_a_slot_and_rejects_when_queue_is_full():
+    controller = AdmissionController(create_config(max_wait_seconds=1))
+
+    ticket = await controller.admit("user-1")
+    waiting = asyncio.create_task(controller.admit("user-2"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejectedError) as error:
+        await controller.admit("user-3")
+
+    assert error.value.reason == "queue_full"
+
+    # 何度 release しても枠は1つだけ返る
+    ticket.release()
+    ticket.release()
+
+    second_ticket = await waiting
+    second_ticket.release()
+
+    third_ticket = await controller.admit("user-3")
+    third_ticket.release()
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_wait_times_out():
+    controller = AdmissionController(create_config())
+
+    ticket = await controller.admit("user-1")
+
+    with pytest.raises(AdmissionRejectedError) as error:
+        await controller.admit("user-2")
+
+    assert error.value.reason == "queue_timeout"
+
+    ticket.release()
+
+
+@pytest.mark.asyncio
+async def test_serializes_turns_of_the_same_user():
+    controller = AdmissionController(
+        create_config(max_concurrency=10, serialize_user_turns=True)
+    )
+
+    first_ticket = await controller.admit("user-1")
+    second = asyncio.create_task(controller.admit("user-1"))
+    other_user_ticket = await controller.admit("user-2")
+    await asyncio.sleep(0.01)
+
+    # 同じユーザーの2件目は、1件目が終わるまで処理の枠も取得しない。待っている数には含める
+    assert not second.done()
+    assert controller._waiting == 1
+    assert controller._semaphore._value == 8
+
+    first_ticket.release()
+    second_ticket = await second
+
+    second_ticket.release()
+    other_user_ticket.release()
+
+    assert len(controller.user_locks) == 0
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_waiting_for_the_user_lock_times_out():
+    controller = AdmissionController(
+        create_config(max_concurrency=10, max_waiting=10, serialize_user_turns=True)
+    )
+
+    ticket = await controller.admit("user-1")
+
+    with pytest.raises(AdmissionRejectedError) as error:
+        await controller.admit("user-1")
+
+    assert error.value.reason == "queue_timeout"
+
+    ticket.release()
+
+    assert len(controller.user_locks) == 0
+    assert controller._waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_too_many_requests_wait_for_the_user_lock():
+    controller = AdmissionController(
+        create_config(
+            max_concurrency=10,
+            max_wait_seconds=1,
+            serialize_user_turns=True,
+        )
+    )
+
+    ticket = await controller.admit("user-1")
+    waiting = asyncio.create_task(controller.admit("user-1"))
+    await asyncio.sleep(0)
+
+    # 1人のユーザーが待っているリクエストを積み上げられない
+    with pytest.raises(AdmissionRejectedError) as error:
+        await controller.admit("user-1")
+
+    assert error.value.reason == "queue_full"
+
+    ticket.release()
+    second_ticket = await waiting
+    second_ticket.release()
+
+
+def test_create_admission_rejected_response():
+    rate_limited = create_admission_rejected_response(
+        AdmissionRejectedError("rate_limited", 1.2), {"Ai-Counselor-Request-Id": "id"}
+    )
+    busy = create_admission_rejected_response(
+        AdmissionRejectedError("queue_timeout", 5), {}
+    )
+
+    assert rate_limited.status_code == 429
+    assert rate_limited.headers["Retry-After"] == "2"
+    assert rate_limited.headers["Ai-Counselor-Request-Id"] == "id"
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == "5"
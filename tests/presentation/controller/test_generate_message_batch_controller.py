@@ -0,0 +1,33 @@
+import json
+import pytest
+from starlette.requests import Request
+from presentation.controller.generate_message_batch_controller import (
+    GenerateMessageBatchController,
+    GenerateMessageBatchRequestBody,
+)
+from usecase.generate_message_batch_use_case import GenerateMessageBatchUseCase
+
+
+class FailingGenerateMessageBatchController(GenerateMessageBatchController):
+    async def _create_use_case(self, request_id: str) -> GenerateMessageBatchUseCase:
+        raise RuntimeError("db pool is not initialized")
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error_line_keeps_the_error_type():
+    controller = FailingGenerateMessageBatchController(
+        Request({"type": "http", "headers": []}),
+        GenerateMessageBatchRequestBody(
+            items=[{"user_id": "user-1", "message": "こんにちは"}]
+        ),
+    )
+
+    lines = [line async for line in controller._stream_results("request-id")]
+
+    assert [json.loads(line) for line in lines] == [
+        {
+            "type": "error",
+            "error": "INTERNAL_SERVER_ERROR",
+            "title": "an unexpected error has occurred.",
+        }
+    ]
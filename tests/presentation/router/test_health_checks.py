@@ -11,3 +11,12 @@ def test_success():
 
     assert response.status_code == 200
     assert "ok" in response.json()["status"]
+
+
+def test_db_pool_not_initialized():
+    response = client.get(
+        "/v1/health-checks/db-pool",
+    )
+
+    assert response.status_code == 503
+    assert response.json()["type"] == "SERVICE_UNAVAILABLE"
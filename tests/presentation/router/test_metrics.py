@@ -0,0 +1,14 @@
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+
+
+def test_metrics():
+    response = client.get(
+        "/v1/metrics",
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE ai_counselor_stage_duration_seconds histogram" in response.text
@@ -0,0 +1,98 @@
+import asyncio
+from typing import AsyncIterator
+import pytest
+from tracing.tracer import (
+    TracingConfig,
+    force_flush_tracing,
+    init_tracing,
+    shutdown_tracing,
+    start_request_span,
+    traced,
+)
+
+in_memory_span_exporter = pytest.importorskip(
+    "opentelemetry.sdk.trace.export.in_memory_span_exporter"
+)
+
+
+@pytest.fixture
+def span_exporter():
+    exporter = in_memory_span_exporter.InMemorySpanExporter()
+    config = TracingConfig(enabled=True, exporter="console", service_name="test")
+
+    assert init_tracing(config, exporter) is True
+
+    yield exporter
+
+    shutdown_tracing()
+
+
+@traced("fetch", {"db.system": "mysql"})
+async def fetch() -> str:
+    return "result"
+
+
+@traced("stream")
+async def stream() -> AsyncIterator[str]:
+    yield "a"
+    yield "b"
+
+
+@pytest.mark.asyncio
+async def test_spans_are_nested_and_have_request_attributes(span_exporter):
+    with start_request_span(
+        "handle", request_id="request-id", webhook_event_id="event-id"
+    ):
+        assert await fetch() == "result"
+        assert [delta async for delta in stream()] == ["a", "b"]
+
+    force_flush_tracing()
+
+    spans = {span.name: span for span in span_exporter.get_finished_spans()}
+
+    assert set(spans) == {"handle", "fetch", "stream"}
+    assert spans["handle"].parent is None
+    assert spans["fetch"].parent.span_id == spans["handle"].context.span_id
+    assert spans["stream"].parent.span_id == spans["handle"].context.span_id
+
+    for span in spans.values():
+        assert span.attributes["ai_counselor.request_id"] == "request-id"
+        assert span.attributes["ai_counselor.webhook_event_id"] == "event-id"
+
+    assert spans["fetch"].attributes["db.system"] == "mysql"
+
+
+@pytest.mark.asyncio
+async def test_stream_span_ends_when_closed_early(span_exporter):
+    generator = stream()
+
+    assert await generator.__anext__() == "a"
+    await generator.aclose()
+
+    force_flush_tracing()
+
+    assert [span.name for span in span_exporter.get_finished_spans()] == ["stream"]
+
+
+@pytest.mark.asyncio
+async def test_does_nothing_when_disabled():
+    config = TracingConfig(enabled=False, exporter="console", service_name="test")
+
+    assert init_tracing(config) is False
+
+    with start_request_span("handle", request_id="request-id"):
+        assert await fetch() == "result"
+
+
+@pytest.mark.asyncio
+async def test_request_span_closed_from_another_context():
+    async def stream_with_request_span() -> AsyncIterator[str]:
+        with start_request_span("handle", request_id="request-id"):
+            yield "a"
+            yield "b"
+
+    generator = stream_with_request_span()
+    assert await generator.__anext__() == "a"
+
+    # StreamingResponse の切断時のように、開始したのとは別のタスク（コンテキスト）から閉じる
+    await asyncio.create_task(generator.aclose())
@@ -0,0 +1,353 @@
+import pytest
+from typing import Dict, List, Optional
+from domain.message import ChatMessage
+from domain.repository.batch_completion_repository_interface import (
+    Batch,
+    BatchCompletionRequest,
+    BatchCompletionResult,
+    SubmitBatchDto,
+)
+from domain.repository.bulk_message_job_repository_interface import (
+    BulkMessageJob,
+    BulkMessageJobItem,
+    CreateBulkMessageJobDto,
+)
+from domain.repository.conversation_history_repository_interface import (
+    CreateMessagesWithConversationHistoryDto,
+    SaveConversationHistoryDto,
+)
+from usecase.bulk_message_job_use_case import (
+    BulkMessageJobRepositories,
+    BulkMessageJobUseCase,
+    BulkMessageJobUseCaseDto,
+)
+from tests.fakes import FakeDbHandler
+
+
+class FakeBulkMessageJobRepository:
+    def __init__(self) -> None:
+        self.jobs: Dict[str, BulkMessageJob] = {}
+        self.items: Dict[str, List[BulkMessageJobItem]] = {}
+
+    async def create_bulk_message_job(self, dto: CreateBulkMessageJobDto) -> None:
+        self.jobs[dto["job_id"]] = BulkMessageJob(
+            job_id=dto["job_id"],
+            status="created",
+            batch_id=None,
+            output_file_id=None,
+            ingested_lines=0,
+            error=None,
+        )
+        self.items[dto["job_id"]] = dto["items"]
+
+    async def find_bulk_message_job(self, job_id: str) -> Optional[BulkMessageJob]:
+        return self.jobs.get(job_id)
+
+    async def find_unfinished_bulk_message_jobs(self) -> List[BulkMessageJob]:
+        return [
+            job
+            for job in self.jobs.values()
+            if job["status"] in ("created", "submitted", "completed")
+        ]
+
+    async def find_bulk_message_job_items(
+        self, job_id: str
+    ) -> List[BulkMessageJobItem]:
+        return self.items[job_id]
+
+    async def update_bulk_message_job(self, job: BulkMessageJob) -> None:
+        self.jobs[job["job_id"]] = job
+
+
+class FakeBatchCompletionRepository:
+    """
+    retrieve_batch を in_progress_polls 回呼ぶまで完了しない。
+    user_id が "unavailable" のリクエストは生成に失敗する。
+    """
+
+    def __init__(self, in_progress_polls: int = 0, fail: bool = False) -> None:
+        self.in_progress_polls = in_progress_polls
+        self.fail = fail
+        self.submitted: List[SubmitBatchDto] = []
+        self.polls = 0
+
+    async def submit_batch(self, dto: SubmitBatchDto) -> str:
+        self.submitted.append(dto)
+        return f"batch-{len(self.submitted)}"
+
+    async def retrieve_batch(self, batch_id: str) -> Batch:
+        self.polls += 1
+        if self.polls <= self.in_progress_polls:
+            return Batch(
+                batch_id=batch_id,
+                status="in_progress",
+                output_file_id=None,
+                error=None,
+            )
+
+        if self.fail:
+            return Batch(
+                batch_id=batch_id,
+                status="failed",
+                output_file_id=None,
+                error="validation failed",
+            )
+
+        return Batch(
+            batch_id=batch_id,
+            status="completed",
+            output_file_id=f"{batch_id}-output",
+            error=None,
+        )
+
+    async def find_batch_results(
+        self, output_file_id: str
+    ) -> List[BatchCompletionResult]:
+        requests: List[BatchCompletionRequest] = self.submitted[-1]["requests"]
+        return [
+            BatchCompletionResult(
+                custom_id=request["custom_id"],
+                ai_response_id=f"chatcmpl-{request['custom_id']}",
+                message=None
+                if request["user_id"] == "unavailable"
+                else f"{request['chat_messages'][-1]['content']}への応答",
+            )
+            for request in requests
+        ]
+
+
+class FakeConversationHistoryRepository:
+    def __init__(self, fail_on_save: Optional[int] = None) -> None:
+        self.saves: List[List[SaveConversationHistoryDto]] = []
+        # この回数目の保存で失敗する
+        self.fail_on_save = fail_on_save
+        self.save_calls = 0
+
+    async def create_messages_with_conversation_histories(
+        self, dtos: List[CreateMessagesWithConversationHistoryDto]
+    ) -> List[List[ChatMessage]]:
+        return [[{"role": "user", "content": dto["request_message"]}] for dto in dtos]
+
+    async def save_conversation_histories(
+        self, dtos: List[SaveConversationHistoryDto]
+    ) -> None:
+        self.save_calls += 1
+        if self.save_calls == self.fail_on_save:
+            raise RuntimeError("connection lost")
+
+        self.saves.append(dtos)
+
+
+class FakeDb:
+    """
+    create_repositories のたびにDB接続を取得したものとして、接続ごとの呼び出しを記録する。
+    """
+
+    def __init__(
+        self,
+        job_repository: FakeBulkMessageJobRepository,
+        history_repository: FakeConversationHistoryRepository,
+    ) -> None:
+        self.job_repository = job_repository
+        self.history_repository = history_repository
+        self.connections: List[List[str]] = []
+        self.in_use = 0
+
+    async def create_repositories(self) -> BulkMessageJobRepositories:
+        calls: List[str] = []
+        self.connections.append(calls)
+        self.in_use += 1
+
+        db = self
+
+        class ClosingDbHandler(FakeDbHandler):
+            def close(self) -> None:
+                super().close()
+                db.in_use -= 1
+
+        return BulkMessageJobRepositories(
+            db_handler=ClosingDbHandler(calls),
+            bulk_message_job_repository=self.job_repository,
+            conversation_history_repository=self.history_repository,
+        )
+
+
+def create_use_case(
+    job_repository: FakeBulkMessageJobRepository,
+    batch_repository: FakeBatchCompletionRepository,
+    history_repository: FakeConversationHistoryRepository,
+    db: Optional[FakeDb] = None,
+    sleeps: Optional[List[float]] = None,
+) -> BulkMessageJobUseCase:
+    db = db or FakeDb(job_repository, history_repository)
+
+    async def sleep(seconds: float) -> None:
+        if sleeps is not None:
+            sleeps.append(seconds)
+        # バッチの完了を待つ間はDB接続を保持しない
+        assert db is not None and db.in_use == 0
+
+    return BulkMessageJobUseCase(
+        BulkMessageJobUseCaseDto(
+            batch_completion_repository=batch_repository,
+            create_repositories=db.create_repositories,
+            ingest_chunk_size=2,
+            poll_interval_seconds=30,
+        ),
+        sleep=sleep,
+    )
+
+
+REQUESTS = [
+    {"user_id": "user-1", "message": "おはよう"},
+    {"user_id": "unavailable", "message": "こんにちは"},
+    {"user_id": "user-3", "message": "こんばんは"},
+]
+
+
+@pytest.mark.asyncio
+async def test_run_submits_polls_and_ingests_results_in_chunks() -> None:
+    job_repository = FakeBulkMessageJobRepository()
+    batch_repository = FakeBatchCompletionRepository(in_progress_polls=2)
+    history_repository = FakeConversationHistoryRepository()
+    db = FakeDb(job_repository, history_repository)
+    sleeps: List[float] = []
+    use_case = create_use_case(
+        job_repository, batch_repository, history_repository, db=db, sleeps=sleeps
+    )
+
+    await use_case.create_job("job-1", REQUESTS)
+    job = await use_case.run("job-1")
+
+    assert job["status"] == "ingested"
+    assert job["batch_id"] == "batch-1"
+    assert job["ingested_lines"] == 3
+    assert job_repository.jobs["job-1"] == job
+    assert sleeps == [30, 30]
+
+    # DBの操作ごとに接続し、使い終わったら閉じる
+    transaction = ["begin", "commit", "close"]
+    assert db.connections == [
+        transaction,  # ジョブの作成
+        ["close"],  # ジョブの読み込み
+        ["close"],  # 送信するリクエストの作成
+        transaction,  # submitted
+        transaction,  # completed
+        ["close"],  # 取り込むリクエストの読み込み
+        transaction,  # 1つ目のチャンク
+        transaction,  # 2つ目のチャンク
+        transaction,  # ingested
+    ]
+    assert db.in_use == 0
+
+    requests = batch_repository.submitted[0]["requests"]
+    assert [request["custom_id"] for request in requests] == [
+        "00000000",
+        "00000001",
+        "00000002",
+    ]
+    assert requests[0]["chat_messages"] == [{"role": "user", "content": "おはよう"}]
+
+    # 生成できなかったリクエストは保存しない
+    assert history_repository.saves == [
+        [
+            {
+                "user_id": "user-1",
+                "user_message": "おはよう",
+                "ai_message": "おはようへの応答",
+                "processed_request": None,
+            }
+        ],
+        [
+            {
+                "user_id": "user-3",
+                "user_message": "こんばんは",
+                "ai_message": "こんばんはへの応答",
+                "processed_request": None,
+            }
+        ],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_resumes_ingestion_from_the_last_committed_chunk() -> None:
+    job_repository = FakeBulkMessageJobRepository()
+    batch_repository = FakeBatchCompletionRepository()
+    failing_history_repository = FakeConversationHistoryRepository(fail_on_save=2)
+    db = FakeDb(job_repository, failing_history_repository)
+    use_case = create_use_case(
+        job_repository, batch_repository, failing_history_repository, db=db
+    )
+
+    await use_case.create_job("job-1", REQUESTS)
+
+    with pytest.raises(RuntimeError):
+        await use_case.run("job-1")
+
+    assert db.connections[-1] == ["begin", "rollback", "close"]
+    assert job_repository.jobs["job-1"]["status"] == "completed"
+    assert job_repository.jobs["job-1"]["ingested_lines"] == 2
+
+    history_repository = FakeConversationHistoryRepository()
+    job = await create_use_case(
+        job_repository, batch_repository, history_repository
+    ).run("job-1")
+
+    assert job["status"] == "ingested"
+    # バッチは再送信せず、取り込んでいない行だけを保存する
+    assert len(batch_repository.submitted) == 1
+    assert [[dto["user_id"] for dto in dtos] for dtos in history_repository.saves] == [
+        ["user-3"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_marks_the_job_as_failed_when_the_batch_fails() -> None:
+    job_repository = FakeBulkMessageJobRepository()
+    history_repository = FakeConversationHistoryRepository()
+    use_case = create_use_case(
+        job_repository, FakeBatchCompletionRepository(fail=True), history_repository
+    )
+
+    await use_case.create_job("job-1", REQUESTS)
+    job = await use_case.run("job-1")
+
+    assert job["status"] == "failed"
+    assert job["error"] == "validation failed"
+    assert history_repository.saves == []
+
+
+@pytest.mark.asyncio
+async def test_resume_unfinished_jobs_runs_every_unfinished_job() -> None:
+    job_repository = FakeBulkMessageJobRepository()
+    use_case = create_use_case(
+        job_repository,
+        FakeBatchCompletionRepository(),
+        FakeConversationHistoryRepository(),
+    )
+
+    await use_case.create_job("job-1", REQUESTS[:1])
+    await use_case.create_job("job-2", REQUESTS[2:])
+
+    jobs = await use_case.resume_unfinished_jobs()
+
+    assert [(job["job_id"], job["status"]) for job in jobs] == [
+        ("job-1", "ingested"),
+        ("job-2", "ingested"),
+    ]
+    assert await use_case.resume_unfinished_jobs() == []
+
+
+@pytest.mark.asyncio
+async def test_create_job_rejects_the_same_user_more_than_once() -> None:
+    job_repository = FakeBulkMessageJobRepository()
+    use_case = create_use_case(
+        job_repository,
+        FakeBatchCompletionRepository(),
+        FakeConversationHistoryRepository(),
+    )
+
+    with pytest.raises(ValueError):
+        await use_case.create_job("job-1", [REQUESTS[0], REQUESTS[0]])
+
+    assert job_repository.jobs == {}
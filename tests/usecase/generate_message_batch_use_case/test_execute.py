@@ -0,0 +1,353 @@
+import asyncio
+import pytest
+from typing import Dict, List, Optional, Set, Tuple
+from domain.message import ChatMessage
+from domain.repository.conversation_history_repository_interface import (
+    CreateMessagesWithConversationHistoryDto,
+    SaveConversationHistoryDto,
+)
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryDto,
+    GenerateMessageResult,
+    GenerateMessageUnavailableError,
+)
+from domain.repository.processed_request_repository_interface import (
+    FindProcessedRequestDto,
+    ProcessedRequest,
+)
+from usecase.admission_controller_interface import AdmissionRejectedError
+from usecase.generate_message_batch_use_case import (
+    GenerateMessageBatchRepositories,
+    GenerateMessageBatchUseCase,
+    GenerateMessageBatchUseCaseDto,
+)
+from tests.fakes import FakeDbHandler
+
+
+class FakeConversationHistoryRepository:
+    def __init__(self) -> None:
+        # 1回の呼び出しでまとめて読み込んだユーザーと、まとめて保存した会話
+        self.loads: List[List[str]] = []
+        self.saves: List[List[SaveConversationHistoryDto]] = []
+        self.processed: Dict[Tuple[str, str], ProcessedRequest] = {}
+
+    @property
+    def saved(self) -> List[SaveConversationHistoryDto]:
+        return [dto for dtos in self.saves for dto in dtos]
+
+    async def create_messages_with_conversation_histories(
+        self, dtos: List[CreateMessagesWithConversationHistoryDto]
+    ) -> List[List[ChatMessage]]:
+        self.loads.append([dto["user_id"] for dto in dtos])
+        return [[{"role": "user", "content": dto["request_message"]}] for dto in dtos]
+
+    async def save_conversation_histories(
+        self, dtos: List[SaveConversationHistoryDto]
+    ) -> None:
+        self.saves.append(dtos)
+
+        for dto in dtos:
+            processed_request = dto["processed_request"]
+            if processed_request is not None:
+                self.processed[(dto["user_id"], processed_request["request_id"])] = {
+                    "ai_response_id": processed_request["ai_response_id"],
+                    "message": dto["ai_message"],
+                }
+
+
+class FakeProcessedRequestRepository:
+    def __init__(
+        self, conversation_history_repository: FakeConversationHistoryRepository
+    ) -> None:
+        self.conversation_history_repository = conversation_history_repository
+
+    async def find_processed_requests(
+        self, dtos: List[FindProcessedRequestDto]
+    ) -> List[Optional[ProcessedRequest]]:
+        return [
+            self.conversation_history_repository.processed.get(
+                (dto["user_id"], dto["request_id"])
+            )
+            for dto in dtos
+        ]
+
+
+class FakeDb:
+    """
+    create_repositories のたびにDB接続を取得したものとして、接続ごとの呼び出しを記録する。
+    """
+
+    def __init__(self) -> None:
+        self.conversation_history_repository = FakeConversationHistoryRepository()
+        self.connections: List[List[str]] = []
+        self.in_use = 0
+        self.max_in_use = 0
+
+    async def create_repositories(self) -> GenerateMessageBatchRepositories:
+        calls: List[str] = []
+        self.connections.append(calls)
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+
+        db = self
+
+        class ReleasingDbHandler(FakeDbHandler):
+            def close(self) -> None:
+                super().close()
+                db.in_use -= 1
+
+        return GenerateMessageBatchRepositories(
+            db_handler=ReleasingDbHandler(calls),
+            conversation_history_repository=self.conversation_history_repository,
+            processed_request_repository=FakeProcessedRequestRepository(
+                self.conversation_history_repository
+            ),
+        )
+
+
+class FakeAdmissionTicket:
+    def __init__(self, admission_controller: "FakeAdmissionController") -> None:
+        self.admission_controller = admission_controller
+
+    def release(self) -> None:
+        self.admission_controller.in_flight -= 1
+
+
+class FakeAdmissionController:
+    def __init__(self, rejected: Optional[Dict[str, str]] = None) -> None:
+        self.rejected = rejected or {}
+        self.admitted: List[str] = []
+        self.in_flight = 0
+
+    async def admit(self, user_id: str) -> FakeAdmissionTicket:
+        if user_id in self.rejected:
+            raise AdmissionRejectedError(self.rejected[user_id], 1)  # type: ignore
+
+        self.admitted.append(user_id)
+        self.in_flight += 1
+        return FakeAdmissionTicket(self)
+
+
+class FakeGenerateMessageRepository:
+    """
+    user_id に応じて、応答の遅延や失敗を再現する。
+    """
+
+    def __init__(self, db: FakeDb) -> None:
+        self.db = db
+        self.calls: List[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # 生成中にDB接続を保持していたユーザー
+        self.holding_connection: Set[str] = set()
+
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        self.calls.append(dto["user_id"])
+        if self.db.in_use > 0:
+            self.holding_connection.add(dto["user_id"])
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if dto["user_id"] == "slow":
+                await asyncio.sleep(0.05)
+            else:
+                await asyncio.sleep(0)
+
+            if dto["user_id"] == "unavailable":
+                raise GenerateMessageUnavailableError("circuit open")
+
+            return {
+                "ai_response_id": f"chatcmpl-{dto['user_id']}",
+                "message": f"{dto['chat_messages'][-1]['content']}への応答",
+            }
+        finally:
+            self.in_flight -= 1
+
+
+def create_use_case(
+    user_ids: List[str],
+    db: FakeDb,
+    generate_message_repository: FakeGenerateMessageRepository,
+    admission_controller: Optional[FakeAdmissionController] = None,
+    max_concurrency: int = 2,
+) -> GenerateMessageBatchUseCase:
+    return GenerateMessageBatchUseCase(
+        GenerateMessageBatchUseCaseDto(
+            request_id="request-id",
+            items=[
+                {"user_id": user_id, "message": f"{user_id}さんへ"} for user_id in user_ids
+            ],
+            max_concurrency=max_concurrency,
+            admission_controller=admission_controller or FakeAdmissionController(),
+            generate_message_repository=generate_message_repository,
+            create_repositories=db.create_repositories,
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_execute_streams_results_in_completion_order():
+    db = FakeDb()
+    generate_message_repository = FakeGenerateMessageRepository(db)
+    admission_controller = FakeAdmissionController()
+
+    use_case = create_use_case(
+        ["slow", "user-1", "unavailable", "user-2"],
+        db,
+        generate_message_repository,
+        admission_controller,
+    )
+
+    events = [event async for event in use_case.execute()]
+
+    assert [(event["type"], event.get("index")) for event in events] == [
+        ("result", 1),
+        ("error", 2),
+        ("result", 3),
+        ("result", 0),
+        ("done", None),
+    ]
+    assert events[1]["error"] == "UNAVAILABLE"
+    assert events[-1] == {"type": "done", "saved": 3, "failed": 1}
+    assert generate_message_repository.max_in_flight == 2
+    # 1件ごとに処理の枠とユーザーのロックを取得し、終わったら返す
+    assert admission_controller.admitted == ["slow", "user-1", "unavailable", "user-2"]
+    assert admission_controller.in_flight == 0
+    assert [
+        (dto["user_id"], dto["processed_request"])
+        for dto in db.conversation_history_repository.saved
+    ] == [
+        (user_id, {"request_id": "request-id", "ai_response_id": f"chatcmpl-{user_id}"})
+        for user_id in ["user-1", "user-2", "slow"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_execute_reads_and_saves_items_processed_together_at_once():
+    db = FakeDb()
+    generate_message_repository = FakeGenerateMessageRepository(db)
+
+    use_case = create_use_case(
+        ["user-1", "user-2", "user-3", "slow"],
+        db,
+        generate_message_repository,
+        max_concurrency=4,
+    )
+
+    events = [event async for event in use_case.execute()]
+
+    assert events[-1] == {"type": "done", "saved": 4, "failed": 0}
+    # 同時に処理の枠を得た項目は1回で読み込み、同時に生成し終えた項目は1回の複数行のINSERTで保存する
+    assert db.conversation_history_repository.loads == [
+        ["user-1", "user-2", "user-3", "slow"]
+    ]
+    assert [
+        [dto["user_id"] for dto in dtos]
+        for dtos in db.conversation_history_repository.saves
+    ] == [["user-1", "user-2", "user-3"], ["slow"]]
+    assert db.connections == [
+        ["close"],
+        ["begin", "commit", "close"],
+        ["begin", "commit", "close"],
+    ]
+    # 生成の遅い項目を待たずに、保存した項目の結果を返す
+    assert [event["index"] for event in events[:-1]] == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_execute_does_not_hold_db_connection_while_generating():
+    db = FakeDb()
+    generate_message_repository = FakeGenerateMessageRepository(db)
+
+    use_case = create_use_case(
+        ["user-1", "unavailable"], db, generate_message_repository, max_concurrency=1
+    )
+
+    [event async for event in use_case.execute()]
+
+    assert generate_message_repository.holding_connection == set()
+    assert db.max_in_use == 1
+    # 読み込みと保存で別々に接続を取得し、生成できなかった場合は保存しない
+    assert db.connections == [
+        ["close"],
+        ["begin", "commit", "close"],
+        ["close"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_execute_reports_items_rejected_by_admission_control():
+    db = FakeDb()
+    generate_message_repository = FakeGenerateMessageRepository(db)
+
+    use_case = create_use_case(
+        ["user-1", "busy", "limited"],
+        db,
+        generate_message_repository,
+        FakeAdmissionController({"busy": "queue_timeout", "limited": "rate_limited"}),
+    )
+
+    events = [event async for event in use_case.execute()]
+
+    assert sorted((event["user_id"], event.get("error")) for event in events[:-1]) == [
+        ("busy", "UNAVAILABLE"),
+        ("limited", "RATE_LIMITED"),
+        ("user-1", None),
+    ]
+    assert events[-1] == {"type": "done", "saved": 1, "failed": 2}
+    assert generate_message_repository.calls == ["user-1"]
+
+
+@pytest.mark.asyncio
+async def test_execute_returns_stored_messages_for_retried_batch():
+    db = FakeDb()
+    generate_message_repository = FakeGenerateMessageRepository(db)
+
+    first = [
+        event
+        async for event in create_use_case(
+            ["user-1", "unavailable"], db, generate_message_repository
+        ).execute()
+    ]
+    retried = [
+        event
+        async for event in create_use_case(
+            ["user-1", "unavailable"], db, generate_message_repository
+        ).execute()
+    ]
+
+    assert first[-1] == {"type": "done", "saved": 1, "failed": 1}
+    # 保存済みの応答を返し、生成も保存もし直さない
+    assert retried[-1] == {"type": "done", "saved": 0, "failed": 1}
+    assert [event.get("message") for event in retried if event["type"] == "result"] == [
+        "user-1さんへへの応答"
+    ]
+    assert generate_message_repository.calls.count("user-1") == 1
+    assert len(db.conversation_history_repository.saved) == 1
+
+
+@pytest.mark.asyncio
+async def test_execute_does_not_save_items_in_progress_when_client_disconnects():
+    db = FakeDb()
+    admission_controller = FakeAdmissionController()
+
+    use_case = create_use_case(
+        ["user-1", "slow"],
+        db,
+        FakeGenerateMessageRepository(db),
+        admission_controller,
+    )
+
+    events = use_case.execute()
+    assert (await events.__anext__())["index"] == 0
+    await events.aclose()
+    await asyncio.sleep(0)
+
+    assert [dto["user_id"] for dto in db.conversation_history_repository.saved] == [
+        "user-1"
+    ]
+    assert admission_controller.in_flight == 0
+    assert db.in_use == 0
@@ -0,0 +1,273 @@
+import pytest
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from domain.message import ChatMessage, UNAVAILABLE_REPLY_MESSAGE
+from domain.repository.conversation_history_repository_interface import (
+    CreateMessagesWithConversationHistoryDto,
+    SaveConversationHistoryDto,
+)
+from domain.repository.generate_message_repository_interface import (
+    GenerateMessageRepositoryDto,
+    GenerateMessageResult,
+    GenerateMessageStreamChunk,
+    GenerateMessageUnavailableError,
+)
+from domain.repository.processed_request_repository_interface import (
+    FindProcessedRequestDto,
+    ProcessedRequest,
+)
+from usecase.generate_message_use_case import (
+    GenerateMessageUseCase,
+    GenerateMessageUseCaseDto,
+)
+from tests.fakes import FakeDbHandler
+
+
+class FakeConversationHistoryRepository:
+    def __init__(self) -> None:
+        self.saved: List[SaveConversationHistoryDto] = []
+        self.processed: Dict[Tuple[str, str], ProcessedRequest] = {}
+
+    async def create_messages_with_conversation_history(
+        self, dto: CreateMessagesWithConversationHistoryDto
+    ) -> List[ChatMessage]:
+        return [{"role": "user", "content": dto["request_message"]}]
+
+    async def save_conversation_history(self, dto: SaveConversationHistoryDto) -> None:
+        self.saved.append(dto)
+
+        processed_request = dto["processed_request"]
+        if processed_request is not None:
+            self.processed[(dto["user_id"], processed_request["request_id"])] = {
+                "ai_response_id": processed_request["ai_response_id"],
+                "message": dto["ai_message"],
+            }
+
+
+class FakeGenerateMessageRepository:
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        return {"ai_response_id": "chatcmpl-1", "message": "こんにちは。"}
+
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        for delta in ["こんにちは", "。", "どうしましたか？"]:
+            yield {"ai_response_id": "chatcmpl-1", "delta": delta}
+
+
+class FakeUnavailableGenerateMessageRepository:
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        raise GenerateMessageUnavailableError("circuit open")
+
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        raise GenerateMessageUnavailableError("circuit open")
+        yield
+
+
+class FakeProcessedRequestRepository:
+    def __init__(
+        self, conversation_history_repository: FakeConversationHistoryRepository
+    ) -> None:
+        self.conversation_history_repository = conversation_history_repository
+
+    async def find_processed_request(
+        self, dto: FindProcessedRequestDto
+    ) -> Optional[ProcessedRequest]:
+        return self.conversation_history_repository.processed.get(
+            (dto["user_id"], dto["request_id"])
+        )
+
+
+class CountingGenerateMessageRepository(FakeGenerateMessageRepository):
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def generate_message(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> GenerateMessageResult:
+        self.calls += 1
+        return await super().generate_message(dto)
+
+    async def generate_message_stream(
+        self, dto: GenerateMessageRepositoryDto
+    ) -> AsyncIterator[GenerateMessageStreamChunk]:
+        self.calls += 1
+        async for chunk in super().generate_message_stream(dto):
+            yield chunk
+
+
+def create_use_case(
+    db_handler: FakeDbHandler,
+    conversation_history_repository: FakeConversationHistoryRepository,
+    generate_message_repository=None,
+    processed_request_repository=None,
+) -> GenerateMessageUseCase:
+    return GenerateMessageUseCase(
+        GenerateMessageUseCaseDto(
+            request_id="request-id",
+            user_id="Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+            message="こんにちは",
+            db_handler=db_handler,
+            generate_message_repository=generate_message_repository
+            or FakeGenerateMessageRepository(),
+            conversation_history_repository=conversation_history_repository,
+            processed_request_repository=processed_request_repository
+            or FakeProcessedRequestRepository(conversation_history_repository),
+            bypass_response_cache=False,
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_execute_stream():
+    db_handler = FakeDbHandler()
+    conversation_history_repository = FakeConversationHistoryRepository()
+
+    use_case = create_use_case(db_handler, conversation_history_repository)
+
+    deltas = [delta async for delta in use_case.execute_stream()]
+
+    assert deltas == ["こんにちは", "。", "どうしましたか？"]
+    assert conversation_history_repository.saved == [
+        {
+            "user_id": "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+            "user_message": "こんにちは",
+            "ai_message": "こんにちは。どうしましたか？",
+            "processed_request": {
+                "request_id": "request-id",
+                "ai_response_id": "chatcmpl-1",
+            },
+        }
+    ]
+    assert db_handler.calls == ["begin", "commit", "close"]
+
+
+@pytest.mark.asyncio
+async def test_execute_stream_client_disconnected():
+    db_handler = FakeDbHandler()
+    conversation_history_repository = FakeConversationHistoryRepository()
+
+    use_case = create_use_case(db_handler, conversation_history_repository)
+
+    stream = use_case.execute_stream()
+    assert await stream.__anext__() == "こんにちは"
+    await stream.aclose()
+
+    assert conversation_history_repository.saved == []
+    assert db_handler.calls == ["close"]
+
+
+@pytest.mark.asyncio
+async def test_execute_stream_returns_fallback_message_when_unavailable():
+    db_handler = FakeDbHandler()
+    conversation_history_repository = FakeConversationHistoryRepository()
+
+    use_case = create_use_case(
+        db_handler,
+        conversation_history_repository,
+        FakeUnavailableGenerateMessageRepository(),
+    )
+
+    deltas = [delta async for delta in use_case.execute_stream()]
+
+    assert deltas == [UNAVAILABLE_REPLY_MESSAGE]
+    assert conversation_history_repository.saved == []
+    assert db_handler.calls == ["close"]
+
+
+@pytest.mark.asyncio
+async def test_execute_returns_fallback_message_when_unavailable():
+    db_handler = FakeDbHandler()
+    conversation_history_repository = FakeConversationHistoryRepository()
+
+    use_case = create_use_case(
+        db_handler,
+        conversation_history_repository,
+        FakeUnavailableGenerateMessageRepository(),
+    )
+
+    result = await use_case.execute()
+
+    assert result == {"message": UNAVAILABLE_REPLY_MESSAGE}
+    assert conversation_history_repository.saved == []
+    assert db_handler.calls == ["close"]
+
+
+@pytest.mark.asyncio
+async def test_execute_returns_stored_message_for_duplicate_request():
+    conversation_history_repository = FakeConversationHistoryRepository()
+    generate_message_repository = CountingGenerateMessageRepository()
+    processed_request_repository = FakeProcessedRequestRepository(
+        conversation_history_repository
+    )
+
+    results = []
+    for _ in range(2):
+        use_case = create_use_case(
+            FakeDbHandler(),
+            conversation_history_repository,
+            generate_message_repository,
+            processed_request_repository,
+        )
+        results.append(await use_case.execute())
+
+    assert results == [{"message": "こんにちは。"}, {"message": "こんにちは。"}]
+    assert generate_message_repository.calls == 1
+    assert len(conversation_history_repository.saved) == 1
+    assert conversation_history_repository.processed == {
+        ("Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx", "request-id"): {
+            "ai_response_id": "chatcmpl-1",
+            "message": "こんにちは。",
+        }
+    }
+
+
+@pytest.mark.asyncio
+async def test_execute_stream_returns_stored_message_for_duplicate_request():
+    db_handler = FakeDbHandler()
+    conversation_history_repository = FakeConversationHistoryRepository()
+    generate_message_repository = CountingGenerateMessageRepository()
+    processed_request_repository = FakeProcessedRequestRepository(
+        conversation_history_repository
+    )
+
+    use_case = create_use_case(
+        FakeDbHandler(),
+        conversation_history_repository,
+        generate_message_repository,
+        processed_request_repository,
+    )
+    [delta async for delta in use_case.execute_stream()]
+
+    use_case = create_use_case(
+        db_handler,
+        conversation_history_repository,
+        generate_message_repository,
+        processed_request_repository,
+    )
+    deltas = [delta async for delta in use_case.execute_stream()]
+
+    assert deltas == ["こんにちは。どうしましたか？"]
+    assert generate_message_repository.calls == 1
+    assert len(conversation_history_repository.saved) == 1
+    assert db_handler.calls == ["close"]
+
+
+@pytest.mark.asyncio
+async def test_execute_does_not_store_fallback_message():
+    conversation_history_repository = FakeConversationHistoryRepository()
+
+    use_case = create_use_case(
+        FakeDbHandler(),
+        conversation_history_repository,
+        FakeUnavailableGenerateMessageRepository(),
+    )
+    await use_case.execute()
+
+    # 再送されたリクエストで、もう一度応答の生成を試せるようにする
+    assert conversation_history_repository.processed == {}
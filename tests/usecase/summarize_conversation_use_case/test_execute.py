@@ -0,0 +1,151 @@
+import pytest
+from typing import List, Optional
+from domain.repository.conversation_history_repository_interface import (
+    ConversationHistory,
+    FindEvictedConversationHistoriesDto,
+)
+from domain.repository.conversation_summary_repository_interface import (
+    ConversationSummary,
+    SaveConversationSummaryDto,
+)
+from domain.repository.summarize_conversation_repository_interface import (
+    SummarizeConversationRepositoryDto,
+)
+from usecase.summarize_conversation_use_case import (
+    SummarizeConversationUseCase,
+    SummarizeConversationUseCaseDto,
+)
+from tests.fakes import FakeDbHandler
+
+USER_ID = "Ua000xxxxxxxxxxxxxxxxxxxxxxxxxxxx"
+
+
+class FakeConversationHistoryRepository:
+    def __init__(self, histories: List[ConversationHistory]) -> None:
+        self.histories = histories
+        self.requested: List[FindEvictedConversationHistoriesDto] = []
+
+    async def find_evicted_conversation_histories(
+        self, dto: FindEvictedConversationHistoriesDto
+    ) -> List[ConversationHistory]:
+        self.requested.append(dto)
+        return [
+            history for history in self.histories if history["id"] > dto["after_id"]
+        ][: dto["limit"]]
+
+
+class FakeConversationSummaryRepository:
+    def __init__(self, summary: Optional[ConversationSummary]) -> None:
+        self.summary = summary
+        self.saved: List[SaveConversationSummaryDto] = []
+
+    async def find_conversation_summary(
+        self, user_id: str
+    ) -> Optional[ConversationSummary]:
+        return self.summary
+
+    async def save_conversation_summary(self, dto: SaveConversationSummaryDto) -> None:
+        self.saved.append(dto)
+
+
+class FakeSummarizeConversationRepository:
+    def __init__(self) -> None:
+        self.requested: List[SummarizeConversationRepositoryDto] = []
+
+    async def summarize_conversation(
+        self, dto: SummarizeConversationRepositoryDto
+    ) -> str:
+        self.requested.append(dto)
+        return "* Userは仕事の悩みを話している。"
+
+
+def create_histories(ids: List[int]) -> List[ConversationHistory]:
+    return [
+        ConversationHistory(
+            id=history_id,
+            user_message=f"悩みを聞いてください{history_id}",
+            ai_message=f"もちろんです{history_id}",
+        )
+        for history_id in ids
+    ]
+
+
+def create_use_case(
+    db_handler: FakeDbHandler,
+    conversation_history_repository: FakeConversationHistoryRepository,
+    conversation_summary_repository: FakeConversationSummaryRepository,
+    summarize_conversation_repository: FakeSummarizeConversationRepository,
+) -> SummarizeConversationUseCase:
+    return SummarizeConversationUseCase(
+        SummarizeConversationUseCaseDto(
+            request_id="request-id",
+            user_id=USER_ID,
+            min_turns=2,
+            db_handler=db_handler,
+            conversation_history_repository=conversation_history_repository,
+            conversation_summary_repository=conversation_summary_repository,
+            summarize_conversation_repository=summarize_conversation_repository,
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_execute_folds_evicted_histories_into_previous_summary():
+    db_handler = FakeDbHandler()
+    conversation_summary_repository = FakeConversationSummaryRepository(
+        ConversationSummary(
+            user_id=USER_ID,
+            summary="* Userは眠れないと話している。",
+            last_summarized_history_id=2,
+        )
+    )
+    summarize_conversation_repository = FakeSummarizeConversationRepository()
+
+    use_case = create_use_case(
+        db_handler,
+        FakeConversationHistoryRepository(create_histories([1, 2, 3, 4, 5])),
+        conversation_summary_repository,
+        summarize_conversation_repository,
+    )
+
+    result = await use_case.execute()
+
+    assert result == {"summarized_turns": 3}
+    assert summarize_conversation_repository.requested[0]["previous_summary"] == (
+        "* Userは眠れないと話している。"
+    )
+    assert [
+        history["id"]
+        for history in summarize_conversation_repository.requested[0][
+            "conversation_histories"
+        ]
+    ] == [3, 4, 5]
+    assert conversation_summary_repository.saved == [
+        {
+            "user_id": USER_ID,
+            "summary": "* Userは仕事の悩みを話している。",
+            "last_summarized_history_id": 5,
+        }
+    ]
+    assert db_handler.calls == ["begin", "commit", "close"]
+
+
+@pytest.mark.asyncio
+async def test_execute_skips_until_enough_histories_are_evicted():
+    db_handler = FakeDbHandler()
+    conversation_summary_repository = FakeConversationSummaryRepository(None)
+    summarize_conversation_repository = FakeSummarizeConversationRepository()
+
+    use_case = create_use_case(
+        db_handler,
+        FakeConversationHistoryRepository(create_histories([1])),
+        conversation_summary_repository,
+        summarize_conversation_repository,
+    )
+
+    result = await use_case.execute()
+
+    assert result == {"summarized_turns": 0}
+    assert summarize_conversation_repository.requested == []
+    assert conversation_summary_repository.saved == []
+    assert db_handler.calls == ["close"]
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from typing import List
+from worker.keyed_lock import KeyedLock
+
+
+@pytest.mark.asyncio
+async def test_same_key_runs_in_order_and_other_keys_run_concurrently():
+    keyed_lock = KeyedLock("test")
+    events: List[str] = []
+
+    async def turn(key: str, name: str, seconds: float) -> None:
+        await keyed_lock.acquire(key)
+        try:
+            events.append(f"start {name}")
+            await asyncio.sleep(seconds)
+            events.append(f"end {name}")
+        finally:
+            keyed_lock.release(key)
+
+    await asyncio.gather(
+        turn("user-1", "a", 0.03),
+        turn("user-1", "b", 0.01),
+        turn("user-2", "c", 0.01),
+    )
+
+    # 同じユーザーの b は a が終わるまで始まらないが、別のユーザーの c は a と並行して実行される
+    assert events.index("end a") < events.index("start b")
+    assert events.index("start c") < events.index("end a")
+    assert len(keyed_lock) == 0
+
+
+@pytest.mark.asyncio
+async def test_removes_key_when_waiter_is_cancelled():
+    keyed_lock = KeyedLock("test")
+
+    await keyed_lock.acquire("user-1")
+    waiter = asyncio.create_task(keyed_lock.acquire("user-1"))
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert keyed_lock.locked("user-1")
+
+    keyed_lock.release("user-1")
+
+    assert len(keyed_lock) == 0
+    assert not keyed_lock.locked("user-1")
@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from typing import List
+from worker.keyed_work_queue import (
+    KeyedWorkQueue,
+    WorkQueueClosedError,
+    WorkQueueFullError,
+)
+
+
+@pytest.mark.asyncio
+async def test_jobs_with_same_key_run_in_order():
+    queue = KeyedWorkQueue("test", concurrency=4)
+    queue.start()
+
+    processed: List[int] = []
+
+    def create_job(value: int):
+        async def job() -> None:
+            # 後から投入したジョブの方が早く終わるようにして、順番が守られることを確認する
+            await asyncio.sleep(0.01 * (5 - value))
+            processed.append(value)
+
+        return job
+
+    for value in range(5):
+        queue.enqueue("user-1", create_job(value))
+
+    await queue.drain(timeout=5)
+
+    assert processed == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_jobs_with_different_keys_run_concurrently():
+    queue = KeyedWorkQueue("test", concurrency=8)
+    queue.start()
+
+    running = 0
+    max_running = 0
+
+    async def job() -> None:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    for index in range(32):
+        queue.enqueue(f"user-{index}", job)
+
+    await queue.drain(timeout=5)
+
+    assert max_running > 1
+
+
+@pytest.mark.asyncio
+async def test_blocked_key_does_not_delay_other_keys():
+    queue = KeyedWorkQueue("test", concurrency=2)
+    queue.start()
+
+    blocked = asyncio.Event()
+    processed: List[str] = []
+
+    async def block() -> None:
+        await blocked.wait()
+        processed.append("a")
+
+    def create_job(value: str):
+        async def job() -> None:
+            processed.append(value)
+
+        return job
+
+    # 1つのワーカーがキーAで止まっていても、ほかのキーのジョブは残りのワーカーで処理される
+    queue.enqueue("a", block)
+    queue.enqueue("a", create_job("a-2"))
+    for index in range(8):
+        queue.enqueue(f"b-{index}", create_job(f"b-{index}"))
+
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert processed == [f"b-{index}" for index in range(8)]
+
+    blocked.set()
+    await queue.drain(timeout=5)
+
+    assert processed[-2:] == ["a", "a-2"]
+
+
+@pytest.mark.asyncio
+async def test_rejects_jobs_over_max_queue_size():
+    queue = KeyedWorkQueue("test", concurrency=2, max_queue_size=2)
+    queue.start()
+
+    async def job() -> None:
+        await asyncio.sleep(0.01)
+
+    queue.enqueue("user-1", job)
+    queue.enqueue("user-2", job)
+
+    with pytest.raises(WorkQueueFullError):
+        queue.enqueue("user-3", job)
+
+    await queue.drain(timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_drain_rejects_new_jobs():
+    queue = KeyedWorkQueue("test", concurrency=1)
+    queue.start()
+
+    processed: List[str] = []
+
+    async def job() -> None:
+        await asyncio.sleep(0.01)
+        processed.append("done")
+
+    queue.enqueue("user-1", job)
+
+    await queue.drain(timeout=5)
+
+    assert processed == ["done"]
+
+    with pytest.raises(WorkQueueClosedError):
+        queue.enqueue("user-1", job)
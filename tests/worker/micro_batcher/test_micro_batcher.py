@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from typing import List
+from worker.micro_batcher import MicroBatcher
+
+
+@pytest.mark.asyncio
+async def test_processes_values_submitted_together_at_once():
+    batches: List[List[int]] = []
+
+    async def operation(values: List[int]) -> List[int]:
+        batches.append(values)
+        await asyncio.sleep(0.01)
+        return [value * 10 for value in values]
+
+    batcher: MicroBatcher[int, int] = MicroBatcher(operation)
+
+    first = await asyncio.gather(*(batcher.submit(value) for value in range(3)))
+    # 処理中に届いた値は、次のバッチにまとめる
+    second = batcher.submit(3)
+    third = batcher.submit(4)
+    await asyncio.sleep(0.005)
+    fourth = batcher.submit(5)
+
+    assert first == [0, 10, 20]
+    assert await asyncio.gather(second, third, fourth) == [30, 40, 50]
+    assert batches == [[0, 1, 2], [3, 4], [5]]
+
+
+@pytest.mark.asyncio
+async def test_fails_every_value_in_failed_batch():
+    async def operation(values: List[int]) -> List[int]:
+        if 0 in values:
+            raise RuntimeError("failed")
+        return values
+
+    batcher: MicroBatcher[int, int] = MicroBatcher(operation)
+
+    results = await asyncio.gather(
+        batcher.submit(0), batcher.submit(1), return_exceptions=True
+    )
+
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+    # 失敗した後も次のバッチを処理する
+    assert await batcher.submit(2) == 2
+
+
+@pytest.mark.asyncio
+async def test_keeps_processing_value_when_submitter_is_cancelled():
+    processed: List[int] = []
+
+    async def operation(values: List[int]) -> List[None]:
+        await asyncio.sleep(0.01)
+        processed.extend(values)
+        return [None] * len(values)
+
+    batcher: MicroBatcher[int, None] = MicroBatcher(operation)
+
+    waiter = asyncio.create_task(asyncio.wait_for(batcher.submit(1), 0.001))
+    with pytest.raises(asyncio.TimeoutError):
+        await waiter
+
+    await asyncio.sleep(0.02)
+
+    assert processed == [1]